@@ -289,9 +289,10 @@ class PageBase(ABC):
 
     def create_update_progress_bar(self):
 
-        def update_progress_bar(progress):
+        def update_progress_bar(progress, throughput=None):
+            text = f'{throughput:.1f} files/s' if throughput else None
             with st.session_state[self.page_name]['build_place']:
-                st.progress(int(progress * 100))
+                st.progress(int(progress * 100), text=text)
 
         return update_progress_bar
 
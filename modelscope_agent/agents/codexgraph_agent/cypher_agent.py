@@ -1,3 +1,6 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 from modelscope_agent import Agent
 from modelscope_agent.agents.codexgraph_agent.prompt import (CYPHER_PROMPT,
                                                              JSON_PROMPT)
@@ -5,7 +8,11 @@ from modelscope_agent.agents.codexgraph_agent.utils.code_utils import \
     process_string
 from modelscope_agent.agents.codexgraph_agent.utils.cypher_utils import (
     add_label_to_nodes, extract_cypher_queries)
+from modelscope_agent.agents.codexgraph_agent.utils.result_cache import \
+    CypherResultCache
 from modelscope_agent.environment.graph_database import GraphDatabaseHandler
+from modelscope_agent.environment.graph_database.query_budget import \
+    QueryBudget
 
 CODE_SEARCH_FORMAT = """[start_of_code_search]
 ### Text Query 1
@@ -28,12 +35,26 @@ class CypherAgent(Agent):
                  graph_db: GraphDatabaseHandler,
                  system_prompts: str = '',
                  task_id: str = '',
-                 message_callback=None):
+                 message_callback=None,
+                 result_budget: QueryBudget = None,
+                 result_cache: CypherResultCache = None,
+                 max_concurrent_queries: int = 4):
         super().__init__(llm=llm, name='CodexGraph agent')
 
         self.graph_db = graph_db
         self.task_id = task_id
         self.message_callback = message_callback
+        # Bounds the rows of every query result rendered into the prompt.
+        self.result_budget = result_budget or QueryBudget()
+        # Rendered results of this session, pass one cache to several agents
+        # (with the same budget) to share it.
+        self.result_cache = result_cache if result_cache is not None \
+            else CypherResultCache()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._stats_lock = threading.Lock()
+        # The queries of one LLM answer run on up to this many threads.
+        self.max_concurrent_queries = max_concurrent_queries
 
         self.system_prompts = system_prompts
 
@@ -80,27 +101,18 @@ class CypherAgent(Agent):
         user_response = ''
 
         while True and retry <= retries:
-            cypher_response = self.llm_call(cypher_messages)
-            cyphers = extract_cypher_queries(cypher_response)
+            llm_response = self.llm_call(cypher_messages)
+            cyphers = extract_cypher_queries(llm_response)
+            responses = self.execute_cyphers([
+                add_label_to_nodes(cypher, '`{}`'.format(self.task_id))
+                for cypher in cyphers
+            ])
             user_response = ''
             tmp_flag = True
-            for idx, cypher in enumerate(cyphers):
+            for idx, (cypher, (cypher_response, flag)) in enumerate(
+                    zip(cyphers, responses)):
                 user_response += (
                     f'### Extracted Cypher query {idx}:\n{cypher}\n')
-                cypher = add_label_to_nodes(cypher,
-                                            '`{}`'.format(self.task_id))
-                cypher_response, flag = self.graph_db.execute_query_with_timeout(
-                    cypher)
-
-                if cypher_response != 'cypher too complex, out of memory':
-                    cypher_response = [
-                        process_string(str(record))
-                        for record in cypher_response
-                    ]
-                    if cypher_response:
-                        cypher_response = '\n\n'.join(cypher_response)
-                    else:
-                        cypher_response = 'Cypher query Return None'
 
                 if not flag:
                     tmp_flag = False
@@ -112,7 +124,7 @@ class CypherAgent(Agent):
 
             cypher_messages.append({
                 'role': 'assistant',
-                'content': cypher_response
+                'content': llm_response
             })
             cypher_messages.append({'role': 'user', 'content': user_response})
             cypher_messages.append({
@@ -134,5 +146,69 @@ class CypherAgent(Agent):
 
         return user_response
 
+    def execute_cyphers(self, cyphers):
+        """
+        Run labelled queries on up to `max_concurrent_queries` threads, each
+        rendering (and expanding the code markers of) its own result. Returns
+        the (response, flag) pairs in query order.
+        """
+        if len(cyphers) <= 1 or self.max_concurrent_queries <= 1:
+            return [self.execute_cypher(cypher) for cypher in cyphers]
+        responses = [None] * len(cyphers)
+        with ThreadPoolExecutor(
+                max_workers=min(len(cyphers), self.max_concurrent_queries),
+                thread_name_prefix='cypher-agent') as executor:
+            futures = {
+                executor.submit(self.execute_cypher, cypher): idx
+                for idx, cypher in enumerate(cyphers)
+            }
+            for future in as_completed(futures):
+                try:
+                    responses[futures[future]] = future.result()
+                except Exception as e:
+                    responses[futures[future]] = str(e), False
+        return responses
+
+    def execute_cypher(self, cypher):
+        """
+        Run a labelled query and render its result for the prompt, answering
+        from `result_cache` while the task's graph version is unchanged.
+        """
+        key = None
+        version = self.graph_db.graph_version(self.task_id)
+        if version is not None:
+            key = CypherResultCache.make_key(self.task_id, version, cypher)
+            cached = self.result_cache.get(key)
+            with self._stats_lock:
+                if cached is not None:
+                    self.cache_hits += 1
+                else:
+                    self.cache_misses += 1
+            if cached is not None:
+                return cached, True
+
+        cypher_response, flag = self.graph_db.execute_query_with_timeout(
+            cypher,
+            budget=self.result_budget,
+            render=lambda record: process_string(str(record)))
+        if not flag or isinstance(cypher_response, str):
+            # Errors and timeouts are not cached.
+            return cypher_response, flag
+        if len(cypher_response):
+            cypher_response = cypher_response.format()
+        else:
+            cypher_response = 'Cypher query Return None'
+        if key is not None:
+            self.result_cache.put(key, cypher_response)
+        return cypher_response, flag
+
+    def get_cache_stats(self):
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            'hits': self.cache_hits,
+            'misses': self.cache_misses,
+            'hit_rate': self.cache_hits / lookups if lookups else 0.0,
+        }
+
     def get_chat_history(self):
         return self.chat_history
@@ -1,7 +1,8 @@
-import codecs
 import re
 
 import json
+from modelscope_agent.environment.graph_database.indexer.source_cache import \
+    get_source_cache
 
 
 def extract_and_parse_json(text):
@@ -17,27 +18,8 @@ def extract_and_parse_json(text):
 
 
 def extract_code_from_file(file_path, start_line, end_line, is_indent=True):
-    if start_line < 1:
-        start_line = 1
-    try:
-        with codecs.open(file_path, 'r', encoding='utf-8') as input:
-            sourceCode = input.read()
-        source_code_lines = sourceCode.split('\n')
-        extracted_lines = source_code_lines[start_line - 1:end_line]
-    except Exception:
-        return ''
-
-    if is_indent:
-        first_line_indent = len(extracted_lines[0]) - len(
-            extracted_lines[0].lstrip())
-
-        extracted_lines = [
-            line[first_line_indent:] if len(line) > first_line_indent else ''
-            for line in extracted_lines
-        ]
-
-    extracted_code = '\n'.join(extracted_lines)
-    return extracted_code
+    return get_source_cache().extract(
+        file_path, start_line, end_line, is_indent=is_indent)
 
 
 def extract_text_between_markers(text, start_marker, end_marker):
@@ -0,0 +1,90 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import json
+
+# String literals and quoted names are kept as they are, any other run of
+# whitespace becomes one space.
+_WHITESPACE_PATTERN = re.compile(
+    r'(\'(?:[^\'\\]|\\.)*\'|"(?:[^"\\]|\\.)*"|`[^`]*`)|\s+')
+
+
+def normalize_cypher(cypher):
+    """
+    Cache key form of a Cypher query: whitespace outside literals collapsed,
+    surrounding whitespace and trailing semicolons removed.
+    """
+
+    def replace(match):
+        return match.group(1) or ' '
+
+    return _WHITESPACE_PATTERN.sub(replace, cypher).strip().rstrip(';').strip()
+
+
+class CypherResultCache:
+    """
+    Least recently used cache of rendered Cypher query results with a time
+    to live.
+
+    Entries are keyed by the task, the task's graph version (see
+    `GraphDatabaseHandler.graph_version`), the normalized query and its
+    parameters. Re-indexing a task bumps its version, so results of the old
+    graph are never returned and simply age out.
+
+    Args:
+        max_entries: Maximum number of cached results.
+        ttl: Seconds a result stays valid, None for no expiry.
+    """
+
+    def __init__(self, max_entries=512, ttl=1800):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(task_id, version, cypher, params=None):
+        return (task_id, version, normalize_cypher(cypher),
+                json.dumps(params or {}, sort_keys=True, default=str))
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[0] is None
+                                      or entry[0] > time.monotonic()):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+            }
@@ -1 +1,2 @@
 from .ast_manage import AstManager
+from .parsed_store import ParsedFileStore
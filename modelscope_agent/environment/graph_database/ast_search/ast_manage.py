@@ -1,89 +1,145 @@
-import ast
 import os
-import pathlib
 from collections import defaultdict
 
 from modelscope_agent.environment.graph_database import GraphDatabaseHandler
 
-from .ast_utils import (get_dotted_name, get_module_name, get_py_files,
-                        method_decorator, module_name_to_path)
+from .ast_utils import get_py_files, method_decorator, module_name_to_path
+from .parsed_store import ParsedFileStore
 
 
-class AstManager:
+TYPE_LABELS = [
+    'MODULE', 'CLASS', 'FUNCTION', 'METHOD', 'GLOBAL_VARIABLE', 'FIELD'
+]
+
+
+def get_type_label(labels):
+    return next((lbl for lbl in labels if lbl in TYPE_LABELS), None)
 
-    def __init__(self, project_path: str, task_id: str,
-                 graphDB: GraphDatabaseHandler):
+
+class AstManager:
+    """
+    Resolve `from x import y` into MODULE-[:CONTAINS]-> edges, class bases
+    into INHERITS edges and copy inherited HAS_METHOD/HAS_FIELD edges down
+    the class hierarchy.
+
+    The MODULE-[:CONTAINS]-> and CLASS-[:HAS_METHOD|HAS_FIELD]-> maps of the
+    task are loaded with one query each before the first lookup. Every
+    lookup is answered from memory, the maps are kept up to date with the
+    edges added during the run, and the new edges are buffered in the
+    handler and written with UNWIND statements at the end of `run`.
+
+    The imports and class bases of the files are read from `store`, a
+    `ParsedFileStore` shared with the rest of the build, so every file is
+    parsed once.
+    """
+
+    def __init__(self,
+                 project_path: str,
+                 task_id: str,
+                 graphDB: GraphDatabaseHandler,
+                 store: ParsedFileStore = None):
         self.project_path = project_path
         self.root_path = project_path
         self.graphDB = graphDB
         self.task_id = task_id
+        self.store = store if store is not None else ParsedFileStore(
+            project_path)
         # self._build_index()
         self.class_inherited = {}
         self.processed_relations = set()  # 用于记录已经处理过的关系
-        self.visited = []
+        self.visited = set()
+
+        self.symbols_loaded = False
+        # module full_name -> [(full_name, name, type label)]
+        self.module_contains = {}
+        # class full_name -> [(full_name, name, relationship type)]
+        self.class_members = {}
+        self._contained = set()
+        self._member_names = {}
+
+    def _module_contains_query(self):
+        return (f'MATCH (m:MODULE:`{self.task_id}`)-[:CONTAINS]->'
+                f'(c:`{self.task_id}`) '
+                'RETURN m.full_name AS module, c.full_name AS full_name, '
+                'c.name AS name, labels(c) AS labels')
+
+    def _class_members_query(self):
+        return (f'MATCH (c:CLASS:`{self.task_id}`) '
+                'OPTIONAL MATCH (c)-[r:HAS_METHOD|HAS_FIELD]->'
+                f'(m:`{self.task_id}`) '
+                'RETURN c.full_name AS class, m.full_name AS full_name, '
+                'm.name AS name, type(r) AS relationship_type')
+
+    def index_usage_report(self):
+        """
+        Report which indexes the queries used while building the graph hit,
+        including the handler's own per-write lookups.
+        """
+        queries = self.graphDB.query_templates()
+        queries.update({
+            'load_module_contains': self._module_contains_query(),
+            'load_class_members': self._class_members_query(),
+        })
+        return self.graphDB.index_usage_report(queries)
+
+    def load_symbols(self):
+        """
+        Load the CONTAINS map of every module and the HAS_METHOD/HAS_FIELD
+        map of every class of the task.
+        """
+        self.module_contains = {}
+        self.class_members = {}
+        self._contained = set()
+        self._member_names = {}
+        for record in self.graphDB.execute_query(
+                self._module_contains_query()) or []:
+            label = get_type_label(record['labels'])
+            if label is not None:
+                self._add_contained(record['module'], record['full_name'],
+                                    record['name'], label)
+        for record in self.graphDB.execute_query(
+                self._class_members_query()) or []:
+            self.class_members.setdefault(record['class'], [])
+            self._member_names.setdefault(record['class'], set())
+            if record['full_name'] is not None:
+                self._add_member(record['class'], record['full_name'],
+                                 record['name'],
+                                 record['relationship_type'])
+        self.symbols_loaded = True
+
+    def _add_contained(self, module_full_name, full_name, name, label):
+        key = (module_full_name, full_name)
+        if key in self._contained:
+            return
+        self._contained.add(key)
+        self.module_contains.setdefault(module_full_name, []).append(
+            (full_name, name, label))
+
+    def _add_member(self, class_full_name, full_name, name,
+                    relationship_type):
+        self.class_members[class_full_name].append(
+            (full_name, name, relationship_type))
+        self._member_names[class_full_name].add(name)
 
     def get_full_name_from_graph(self, module_full_name, target_name):
-        query = (
-            f"MATCH (m:MODULE:`{self.task_id}` {{full_name: '{module_full_name}'}})"
-            f'-[:CONTAINS]->(c:`{self.task_id}` '
-            f"{{name: '{target_name}'}}) "
-            'RETURN c.full_name as full_name, labels(c) AS labels')
-        response = self.graphDB.execute_query(query)
-        if response:
-            full_name, labels = response[0]['full_name'], response[0]['labels']
-            label = next(lbl for lbl in labels if lbl in [
-                'MODULE', 'CLASS', 'FUNCTION', 'METHOD', 'GLOBAL_VARIABLE',
-                'FIELD'
-            ])
-            return full_name, label
-        else:
-            return None, None
+        for full_name, name, label in self.module_contains.get(
+                module_full_name, []):
+            if name == target_name:
+                return full_name, label
+        return None, None
 
     def get_all_name_from_graph(self, module_full_name):
-        query = f"""
-MATCH (m:MODULE:`{self.task_id}` {{full_name: '{module_full_name}'}})-[:CONTAINS]->(c:`{self.task_id}`)
-RETURN c.full_name as full_name, labels(c) AS labels
-"""
-
-        def get_type_label(labels):
-            type_label = next(lbl for lbl in labels if lbl in [
-                'MODULE', 'CLASS', 'FUNCTION', 'METHOD', 'GLOBAL_VARIABLE',
-                'FIELD'
-            ])
-            return type_label
-
-        response = self.graphDB.execute_query(query)
-
-        if response:
-            return [[record['full_name'],
-                     get_type_label(record['labels'])] for record in response]
+        contained = self.module_contains.get(module_full_name)
+        if contained:
+            return [[full_name, label] for full_name, _, label in contained]
         else:
             return None
 
     def get_all_edge_of_class(self, class_full_name):
-        query = f"""
-MATCH (c:CLASS:`{self.task_id}` {{full_name: '{class_full_name}'}})-[r:HAS_METHOD|HAS_FIELD]->(m:`{self.task_id}`)
-RETURN m.full_name as full_name, m.name as name, type(r) as relationship_type
-"""
-        response = self.graphDB.execute_query(query)
-        if response:
-            methods = [(record['full_name'], record['name'],
-                        record['relationship_type']) for record in response]
-            return methods
-        else:
-            return None
+        return self.class_members.get(class_full_name) or None
 
     def check_exist_edge_of_class(self, class_full_name, node_name):
-        query = (
-            f"MATCH (c:CLASS:`{self.task_id}` {{full_name: '{class_full_name}'}}) "
-            f"-[r:HAS_METHOD|HAS_FIELD]->(m:`{self.task_id}` {{name: '{node_name}'}}) "
-            'RETURN m.full_name as full_name')
-        response = self.graphDB.execute_query(query)
-        if response:
-            methods = [record['full_name'] for record in response]
-            return methods
-        else:
-            return None
+        return node_name in self._member_names.get(class_full_name, ())
 
     def run(self, py_files=None):
         self._run(py_files)
@@ -92,6 +148,8 @@ RETURN m.full_name as full_name, m.name as name, type(r) as relationship_type
     def _run(self, py_files=None):
         if py_files is None:
             py_files = get_py_files(self.project_path)
+        if not self.symbols_loaded:
+            self.load_symbols()
 
         for py_file in py_files:
             self.build_modules_contain(py_file)
@@ -105,6 +163,8 @@ RETURN m.full_name as full_name, m.name as name, type(r) as relationship_type
                 self._build_inherited_method(cur_class_full_name,
                                              base_class_full_name)
 
+        self.graphDB.flush()
+
     def _build_inherited_method(self, cur_class_full_name,
                                 base_class_full_name):
         # 创建一个关系的唯一标识符
@@ -118,14 +178,18 @@ RETURN m.full_name as full_name, m.name as name, type(r) as relationship_type
         methods = self.get_all_edge_of_class(base_class_full_name)
         if methods is None:
             return
-        for node_full_name, name, type in methods:
+        # Iterate over a copy, the base may be the class being extended.
+        for node_full_name, name, type in list(methods):
             # 可能有overwrite的情况
             if not self.check_exist_edge_of_class(cur_class_full_name, name):
-                self.graphDB.update_edge(
+                self.graphDB.queue_edge_update(
                     start_name=cur_class_full_name,
                     relationship_type=type,
                     end_name=node_full_name,
                 )
+                if cur_class_full_name in self.class_members:
+                    self._add_member(cur_class_full_name, node_full_name,
+                                     name, type)
 
         if base_class_full_name in self.class_inherited.keys():
             for base_base_class_full_name in self.class_inherited[
@@ -140,65 +204,52 @@ RETURN m.full_name as full_name, m.name as name, type(r) as relationship_type
         if not target_full_name:
             return False
 
-        edge = self.graphDB.add_edge(
+        self._add_contains_edge(cur_module_full_name, target_full_name,
+                                target_name, target_label)
+        return True
+
+    def _add_contains_edge(self, cur_module_full_name, target_full_name,
+                           target_name, target_label):
+        if (cur_module_full_name, target_full_name) in self._contained:
+            return
+        self.graphDB.queue_edge(
             start_label='MODULE',
             start_name=cur_module_full_name,
             relationship_type='CONTAINS',
             end_name=target_full_name,
             params={'association_type': target_label},
         )
-        return edge is not None
+        self._add_contained(cur_module_full_name, target_full_name,
+                            target_name, target_label)
 
     def _build_modules_contain_edge_all(self, target_module_full_name,
                                         cur_module_full_name):
-        target_list = self.get_all_name_from_graph(target_module_full_name)
+        target_list = self.module_contains.get(target_module_full_name)
 
         if not target_list:
             return False
 
-        for target_full_name, target_label in target_list:
+        # Iterate over a copy, a module may star-import itself.
+        for target_full_name, target_name, target_label in list(target_list):
             # print(cur_module_full_name, '->', target_full_name, target_name)
-            edge = self.graphDB.add_edge(
-                start_label='MODULE',
-                start_name=cur_module_full_name,
-                relationship_type='CONTAINS',
-                end_name=target_full_name,
-                params={'association_type': target_label},
-            )
-            if not edge:
-                return False
+            self._add_contains_edge(cur_module_full_name, target_full_name,
+                                    target_name, target_label)
 
         return True
 
     def build_modules_contain(self, file_full_path):
         if file_full_path in self.visited:
             return None
-        self.visited.append(file_full_path)
+        self.visited.add(file_full_path)
 
-        try:
-            file_content = pathlib.Path(file_full_path).read_text()
-            tree = ast.parse(file_content)
-        except Exception:
+        summary = self.store.get(file_full_path)
+        if summary is None:
             # failed to read/parse one file, we should ignore it
             return None
+        cur_module_full_name = summary['module']
 
-        if '__init__.py' in file_full_path:
-            cur_module_full_name = get_dotted_name(
-                self.root_path, os.path.dirname(file_full_path))
-        else:
-            cur_module_full_name = get_dotted_name(self.root_path,
-                                                   file_full_path)
-
-        for node in ast.walk(tree):
-            if not isinstance(node, ast.ImportFrom):
-                continue
-            target_module_full_name = get_module_name(file_full_path, node,
-                                                      self.root_path)
-            if not target_module_full_name:
-                continue
-
-            for target in node.names:
-                target_name = target.name
+        for target_module_full_name, target_names in summary['imports']:
+            for target_name in target_names:
 
                 if target_name == '*':
                     if not self._build_modules_contain_edge_all(
@@ -226,41 +277,28 @@ RETURN m.full_name as full_name, m.name as name, type(r) as relationship_type
                                                      cur_module_full_name)
 
     def build_inherited(self, file_full_path):
-        try:
-            file_content = pathlib.Path(file_full_path).read_text()
-            tree = ast.parse(file_content)
-        except Exception:
+        summary = self.store.get(file_full_path)
+        if summary is None:
             # failed to read/parse one file, we should ignore it
             return None
+        cur_module_full_name = summary['module']
 
-        if '__init__.py' in file_full_path:
-            cur_module_full_name = get_dotted_name(
-                self.root_path, os.path.dirname(file_full_path))
-        else:
-            cur_module_full_name = get_dotted_name(self.root_path,
-                                                   file_full_path)
-
-        for node in ast.walk(tree):
-            if not isinstance(node, ast.ClassDef):
-                continue
-            class_name = node.name
+        for class_name, base_names in summary['classes']:
             cur_class_full_name = cur_module_full_name + '.' + class_name
-            for base in node.bases:
-                if not isinstance(base, ast.Name):
-                    continue
+            for base_name in base_names:
                 base_class_full_name, _ = self.get_full_name_from_graph(
-                    cur_module_full_name, base.id)
+                    cur_module_full_name, base_name)
                 if base_class_full_name is None:
                     pass
                     # print(
-                    #     "base_class_full_name is None: ", cur_class_full_name, base.id
+                    #     "base_class_full_name is None: ", cur_class_full_name, base_name
                     # )
                 if cur_class_full_name not in self.class_inherited.keys():
                     self.class_inherited[cur_class_full_name] = []
                 self.class_inherited[cur_class_full_name].append(
                     base_class_full_name)
                 if base_class_full_name:
-                    self.graphDB.update_edge(
+                    self.graphDB.queue_edge_update(
                         start_name=cur_class_full_name,
                         relationship_type='INHERITS',
                         end_name=base_class_full_name,
@@ -428,21 +466,6 @@ RETURN source_node.full_name AS source_node_full_name,
 
         return results if results else None
 
-    def _build_edge_old_to_new(self,
-                               old_node_full_name,
-                               new_node_full_name,
-                               relation=''):
-        edge = self.graphNew.update_edge(
-            start_name=old_node_full_name,
-            relationship_type=relation,
-            end_name=new_node_full_name,
-        )
-        # print(old_node_full_name, new_node_full_name, relation, edge)
-        if edge is not None and relation == 'INHERITS':
-            if old_node_full_name not in self.class_inherited.keys():
-                self.class_inherited[old_node_full_name] = []
-            self.class_inherited[old_node_full_name].append(new_node_full_name)
-
     def build_new_node_to_old(self, change_files):
         self.ast_manage.run(py_files=change_files)
 
@@ -467,48 +490,13 @@ RETURN source_node.full_name AS source_node_full_name,
         self.ast_manage.class_inherited.update(self.class_inherited)
         # print(f"class_inherited: {self.ast_manage.class_inherited}")
         self.build_new_node_to_old(change_files)
-        self.drop_indexes()
 
     def create_indexes(self):
-        task_id_old = self.task_id_old
-        task_id_new = self.task_id_new
-
-        # 为常用查询创建索引
-        index_queries = [
-            f'CREATE INDEX ON :MODULE:`{task_id_new}`(full_name);',
-            f'CREATE INDEX ON :`{task_id_new}`(name);',
-            f'CREATE INDEX ON :CLASS:`{task_id_new}`(full_name);',
-            f'CREATE INDEX ON :`{task_id_new}`(file_path);',
-            f'CREATE INDEX ON :`{task_id_old}`(full_name);',
-            f'CREATE INDEX ON :`{task_id_old}`(file_path);',
-            f'CREATE INDEX ON :`{task_id_old}`:`{task_id_new}`(file_path);',
-        ]
-
-        for query in index_queries:
-            try:
-                # print(f"Executing: {query}")
-                self.graphNew.execute_query(query)
-            except Exception as e:
-                print(f"Error creating index with query '{query}': {str(e)}")
+        # The indexes are owned by the task labels and kept after the edges
+        # are built, every later build of either task relies on them.
+        self.graphNew.create_indexes(self.task_id_new)
+        self.graphNew.create_indexes(self.task_id_old)
 
     def drop_indexes(self):
-        task_id_old = self.task_id_old
-        task_id_new = self.task_id_new
-
-        # 为常用查询删除索引
-        index_queries = [
-            f'DROP INDEX ON :MODULE:`{task_id_new}`(full_name);',
-            f'DROP INDEX ON :`{task_id_new}`(name);',
-            f'DROP INDEX ON :CLASS:`{task_id_new}`(full_name);',
-            f'DROP INDEX ON :`{task_id_new}`(file_path);',
-            f'DROP INDEX ON :`{task_id_old}`(full_name);',
-            f'DROP INDEX ON :`{task_id_old}`(file_path);',
-            f'DROP INDEX ON :`{task_id_old}`:`{task_id_new}`(file_path);',
-        ]
-
-        for query in index_queries:
-            try:
-                # print(f"Executing: {query}")
-                self.graphNew.execute_query(query)
-            except Exception as e:
-                print(f"Error dropping index with query '{query}': {str(e)}")
+        self.graphNew.drop_indexes(self.task_id_new)
+        self.graphNew.drop_indexes(self.task_id_old)
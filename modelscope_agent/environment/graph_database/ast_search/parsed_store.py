@@ -0,0 +1,149 @@
+import ast
+import os
+import pickle
+import tempfile
+from collections import OrderedDict
+
+from .ast_utils import get_dotted_name, get_module_name
+
+
+def summarize_source(file_path, source, root_path):
+    """
+    Everything the graph build needs from a file's syntax tree, in `ast.walk`
+    order:
+
+    - module: dotted name of the file's module.
+    - imports: `(module, [names])` of every `from module import names` whose
+      module resolves inside the repository, '*' for star imports.
+    - modules: names of plain `import x` statements.
+    - classes: `(name, [base names])` of every class with simple-name bases.
+
+    Returns None when the source does not parse.
+    """
+    try:
+        tree = ast.parse(source)
+    except Exception:
+        return None
+
+    if '__init__.py' in file_path:
+        module = get_dotted_name(root_path, os.path.dirname(file_path))
+    else:
+        module = get_dotted_name(root_path, file_path)
+
+    imports, modules, classes = [], [], []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom):
+            target_module = get_module_name(file_path, node, root_path)
+            if target_module:
+                imports.append(
+                    (target_module, [alias.name for alias in node.names]))
+        elif isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ClassDef):
+            bases = [
+                base.id for base in node.bases if isinstance(base, ast.Name)
+            ]
+            if bases:
+                classes.append((node.name, bases))
+    return {
+        'module': module,
+        'imports': imports,
+        'modules': modules,
+        'classes': classes,
+    }
+
+
+def summarize_file(file_path, root_path):
+    try:
+        with open(file_path, 'rb') as f:
+            source = f.read()
+    except OSError:
+        return None
+    return summarize_source(file_path, source, root_path)
+
+
+class ParsedFileStore:
+    """
+    Per-build store of file summaries (see `summarize_source`), so that each
+    file is read and parsed once for the import, inheritance and
+    incremental-manifest phases of a build.
+
+    Indexing workers summarize the files while they have the source at hand
+    and `put` the results here, files missing from the store are summarized
+    on first `get`. Summaries are kept in memory up to `max_bytes` (pickled
+    size). The least recently used ones are then spilled to a temporary
+    file and read back from it when needed.
+
+    Args:
+        root_path: Root of the repository.
+        max_bytes: Memory budget of the in-memory summaries.
+    """
+
+    def __init__(self, root_path, max_bytes=64 * 1024 * 1024):
+        self.root_path = root_path
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict()  # file path -> (summary, size)
+        self._memory_bytes = 0
+        self._spilled = {}  # file path -> (offset, size)
+        self._spill_file = None
+        self.parsed = 0
+
+    def __contains__(self, file_path):
+        return file_path in self._memory or file_path in self._spilled
+
+    def __len__(self):
+        return len(self._memory) + len(self._spilled)
+
+    def put(self, file_path, summary):
+        data = pickle.dumps(summary, protocol=pickle.HIGHEST_PROTOCOL)
+        self._spilled.pop(file_path, None)
+        previous = self._memory.pop(file_path, None)
+        if previous is not None:
+            self._memory_bytes -= previous[1]
+        self._memory[file_path] = (summary, len(data))
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_bytes and len(self._memory) > 1:
+            self._spill(*self._memory.popitem(last=False))
+
+    def _spill(self, file_path, entry):
+        summary, size = entry
+        if self._spill_file is None:
+            self._spill_file = tempfile.TemporaryFile(
+                prefix='codexgraph-summaries-')
+        self._spill_file.seek(0, os.SEEK_END)
+        offset = self._spill_file.tell()
+        self._spill_file.write(
+            pickle.dumps(summary, protocol=pickle.HIGHEST_PROTOCOL))
+        self._spilled[file_path] = (offset, size)
+        self._memory_bytes -= size
+
+    def get(self, file_path):
+        """
+        Summary of `file_path`, None when it cannot be read or parsed.
+        """
+        entry = self._memory.get(file_path)
+        if entry is not None:
+            self._memory.move_to_end(file_path)
+            return entry[0]
+        if file_path in self._spilled:
+            offset, size = self._spilled[file_path]
+            self._spill_file.seek(offset)
+            return pickle.loads(self._spill_file.read(size))
+        summary = summarize_file(file_path, self.root_path)
+        self.parsed += 1
+        self.put(file_path, summary)
+        return summary
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+        self._memory.clear()
+        self._memory_bytes = 0
+        self._spilled = {}
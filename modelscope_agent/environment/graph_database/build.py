@@ -4,7 +4,14 @@ import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from modelscope_agent.environment.graph_database import GraphDatabaseHandler
-from modelscope_agent.environment.graph_database.ast_search import AstManager
+from modelscope_agent.environment.graph_database.ast_search import (
+    AstManager, ParsedFileStore)
+from modelscope_agent.environment.graph_database.description_pipeline import \
+    DescriptionPipeline
+from modelscope_agent.environment.graph_database.incremental import \
+    IncrementalIndexer
+from modelscope_agent.environment.graph_database.parallel_indexer import \
+    ParallelIndexer
 
 
 def get_py_files(directory):
@@ -94,20 +101,115 @@ def build_graph_database(graph_db: GraphDatabaseHandler,
                          is_clear: bool = True,
                          max_workers=None,
                          env_path_dict=None,
-                         update_progress_bar=None):
+                         update_progress_bar=None,
+                         in_process=True,
+                         incremental=False,
+                         manifest_dir=None,
+                         generate_descriptions=True,
+                         description_options=None):
+    """
+    Shallow-index every `.py` file under `repo_path` and build the class
+    inheritance edges. With `in_process=True` files are indexed by a pool of
+    long-lived workers (`ParallelIndexer`); otherwise every file is indexed
+    by running `run_index_single.py` in the `env_path` interpreter.
+    `update_progress_bar` receives the progress and the throughput in files/s.
+
+    With `incremental=True` a manifest of file hashes is kept for the task
+    and, when one exists for a graph that still holds the task, only the
+    changed, added and deleted files are re-indexed (`is_clear` is ignored).
+
+    With `generate_descriptions=True` the FUNCTION/METHOD nodes still missing
+    a description are described afterwards by a `DescriptionPipeline`
+    created with `description_options`.
+
+    Every file is parsed once for the import, inheritance and manifest
+    phases: the indexing workers put their summaries into a
+    `ParsedFileStore` the later phases read from.
+
+    Finally the task's graph version is bumped, which invalidates the query
+    results cached for the task.
+    """
     file_list = get_py_files(repo_path)
     root_path = repo_path
+    with ParsedFileStore(repo_path) as store:
 
-    if is_clear:
-        graph_db.clear_task_data(task_id=task_id)
+        def index_files(files, progress_callback=None):
+            _index_files(files, root_path, task_id, max_workers,
+                         env_path_dict, progress_callback, in_process, store)
 
-    start_time = time.time()
+        updater = None
+        if incremental:
+            updater = IncrementalIndexer(
+                graph_db,
+                repo_path,
+                task_id,
+                index_files,
+                manifest_dir=manifest_dir,
+                store=store)
+            if updater.can_update():
+                graph_db.create_indexes(task_id)
+                updater.run(
+                    file_list, update_progress_bar=update_progress_bar)
+                if generate_descriptions:
+                    DescriptionPipeline(graph_db, task_id,
+                                        **(description_options or {})).run()
+                graph_db.bump_graph_version(task_id)
+                return graph_db
 
-    total_files = len(file_list)
+        if is_clear:
+            graph_db.clear_task_data(task_id=task_id)
+        # Every write and every AstManager lookup is keyed by full_name, name
+        # or file_path under the task label, so provision those indexes first.
+        graph_db.create_indexes(task_id)
+
+        start_time = time.time()
+
+        total_files = len(file_list)
+
+        if update_progress_bar and total_files:
+            update_progress_bar(0.5 / total_files)
 
-    if update_progress_bar:
-        update_progress_bar(0.5 / total_files)
+        index_files(file_list, update_progress_bar)
+        # ast, class inheritance
+        ast_manage = AstManager(repo_path, task_id, graph_db, store=store)
+        ast_manage.run()
 
+        if updater:
+            updater.record_full_build(file_list)
+
+        if generate_descriptions:
+            DescriptionPipeline(graph_db, task_id,
+                                **(description_options or {})).run()
+        graph_db.bump_graph_version(task_id)
+
+        end_time = time.time()
+        elapsed_time = end_time - start_time
+        print(f'✍️ Shallow indexing ({int(elapsed_time)} s)')
+        # logger.info(f"✍️ Shallow indexing ({int(elapsed_time)} s)")
+        return graph_db
+
+
+def _index_files(file_list,
+                 root_path,
+                 task_id,
+                 max_workers,
+                 env_path_dict,
+                 update_progress_bar,
+                 in_process,
+                 store=None):
+    if in_process:
+        indexer = ParallelIndexer(
+            root_path, task_id, env_path_dict, max_workers=max_workers)
+        indexer.run(
+            file_list, update_progress_bar=update_progress_bar, store=store)
+    else:
+        _run_in_subprocesses(file_list, root_path, task_id, max_workers,
+                             env_path_dict, update_progress_bar, time.time())
+
+
+def _run_in_subprocesses(file_list, root_path, task_id, max_workers,
+                         env_path_dict, update_progress_bar, start_time):
+    total_files = len(file_list)
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
         future_to_file = {
             executor.submit(run_single, file_path, root_path, task_id, True,
@@ -126,17 +228,10 @@ def build_graph_database(graph_db: GraphDatabaseHandler,
             finally:
                 # 每完成一个任务，更新进度条
                 if update_progress_bar:
-                    update_progress_bar((i + 1) / total_files)
+                    elapsed = max(time.time() - start_time, 1e-6)
+                    update_progress_bar((i + 1) / total_files,
+                                        throughput=(i + 1) / elapsed)
                 # print((i+1) / total_files)
-    # ast, class inheritance
-    ast_manage = AstManager(repo_path, task_id, graph_db)
-    ast_manage.run()
-
-    end_time = time.time()
-    elapsed_time = end_time - start_time
-    print(f'✍️ Shallow indexing ({int(elapsed_time)} s)')
-    # logger.info(f"✍️ Shallow indexing ({int(elapsed_time)} s)")
-    return graph_db
 
 
 if __name__ == '__main__':
@@ -0,0 +1,292 @@
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import json
+from modelscope_agent.environment.graph_database.indexer.method_description_generator import \
+    get_description_generator
+from modelscope_agent.environment.graph_database.indexer.source_cache import \
+    get_source_cache
+
+CODE_MARKER_PATTERN = re.compile(r'<CODE>(.*?)</CODE>')
+
+
+def estimate_tokens(text):
+    # Rough estimate for code and CJK prompts, good enough for rate limiting.
+    return len(text) // 3 + 1
+
+
+class TokenRateLimiter:
+    """
+    Token bucket limiting the tokens sent to the LLM per minute, shared by
+    all description workers.
+    """
+
+    def __init__(self, tokens_per_minute):
+        self.capacity = tokens_per_minute
+        self.tokens = tokens_per_minute
+        self.rate = tokens_per_minute / 60.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens):
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens
+                                  + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class NoOpRateLimiter:
+
+    def acquire(self, tokens):
+        pass
+
+
+class DescriptionPipeline:
+    """
+    Generate descriptions for the FUNCTION/METHOD nodes of a task after the
+    structural indexing finished.
+
+    Nodes without a description are read from the graph, their code markers
+    resolved to source, and the ones not answered by the generator cache are
+    sent to the LLM by `concurrency` worker threads, packing up to
+    `methods_per_prompt` methods into one prompt. `tokens_per_minute` bounds
+    the estimated prompt and completion tokens sent per minute. Results are
+    written back with the handler's UNWIND bulk writer every
+    `write_batch_size` descriptions.
+
+    Args:
+        graph_db: Handler of the task graph.
+        task_id: Task label.
+        generator: MethodDescriptionGenerator, defaults to the global one.
+        concurrency: Number of concurrent LLM requests.
+        tokens_per_minute: Token budget per minute, None for no limit.
+        methods_per_prompt: Maximum number of methods packed into a prompt.
+        max_prompt_chars: Code budget of a packed prompt.
+        write_batch_size: Descriptions written back per flush.
+        overwrite: Also regenerate nodes that already have a description.
+    """
+
+    def __init__(self,
+                 graph_db,
+                 task_id,
+                 generator=None,
+                 concurrency=4,
+                 tokens_per_minute=None,
+                 methods_per_prompt=1,
+                 max_prompt_chars=6000,
+                 write_batch_size=200,
+                 overwrite=False):
+        self.graph_db = graph_db
+        self.task_id = task_id
+        self.generator = generator or get_description_generator()
+        self.concurrency = concurrency
+        self.rate_limiter = TokenRateLimiter(
+            tokens_per_minute) if tokens_per_minute else NoOpRateLimiter()
+        self.methods_per_prompt = max(1, methods_per_prompt)
+        self.max_prompt_chars = max_prompt_chars
+        self.write_batch_size = write_batch_size
+        self.overwrite = overwrite
+        self.source_cache = get_source_cache()
+
+    def resolve_code(self, code):
+        """
+        Replace `<CODE>{"S":..,"E":..,"F":..}</CODE>` markers by the source
+        lines they point at.
+        """
+
+        def replace(match):
+            try:
+                marker = json.loads(match.group(1))
+            except ValueError:
+                return ''
+            return self.source_cache.extract(
+                marker['F'], int(marker['S']), int(marker['E']))
+
+        return CODE_MARKER_PATTERN.sub(replace, code or '')
+
+    def _run(self, query, **params):
+        response, ok = self.graph_db.execute_query_with_exception(
+            query, **params)
+        if not ok:
+            print(f'Description pipeline query failed: {response}')
+            return []
+        return response
+
+    def collect_methods(self, full_names=None):
+        """
+        FUNCTION/METHOD nodes of the task still needing a description,
+        restricted to `full_names` when given.
+        """
+        conditions = ['(n:FUNCTION OR n:METHOD)', 'exists(n.code)']
+        if not self.overwrite:
+            conditions.append('NOT exists(n.description)')
+        if full_names is not None:
+            conditions.append('n.full_name IN $full_names')
+        query = ('MATCH (n:`{0}`) WHERE {1} '
+                 'RETURN n.full_name AS full_name, n.name AS name, '
+                 'n.class AS class_name, n.file_path AS file_path, '
+                 'n.code AS code').format(self.task_id,
+                                          ' AND '.join(conditions))
+        return [
+            dict(record) for record in self._run(
+                query, full_names=list(full_names or []))
+        ]
+
+    def load_relations(self):
+        """
+        CALL and INHERITS neighbours of every node of the task, read with one
+        query instead of four per method.
+        """
+        relations = {}
+
+        def entry(full_name):
+            return relations.setdefault(
+                full_name, {
+                    'incoming_calls': [],
+                    'outgoing_calls': [],
+                    'inherits_from': [],
+                    'inherited_by': [],
+                })
+
+        query = ('MATCH (s:`{0}`)-[r:CALL|INHERITS]->(e:`{0}`) '
+                 'RETURN s.full_name AS source, type(r) AS relationship_type, '
+                 'e.full_name AS target').format(self.task_id)
+        for record in self._run(query):
+            source, target = record['source'], record['target']
+            if record['relationship_type'] == 'CALL':
+                entry(source)['outgoing_calls'].append(target)
+                entry(target)['incoming_calls'].append(source)
+            else:
+                entry(source)['inherits_from'].append(target)
+                entry(target)['inherited_by'].append(source)
+        return relations
+
+    def _pack(self, methods):
+        packs, pack, size = [], [], 0
+        for method in methods:
+            code_size = len(method['method_code'])
+            if pack and (len(pack) >= self.methods_per_prompt
+                         or size + code_size > self.max_prompt_chars):
+                packs.append(pack)
+                pack, size = [], 0
+            pack.append(method)
+            size += code_size
+        if pack:
+            packs.append(pack)
+        return packs
+
+    def _describe_pack(self, pack):
+        completion_tokens = self.generator.llm_config.get('max_tokens', 200)
+        prompt_tokens = sum(
+            estimate_tokens(method['method_code']) for method in pack)
+        self.rate_limiter.acquire(prompt_tokens
+                                  + completion_tokens * len(pack))
+        if len(pack) == 1:
+            method = pack[0]
+            description = self.generator.generate_method_description(
+                method_code=method['method_code'],
+                method_name=method['method_name'],
+                class_name=method['class_name'],
+                file_path=method['file_path'],
+                relations=method['relations'],
+                raise_on_error=True,
+                skip_cache_lookup=True)
+            return [(method['full_name'], description)]
+        # run() already looked every method up in the generator cache.
+        descriptions = self.generator.generate_batch_descriptions(
+            pack, raise_on_error=True, skip_cache_lookup=True)
+        return [(method['full_name'], description)
+                for method, description in zip(pack, descriptions)]
+
+    def run(self, full_names=None, update_progress_bar=None):
+        """
+        Describe the methods and write the results back. Returns counters of
+        the run.
+        """
+        start_time = time.time()
+        stats = {
+            'methods': 0,
+            'cached': 0,
+            'generated': 0,
+            'failed': 0,
+            'llm_requests': 0,
+        }
+        records = self.collect_methods(full_names)
+        if not records:
+            return stats
+        relations = self.load_relations()
+
+        methods, results = [], []
+        for record in records:
+            method_code = self.resolve_code(record['code'])
+            if not method_code.strip():
+                continue
+            method = {
+                'full_name': record['full_name'],
+                'method_name': record['name']
+                or record['full_name'].split('.')[-1],
+                'method_code': method_code,
+                'class_name': record['class_name'] or '',
+                'file_path': record['file_path'] or '',
+                'relations': relations.get(record['full_name']),
+            }
+            cached = self.generator.get_cached_description(
+                method['method_code'], method['method_name'])
+            if cached is not None:
+                results.append((method['full_name'], cached))
+            else:
+                methods.append(method)
+        stats['methods'] = len(results) + len(methods)
+        stats['cached'] = len(results)
+
+        written = 0
+
+        def write_back(force=False):
+            nonlocal written
+            if len(results) - written < self.write_batch_size and not force:
+                return
+            for full_name, description in results[written:]:
+                self.graph_db.queue_node_update(
+                    full_name, {'description': description})
+            written = len(results)
+            self.graph_db.flush()
+
+        packs = self._pack(methods)
+        stats['llm_requests'] = len(packs)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = {
+                executor.submit(self._describe_pack, pack): pack
+                for pack in packs
+            }
+            for i, future in enumerate(as_completed(futures)):
+                try:
+                    described = [(full_name, description)
+                                 for full_name, description in future.result()
+                                 if description]
+                    results.extend(described)
+                    stats['generated'] += len(described)
+                    stats['failed'] += len(futures[future]) - len(described)
+                except Exception as e:
+                    stats['failed'] += len(futures[future])
+                    print(f'Description generation failed: {e}')
+                write_back()
+                if update_progress_bar:
+                    update_progress_bar((i + 1) / len(packs))
+        write_back(force=True)
+        if hasattr(self.generator, 'get_cache_stats'):
+            stats['cache'] = self.generator.get_cache_stats()
+
+        elapsed_time = time.time() - start_time
+        print(f"📝 Method descriptions ({stats['methods']} methods, "
+              f"{stats['cached']} cached, {elapsed_time:.1f} s)")
+        return stats
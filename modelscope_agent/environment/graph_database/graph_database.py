@@ -1,50 +1,116 @@
 import concurrent.futures
-
-import fasteners
-from py2neo import Graph, Node, NodeMatcher, Relationship, RelationshipMatcher
-
-REMOVE_LABEL_QUERY_TEMPLATE = """
+import threading
+import time
+import uuid
+
+from py2neo import NodeMatcher, RelationshipMatcher
+from py2neo.client import Connection
+from py2neo.cypher import Cursor
+
+from modelscope_agent.environment.graph_database.indexer.embedded_graph import \
+    is_embedded_uri
+from modelscope_agent.environment.graph_database.indexer.graph_pool import \
+    get_graph_pool_registry
+from modelscope_agent.environment.graph_database.indexer.task_lock import (
+    FileLock, NoOpLock, task_lockfile)
+from .query_budget import consume_records
+
+# Labels a node can carry besides task labels. A node whose other labels
+# are all in this list belongs to one task only.
+NODE_LABELS = [
+    'MODULE', 'CLASS', 'FUNCTION', 'METHOD', 'GLOBAL_VARIABLE', 'FIELD', 'none'
+]
+
+# One batch of `clear_task_data`: nodes shared with another task (or a
+# snapshot) lose the task label, the others are deleted with their edges.
+CLEAR_TASK_QUERY_TEMPLATE = """
 MATCH (n:`{label}`)
-WHERE size(labels(n)) > 1
-WITH n LIMIT {limit}
-REMOVE n:`{label}`
-RETURN count(n) AS removed_count
+WITH n LIMIT $limit
+WITH collect(n) AS nodes
+FOREACH (n IN [x IN nodes WHERE any(l IN labels(x)
+               WHERE l <> $label AND NOT l IN $node_labels)] |
+    REMOVE n:`{label}`)
+FOREACH (n IN [x IN nodes WHERE none(l IN labels(x)
+               WHERE l <> $label AND NOT l IN $node_labels)] |
+    DETACH DELETE n)
+RETURN size(nodes) AS processed
 """
 
-DELETE_NODE_QUERY_TEMPLATE = """
-MATCH (n:`{label}`)
-WHERE size(labels(n)) = 1
-WITH n LIMIT {limit}
+# One batch of `collect_garbage`: nodes left without any task label.
+COLLECT_GARBAGE_QUERY = """
+MATCH (n)
+WHERE size(labels(n)) > 0 AND all(l IN labels(n) WHERE l IN $node_labels)
+WITH n LIMIT $limit
 DETACH DELETE n
-RETURN count(n) AS deleted_count
+RETURN count(*) AS deleted
 """
 
+# Kills the running queries tagged with $tag, see `kill_query`.
+KILL_QUERY_TEMPLATE = """
+CALL dbms.listQueries() YIELD queryId, query
+WHERE query CONTAINS $tag AND NOT query CONTAINS 'dbms.listQueries'
+CALL dbms.killQuery(queryId) YIELD message
+RETURN count(*) AS killed
+"""
 
-class NoOpLock:
-
-    def __enter__(self):
-        pass
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        pass
-
-
-class FileLock:
-    # 读写锁
-    def __init__(self, lockfile):
-        self.lockfile = lockfile
-        self.lock = fasteners.InterProcessLock(self.lockfile)
-        self.lock_acquired = False
-
-    def __enter__(self):
-        self.lock_acquired = self.lock.acquire(blocking=True)
-        if not self.lock_acquired:
-            raise RuntimeError('Unable to acquire the lock')
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.lock_acquired:
-            self.lock.release()
-            self.lock_acquired = False
+# One node per task holding the version of the task's graph, see
+# `bump_graph_version`. It carries no task label so clearing the task keeps it.
+GRAPH_VERSION_LABEL = 'CODEXGRAPH_VERSION'
+
+# Threads shared by every handler for `execute_query_with_timeout`.
+QUERY_EXECUTOR_WORKERS = 8
+_query_executor = None
+_query_executor_lock = threading.Lock()
+# Seconds an embedded query may run past the timeout of
+# `execute_query_with_timeout` before it stops itself.
+EMBEDDED_DEADLINE_GRACE = 1.0
+
+
+def _get_query_executor():
+    global _query_executor
+    with _query_executor_lock:
+        if _query_executor is None:
+            _query_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=QUERY_EXECUTOR_WORKERS,
+                thread_name_prefix='codexgraph-query')
+        return _query_executor
+
+
+# Properties looked up by full_name/name/file_path in every CodexGraph query.
+INDEXED_PROPERTIES = ('full_name', 'name', 'file_path')
+
+# Plan operators that read through a schema index.
+INDEX_OPERATORS = ('NodeIndexSeek', 'NodeUniqueIndexSeek',
+                   'NodeIndexSeekByRange', 'NodeIndexScan',
+                   'NodeIndexContainsScan', 'NodeIndexEndsWithScan',
+                   'MultiNodeIndexSeek', 'AssertingMultiNodeIndexSeek')
+
+
+def _plan_operators(plan):
+    """
+    Flatten an EXPLAIN plan (as returned by `Cursor.plan()`) into
+    (operator_type, details) pairs.
+    """
+    if not plan:
+        return []
+    if isinstance(plan, dict):
+        operator_type = plan.get('operatorType', '')
+        args = plan.get('args', {})
+        children = plan.get('children', [])
+    else:
+        operator_type = getattr(plan, 'operator_type', '')
+        args = getattr(plan, 'args', {})
+        children = getattr(plan, 'children', [])
+    details = args.get('Details', '') if isinstance(args, dict) else ''
+    operators = [(operator_type.split('@')[0], details)]
+    for child in children:
+        operators.extend(_plan_operators(child))
+    return operators
+
+
+# Attempts of a flush transaction failing with a transient error (e.g. a
+# deadlock between writers of tasks sharing nodes).
+FLUSH_RETRIES = 3
 
 
 class GraphDatabaseHandler:
@@ -58,139 +124,428 @@ class GraphDatabaseHandler:
         task_id='',
         use_lock=False,
         lockfile='neo4j.lock',
+        bulk_write=False,
+        batch_size=1000,
+        max_buffered_rows=10000,
     ):
-        self.graph = self._connect_to_graph(uri, user, password, database_name)
-        self.node_matcher = NodeMatcher(self.graph)
-        self.rel_matcher = RelationshipMatcher(self.graph)
+        # `embedded://path` opens a serverless graph file instead of Neo4j.
+        self.embedded = is_embedded_uri(uri)
+        # Shared `GraphPool` of the database, see `_connect_to_graph`.
+        self.pool = None
+        self._graph = self._connect_to_graph(uri, user, password,
+                                             database_name)
+        if self.pool is None:
+            self._node_matcher = NodeMatcher(self._graph)
+            self._rel_matcher = RelationshipMatcher(self._graph)
         self.none_label = 'none'
         self.task_id = task_id
-        self.lock = FileLock(lockfile) if use_lock else NoOpLock()
+        # Reads never lock, every query is its own transaction. With use_lock
+        # the writes of a task are serialized across threads and processes
+        # on a lock file of that task, see `task_lock`.
+        self.use_lock = use_lock
+        self.lockfile = lockfile
+        self.lock = self.task_lock()
+        # bulk_write routes add_node/add_edge/update_node into buffers that
+        # are written by `flush` with UNWIND statements. Without it every
+        # call is written at once by the same MERGE statements.
+        self.bulk_write = bulk_write
+        self.batch_size = batch_size
+        self.max_buffered_rows = max_buffered_rows
+        self._node_buffer = {}
+        self._update_buffer = {}
+        self._edge_buffer = {}
+        self._edge_update_buffer = {}
+        self._metrics_lock = threading.Lock()
+        self._query_metrics = {
+            'completed': 0,
+            'failed': 0,
+            'timed_out': 0,
+            'cancelled': 0,
+            'total_seconds': 0.0,
+        }
 
     def _connect_to_graph(self, uri, user, password, database_name):
         try:
-            return Graph(uri, auth=(user, password), name=database_name)
+            self.pool = get_graph_pool_registry().acquire(
+                uri, user, password, database_name)
         except Exception as e:
             raise ConnectionError(
                 'Failed to connect to Neo4j at {} after attempting to start the service.'
                 .format(uri)) from e
+        return self.pool.graph
+
+    @property
+    def graph(self):
+        # The pool replaces its graph when it reconnects.
+        if self.pool is not None:
+            return self.pool.graph
+        return self._graph
+
+    @property
+    def node_matcher(self):
+        if self.pool is not None:
+            return self.pool.node_matcher
+        return self._node_matcher
+
+    @property
+    def rel_matcher(self):
+        if self.pool is not None:
+            return self.pool.rel_matcher
+        return self._rel_matcher
+
+    def task_lock(self, task_id=None):
+        """
+        Write lock of a task (this handler's task by default), shared by
+        every handler of every process using the same `lockfile`. Writes of
+        different tasks do not wait for each other.
+        """
+        if not self.use_lock:
+            return NoOpLock()
+        return FileLock(task_lockfile(self.lockfile, task_id or self.task_id))
 
-    def _match_node(self, full_name):
-        if self.task_id:
-            existing_node = self.node_matcher.match(
-                self.task_id, full_name=full_name).first()
-        else:
-            existing_node = self.node_matcher.match(
-                full_name=full_name).first()
-        return existing_node
-
-    def _create_node(self, label=None, full_name='', parms={}):
-        if label is None or label == '':
-            label = self.none_label
-        if self.task_id:
-            node = Node(self.task_id, label, full_name=full_name, **parms)
-        else:
-            node = Node(label, full_name=full_name, **parms)
-        self.graph.create(node)
-        return node
-
-    def _update_node_label(self, full_name, label):
-        existing_node = self._match_node(full_name)
-        if existing_node:
-            query = ('MATCH (n:{0}:`{1}` {{full_name: $full_name}}) '
-                     'REMOVE n:{0} '
-                     'SET n:{2}').format(self.none_label, self.task_id, label)
-            self.graph.run(query, full_name=full_name)
-            return True
-        return False
-
-    def _add_node_label(self, full_name, new_label):
-        existing_node = self._match_node(full_name)
-        if existing_node:
-            query = ('MATCH (n:`{0}` {{full_name: $full_name}}) '
-                     'SET n:{1}').format(self.task_id, new_label)
-            self.graph.run(query, full_name=full_name)
-            return True
-        return False
-
-    def clear_task_data(self, task_id, batch_size=500):
-        """
-        Remove a specific label from nodes in batches. If a node only has this one label,
-        delete the node.
+    def pool_metrics(self):
         """
-        with self.lock:
-            while True:
-                remove_label_query = REMOVE_LABEL_QUERY_TEMPLATE.format(
-                    label=task_id, limit=batch_size)
-                remove_label_result = self.graph.run(remove_label_query).data()
-                removed_count = remove_label_result[0]['removed_count']
+        Utilization and acquire-wait counters of the shared connection pool
+        of this handler's database, see `GraphPool.metrics`.
+        """
+        return self.pool.metrics() if self.pool is not None else {}
+
+    def create_indexes(self, task_id=None, unique_full_name=True):
+        """
+        Idempotently provision the full_name, name and file_path indexes of a
+        task label. With `unique_full_name` a uniqueness constraint backs the
+        full_name lookups instead of a plain index; if it cannot be created
+        (duplicate full_names already stored, or an edition without
+        constraints) the plain index is used.
+
+        Returns a dict mapping every attempted statement to 'ok' or the error.
+        """
+        label = task_id or self.task_id
+        report = {}
+        if not label:
+            return report
+
+        def run_schema(*queries):
+            # The first statement uses the Neo4j 4.1+ syntax, the second one
+            # the legacy syntax, which fails when the index already exists.
+            error = ''
+            for query in queries:
+                try:
+                    with self.task_lock(label):
+                        self.graph.run(query)
+                    report[query] = 'ok'
+                    return True
+                except Exception as e:
+                    error = str(e)
+            report[queries[0]] = error
+            return False
+
+        for prop in INDEXED_PROPERTIES:
+            if prop == 'full_name' and unique_full_name and run_schema(
+                    'CREATE CONSTRAINT `codexgraph_{0}_{1}_unique` IF NOT EXISTS '
+                    'ON (n:`{0}`) ASSERT n.{1} IS UNIQUE'.format(label, prop),
+                    'CREATE CONSTRAINT ON (n:`{0}`) '
+                    'ASSERT n.{1} IS UNIQUE'.format(label, prop)):
+                continue
+            run_schema(
+                'CREATE INDEX `codexgraph_{0}_{1}` IF NOT EXISTS '
+                'FOR (n:`{0}`) ON (n.{1})'.format(label, prop),
+                'CREATE INDEX ON :`{0}`({1})'.format(label, prop))
+        return report
+
+    def drop_indexes(self, task_id=None):
+        """
+        Drop the indexes and constraint created by `create_indexes`.
+        """
+        label = task_id or self.task_id
+        if not label:
+            return
+        queries = ['DROP CONSTRAINT `codexgraph_{0}_full_name_unique` '
+                   'IF EXISTS'.format(label)]
+        queries.extend(
+            'DROP INDEX `codexgraph_{0}_{1}` IF EXISTS'.format(label, prop)
+            for prop in INDEXED_PROPERTIES)
+        for query in queries:
+            try:
+                with self.task_lock(label):
+                    self.graph.run(query)
+            except Exception as e:
+                print(f"Error dropping index with query '{query}': {str(e)}")
 
-                delete_node_query = DELETE_NODE_QUERY_TEMPLATE.format(
-                    label=task_id, limit=batch_size)
-                delete_node_result = self.graph.run(delete_node_query).data()
-                deleted_count = delete_node_result[0]['deleted_count']
+    def query_templates(self):
+        """
+        The Cypher this handler issues per write, with a probe value, keyed by
+        a short name. Used by `index_usage_report`.
+        """
+        task_label = self._task_label()
+        probe = '__codexgraph_probe__'
+        return {
+            'match_node':
+            'MATCH (n{0}) WHERE n.full_name = \'{1}\' RETURN n LIMIT 1'.format(
+                task_label, probe),
+            'bulk_merge_node':
+            'MERGE (n{0} {{full_name: \'{1}\'}}) RETURN n'.format(
+                task_label, probe),
+        }
+
+    def index_usage_report(self, queries=None):
+        """
+        EXPLAIN every query in `queries` (name -> cypher, defaults to
+        `query_templates()`) and report which indexes its plan reads.
 
-                if removed_count == 0 and deleted_count == 0:
+        Returns name -> {'uses_index': bool, 'indexes': [...],
+        'operators': [...]} or {'error': str} when the query cannot be
+        planned.
+        """
+        if queries is None:
+            queries = self.query_templates()
+        report = {}
+        for name, query in queries.items():
+            try:
+                plan = self.graph.run('EXPLAIN ' + query).plan()
+            except Exception as e:
+                report[name] = {'error': str(e)}
+                continue
+            operators = _plan_operators(plan)
+            indexes = [
+                '{0}({1})'.format(operator, details)
+                for operator, details in operators
+                if operator in INDEX_OPERATORS
+            ]
+            report[name] = {
+                'uses_index': bool(indexes),
+                'indexes': indexes,
+                'operators': [operator for operator, _ in operators],
+            }
+        return report
+
+    def count_task_nodes(self, task_id=None):
+        label = task_id or self.task_id
+        return self.graph.run('MATCH (n:`{0}`) RETURN count(n)'.format(
+            label)).evaluate() or 0
+
+    def clear_task_data(self,
+                        task_id,
+                        batch_size=10000,
+                        update_progress_bar=None):
+        """
+        Remove a task from the graph: nodes of this task only are deleted
+        with their edges, nodes shared with other tasks just lose the task
+        label. Runs one transaction of `batch_size` nodes at a time and
+        reports the done fraction to `update_progress_bar`. Returns the
+        number of processed nodes.
+        """
+        total = self.count_task_nodes(task_id) if update_progress_bar else 0
+        query = CLEAR_TASK_QUERY_TEMPLATE.format(label=task_id)
+        processed = 0
+        with self.task_lock(task_id):
+            while True:
+                count = self.graph.run(
+                    query,
+                    limit=batch_size,
+                    label=task_id,
+                    node_labels=NODE_LABELS).evaluate() or 0
+                processed += count
+                if update_progress_bar and total:
+                    update_progress_bar(min(processed / total, 1.0))
+                if count < batch_size:
                     break
+        return processed
+
+    def collect_garbage(self, batch_size=10000):
+        """
+        Delete the nodes left without any task label (e.g. by clears before
+        shared nodes were told apart). Returns the number of deleted nodes.
+        """
+        deleted = 0
+        while True:
+            count = self.graph.run(
+                COLLECT_GARBAGE_QUERY,
+                limit=batch_size,
+                node_labels=NODE_LABELS).evaluate() or 0
+            deleted += count
+            if count < batch_size:
+                return deleted
 
     def clear_database(self):
-        with self.lock:
-            self.graph.run('MATCH (n) DETACH DELETE n')
+        self.graph.run('MATCH (n) DETACH DELETE n')
 
     def execute_query(self, query, **params):
         try:
-            with self.lock:
-                result = self.graph.run(query, **params)
-                return [record for record in result]
+            result = self.graph.run(query, **params)
+            return [record for record in result]
         except Exception:
             return ''
 
     def execute_query_with_exception(self, query, **params):
         try:
-            with self.lock:
-                result = self.graph.run(query, **params)
-                return [record for record in result], True
+            result = self.graph.run(query, **params)
+            return [record for record in result], True
         except Exception as e:
             return str(e), False
 
-    def execute_query_with_timeout(graph_db, cypher, timeout=60):
+    def stream_query(self, query, fetch_size=1000, **params):
+        """
+        Yield the records of `query` while pulling them from the server
+        `fetch_size` at a time (Bolt 4+, older servers send everything at
+        once). Closing the generator early discards the rest of the result
+        on the server instead of transferring it.
+        """
+        if self.embedded:
+            yield from self.graph.run(query, **params)
+            return
+        connector = self.graph.service.connector
+        hydrant = Connection.default_hydrant(connector.profile, self.graph)
+        result = connector.auto_run(query, params, graph_name=self.graph.name)
+        try:
+            try:
+                connector.pull(result, n=fetch_size)
+            except IndexError:
+                # No flow control in this protocol version.
+                connector.pull(result)
+            cursor = Cursor(result, hydrant)
+            while True:
+                if cursor.forward():
+                    yield cursor.current
+                elif result.has_more_records():
+                    connector.pull(result, n=fetch_size)
+                else:
+                    break
+        finally:
+            if result.has_more_records():
+                connector.discard(result)
 
-        def query_execution():
-            return graph_db.execute_query_with_exception(cypher)
+    def execute_query_budgeted(self, query, budget=None, render=str, **params):
+        """
+        Stream `query` and keep only what fits `budget` (a `QueryBudget`),
+        see `consume_records`. Returns a `BudgetedResult` and True, or the
+        error message and False.
+        """
+        try:
+            return consume_records(
+                self.stream_query(query, **params), budget, render), True
+        except Exception as e:
+            return str(e), False
 
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future = executor.submit(query_execution)
-            try:
-                cypher_response, flag = future.result(timeout=timeout)
-            except concurrent.futures.TimeoutError:
-                cypher_response = 'cypher too complex, out of memory'
-                flag = True
-            except Exception as e:
-                cypher_response = str(e)
-                flag = False
+    def graph_version(self, task_id=None):
+        """
+        Version of the task's graph, changed by every (re-)index of the task.
+        None when the task was never indexed or the graph is unreachable.
+        """
+        query = ('MATCH (v:{0} {{task_id: $task_id}}) '
+                 'RETURN v.version').format(GRAPH_VERSION_LABEL)
+        try:
+            return self.graph.run(
+                query, task_id=task_id or self.task_id).evaluate()
+        except Exception:
+            return None
+
+    def bump_graph_version(self, task_id=None):
+        """
+        Give the task's graph a new version, invalidating every result cached
+        for the previous one. Returns the new version.
+        """
+        version = uuid.uuid4().hex
+        query = ('MERGE (v:{0} {{task_id: $task_id}}) '
+                 'SET v.version = $version').format(GRAPH_VERSION_LABEL)
+        self.graph.run(query, task_id=task_id or self.task_id, version=version)
+        return version
 
+    def kill_query(self, tag):
+        """
+        Kill the running queries whose text contains `tag` (see
+        `execute_query_with_timeout`). Returns the number of killed queries,
+        None when the server refused the procedure calls. Embedded queries
+        are cancelled in process.
+        """
+        if self.embedded:
+            return self.graph.kill_queries(tag)
+        try:
+            return self.graph.run(KILL_QUERY_TEMPLATE, tag=tag).evaluate()
+        except Exception as e:
+            print(f'Unable to kill query {tag}: {e}')
+            return None
+
+    def _count_query(self, outcome, elapsed):
+        with self._metrics_lock:
+            self._query_metrics[outcome] += 1
+            self._query_metrics['total_seconds'] += elapsed
+
+    def query_metrics(self):
+        """
+        Counters of the queries run by `execute_query_with_timeout`:
+        completed, failed, timed_out, and cancelled (the timed out ones that
+        were killed on the server or had not started yet).
+        """
+        with self._metrics_lock:
+            return dict(self._query_metrics)
+
+    def execute_query_with_timeout(self,
+                                   cypher,
+                                   timeout=60,
+                                   budget=None,
+                                   render=str):
+        """
+        Run `cypher` with a time limit. With `budget` the result is streamed
+        and returned as a `BudgetedResult`, otherwise as a list of records.
+
+        Queries run on an executor shared by all handlers. The query text is
+        tagged with a unique comment so that, once `timeout` expires, the
+        query can be found in `dbms.listQueries()` (or among the running
+        queries of an embedded graph) and killed. The worker thread then
+        gets the error and returns to the executor instead of running on.
+        Reads take no handler lock, there is none to release.
+        """
+        tag = 'codexgraph-query-{}'.format(uuid.uuid4().hex)
+        tagged_cypher = '/* {} */ {}'.format(tag, cypher)
+        abandoned = threading.Event()
+
+        def query_execution():
+            if abandoned.is_set():
+                return None, True
+            if self.embedded:
+                # `kill_query` cancels the embedded query when the caller
+                # gives up; the deadline also stops one that only gets the
+                # graph's lock after that.
+                remaining = timeout - (time.monotonic() - start_time)
+                remaining += EMBEDDED_DEADLINE_GRACE
+                with self.graph.deadline(remaining):
+                    return run_query()
+            return run_query()
+
+        def run_query():
+            if budget is not None:
+                return self.execute_query_budgeted(
+                    tagged_cypher, budget=budget, render=render)
+            return self.execute_query_with_exception(tagged_cypher)
+
+        start_time = time.monotonic()
+        future = _get_query_executor().submit(query_execution)
+        try:
+            cypher_response, flag = future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            abandoned.set()
+            cancelled = future.cancel() or bool(self.kill_query(tag))
+            self._count_query('timed_out', time.monotonic() - start_time)
+            if cancelled:
+                self._count_query('cancelled', 0.0)
+            return 'cypher too complex, out of memory', True
+        except Exception as e:
+            cypher_response = str(e)
+            flag = False
+        self._count_query('completed' if flag else 'failed',
+                          time.monotonic() - start_time)
         return cypher_response, flag
 
     def update_node(self, full_name, parms={}):
-        with self.lock:
-            existing_node = self._match_node(full_name)
-            if existing_node:
-                existing_node.update(parms)
-                self.graph.push(existing_node)
+        self.queue_node_update(full_name, parms)
+        if not self.bulk_write:
+            self.flush()
 
     def add_node(self, label, full_name, parms={}):
-        with self.lock:
-            existing_node = self._match_node(full_name)
-            if existing_node:
-                if self.none_label in list(existing_node.labels):
-                    self._update_node_label(full_name, label)
-                elif label not in list(existing_node.labels):
-                    self._add_node_label(full_name, label)
-                existing_node.update(parms)
-                self.graph.push(existing_node)
-            else:
-                existing_node = self._create_node(
-                    label, full_name, parms=parms)
-            return existing_node
+        self.queue_node(label, full_name, parms)
+        if not self.bulk_write:
+            self.flush()
 
     def add_edge(
         self,
@@ -201,52 +556,212 @@ class GraphDatabaseHandler:
         end_name='',
         params={},
     ):
-        with self.lock:
-            start_node = self._match_node(full_name=start_name)
-            end_node = self._match_node(full_name=end_name)
-
-            if not start_node:
-                start_node = self._create_node(
-                    start_label, full_name=start_name, parms=params)
-            if not end_node:
-                end_node = self._create_node(
-                    end_label, full_name=end_name, parms=params)
-
-            if start_node and end_node:
-                rel = self.rel_matcher.match((start_node, end_node),
-                                             relationship_type).first()
-                if rel:
-                    rel.update(params)
-                    self.graph.push(rel)
-                    return rel
-                else:
-                    rel = Relationship(start_node, relationship_type, end_node,
-                                       **params)
-                    self.graph.create(rel)
-                    return rel
-            return None
+        self.queue_edge(start_label, start_name, relationship_type, end_label,
+                        end_name, params)
+        if not self.bulk_write:
+            self.flush()
 
     def update_edge(self,
                     start_name='',
                     relationship_type='',
                     end_name='',
                     params={}):
-        with self.lock:
-            start_node = self._match_node(full_name=start_name)
-            end_node = self._match_node(full_name=end_name)
-            if start_node and end_node:
-                rel = self.rel_matcher.match((start_node, end_node),
-                                             relationship_type).first()
-                if rel:
-                    rel.update(params)
-                    self.graph.push(rel)
-                    return rel
-                else:
-                    rel = Relationship(start_node, relationship_type, end_node,
-                                       **params)
-                    self.graph.create(rel)
-                    return rel
-            return None
+        self.queue_edge_update(start_name, relationship_type, end_name,
+                               params)
+        if not self.bulk_write:
+            self.flush()
+
+    def _task_label(self):
+        return ':`{0}`'.format(self.task_id) if self.task_id else ''
+
+    def queue_node(self, label, full_name, parms={}):
+        """
+        Buffer an `add_node`. Repeated calls for the same full_name are merged
+        and written by the next `flush`.
+        """
+        row = self._node_buffer.get(full_name)
+        if row is None:
+            row = self._node_buffer[full_name] = {'labels': [], 'parms': {}}
+        if label and label != self.none_label and label not in row['labels']:
+            row['labels'].append(label)
+        row['parms'].update(parms)
+        self._flush_if_full()
+
+    def queue_node_update(self, full_name, parms={}):
+        """
+        Buffer an `update_node`, which only touches nodes that already exist.
+        """
+        if full_name in self._node_buffer:
+            self._node_buffer[full_name]['parms'].update(parms)
+        else:
+            self._update_buffer.setdefault(full_name, {}).update(parms)
+            self._flush_if_full()
+
+    def queue_edge(
+        self,
+        start_label=None,
+        start_name='',
+        relationship_type='',
+        end_label=None,
+        end_name='',
+        params={},
+    ):
+        """
+        Buffer an `add_edge`. Missing endpoints are created with the edge
+        params, exactly like the unbuffered call does.
+        """
+        key = (start_name, relationship_type, end_name)
+        row = self._edge_buffer.get(key)
+        if row is None:
+            self._edge_buffer[key] = {
+                'start_label': start_label or self.none_label,
+                'end_label': end_label or self.none_label,
+                'params': dict(params),
+            }
+        else:
+            row['params'].update(params)
+        self._flush_if_full()
+
+    def queue_edge_update(self,
+                          start_name='',
+                          relationship_type='',
+                          end_name='',
+                          params={}):
+        """
+        Buffer an `update_edge`, which only connects nodes that already exist.
+        """
+        key = (start_name, relationship_type, end_name)
+        self._edge_update_buffer.setdefault(key, {}).update(params)
+        self._flush_if_full()
+
+    def _flush_if_full(self):
+        pending = len(self._node_buffer) + len(self._update_buffer) + len(
+            self._edge_buffer) + len(self._edge_update_buffer)
+        if pending >= self.max_buffered_rows:
+            self.flush()
+
+    def _bulk_statements(self):
+        task_label = self._task_label()
+        node_groups = {}
+        for full_name, row in self._node_buffer.items():
+            node_groups.setdefault(tuple(row['labels']), []).append({
+                'full_name':
+                full_name,
+                'parms':
+                row['parms'],
+            })
+        statements = []
+        for labels, rows in node_groups.items():
+            if labels:
+                query = ('UNWIND $rows AS row '
+                         'MERGE (n{0} {{full_name: row.full_name}}) '
+                         'SET n += row.parms, n{1} '
+                         'REMOVE n:`{2}`').format(
+                             task_label,
+                             ''.join(':`{0}`'.format(label)
+                                     for label in labels), self.none_label)
+            else:
+                query = ('UNWIND $rows AS row '
+                         'MERGE (n{0} {{full_name: row.full_name}}) '
+                         'ON CREATE SET n:`{1}` '
+                         'SET n += row.parms').format(task_label,
+                                                      self.none_label)
+            statements.append((query, rows))
+
+        if self._update_buffer:
+            query = ('UNWIND $rows AS row '
+                     'MATCH (n{0} {{full_name: row.full_name}}) '
+                     'SET n += row.parms').format(task_label)
+            statements.append((query, [{
+                'full_name': full_name,
+                'parms': parms
+            } for full_name, parms in self._update_buffer.items()]))
+
+        edge_groups = {}
+        for (start_name, relationship_type,
+             end_name), row in self._edge_buffer.items():
+            group = (relationship_type, row['start_label'], row['end_label'])
+            edge_groups.setdefault(group, []).append({
+                'start_name': start_name,
+                'end_name': end_name,
+                'params': row['params'],
+            })
+        for (relationship_type, start_label,
+             end_label), rows in edge_groups.items():
+            query = ('UNWIND $rows AS row '
+                     'MERGE (s{0} {{full_name: row.start_name}}) '
+                     'ON CREATE SET s:`{1}`, s += row.params '
+                     'MERGE (e{0} {{full_name: row.end_name}}) '
+                     'ON CREATE SET e:`{2}`, e += row.params '
+                     'MERGE (s)-[r:`{3}`]->(e) '
+                     'SET r += row.params').format(task_label, start_label,
+                                                   end_label,
+                                                   relationship_type)
+            statements.append((query, rows))
+
+        edge_update_groups = {}
+        for (start_name, relationship_type,
+             end_name), params in self._edge_update_buffer.items():
+            edge_update_groups.setdefault(relationship_type, []).append({
+                'start_name': start_name,
+                'end_name': end_name,
+                'params': params,
+            })
+        for relationship_type, rows in edge_update_groups.items():
+            query = ('UNWIND $rows AS row '
+                     'MATCH (s{0} {{full_name: row.start_name}}) '
+                     'MATCH (e{0} {{full_name: row.end_name}}) '
+                     'MERGE (s)-[r:`{1}`]->(e) '
+                     'SET r += row.params').format(task_label,
+                                                   relationship_type)
+            statements.append((query, rows))
+        return statements
+
+    def flush(self):
+        """
+        Write all buffered nodes, node updates, edges and edge updates (in that
+        order) as
+        `UNWIND $rows` statements of at most `batch_size` rows, all inside one
+        explicit transaction. Returns the number of rows written.
+
+        The statements only MERGE, so a transaction that fails with a
+        transient error is simply run again, up to `FLUSH_RETRIES` times.
+        If the write still fails, the rows stay buffered for the next flush.
+        """
+        statements = self._bulk_statements()
+        if not statements:
+            return 0
+
+        for attempt in range(FLUSH_RETRIES):
+            try:
+                with self.lock:
+                    written = self._write_statements(statements)
+                break
+            except Exception as e:
+                retry = getattr(e, 'should_retry', None)
+                if attempt == FLUSH_RETRIES - 1 or not (retry and retry()):
+                    raise
+                time.sleep(0.1 * 2**attempt)
+
+        self._node_buffer = {}
+        self._update_buffer = {}
+        self._edge_buffer = {}
+        self._edge_update_buffer = {}
+        return written
+
+    def _write_statements(self, statements):
+        written = 0
+        tx = self.graph.begin()
+        try:
+            for query, rows in statements:
+                for i in range(0, len(rows), self.batch_size):
+                    tx.run(query, rows=rows[i:i + self.batch_size])
+                written += len(rows)
+            self.graph.commit(tx)
+        except Exception:
+            self.graph.rollback(tx)
+            raise
+        return written
 
     def update_file_path(self, root_path):
         with self.lock:
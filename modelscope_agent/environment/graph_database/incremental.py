@@ -0,0 +1,398 @@
+import hashlib
+import os
+import time
+
+import json
+from modelscope_agent.environment.graph_database.ast_search import (
+    AstManager, ParsedFileStore)
+from modelscope_agent.environment.graph_database.ast_search.ast_utils import \
+    get_dotted_name
+from modelscope_agent.environment.graph_database.ast_search.parsed_store import \
+    summarize_file
+from modelscope_agent.environment.graph_database.graph_database import \
+    NODE_LABELS
+
+MANIFEST_DIR = os.environ.get(
+    'CODEXGRAPH_MANIFEST_DIR',
+    os.path.join(os.path.expanduser('~'), '.codexgraph', 'manifests'))
+
+MANIFEST_VERSION = 1
+
+
+def file_hash(file_path):
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def module_of_file(root_path, file_path):
+    if '__init__.py' in file_path:
+        return get_dotted_name(root_path, os.path.dirname(file_path))
+    return get_dotted_name(root_path, file_path)
+
+
+def imported_modules(root_path, file_path, summary=None):
+    """
+    Dotted names a file imports from, including `pkg.name` for every
+    `from pkg import name`, so a changed submodule can be matched too.
+    `summary` is the file's `ParsedFileStore` summary when already known.
+    """
+    if summary is None:
+        summary = summarize_file(file_path, root_path)
+    if summary is None:
+        return []
+    imports = set(summary['modules'])
+    for module_name, names in summary['imports']:
+        imports.add(module_name)
+        imports.update(module_name + '.' + name for name in names
+                       if name != '*')
+    return sorted(imports)
+
+
+class TaskManifest:
+    """
+    Persistent record of what the last build of a task indexed: for every
+    file (relative to the repository) its content hash, module name, imported
+    modules and the full_names of the nodes defined in it.
+    """
+
+    def __init__(self, task_id, repo_path, manifest_dir=None):
+        self.task_id = task_id
+        self.repo_path = repo_path
+        self.manifest_dir = manifest_dir or MANIFEST_DIR
+        self.files = {}
+
+    @property
+    def path(self):
+        return os.path.join(self.manifest_dir, f'{self.task_id}.json')
+
+    def load(self):
+        """
+        Load the manifest, returns False when there is none or it belongs to
+        another repository.
+        """
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if data.get('version') != MANIFEST_VERSION or data.get(
+                'repo_path') != os.path.abspath(self.repo_path):
+            return False
+        self.files = data.get('files', {})
+        return True
+
+    def save(self):
+        os.makedirs(self.manifest_dir, exist_ok=True)
+        data = {
+            'version': MANIFEST_VERSION,
+            'task_id': self.task_id,
+            'repo_path': os.path.abspath(self.repo_path),
+            'files': self.files,
+        }
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def delete(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class IncrementalIndexer:
+    """
+    Re-index only the files whose content hash changed since the manifest of
+    the task was written, and splice their subgraph into the task graph.
+
+    For the changed and deleted files the nodes they define are removed after
+    saving the edges other files point at them with. Changed and added files
+    are shallow-indexed again, the saved CALL/USES/INHERITS/CONTAINS/... edges
+    are restored where both ends still exist, and `AstManager` re-resolves
+    imports and inheritance for the changed files and the files importing
+    them.
+
+    Args:
+        graph_db: Handler of the task graph.
+        repo_path: Root of the indexed repository.
+        task_id: Task label.
+        index_files: Callable indexing a list of files into the task graph,
+            `index_files(file_list, update_progress_bar)`.
+        manifest_dir: Directory holding the `<task_id>.json` manifests.
+        store: `ParsedFileStore` of the current build, a fresh one is used
+            for every `run` otherwise.
+    """
+
+    def __init__(self,
+                 graph_db,
+                 repo_path,
+                 task_id,
+                 index_files,
+                 manifest_dir=None,
+                 store=None):
+        self.graph_db = graph_db
+        self.repo_path = repo_path
+        self.task_id = task_id
+        self.index_files = index_files
+        self.manifest = TaskManifest(task_id, repo_path, manifest_dir)
+        self.store = store
+        self._run_store = None
+
+    def _store(self):
+        if self.store is not None:
+            return self.store
+        if self._run_store is None:
+            self._run_store = ParsedFileStore(self.repo_path)
+        return self._run_store
+
+    def _relpath(self, file_path):
+        return os.path.relpath(file_path, self.repo_path)
+
+    def _abspath(self, rel_path):
+        return os.path.join(self.repo_path, rel_path)
+
+    def _node_file_paths(self, file_path):
+        # The indexer stores file_path with the repository root stripped off,
+        # see AstVisitorClient.process_file_path.
+        paths = {file_path, file_path.replace('\\', '/')}
+        return [
+            path[len(self.repo_path):]
+            if path.startswith(self.repo_path) else path for path in paths
+        ]
+
+    def _run(self, query, **params):
+        response, ok = self.graph_db.execute_query_with_exception(
+            query, **params)
+        if not ok:
+            print(f'Incremental indexing query failed: {response}')
+            return []
+        return response
+
+    def can_update(self):
+        """
+        True when a manifest exists for the task and the graph still holds
+        the task, so an incremental update is possible.
+        """
+        if not self.manifest.load():
+            return False
+        return bool(
+            self._run('MATCH (n:`{0}`) RETURN n.full_name LIMIT 1'.format(
+                self.task_id)))
+
+    def scan(self, file_path, with_nodes=True):
+        entry = {
+            'hash':
+            file_hash(file_path),
+            'module':
+            module_of_file(self.repo_path, file_path),
+            'imports':
+            imported_modules(self.repo_path, file_path,
+                             self._store().get(file_path)),
+        }
+        if with_nodes:
+            entry['nodes'] = self.nodes_of_file(file_path)
+        return entry
+
+    def nodes_of_file(self, file_path):
+        response = self._run(
+            'MATCH (n:`{0}`) WHERE n.file_path IN $paths '
+            'RETURN n.full_name AS full_name'.format(self.task_id),
+            paths=self._node_file_paths(file_path))
+        return sorted(record['full_name'] for record in response)
+
+    def manifest_nodes(self, file_paths):
+        """
+        Full names of the nodes the manifest records for `file_paths`.
+        """
+        nodes = set()
+        for file_path in file_paths:
+            entry = self.manifest.files.get(self._relpath(file_path), {})
+            nodes.update(entry.get('nodes', []))
+        return sorted(nodes)
+
+    def diff(self, file_list, candidates=None):
+        """
+        Compare the files on disk with the manifest. With `candidates` only
+        those paths are checked (e.g. the paths a file watcher reported),
+        every other file is assumed unchanged.
+
+        Returns (changed, added, deleted) lists of absolute paths and a dict
+        of the new hashes of the changed and added files.
+        """
+        changed, added, deleted, hashes = [], [], [], {}
+        if candidates is None:
+            current = {self._relpath(file_path) for file_path in file_list}
+            deleted = [
+                self._abspath(rel_path) for rel_path in self.manifest.files
+                if rel_path not in current
+            ]
+            candidates = file_list
+        for file_path in candidates:
+            rel_path = self._relpath(file_path)
+            entry = self.manifest.files.get(rel_path)
+            try:
+                digest = file_hash(file_path)
+            except OSError:
+                if entry is not None and not os.path.exists(file_path) \
+                        and file_path not in deleted:
+                    deleted.append(file_path)
+                continue
+            if entry is None:
+                added.append(file_path)
+            elif entry.get('hash') != digest:
+                changed.append(file_path)
+            else:
+                continue
+            hashes[file_path] = digest
+        return changed, added, deleted, hashes
+
+    def dependents(self, file_paths):
+        """
+        Files of the manifest importing any module defined by `file_paths`.
+        """
+        modules = {
+            module_of_file(self.repo_path, file_path)
+            for file_path in file_paths
+        }
+        return [
+            self._abspath(rel_path)
+            for rel_path, entry in self.manifest.files.items()
+            if modules.intersection(entry.get('imports', []))
+        ]
+
+    def _save_incoming_edges(self, owned):
+        query = ('MATCH (s:`{0}`)-[r]->(n:`{0}`) '
+                 'WHERE n.full_name IN $owned AND NOT s.full_name IN $owned '
+                 'RETURN s.full_name AS source, type(r) AS relationship_type, '
+                 'properties(r) AS params, n.full_name AS target').format(
+                     self.task_id)
+        return [dict(record) for record in self._run(query, owned=owned)]
+
+    def _delete_nodes(self, owned):
+        labels = ', '.join(f"'{label}'" for label in NODE_LABELS)
+        self._run(
+            'MATCH (n:`{0}`) WHERE n.full_name IN $owned '
+            'AND any(l IN labels(n) WHERE l <> \'{0}\' AND NOT l IN [{1}]) '
+            'REMOVE n:`{0}`'.format(self.task_id, labels),
+            owned=owned)
+        self._run(
+            'MATCH (n:`{0}`) WHERE n.full_name IN $owned '
+            'DETACH DELETE n'.format(self.task_id),
+            owned=owned)
+
+    def _restore_edges(self, edges, batch_size=500):
+        """
+        Merge the saved `edges` back, returns how many were restored; edges
+        whose end node is gone are dropped.
+        """
+        restored = 0
+        by_type = {}
+        for edge in edges:
+            by_type.setdefault(edge['relationship_type'], []).append(edge)
+        for relationship_type, rows in by_type.items():
+            query = ('UNWIND $rows AS row '
+                     'MATCH (s:`{0}` {{full_name: row.source}}) '
+                     'MATCH (e:`{0}` {{full_name: row.target}}) '
+                     'MERGE (s)-[r:`{1}`]->(e) '
+                     'SET r += row.params '
+                     'RETURN count(r) AS restored').format(
+                         self.task_id, relationship_type)
+            for i in range(0, len(rows), batch_size):
+                for record in self._run(query, rows=rows[i:i + batch_size]):
+                    restored += record['restored']
+        return restored
+
+    def record_full_build(self, file_list):
+        """
+        Write the manifest after a full build of `file_list`.
+        """
+        try:
+            self.manifest.files = {
+                self._relpath(file_path): self.scan(file_path)
+                for file_path in file_list
+            }
+        finally:
+            self._close_run_store()
+        self.manifest.save()
+
+    def _close_run_store(self):
+        if self._run_store is not None:
+            self._run_store.close()
+            self._run_store = None
+
+    def run(self, file_list, update_progress_bar=None, candidates=None):
+        """
+        Apply the changes between the manifest and `file_list` (restricted to
+        `candidates` when given) to the graph and update the manifest.
+        Returns a summary dict with the changed, added and deleted files and
+        the number of restored edges.
+        """
+        try:
+            return self._update(file_list, update_progress_bar, candidates)
+        finally:
+            self._close_run_store()
+
+    def _update(self, file_list, update_progress_bar, candidates):
+        start_time = time.time()
+        if not self.manifest.files:
+            self.manifest.load()
+        changed, added, deleted, hashes = self.diff(file_list, candidates)
+        summary = {
+            'changed': changed,
+            'added': added,
+            'deleted': deleted,
+            'restored_edges': 0,
+        }
+        if not (changed or added or deleted):
+            if update_progress_bar:
+                update_progress_bar(1.0)
+            return summary
+
+        # 1. save the edges other files point at the nodes we are replacing
+        #    with, then drop those nodes.
+        owned = set()
+        for file_path in changed + deleted:
+            entry = self.manifest.files.get(self._relpath(file_path), {})
+            owned.update(entry.get('nodes', []))
+        owned = sorted(owned)
+        incoming_edges = self._save_incoming_edges(owned) if owned else []
+        if owned:
+            self._delete_nodes(owned)
+
+        # 2. index the new content and put the saved edges back.
+        touched = changed + added
+        if touched:
+            self.index_files(touched, update_progress_bar)
+        summary['restored_edges'] = self._restore_edges(incoming_edges)
+
+        # 3. re-resolve imports/inheritance of the touched files and of the
+        #    unchanged files importing them.
+        dependents = self.dependents(touched + deleted)
+        rerun = [
+            file_path
+            for file_path in sorted(set(touched + dependents) - set(deleted))
+            if os.path.exists(file_path)
+        ]
+        if rerun:
+            AstManager(
+                self.repo_path,
+                self.task_id,
+                self.graph_db,
+                store=self._store()).run(py_files=rerun)
+
+        # 4. update the manifest.
+        for file_path in deleted:
+            self.manifest.files.pop(self._relpath(file_path), None)
+        for file_path in touched:
+            entry = self.scan(file_path)
+            entry['hash'] = hashes.get(file_path, entry['hash'])
+            self.manifest.files[self._relpath(file_path)] = entry
+        self.manifest.save()
+        self.graph_db.bump_graph_version(self.task_id)
+
+        elapsed_time = time.time() - start_time
+        print(f'✍️ Incremental indexing ({len(touched)} changed, '
+              f'{len(deleted)} deleted, {elapsed_time:.1f} s)')
+        return summary
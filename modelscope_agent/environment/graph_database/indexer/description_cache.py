@@ -0,0 +1,223 @@
+import hashlib
+import os
+import sqlite3
+import textwrap
+import threading
+import time
+
+DEFAULT_CACHE_PATH = os.environ.get(
+    'CODEXGRAPH_DESCRIPTION_CACHE',
+    os.path.join(
+        os.path.expanduser('~'), '.codexgraph',
+        'method_descriptions.sqlite3'))
+
+
+class _NullLock:
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+def normalize_code(code):
+    """
+    Normalize code before hashing so that indentation level, line endings and
+    trailing whitespace do not change the key.
+    """
+    lines = code.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    lines = [line.rstrip() for line in lines]
+    return textwrap.dedent('\n'.join(lines)).strip('\n')
+
+
+def description_key(code, model='', prompt_version=''):
+    """
+    Content address of a description: sha256 of the normalized code, the
+    model and the prompt version.
+    """
+    payload = '\0'.join([normalize_code(code), model, str(prompt_version)])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class DescriptionCache:
+    """
+    On-disk, content-addressed store for generated method descriptions.
+
+    Backed by SQLite in WAL mode with a busy timeout, so any number of
+    threads and processes can read and write the same file concurrently.
+    Each thread uses its own connection. Entries are evicted least recently
+    used first once `max_entries` or `max_bytes` is exceeded. Hit and miss
+    counters of this instance are reported by `stats()`.
+
+    Args:
+        path: SQLite file, ':memory:' for a private in-memory cache.
+        max_entries: Maximum number of stored descriptions, None for no limit.
+        max_bytes: Maximum total size of the stored descriptions.
+        evict_every: Number of writes between two eviction checks.
+        timeout: Seconds to wait for a lock held by another writer.
+    """
+
+    def __init__(self,
+                 path=None,
+                 max_entries=200000,
+                 max_bytes=256 * 1024 * 1024,
+                 evict_every=256,
+                 timeout=30.0):
+        self.path = path or DEFAULT_CACHE_PATH
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.evict_every = evict_every
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # The shared in-memory connection needs serializing, file connections
+        # are per thread and rely on SQLite's own locking.
+        self._db_lock = threading.Lock(
+        ) if self.path == ':memory:' else _NullLock()
+        self._memory_conn = None
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        if self.path != ':memory:':
+            os.makedirs(
+                os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._init_schema()
+
+    def _connect(self):
+        if self.path == ':memory:':
+            # One shared connection, an in-memory database is per connection.
+            if self._memory_conn is None:
+                self._memory_conn = sqlite3.connect(
+                    ':memory:', check_same_thread=False)
+            return self._memory_conn
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA busy_timeout={0}'.format(
+                int(self.timeout * 1000)))
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._connect()
+        with conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS descriptions ('
+                         'key TEXT PRIMARY KEY, '
+                         'description TEXT NOT NULL, '
+                         'size INTEGER NOT NULL, '
+                         'created REAL NOT NULL, '
+                         'last_used REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS descriptions_last_used '
+                         'ON descriptions(last_used)')
+
+    def get(self, key):
+        conn = self._connect()
+        with self._db_lock:
+            row = conn.execute(
+                'SELECT description FROM descriptions WHERE key = ?',
+                (key, )).fetchone()
+            if row is not None:
+                with conn:
+                    conn.execute(
+                        'UPDATE descriptions SET last_used = ? WHERE key = ?',
+                        (time.time(), key))
+        with self._lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return row[0] if row is not None else None
+
+    def put(self, key, description):
+        now = time.time()
+        conn = self._connect()
+        with self._db_lock:
+            with conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO descriptions '
+                    '(key, description, size, created, last_used) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (key, description, len(description.encode('utf-8')), now,
+                     now))
+        with self._lock:
+            self._writes += 1
+            check = self._writes % self.evict_every == 0
+        if check:
+            self.evict()
+
+    def __contains__(self, key):
+        conn = self._connect()
+        with self._db_lock:
+            return conn.execute('SELECT 1 FROM descriptions WHERE key = ?',
+                                (key, )).fetchone() is not None
+
+    def __len__(self):
+        return self._totals()[0]
+
+    def _totals(self):
+        conn = self._connect()
+        with self._db_lock:
+            count, size = conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM descriptions'
+            ).fetchone()
+        return count, size
+
+    def evict(self):
+        """
+        Remove least recently used entries until both limits hold. Returns the
+        number of removed entries.
+        """
+        removed = 0
+        conn = self._connect()
+        while True:
+            count, size = self._totals()
+            excess = 0
+            if self.max_entries is not None and count > self.max_entries:
+                excess = count - self.max_entries
+            if self.max_bytes is not None and size > self.max_bytes:
+                # Drop a tenth of the entries at a time until under the limit.
+                excess = max(excess, count // 10, 1)
+            if not excess or not count:
+                return removed
+            with self._db_lock:
+                with conn:
+                    conn.execute(
+                        'DELETE FROM descriptions WHERE key IN ('
+                        'SELECT key FROM descriptions '
+                        'ORDER BY last_used LIMIT ?)', (excess, ))
+            removed += excess
+
+    def items(self):
+        conn = self._connect()
+        with self._db_lock:
+            return conn.execute(
+                'SELECT key, description FROM descriptions').fetchall()
+
+    def clear(self):
+        conn = self._connect()
+        with self._db_lock:
+            with conn:
+                conn.execute('DELETE FROM descriptions')
+
+    def stats(self):
+        count, size = self._totals()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'total_cached': count,
+            'cache_size_bytes': size,
+        }
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+        if self._memory_conn is not None:
+            self._memory_conn.close()
+            self._memory_conn = None
@@ -0,0 +1,2463 @@
+"""
+Interpreter for the Cypher subset used by CodexGraph, run by `EmbeddedGraph`
+on a `GraphStore`.
+
+Supported: MATCH / OPTIONAL MATCH with WHERE (node and relationship
+patterns, label alternatives of relationship types, variable length
+relationships, named paths, pattern predicates), UNWIND, WITH, RETURN
+(DISTINCT, aggregation, ORDER BY, SKIP, LIMIT), UNION [ALL], CREATE, MERGE
+(ON CREATE / ON MATCH SET), SET, REMOVE, [DETACH] DELETE, FOREACH, EXPLAIN,
+and the
+usual operators and scalar, list, string and aggregating functions. Index
+and constraint statements are accepted and ignored, the store indexes its
+lookup properties itself.
+"""
+import math
+import re
+import time
+from functools import cmp_to_key
+from itertools import islice
+
+
+class CypherError(Exception):
+    pass
+
+
+class QueryCancelled(CypherError):
+    """
+    The query passed its deadline or was cancelled while it ran.
+    """
+
+
+# Unbounded variable length relationships (`*`, `*2..`) stop at this depth.
+MAX_VARIABLE_LENGTH = 15
+# Row loop iterations between two deadline/cancel checks.
+CHECK_INTERVAL = 256
+
+
+class NodeRef:
+    __slots__ = ('id', )
+
+    def __init__(self, node_id):
+        self.id = node_id
+
+    def __eq__(self, other):
+        return isinstance(other, NodeRef) and other.id == self.id
+
+    def __hash__(self):
+        return hash(('node', self.id))
+
+    def __repr__(self):
+        return 'NodeRef({})'.format(self.id)
+
+
+class RelRef:
+    __slots__ = ('id', )
+
+    def __init__(self, rel_id):
+        self.id = rel_id
+
+    def __eq__(self, other):
+        return isinstance(other, RelRef) and other.id == self.id
+
+    def __hash__(self):
+        return hash(('rel', self.id))
+
+    def __repr__(self):
+        return 'RelRef({})'.format(self.id)
+
+
+class PathValue:
+    __slots__ = ('nodes', 'rels')
+
+    def __init__(self, nodes, rels):
+        self.nodes = nodes
+        self.rels = rels
+
+    def __eq__(self, other):
+        return isinstance(other, PathValue) and (
+            other.nodes, other.rels) == (self.nodes, self.rels)
+
+    def __hash__(self):
+        return hash(('path', tuple(self.nodes), tuple(self.rels)))
+
+
+# Lexer
+
+_TOKEN_PATTERN = re.compile(
+    r"""
+    (?P<space>\s+|//[^\n]*|/\*.*?\*/)
+    |(?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+    |(?P<number>\d+\.\d+(?:[eE][-+]?\d+)?|\d+[eE][-+]?\d+|0x[0-9a-fA-F]+|\d+)
+    |(?P<param>\$(?:\w+|`[^`]*`))
+    |(?P<name>[^\W\d]\w*)
+    |(?P<quoted>`(?:[^`]|``)*`)
+    |(?P<op>\.\.|<>|!=|<=|>=|=~|\+=|[-+*/%^=<>()\[\]{},.:|;])
+    """, re.S | re.X)
+
+_ESCAPES = {
+    'n': '\n',
+    't': '\t',
+    'r': '\r',
+    'b': '\b',
+    'f': '\f',
+    '\\': '\\',
+    "'": "'",
+    '"': '"',
+}
+
+
+def _unescape(text):
+
+    def replace(match):
+        escape = match.group(1)
+        if escape[0] in 'uU':
+            return chr(int(escape[1:], 16))
+        return _ESCAPES.get(escape, escape)
+
+    return re.sub(r'\\(u[0-9a-fA-F]{4}|U[0-9a-fA-F]{8}|.)', replace, text)
+
+
+class Token:
+    __slots__ = ('kind', 'value', 'start', 'end')
+
+    def __init__(self, kind, value, start, end):
+        self.kind = kind
+        self.value = value
+        self.start = start
+        self.end = end
+
+    def __repr__(self):
+        return 'Token({}, {!r})'.format(self.kind, self.value)
+
+
+def tokenize(text):
+    tokens = []
+    pos = 0
+    while pos < len(text):
+        match = _TOKEN_PATTERN.match(text, pos)
+        if match is None:
+            raise CypherError('Invalid input {!r} at position {}'.format(
+                text[pos:pos + 20], pos))
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'string':
+            value = _unescape(value[1:-1])
+        elif kind == 'number':
+            if value.startswith('0x'):
+                value = int(value, 16)
+            elif '.' in value or 'e' in value or 'E' in value:
+                value = float(value)
+            else:
+                value = int(value)
+        elif kind == 'param':
+            value = value[1:].strip('`')
+        elif kind == 'quoted':
+            kind, value = 'name', value[1:-1].replace('``', '`')
+            tokens.append(Token('quoted', value, match.start(), match.end()))
+            pos = match.end()
+            continue
+        if kind != 'space':
+            tokens.append(Token(kind, value, match.start(), match.end()))
+        pos = match.end()
+    tokens.append(Token('eof', None, len(text), len(text)))
+    return tokens
+
+
+# Parser. Expressions are tuples (kind, ...), clauses are dicts.
+
+_CLAUSE_KEYWORDS = {
+    'MATCH', 'OPTIONAL', 'WHERE', 'WITH', 'RETURN', 'UNWIND', 'CREATE',
+    'MERGE', 'SET', 'REMOVE', 'DELETE', 'DETACH', 'ORDER', 'SKIP', 'LIMIT',
+    'UNION', 'ON', 'CALL', 'FOREACH', 'LOAD', 'USING'
+}
+
+_UPDATE_CLAUSES = {'create', 'merge', 'set', 'remove', 'delete', 'foreach'}
+
+AGGREGATES = {'count', 'collect', 'sum', 'avg', 'min', 'max', 'stdev'}
+
+
+class NodePattern:
+    __slots__ = ('var', 'labels', 'props')
+
+    def __init__(self, var, labels, props):
+        self.var = var
+        self.labels = labels
+        self.props = props
+
+
+class RelPattern:
+    __slots__ = ('var', 'types', 'direction', 'min', 'max', 'props',
+                 'variable')
+
+    def __init__(self, var, types, direction, min_hops, max_hops, props,
+                 variable):
+        self.var = var
+        self.types = types
+        self.direction = direction
+        self.min = min_hops
+        self.max = max_hops
+        self.props = props
+        self.variable = variable
+
+
+class PathPattern:
+    __slots__ = ('var', 'nodes', 'rels')
+
+    def __init__(self, var, nodes, rels):
+        self.var = var
+        self.nodes = nodes
+        self.rels = rels
+
+
+class Parser:
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = tokenize(text)
+        self.pos = 0
+        self.anonymous = 0
+
+    # Token helpers
+
+    @property
+    def token(self):
+        return self.tokens[self.pos]
+
+    def peek(self, offset=1):
+        return self.tokens[min(self.pos + offset, len(self.tokens) - 1)]
+
+    def advance(self):
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def is_keyword(self, *words, token=None):
+        token = token or self.token
+        return token.kind == 'name' and token.value.upper() in words
+
+    def accept_keyword(self, *words):
+        if self.is_keyword(*words):
+            return self.advance().value.upper()
+        return None
+
+    def expect_keyword(self, word):
+        if not self.accept_keyword(word):
+            self.error('expected {}'.format(word))
+
+    def is_op(self, *ops, token=None):
+        token = token or self.token
+        return token.kind == 'op' and token.value in ops
+
+    def accept_op(self, *ops):
+        if self.is_op(*ops):
+            return self.advance().value
+        return None
+
+    def expect_op(self, op):
+        if not self.accept_op(op):
+            self.error("expected '{}'".format(op))
+
+    def error(self, message):
+        token = self.token
+        found = 'end of input' if token.kind == 'eof' else repr(
+            self.text[token.start:token.end])
+        raise CypherError('Invalid input {} at position {}: {}'.format(
+            found, token.start, message))
+
+    def name(self):
+        token = self.token
+        if token.kind in ('name', 'quoted'):
+            self.pos += 1
+            return token.value
+        self.error('expected a name')
+
+    def anonymous_var(self):
+        self.anonymous += 1
+        return '  anon_{}'.format(self.anonymous)
+
+    # Statements
+
+    def parse(self):
+        query = {'explain': False, 'parts': [], 'union_all': []}
+        if self.accept_keyword('EXPLAIN', 'PROFILE'):
+            query['explain'] = True
+        if self.is_schema_command():
+            query['schema'] = True
+            return query
+        query['parts'].append(self.single_query())
+        while self.accept_keyword('UNION'):
+            query['union_all'].append(bool(self.accept_keyword('ALL')))
+            query['parts'].append(self.single_query())
+        self.accept_op(';')
+        if self.token.kind != 'eof':
+            self.error('expected end of query')
+        return query
+
+    def is_schema_command(self):
+        if self.is_keyword('CREATE', 'DROP'):
+            return self.is_keyword(
+                'INDEX', 'CONSTRAINT', 'TEXT', 'RANGE', 'POINT', 'LOOKUP',
+                'FULLTEXT', 'BTREE', token=self.peek())
+        return self.is_keyword('SHOW')
+
+    def single_query(self):
+        clauses = []
+        while self.token.kind != 'eof' and not self.is_keyword(
+                'UNION') and not self.is_op(';'):
+            clauses.append(self.clause())
+        if not clauses:
+            self.error('expected a clause')
+        return clauses
+
+    def clause(self):
+        if self.accept_keyword('OPTIONAL'):
+            self.expect_keyword('MATCH')
+            return self.match_clause(True)
+        keyword = self.accept_keyword('MATCH', 'UNWIND', 'WITH', 'RETURN',
+                                      'CREATE', 'MERGE', 'SET', 'REMOVE',
+                                      'DELETE', 'DETACH', 'FOREACH')
+        if keyword == 'MATCH':
+            return self.match_clause(False)
+        if keyword == 'UNWIND':
+            expr = self.expression()
+            self.expect_keyword('AS')
+            return {'kind': 'unwind', 'expr': expr, 'var': self.name()}
+        if keyword in ('WITH', 'RETURN'):
+            return self.projection(keyword.lower())
+        if keyword == 'CREATE':
+            return {'kind': 'create', 'patterns': self.patterns()}
+        if keyword == 'MERGE':
+            return self.merge_clause()
+        if keyword == 'SET':
+            return {'kind': 'set', 'items': self.set_items()}
+        if keyword == 'REMOVE':
+            return {'kind': 'remove', 'items': self.remove_items()}
+        if keyword == 'DETACH':
+            self.expect_keyword('DELETE')
+            return self.delete_clause(True)
+        if keyword == 'DELETE':
+            return self.delete_clause(False)
+        if keyword == 'FOREACH':
+            return self.foreach_clause()
+        if self.is_keyword('CALL', 'LOAD', 'USING'):
+            self.error('{} is not supported by the embedded graph'.format(
+                self.token.value.upper()))
+        self.error('expected a clause')
+
+    def match_clause(self, optional):
+        clause = {
+            'kind': 'match',
+            'optional': optional,
+            'patterns': self.patterns(),
+            'where': None,
+        }
+        if self.accept_keyword('WHERE'):
+            clause['where'] = self.expression()
+        return clause
+
+    def foreach_clause(self):
+        self.expect_op('(')
+        var = self.name()
+        self.expect_keyword('IN')
+        expr = self.expression()
+        self.expect_op('|')
+        clauses = []
+        while not self.is_op(')'):
+            clause = self.clause()
+            if clause['kind'] not in _UPDATE_CLAUSES:
+                self.error('only updating clauses are allowed in FOREACH')
+            clauses.append(clause)
+        self.expect_op(')')
+        if not clauses:
+            self.error('expected an updating clause')
+        return {
+            'kind': 'foreach',
+            'var': var,
+            'expr': expr,
+            'clauses': clauses
+        }
+
+    def merge_clause(self):
+        clause = {
+            'kind': 'merge',
+            'pattern': self.path_pattern(),
+            'on_create': [],
+            'on_match': [],
+        }
+        while self.is_keyword('ON'):
+            self.advance()
+            which = self.accept_keyword('CREATE', 'MATCH')
+            if not which:
+                self.error('expected CREATE or MATCH')
+            self.expect_keyword('SET')
+            clause['on_create' if which == 'CREATE' else 'on_match'].extend(
+                self.set_items())
+        return clause
+
+    def delete_clause(self, detach):
+        exprs = [self.expression()]
+        while self.accept_op(','):
+            exprs.append(self.expression())
+        return {'kind': 'delete', 'exprs': exprs, 'detach': detach}
+
+    def set_items(self):
+        items = [self.set_item()]
+        while self.accept_op(','):
+            items.append(self.set_item())
+        return items
+
+    def set_item(self):
+        start = self.pos
+        var = self.name()
+        if self.is_op(':'):
+            return ('labels', var, self.label_list())
+        if self.accept_op('+='):
+            return ('merge', var, self.expression())
+        if self.accept_op('='):
+            return ('replace', var, self.expression())
+        self.pos = start
+        target = self.postfix()
+        if target[0] != 'prop':
+            self.error('expected a property')
+        self.expect_op('=')
+        return ('prop', target[1], target[2], self.expression())
+
+    def remove_items(self):
+        items = [self.remove_item()]
+        while self.accept_op(','):
+            items.append(self.remove_item())
+        return items
+
+    def remove_item(self):
+        var = self.name()
+        if self.is_op(':'):
+            return ('labels', var, self.label_list())
+        self.expect_op('.')
+        return ('prop', ('var', var), self.name())
+
+    def label_list(self):
+        labels = []
+        while self.accept_op(':'):
+            labels.append(self.name())
+        return labels
+
+    def projection(self, kind):
+        clause = {
+            'kind': kind,
+            'distinct': bool(self.accept_keyword('DISTINCT')),
+            'star': False,
+            'items': [],
+            'order': [],
+            'skip': None,
+            'limit': None,
+            'where': None,
+        }
+        if self.accept_op('*'):
+            clause['star'] = True
+            if not self.accept_op(','):
+                return self.projection_tail(clause)
+        while True:
+            start = self.token.start
+            expr = self.expression()
+            if self.accept_keyword('AS'):
+                alias = self.name()
+            elif expr[0] == 'var':
+                alias = expr[1]
+            else:
+                alias = self.text[start:self.tokens[self.pos - 1].end].strip()
+            clause['items'].append((expr, alias))
+            if not self.accept_op(','):
+                break
+        return self.projection_tail(clause)
+
+    def projection_tail(self, clause):
+        if self.accept_keyword('ORDER'):
+            self.expect_keyword('BY')
+            while True:
+                expr = self.expression()
+                descending = self.accept_keyword('DESC', 'DESCENDING')
+                if not descending:
+                    self.accept_keyword('ASC', 'ASCENDING')
+                clause['order'].append((expr, bool(descending)))
+                if not self.accept_op(','):
+                    break
+        if self.accept_keyword('SKIP'):
+            clause['skip'] = self.expression()
+        if self.accept_keyword('LIMIT'):
+            clause['limit'] = self.expression()
+        if clause['kind'] == 'with' and self.accept_keyword('WHERE'):
+            clause['where'] = self.expression()
+        return clause
+
+    # Patterns
+
+    def patterns(self):
+        patterns = [self.path_pattern()]
+        while self.accept_op(','):
+            patterns.append(self.path_pattern())
+        return patterns
+
+    def path_pattern(self):
+        var = None
+        if self.token.kind in ('name', 'quoted') and self.is_op(
+                '=', token=self.peek()):
+            var = self.name()
+            self.advance()
+        if self.is_keyword('SHORTESTPATH', 'ALLSHORTESTPATHS'):
+            self.error('shortest path functions are not supported')
+        nodes = [self.node_pattern()]
+        rels = []
+        while self.is_op('-', '<'):
+            rels.append(self.rel_pattern())
+            nodes.append(self.node_pattern())
+        return PathPattern(var, nodes, rels)
+
+    def node_pattern(self):
+        self.expect_op('(')
+        var = None
+        if self.token.kind in ('name', 'quoted'):
+            var = self.name()
+        labels = self.label_list()
+        props = self.properties()
+        self.expect_op(')')
+        return NodePattern(var or self.anonymous_var(), labels, props)
+
+    def properties(self):
+        if self.is_op('{'):
+            return self.map_literal()
+        if self.token.kind == 'param':
+            return ('param', self.advance().value)
+        return None
+
+    def rel_pattern(self):
+        left = bool(self.accept_op('<'))
+        self.expect_op('-')
+        var, types, props = None, [], None
+        min_hops = max_hops = 1
+        variable = False
+        if self.accept_op('['):
+            if self.token.kind in ('name', 'quoted'):
+                var = self.name()
+            if self.accept_op(':'):
+                types.append(self.name())
+                while self.accept_op('|'):
+                    self.accept_op(':')
+                    types.append(self.name())
+            if self.accept_op('*'):
+                variable = True
+                min_hops, max_hops = 1, None
+                if self.token.kind == 'number':
+                    min_hops = max_hops = self.advance().value
+                if self.accept_op('..'):
+                    max_hops = None
+                    if self.token.kind == 'number':
+                        max_hops = self.advance().value
+            props = self.properties()
+            self.expect_op(']')
+        self.expect_op('-')
+        right = bool(self.accept_op('>'))
+        if left and right:
+            self.error('a relationship cannot point both ways')
+        direction = 'in' if left else 'out' if right else 'both'
+        return RelPattern(var or self.anonymous_var(), types, direction,
+                          min_hops, max_hops, props, variable)
+
+    def looks_like_pattern(self):
+        """
+        Whether the '(' at the current position starts a relationship
+        pattern rather than a parenthesized expression.
+        """
+        i = self.pos + 1
+        tokens = self.tokens
+        if tokens[i].kind in ('name', 'quoted'):
+            i += 1
+        while tokens[i].kind == 'op' and tokens[i].value == ':':
+            i += 2
+        if tokens[i].kind == 'op' and tokens[i].value == '{':
+            depth = 0
+            while tokens[i].kind != 'eof':
+                if tokens[i].kind == 'op' and tokens[i].value == '{':
+                    depth += 1
+                elif tokens[i].kind == 'op' and tokens[i].value == '}':
+                    depth -= 1
+                    if not depth:
+                        break
+                i += 1
+            i += 1
+        if not (tokens[i].kind == 'op' and tokens[i].value == ')'):
+            return False
+        first, second = tokens[i + 1], tokens[min(i + 2, len(tokens) - 1)]
+        if first.kind != 'op':
+            return False
+        if first.value == '<':
+            return second.kind == 'op' and second.value == '-'
+        return first.value == '-' and second.kind == 'op' and \
+            second.value in ('[', '-')
+
+    # Expressions
+
+    def expression(self):
+        return self.or_expression()
+
+    def or_expression(self):
+        expr = self.xor_expression()
+        while self.accept_keyword('OR'):
+            expr = ('or', expr, self.xor_expression())
+        return expr
+
+    def xor_expression(self):
+        expr = self.and_expression()
+        while self.accept_keyword('XOR'):
+            expr = ('xor', expr, self.and_expression())
+        return expr
+
+    def and_expression(self):
+        expr = self.not_expression()
+        while self.accept_keyword('AND'):
+            expr = ('and', expr, self.not_expression())
+        return expr
+
+    def not_expression(self):
+        if self.accept_keyword('NOT'):
+            return ('not', self.not_expression())
+        return self.comparison()
+
+    def comparison(self):
+        expr = self.additive()
+        while True:
+            op = self.accept_op('=', '<>', '!=', '<', '>', '<=', '>=', '=~')
+            if op:
+                expr = ('cmp', '<>' if op == '!=' else op, expr,
+                        self.additive())
+            elif self.accept_keyword('IN'):
+                expr = ('in', expr, self.additive())
+            elif self.is_keyword('STARTS', 'ENDS') and self.is_keyword(
+                    'WITH', token=self.peek()):
+                op = self.advance().value.upper()
+                self.advance()
+                expr = ('str', op, expr, self.additive())
+            elif self.accept_keyword('CONTAINS'):
+                expr = ('str', 'CONTAINS', expr, self.additive())
+            elif self.accept_keyword('IS'):
+                negated = bool(self.accept_keyword('NOT'))
+                self.expect_keyword('NULL')
+                expr = ('is_null', expr, negated)
+            else:
+                return expr
+
+    def additive(self):
+        expr = self.multiplicative()
+        while True:
+            op = self.accept_op('+', '-')
+            if not op:
+                return expr
+            expr = ('arith', op, expr, self.multiplicative())
+
+    def multiplicative(self):
+        expr = self.power()
+        while True:
+            op = self.accept_op('*', '/', '%')
+            if not op:
+                return expr
+            expr = ('arith', op, expr, self.power())
+
+    def power(self):
+        expr = self.unary()
+        while self.accept_op('^'):
+            expr = ('arith', '^', expr, self.unary())
+        return expr
+
+    def unary(self):
+        if self.accept_op('-'):
+            return ('neg', self.unary())
+        if self.accept_op('+'):
+            return self.unary()
+        return self.postfix()
+
+    def postfix(self):
+        expr = self.atom()
+        while True:
+            if self.is_op('.') and self.peek().kind in ('name', 'quoted'):
+                self.advance()
+                expr = ('prop', expr, self.name())
+            elif self.accept_op('['):
+                low = high = None
+                if not self.is_op('..'):
+                    low = self.expression()
+                if self.accept_op('..'):
+                    if not self.is_op(']'):
+                        high = self.expression()
+                    self.expect_op(']')
+                    expr = ('slice', expr, low, high)
+                else:
+                    self.expect_op(']')
+                    expr = ('index', expr, low)
+            elif self.is_op(':') and self.peek().kind in ('name', 'quoted'):
+                expr = ('has_labels', expr, self.label_list())
+            else:
+                return expr
+
+    def atom(self):
+        token = self.token
+        if token.kind in ('string', 'number'):
+            self.advance()
+            return ('lit', token.value)
+        if token.kind == 'param':
+            self.advance()
+            return ('param', token.value)
+        if self.is_op('('):
+            if self.looks_like_pattern():
+                return ('pattern', self.path_pattern())
+            self.advance()
+            expr = self.expression()
+            self.expect_op(')')
+            return expr
+        if self.is_op('['):
+            return self.list_literal()
+        if self.is_op('{'):
+            return self.map_literal()
+        if token.kind == 'quoted':
+            self.advance()
+            return ('var', token.value)
+        if token.kind != 'name':
+            self.error('expected an expression')
+        word = token.value.upper()
+        if word in ('TRUE', 'FALSE'):
+            self.advance()
+            return ('lit', word == 'TRUE')
+        if word == 'NULL':
+            self.advance()
+            return ('lit', None)
+        if word == 'CASE':
+            return self.case_expression()
+        if word in ('ANY', 'ALL', 'NONE', 'SINGLE') and self.is_op(
+                '(', token=self.peek()) and self.peek(
+                    3).kind == 'name' and self.is_keyword(
+                        'IN', token=self.peek(3)):
+            self.advance()
+            self.advance()
+            var = self.name()
+            self.expect_keyword('IN')
+            source = self.expression()
+            where = None
+            if self.accept_keyword('WHERE'):
+                where = self.expression()
+            self.expect_op(')')
+            return ('quantifier', word.lower(), var, source, where)
+        if word == 'EXISTS' and self.is_op('{', token=self.peek()):
+            self.error('EXISTS subqueries are not supported')
+        if self.is_op('(', token=self.peek()) or (self.is_op(
+                '.', token=self.peek()) and not self._is_property_access()):
+            return self.function_call()
+        if word in _CLAUSE_KEYWORDS and word not in ('COUNT', ):
+            self.error('expected an expression')
+        self.advance()
+        return ('var', token.value)
+
+    def _is_property_access(self):
+        """
+        Tell `n.name` from a namespaced function like `apoc.text.join(`.
+        """
+        i = self.pos
+        while self.tokens[i + 1].kind == 'op' and self.tokens[
+                i + 1].value == '.' and self.tokens[i + 2].kind == 'name':
+            i += 2
+        return not (self.tokens[i + 1].kind == 'op'
+                    and self.tokens[i + 1].value == '(')
+
+    def function_call(self):
+        name = self.name()
+        while self.accept_op('.'):
+            name += '.' + self.name()
+        self.expect_op('(')
+        lowered = name.lower()
+        if lowered == 'count' and self.accept_op('*'):
+            self.expect_op(')')
+            return ('count_star', )
+        distinct = bool(self.accept_keyword('DISTINCT'))
+        args = []
+        if not self.is_op(')'):
+            args.append(self.expression())
+            while self.accept_op(','):
+                args.append(self.expression())
+        self.expect_op(')')
+        if lowered not in FUNCTIONS and lowered not in AGGREGATES and \
+                lowered != 'exists':
+            raise CypherError('Unknown function {!r}'.format(name))
+        return ('call', lowered, args, distinct)
+
+    def case_expression(self):
+        self.advance()
+        subject = None
+        if not self.is_keyword('WHEN'):
+            subject = self.expression()
+        whens = []
+        while self.accept_keyword('WHEN'):
+            condition = self.expression()
+            self.expect_keyword('THEN')
+            whens.append((condition, self.expression()))
+        default = None
+        if self.accept_keyword('ELSE'):
+            default = self.expression()
+        self.expect_keyword('END')
+        return ('case', subject, whens, default)
+
+    def list_literal(self):
+        self.expect_op('[')
+        if self.token.kind in ('name', 'quoted') and self.is_keyword(
+                'IN', token=self.peek()):
+            var = self.name()
+            self.advance()
+            source = self.expression()
+            where = projection = None
+            if self.accept_keyword('WHERE'):
+                where = self.expression()
+            if self.accept_op('|'):
+                projection = self.expression()
+            self.expect_op(']')
+            return ('list_comp', var, source, where, projection)
+        if self.is_op('('):
+            self.error('pattern comprehensions are not supported')
+        items = []
+        if not self.is_op(']'):
+            items.append(self.expression())
+            while self.accept_op(','):
+                items.append(self.expression())
+        self.expect_op(']')
+        return ('list', items)
+
+    def map_literal(self):
+        self.expect_op('{')
+        entries = []
+        if not self.is_op('}'):
+            while True:
+                token = self.token
+                if token.kind == 'string':
+                    self.advance()
+                    key = token.value
+                else:
+                    key = self.name()
+                self.expect_op(':')
+                entries.append((key, self.expression()))
+                if not self.accept_op(','):
+                    break
+        self.expect_op('}')
+        return ('map', entries)
+
+
+# Values
+
+
+def _type_rank(value):
+    if isinstance(value, dict):
+        return 0
+    if isinstance(value, NodeRef):
+        return 1
+    if isinstance(value, RelRef):
+        return 2
+    if isinstance(value, list):
+        return 3
+    if isinstance(value, PathValue):
+        return 4
+    if isinstance(value, str):
+        return 5
+    if isinstance(value, bool):
+        return 6
+    if isinstance(value, (int, float)):
+        return 7
+    return 8
+
+
+def _compare_for_order(a, b):
+    """
+    Total order of ORDER BY: values of different types by type, null last.
+    """
+    if a is None or b is None:
+        return (a is None) - (b is None)
+    rank_a, rank_b = _type_rank(a), _type_rank(b)
+    if rank_a != rank_b:
+        return (rank_a > rank_b) - (rank_a < rank_b)
+    if isinstance(a, (NodeRef, RelRef)):
+        a, b = a.id, b.id
+    elif isinstance(a, list):
+        for x, y in zip(a, b):
+            result = _compare_for_order(x, y)
+            if result:
+                return result
+        return (len(a) > len(b)) - (len(a) < len(b))
+    elif isinstance(a, (dict, PathValue)):
+        return 0
+    if isinstance(a, float) and math.isnan(a):
+        return 0 if isinstance(b, float) and math.isnan(b) else 1
+    return (a > b) - (a < b)
+
+
+def _hashable(value):
+    if isinstance(value, list):
+        return ('list', tuple(_hashable(item) for item in value))
+    if isinstance(value, dict):
+        return ('map',
+                tuple(
+                    sorted((key, _hashable(item))
+                           for key, item in value.items())))
+    if isinstance(value, bool):
+        return ('bool', value)
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _equals(a, b):
+    """
+    Cypher `=`: null when either side is null.
+    """
+    if a is None or b is None:
+        return None
+    if isinstance(a, bool) or isinstance(b, bool):
+        return isinstance(a, bool) and isinstance(b, bool) and a == b
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return a == b
+    if isinstance(a, list) and isinstance(b, list):
+        if len(a) != len(b):
+            return False
+        result = True
+        for x, y in zip(a, b):
+            equal = _equals(x, y)
+            if equal is False:
+                return False
+            if equal is None:
+                result = None
+        return result
+    if isinstance(a, dict) and isinstance(b, dict):
+        if set(a) != set(b):
+            return False
+        return _equals([a[key] for key in sorted(a)],
+                       [b[key] for key in sorted(b)])
+    if type(a) is not type(b):
+        return False
+    return a == b
+
+
+def _less(a, b):
+    if a is None or b is None:
+        return None
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)) and \
+            not isinstance(a, bool) and not isinstance(b, bool):
+        return a < b
+    if isinstance(a, str) and isinstance(b, str):
+        return a < b
+    if isinstance(a, bool) and isinstance(b, bool):
+        return a < b
+    if isinstance(a, list) and isinstance(b, list):
+        return _compare_for_order(a, b) < 0
+    return None
+
+
+def _not(value):
+    return None if value is None else not value
+
+
+def _truthy(value):
+    """
+    WHERE keeps a row only for true, null counts as false.
+    """
+    if value is None:
+        return False
+    if not isinstance(value, bool):
+        raise CypherError('Expected a boolean, got {!r}'.format(value))
+    return value
+
+
+def _as_bool(value):
+    if value is None or isinstance(value, bool):
+        return value
+    raise CypherError('Expected a boolean, got {!r}'.format(value))
+
+
+# Functions
+
+
+def _fn_size(ctx, value):
+    if value is None:
+        return None
+    if isinstance(value, (list, str)):
+        return len(value)
+    raise CypherError('size() expects a list or a string')
+
+
+def _fn_length(ctx, value):
+    if isinstance(value, PathValue):
+        return len(value.rels)
+    return _fn_size(ctx, value)
+
+
+def _fn_labels(ctx, node):
+    if node is None:
+        return None
+    return list(ctx.store.nodes[node.id].labels)
+
+
+def _fn_type(ctx, rel):
+    if rel is None:
+        return None
+    return ctx.store.rels[rel.id].type
+
+
+def _fn_id(ctx, entity):
+    if entity is None:
+        return None
+    return entity.id
+
+
+def _fn_properties(ctx, value):
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        return dict(value)
+    return dict(ctx.entity_props(value))
+
+
+def _fn_keys(ctx, value):
+    properties = _fn_properties(ctx, value)
+    return None if properties is None else list(properties)
+
+
+def _fn_start_node(ctx, rel):
+    return None if rel is None else NodeRef(ctx.store.rels[rel.id].start)
+
+
+def _fn_end_node(ctx, rel):
+    return None if rel is None else NodeRef(ctx.store.rels[rel.id].end)
+
+
+def _fn_nodes(ctx, path):
+    return None if path is None else [NodeRef(i) for i in path.nodes]
+
+
+def _fn_relationships(ctx, path):
+    return None if path is None else [RelRef(i) for i in path.rels]
+
+
+def _fn_coalesce(ctx, *values):
+    for value in values:
+        if value is not None:
+            return value
+    return None
+
+
+def _string_function(func):
+
+    def wrapper(ctx, value, *args):
+        if value is None or any(arg is None for arg in args):
+            return None
+        if not isinstance(value, str):
+            raise CypherError('Expected a string, got {!r}'.format(value))
+        return func(value, *args)
+
+    return wrapper
+
+
+def _fn_substring(value, start, length=None):
+    if length is None:
+        return value[start:]
+    return value[start:start + length]
+
+
+def _fn_to_string(ctx, value):
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+
+def _fn_to_integer(ctx, value):
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        return int(float(value)) if isinstance(value, str) else int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _fn_to_float(ctx, value):
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _fn_to_boolean(ctx, value):
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, str) and value.lower() in ('true', 'false'):
+        return value.lower() == 'true'
+    return None
+
+
+def _fn_head(ctx, values):
+    return values[0] if values else None
+
+
+def _fn_last(ctx, values):
+    return values[-1] if values else None
+
+
+def _fn_tail(ctx, values):
+    return None if values is None else values[1:]
+
+
+def _fn_range(ctx, start, end, step=1):
+    if step == 0:
+        raise CypherError('range() step cannot be zero')
+    return list(range(start, end + (1 if step > 0 else -1), step))
+
+
+def _fn_reverse(ctx, value):
+    return None if value is None else value[::-1]
+
+
+def _numeric(func):
+
+    def wrapper(ctx, *args):
+        if any(arg is None for arg in args):
+            return None
+        return func(*args)
+
+    return wrapper
+
+
+FUNCTIONS = {
+    'size': _fn_size,
+    'length': _fn_length,
+    'labels': _fn_labels,
+    'type': _fn_type,
+    'id': _fn_id,
+    'elementid': lambda ctx, e: None if e is None else str(e.id),
+    'properties': _fn_properties,
+    'keys': _fn_keys,
+    'startnode': _fn_start_node,
+    'endnode': _fn_end_node,
+    'nodes': _fn_nodes,
+    'relationships': _fn_relationships,
+    'rels': _fn_relationships,
+    'coalesce': _fn_coalesce,
+    'head': _fn_head,
+    'last': _fn_last,
+    'tail': _fn_tail,
+    'range': _fn_range,
+    'reverse': _fn_reverse,
+    'tolower': _string_function(str.lower),
+    'lower': _string_function(str.lower),
+    'toupper': _string_function(str.upper),
+    'upper': _string_function(str.upper),
+    'trim': _string_function(str.strip),
+    'ltrim': _string_function(str.lstrip),
+    'rtrim': _string_function(str.rstrip),
+    'replace': _string_function(str.replace),
+    'split': _string_function(str.split),
+    'substring': _string_function(_fn_substring),
+    'left': _string_function(lambda value, n: value[:n]),
+    'right': _string_function(lambda value, n: value[-n:] if n else ''),
+    'tostring': _fn_to_string,
+    'tointeger': _fn_to_integer,
+    'toint': _fn_to_integer,
+    'tofloat': _fn_to_float,
+    'toboolean': _fn_to_boolean,
+    'abs': _numeric(abs),
+    'ceil': _numeric(lambda x: float(math.ceil(x))),
+    'floor': _numeric(lambda x: float(math.floor(x))),
+    'round': _numeric(lambda x, digits=0: float(round(x, int(digits)))),
+    'sign': _numeric(lambda x: (x > 0) - (x < 0)),
+    'sqrt': _numeric(math.sqrt),
+    'timestamp': lambda ctx: int(time.time() * 1000),
+    'isempty': lambda ctx, value: None if value is None else not value,
+}
+
+
+# Evaluation
+
+
+class Context:
+    """
+    Per query state: the store, the parameters and, while projecting an
+    aggregation, the aggregated values of the current group. The row loops
+    call `check`, which stops the query once the `time.monotonic()`
+    `deadline` passed or the `cancel` event is set.
+    """
+
+    def __init__(self, store, params, deadline=None, cancel=None):
+        self.store = store
+        self.params = params
+        self.aggregates = None
+        self.regexes = {}
+        self.deadline = deadline
+        self.cancel = cancel
+        self._ticks = 0
+
+    def check(self):
+        self._ticks += 1
+        if not self._ticks % CHECK_INTERVAL:
+            self.stop_if_due()
+
+    def stop_if_due(self):
+        if self.cancel is not None and self.cancel.is_set():
+            raise QueryCancelled('The query was cancelled')
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise QueryCancelled('The query exceeded its deadline')
+
+    def entity_props(self, entity):
+        if isinstance(entity, NodeRef):
+            data = self.store.nodes.get(entity.id)
+        elif isinstance(entity, RelRef):
+            data = self.store.rels.get(entity.id)
+        else:
+            raise CypherError('Expected a node or a relationship, '
+                              'got {!r}'.format(entity))
+        if data is None:
+            raise CypherError('The entity {!r} has been deleted'.format(
+                entity))
+        return data.props
+
+    def regex(self, pattern):
+        regex = self.regexes.get(pattern)
+        if regex is None:
+            try:
+                regex = self.regexes[pattern] = re.compile(pattern, re.S)
+            except re.error as e:
+                raise CypherError('Invalid regex {!r}: {}'.format(
+                    pattern, e))
+        return regex
+
+
+def evaluate(expr, row, ctx):
+    return _EVALUATORS[expr[0]](expr, row, ctx)
+
+
+def _eval_var(expr, row, ctx):
+    try:
+        return row[expr[1]]
+    except KeyError:
+        raise CypherError('Variable `{}` not defined'.format(expr[1]))
+
+
+def _eval_param(expr, row, ctx):
+    try:
+        return ctx.params[expr[1]]
+    except KeyError:
+        raise CypherError('Expected parameter(s): {}'.format(expr[1]))
+
+
+def _eval_prop(expr, row, ctx):
+    value = evaluate(expr[1], row, ctx)
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        return value.get(expr[2])
+    return ctx.entity_props(value).get(expr[2])
+
+
+def _eval_index(expr, row, ctx):
+    value = evaluate(expr[1], row, ctx)
+    index = evaluate(expr[2], row, ctx)
+    if value is None or index is None:
+        return None
+    if isinstance(value, list):
+        if not isinstance(index, int):
+            raise CypherError('List index must be an integer')
+        return value[index] if -len(value) <= index < len(value) else None
+    if isinstance(value, dict):
+        return value.get(index)
+    return ctx.entity_props(value).get(index)
+
+
+def _eval_slice(expr, row, ctx):
+    value = evaluate(expr[1], row, ctx)
+    low = evaluate(expr[2], row, ctx) if expr[2] is not None else None
+    high = evaluate(expr[3], row, ctx) if expr[3] is not None else None
+    if value is None:
+        return None
+    return value[low:high]
+
+
+def _eval_has_labels(expr, row, ctx):
+    value = evaluate(expr[1], row, ctx)
+    if value is None:
+        return None
+    if isinstance(value, RelRef):
+        return ctx.store.rels[value.id].type in expr[2]
+    labels = ctx.store.nodes[value.id].labels
+    return all(label in labels for label in expr[2])
+
+
+def _eval_call(expr, row, ctx):
+    name, args = expr[1], expr[2]
+    if name in AGGREGATES:
+        if ctx.aggregates is None:
+            raise CypherError(
+                'Aggregation {}() is only allowed in WITH and RETURN'.format(
+                    name))
+        return ctx.aggregates[id(expr)]
+    if name == 'exists':
+        if len(args) != 1:
+            raise CypherError('exists() takes one argument')
+        if args[0][0] == 'pattern':
+            return evaluate(args[0], row, ctx)
+        return evaluate(args[0], row, ctx) is not None
+    values = [evaluate(arg, row, ctx) for arg in args]
+    try:
+        return FUNCTIONS[name](ctx, *values)
+    except TypeError as e:
+        raise CypherError('Invalid call of {}(): {}'.format(name, e))
+
+
+def _eval_count_star(expr, row, ctx):
+    if ctx.aggregates is None:
+        raise CypherError('count(*) is only allowed in WITH and RETURN')
+    return ctx.aggregates[id(expr)]
+
+
+def _eval_list(expr, row, ctx):
+    return [evaluate(item, row, ctx) for item in expr[1]]
+
+
+def _eval_map(expr, row, ctx):
+    return {key: evaluate(value, row, ctx) for key, value in expr[1]}
+
+
+def _eval_and(expr, row, ctx):
+    left = _as_bool(evaluate(expr[1], row, ctx))
+    if left is False:
+        return False
+    right = _as_bool(evaluate(expr[2], row, ctx))
+    if right is False:
+        return False
+    return None if left is None or right is None else True
+
+
+def _eval_or(expr, row, ctx):
+    left = _as_bool(evaluate(expr[1], row, ctx))
+    if left is True:
+        return True
+    right = _as_bool(evaluate(expr[2], row, ctx))
+    if right is True:
+        return True
+    return None if left is None or right is None else False
+
+
+def _eval_xor(expr, row, ctx):
+    left = _as_bool(evaluate(expr[1], row, ctx))
+    right = _as_bool(evaluate(expr[2], row, ctx))
+    return None if left is None or right is None else left != right
+
+
+def _eval_not(expr, row, ctx):
+    return _not(_as_bool(evaluate(expr[1], row, ctx)))
+
+
+def _eval_cmp(expr, row, ctx):
+    op = expr[1]
+    left = evaluate(expr[2], row, ctx)
+    right = evaluate(expr[3], row, ctx)
+    if op == '=':
+        return _equals(left, right)
+    if op == '<>':
+        return _not(_equals(left, right))
+    if op == '=~':
+        if left is None or right is None:
+            return None
+        if not isinstance(left, str):
+            return None
+        return ctx.regex(right).fullmatch(left) is not None
+    if op == '<':
+        return _less(left, right)
+    if op == '>':
+        return _less(right, left)
+    if op == '<=':
+        less = _less(right, left)
+        return _not(less)
+    less = _less(left, right)
+    return _not(less)
+
+
+def _eval_in(expr, row, ctx):
+    value = evaluate(expr[1], row, ctx)
+    values = evaluate(expr[2], row, ctx)
+    if values is None:
+        return None
+    if not isinstance(values, list):
+        raise CypherError('IN expects a list')
+    result = False
+    for item in values:
+        equal = _equals(value, item)
+        if equal:
+            return True
+        if equal is None:
+            result = None
+    return result
+
+
+def _eval_str(expr, row, ctx):
+    left = evaluate(expr[2], row, ctx)
+    right = evaluate(expr[3], row, ctx)
+    if not isinstance(left, str) or not isinstance(right, str):
+        return None
+    if expr[1] == 'STARTS':
+        return left.startswith(right)
+    if expr[1] == 'ENDS':
+        return left.endswith(right)
+    return right in left
+
+
+def _eval_is_null(expr, row, ctx):
+    is_null = evaluate(expr[1], row, ctx) is None
+    return not is_null if expr[2] else is_null
+
+
+def _eval_arith(expr, row, ctx):
+    op = expr[1]
+    left = evaluate(expr[2], row, ctx)
+    right = evaluate(expr[3], row, ctx)
+    if left is None or right is None:
+        return None
+    if op == '+':
+        if isinstance(left, list):
+            return left + (right if isinstance(right, list) else [right])
+        if isinstance(right, list):
+            return [left] + right
+        if isinstance(left, str) or isinstance(right, str):
+            return _fn_to_string(ctx, left) + _fn_to_string(ctx, right)
+    if not (isinstance(left, (int, float)) and isinstance(right, (int, float))):
+        raise CypherError('Cannot apply {} to {!r} and {!r}'.format(
+            op, left, right))
+    if op == '+':
+        return left + right
+    if op == '-':
+        return left - right
+    if op == '*':
+        return left * right
+    if op == '/':
+        if isinstance(left, int) and isinstance(right, int):
+            if right == 0:
+                raise CypherError('/ by zero')
+            return int(left / right)
+        return left / right if right else math.copysign(
+            math.inf, left) if left else math.nan
+    if op == '%':
+        if isinstance(left, int) and isinstance(right, int):
+            if right == 0:
+                raise CypherError('/ by zero')
+            return int(math.fmod(left, right))
+        return math.fmod(left, right)
+    return float(left)**right
+
+
+def _eval_neg(expr, row, ctx):
+    value = evaluate(expr[1], row, ctx)
+    return None if value is None else -value
+
+
+def _eval_case(expr, row, ctx):
+    subject, whens, default = expr[1], expr[2], expr[3]
+    if subject is not None:
+        value = evaluate(subject, row, ctx)
+        for candidate, result in whens:
+            if _equals(value, evaluate(candidate, row, ctx)):
+                return evaluate(result, row, ctx)
+    else:
+        for condition, result in whens:
+            if evaluate(condition, row, ctx) is True:
+                return evaluate(result, row, ctx)
+    return evaluate(default, row, ctx) if default is not None else None
+
+
+def _eval_list_comp(expr, row, ctx):
+    var, source, where, projection = expr[1:]
+    values = evaluate(source, row, ctx)
+    if values is None:
+        return None
+    result = []
+    for value in values:
+        scope = dict(row)
+        scope[var] = value
+        if where is not None and not _truthy(evaluate(where, scope, ctx)):
+            continue
+        result.append(
+            evaluate(projection, scope, ctx
+                     ) if projection is not None else value)
+    return result
+
+
+def _eval_quantifier(expr, row, ctx):
+    kind, var, source, where = expr[1:]
+    values = evaluate(source, row, ctx)
+    if values is None:
+        return None
+    matches = 0
+    for value in values:
+        scope = dict(row)
+        scope[var] = value
+        if where is None or _truthy(evaluate(where, scope, ctx)):
+            matches += 1
+    if kind == 'any':
+        return matches > 0
+    if kind == 'all':
+        return matches == len(values)
+    if kind == 'none':
+        return matches == 0
+    return matches == 1
+
+
+def _eval_pattern(expr, row, ctx):
+    for _ in Matcher(ctx, [expr[1]], None).match(row):
+        return True
+    return False
+
+
+_EVALUATORS = {
+    'lit': lambda expr, row, ctx: expr[1],
+    'var': _eval_var,
+    'param': _eval_param,
+    'prop': _eval_prop,
+    'index': _eval_index,
+    'slice': _eval_slice,
+    'has_labels': _eval_has_labels,
+    'call': _eval_call,
+    'count_star': _eval_count_star,
+    'list': _eval_list,
+    'map': _eval_map,
+    'and': _eval_and,
+    'or': _eval_or,
+    'xor': _eval_xor,
+    'not': _eval_not,
+    'cmp': _eval_cmp,
+    'in': _eval_in,
+    'str': _eval_str,
+    'is_null': _eval_is_null,
+    'arith': _eval_arith,
+    'neg': _eval_neg,
+    'case': _eval_case,
+    'list_comp': _eval_list_comp,
+    'quantifier': _eval_quantifier,
+    'pattern': _eval_pattern,
+}
+
+
+def walk(expr):
+    """
+    Yield `expr` and every expression nested in it (not crossing into
+    patterns).
+    """
+    stack = [expr]
+    while stack:
+        expr = stack.pop()
+        if not isinstance(expr, tuple):
+            continue
+        yield expr
+        kind = expr[0]
+        if kind in ('lit', 'var', 'param', 'count_star', 'pattern'):
+            continue
+        for item in expr[1:]:
+            if isinstance(item, tuple):
+                stack.append(item)
+            elif isinstance(item, list):
+                for element in item:
+                    if isinstance(element, tuple) and element and isinstance(
+                            element[0], str) and element[0] in _EVALUATORS:
+                        stack.append(element)
+                    elif isinstance(element, tuple):
+                        stack.extend(part for part in element
+                                     if isinstance(part, tuple))
+
+
+def variables(expr):
+    names = set()
+    for node in walk(expr):
+        if node[0] == 'var':
+            names.add(node[1])
+        elif node[0] == 'pattern':
+            names.update(pattern_variables(node[1]))
+    return names
+
+
+def pattern_variables(path):
+    names = {node.var for node in path.nodes}
+    names.update(rel.var for rel in path.rels)
+    if path.var:
+        names.add(path.var)
+    return names
+
+
+def aggregate_calls(expr):
+    return [
+        node for node in walk(expr)
+        if node[0] == 'count_star' or (
+            node[0] == 'call' and node[1] in AGGREGATES)
+    ]
+
+
+# Pattern matching
+
+
+class Matcher:
+    """
+    Match the comma separated path patterns of one MATCH (or of a pattern
+    predicate) against the store, extending a row with every binding.
+
+    Each path is expanded from its most selective node pattern: a node
+    bound by the row, an indexed property given by the pattern or by an
+    equality of the WHERE clause, or the smallest label.
+    Relationships are not reused within one match.
+    """
+
+    def __init__(self, ctx, paths, where):
+        self.ctx = ctx
+        self.store = ctx.store
+        self.paths = paths
+        self.where = where
+        self.seeks = self._where_seeks(where)
+
+    def _where_seeks(self, where):
+        """
+        `var.key = value` and `var.key IN list` conjuncts of the WHERE
+        clause, by variable, where the value does not depend on the
+        pattern's own variables.
+        """
+        seeks = {}
+        if where is None:
+            return seeks
+        own = set()
+        for path in self.paths:
+            own.update(pattern_variables(path))
+        conjuncts = [where]
+        while conjuncts:
+            expr = conjuncts.pop()
+            if expr[0] == 'and':
+                conjuncts.extend(expr[1:])
+                continue
+            if expr[0] == 'cmp' and expr[1] == '=':
+                sides = [(expr[2], expr[3]), (expr[3], expr[2])]
+                kind = 'eq'
+            elif expr[0] == 'in':
+                sides = [(expr[1], expr[2])]
+                kind = 'in'
+            else:
+                continue
+            for target, value in sides:
+                if target[0] == 'prop' and target[1][0] == 'var' and \
+                        target[2] in self.store.prop_index and \
+                        not variables(value) & own:
+                    seeks.setdefault(target[1][1], []).append(
+                        (kind, target[2], value))
+                    break
+        return seeks
+
+    def match(self, row):
+        yield from self._match_paths(0, row, set())
+
+    def _match_paths(self, index, row, used):
+        self.ctx.check()
+        if index == len(self.paths):
+            if self.where is None or _truthy(
+                    evaluate(self.where, row, self.ctx)):
+                yield row
+            return
+        for bound, used_rels in self.match_path(self.paths[index], row,
+                                                used):
+            yield from self._match_paths(index + 1, bound, used_rels)
+
+    def _node_props(self, pattern, row):
+        if pattern.props is None:
+            return None
+        props = evaluate(pattern.props, row, self.ctx)
+        if props is not None and not isinstance(props, dict):
+            raise CypherError('Expected a map of properties')
+        return props
+
+    def node_matches(self, node_id, labels, props):
+        data = self.store.nodes.get(node_id)
+        if data is None:
+            return False
+        for label in labels:
+            if label not in data.labels:
+                return False
+        if props:
+            for key, value in props.items():
+                if not _equals(data.props.get(key), value):
+                    return False
+        return True
+
+    def candidates(self, pattern, props, row):
+        """
+        Node ids a node pattern can bind, narrowed with the indexes, and a
+        short description of the access path (for EXPLAIN).
+        """
+        options = []
+        for key, value in (props or {}).items():
+            ids = self.store.nodes_with_property(key, value)
+            if ids is not None:
+                options.append((len(ids), ids, 'NodeIndexSeek', key))
+        for kind, key, value_expr in self.seeks.get(pattern.var, ()):
+            value = evaluate(value_expr, row, self.ctx)
+            if kind == 'eq':
+                ids = self.store.nodes_with_property(key, value)
+            else:
+                if value is None:
+                    ids = set()
+                elif not isinstance(value, list):
+                    continue
+                else:
+                    ids = set()
+                    for item in value:
+                        ids |= self.store.nodes_with_property(key, item)
+            options.append((len(ids), ids, 'NodeIndexSeek', key))
+        for label in pattern.labels:
+            ids = self.store.nodes_with_label(label)
+            options.append((len(ids), ids, 'NodeByLabelScan', label))
+        if not options:
+            return list(self.store.nodes), 'AllNodesScan', None
+        _, ids, operator, detail = min(options, key=lambda option: option[0])
+        return list(ids), operator, detail
+
+    def match_path(self, path, row, used):
+        nodes, rels = path.nodes, path.rels
+        props = [self._node_props(pattern, row) for pattern in nodes]
+        rel_props = [
+            evaluate(rel.props, row, self.ctx)
+            if rel.props is not None else None for rel in rels
+        ]
+
+        # Pick the start: bound nodes first, then the fewest candidates.
+        start, start_ids = None, None
+        for i, pattern in enumerate(nodes):
+            value = row.get(pattern.var)
+            if isinstance(value, NodeRef):
+                start, start_ids = i, [value.id]
+                break
+            if pattern.var in row and value is None:
+                return
+        if start is None:
+            best = None
+            for i, pattern in enumerate(nodes):
+                ids, _, _ = self.candidates(pattern, props[i], row)
+                if best is None or len(ids) < best:
+                    best, start, start_ids = len(ids), i, ids
+                if not best:
+                    break
+
+        # Steps outward from the start: right of it, then left of it.
+        steps = [(j, j, j + 1, False) for j in range(start, len(rels))]
+        steps.extend((j, j + 1, j, True) for j in range(start - 1, -1, -1))
+
+        for node_id in start_ids:
+            self.ctx.check()
+            if not self.node_matches(node_id, nodes[start].labels,
+                                     props[start]):
+                continue
+            bound = {start: node_id}
+            yield from self._expand(path, steps, 0, bound, {}, row, used,
+                                    props, rel_props)
+
+    def _expand(self, path, steps, step, bound, rel_bound, row, used, props,
+                rel_props):
+        if step == len(steps):
+            result = self._bind(path, bound, rel_bound, row)
+            if result is not None:
+                new_used = set(used)
+                for rel_ids in rel_bound.values():
+                    new_used.update(rel_ids)
+                yield result, new_used
+            return
+        rel_index, from_index, to_index, reverse = steps[step]
+        pattern = path.rels[rel_index]
+        direction = pattern.direction
+        if reverse and direction != 'both':
+            direction = 'in' if direction == 'out' else 'out'
+        target = path.nodes[to_index]
+        bound_target = row.get(target.var)
+        if target.var in row and not isinstance(bound_target, NodeRef):
+            return
+        bound_rel = row.get(pattern.var) if pattern.var in row else None
+        for end_id, rel_ids in self._traverse(bound[from_index], pattern,
+                                              direction, used, rel_bound,
+                                              rel_props[rel_index]):
+            self.ctx.check()
+            if bound_target is not None and bound_target.id != end_id:
+                continue
+            if to_index in bound and bound[to_index] != end_id:
+                continue
+            if pattern.var in row and not self._same_rels(
+                    bound_rel, rel_ids, reverse):
+                continue
+            if not self.node_matches(end_id, target.labels, props[to_index]):
+                continue
+            had = to_index in bound
+            bound[to_index] = end_id
+            rel_bound[rel_index] = rel_ids[::-1] if reverse else rel_ids
+            yield from self._expand(path, steps, step + 1, bound, rel_bound,
+                                    row, used, props, rel_props)
+            del rel_bound[rel_index]
+            if not had:
+                del bound[to_index]
+
+    @staticmethod
+    def _same_rels(bound_rel, rel_ids, reverse):
+        if isinstance(bound_rel, RelRef):
+            return rel_ids == [bound_rel.id]
+        if isinstance(bound_rel, list):
+            ids = [rel.id for rel in bound_rel]
+            return (rel_ids[::-1] if reverse else rel_ids) == ids
+        return False
+
+    def _neighbours(self, node_id, types, direction):
+        adjacencies = []
+        if direction in ('out', 'both'):
+            adjacencies.append((self.store.out_adj, 'end'))
+        if direction in ('in', 'both'):
+            adjacencies.append((self.store.in_adj, 'start'))
+        seen = set()
+        for adjacency, other in adjacencies:
+            by_type = adjacency.get(node_id)
+            if not by_type:
+                continue
+            for rel_type in types or list(by_type):
+                for rel_id in list(by_type.get(rel_type, ())):
+                    if rel_id in seen:
+                        continue
+                    seen.add(rel_id)
+                    yield rel_id, getattr(self.store.rels[rel_id], other)
+
+    def _rel_matches(self, rel_id, props):
+        if not props:
+            return True
+        rel_props = self.store.rels[rel_id].props
+        return all(
+            _equals(rel_props.get(key), value) for key, value in props.items())
+
+    def _traverse(self, node_id, pattern, direction, used, rel_bound, props):
+        taken = set()
+        for rel_ids in rel_bound.values():
+            taken.update(rel_ids)
+        if not pattern.variable:
+            for rel_id, end_id in self._neighbours(node_id, pattern.types,
+                                                   direction):
+                if rel_id in used or rel_id in taken:
+                    continue
+                if self._rel_matches(rel_id, props):
+                    yield end_id, [rel_id]
+            return
+        max_hops = pattern.max if pattern.max is not None else \
+            MAX_VARIABLE_LENGTH
+        if pattern.min == 0:
+            yield node_id, []
+        stack = [(node_id, [])]
+        while stack:
+            self.ctx.check()
+            current, rel_ids = stack.pop()
+            if len(rel_ids) >= max_hops:
+                continue
+            for rel_id, end_id in self._neighbours(current, pattern.types,
+                                                   direction):
+                if rel_id in used or rel_id in taken or rel_id in rel_ids:
+                    continue
+                if not self._rel_matches(rel_id, props):
+                    continue
+                path = rel_ids + [rel_id]
+                if len(path) >= pattern.min:
+                    yield end_id, path
+                stack.append((end_id, path))
+
+    def _bind(self, path, bound, rel_bound, row):
+        result = dict(row)
+        for i, pattern in enumerate(path.nodes):
+            value = NodeRef(bound[i])
+            existing = result.get(pattern.var)
+            if existing is not None and existing != value:
+                return None
+            result[pattern.var] = value
+        for i, pattern in enumerate(path.rels):
+            rel_ids = rel_bound[i]
+            if pattern.variable:
+                result[pattern.var] = [RelRef(rel_id) for rel_id in rel_ids]
+            else:
+                result[pattern.var] = RelRef(rel_ids[0])
+        if path.var:
+            node_ids = [bound[0]]
+            rel_list = []
+            for i in range(len(path.rels)):
+                rel_ids = rel_bound[i]
+                current = node_ids[-1]
+                for rel_id in rel_ids:
+                    rel = self.store.rels[rel_id]
+                    current = rel.end if rel.start == current else rel.start
+                    node_ids.append(current)
+                    rel_list.append(rel_id)
+            result[path.var] = PathValue(node_ids, rel_list)
+        return result
+
+    def describe(self, row):
+        """
+        EXPLAIN operators of the start of every path.
+        """
+        operators = []
+        for path in self.paths:
+            best = None
+            for pattern in path.nodes:
+                if pattern.var in row:
+                    best = (0, 'Argument', pattern.var)
+                    break
+                props = self._node_props(pattern, row) if not variables(
+                    pattern.props or ('lit', None)) else None
+                ids, operator, detail = self.candidates(pattern, props, row)
+                if best is None or len(ids) < best[0]:
+                    best = (len(ids), operator,
+                            '{}.{}'.format(pattern.var.strip(), detail)
+                            if operator == 'NodeIndexSeek' else
+                            '{}:{}'.format(pattern.var.strip(), detail)
+                            if detail else pattern.var.strip())
+            operators.append({
+                'operatorType': best[1],
+                'args': {
+                    'Details': best[2]
+                },
+                'children': [],
+            })
+            if path.rels:
+                operators.append({
+                    'operatorType': 'Expand(All)',
+                    'args': {},
+                    'children': [],
+                })
+        return operators
+
+
+# Clauses
+
+
+def _project_star(row):
+    return {
+        key: value
+        for key, value in row.items() if not key.startswith('  ')
+    }
+
+
+def _order_rows(rows, order, ctx):
+    keys = []
+    for scope, out in rows:
+        keys.append([evaluate(expr, scope, ctx) for expr, _ in order])
+
+    def compare(a, b):
+        for (_, descending), x, y in zip(order, keys[a], keys[b]):
+            result = _compare_for_order(x, y)
+            if result:
+                return -result if descending else result
+        return 0
+
+    indexes = sorted(range(len(rows)), key=cmp_to_key(compare))
+    return [rows[i] for i in indexes]
+
+
+def _count_expr(expr, ctx, name):
+    if expr is None:
+        return None
+    value = evaluate(expr, {}, ctx)
+    if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+        raise CypherError('{} expects a non-negative integer'.format(name))
+    return value
+
+
+class _Aggregator:
+
+    def __init__(self, expr):
+        self.expr = expr
+        self.kind = 'count' if expr[0] == 'count_star' else expr[1]
+        self.distinct = expr[0] == 'call' and expr[3]
+        self.values = []
+        self.seen = set()
+        self.count = 0
+
+    def add(self, row, ctx):
+        if self.expr[0] == 'count_star':
+            self.count += 1
+            return
+        args = self.expr[2]
+        if len(args) != 1:
+            raise CypherError('{}() takes one argument'.format(self.kind))
+        value = evaluate(args[0], row, ctx)
+        if value is None:
+            return
+        if self.distinct:
+            key = _hashable(value)
+            if key in self.seen:
+                return
+            self.seen.add(key)
+        self.values.append(value)
+
+    def result(self):
+        values = self.values
+        if self.kind == 'count':
+            return self.count if self.expr[0] == 'count_star' else len(values)
+        if self.kind == 'collect':
+            return values
+        if self.kind == 'sum':
+            return sum(values) if values else 0
+        if not values:
+            return None
+        if self.kind == 'avg':
+            return sum(values) / len(values)
+        if self.kind == 'stdev':
+            if len(values) < 2:
+                return 0.0
+            mean = sum(values) / len(values)
+            return math.sqrt(
+                sum((value - mean)**2
+                    for value in values) / (len(values) - 1))
+        ordered = sorted(values, key=cmp_to_key(_compare_for_order))
+        return ordered[0] if self.kind == 'min' else ordered[-1]
+
+
+class Executor:
+
+    def __init__(self, store, params, deadline=None, cancel=None):
+        self.ctx = Context(store, params, deadline, cancel)
+        self.store = store
+        self.plan = []
+
+    def run(self, query):
+        if query.get('schema'):
+            return [], []
+        if len(set(query['union_all'])) > 1:
+            raise CypherError('Invalid combination of UNION and UNION ALL')
+        # Plain UNION removes duplicate rows over all parts.
+        distinct = bool(query['union_all']) and not query['union_all'][0]
+        fields, rows = None, []
+        seen = set()
+        for part in query['parts']:
+            part_fields, part_rows = self.run_single(part)
+            if fields is None:
+                fields = part_fields
+            elif part_fields != fields:
+                raise CypherError(
+                    'All sub queries in an UNION must have the same column '
+                    'names')
+            for row in part_rows:
+                if distinct:
+                    key = _hashable(row)
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                rows.append(row)
+        return fields or [], rows
+
+    def run_single(self, clauses):
+        rows = iter([{}])
+        fields = []
+        for i, clause in enumerate(clauses):
+            kind = clause['kind']
+            if kind == 'return' and i != len(clauses) - 1:
+                raise CypherError('RETURN can only be used at the end of '
+                                  'the query')
+            if kind == 'match':
+                rows = self.match(clause, rows)
+            elif kind == 'unwind':
+                rows = self.unwind(clause, rows)
+            elif kind in ('with', 'return'):
+                rows, fields = self.project(clause, rows)
+            else:
+                # Writes see all rows produced so far before anything is
+                # changed, like Neo4j's eager write plans.
+                rows = iter(getattr(self, kind)(clause, list(rows)))
+        if clauses[-1]['kind'] != 'return':
+            for _ in rows:
+                pass
+            return [], []
+        return fields, [[row[field] for field in fields] for row in rows]
+
+    def match(self, clause, rows):
+        matcher = Matcher(self.ctx, clause['patterns'], clause['where'])
+        self.plan.append(matcher)
+        new_vars = set()
+        for path in clause['patterns']:
+            new_vars.update(pattern_variables(path))
+        for row in rows:
+            matched = False
+            for result in matcher.match(row):
+                matched = True
+                yield result
+            if clause['optional'] and not matched:
+                result = dict(row)
+                for var in new_vars:
+                    result.setdefault(var, None)
+                yield result
+
+    def unwind(self, clause, rows):
+        for row in rows:
+            values = evaluate(clause['expr'], row, self.ctx)
+            if values is None:
+                continue
+            if not isinstance(values, list):
+                values = [values]
+            for value in values:
+                self.ctx.check()
+                result = dict(row)
+                result[clause['var']] = value
+                yield result
+
+    def project(self, clause, rows):
+        items = list(clause['items'])
+        if clause['star']:
+            rows = list(rows)
+            star_vars = sorted(_project_star(rows[0])) if rows else []
+            items = [(('var', var), var) for var in star_vars] + items
+        fields = [alias for _, alias in items]
+        if len(set(fields)) != len(fields):
+            raise CypherError('Multiple result columns with the same name')
+        aggregates = {}
+        for expr, _ in items:
+            for call in aggregate_calls(expr):
+                aggregates[id(call)] = call
+        for expr, _ in clause['order']:
+            for call in aggregate_calls(expr):
+                aggregates[id(call)] = call
+
+        if aggregates:
+            projected = self._aggregate(items, aggregates, rows)
+        else:
+            projected = ((row, {
+                alias: evaluate(expr, row, self.ctx)
+                for expr, alias in items
+            }) for row in rows)
+
+        if clause['distinct']:
+            projected = self._distinct(projected)
+
+        skip = _count_expr(clause['skip'], self.ctx, 'SKIP')
+        limit = _count_expr(clause['limit'], self.ctx, 'LIMIT')
+        if clause['order']:
+            scoped = []
+            for row, out in projected:
+                scope = out if aggregates or clause['distinct'] else dict(
+                    row, **out)
+                scoped.append((scope, out))
+            if aggregates:
+                self.ctx.aggregates = None
+            projected = [(None, out)
+                         for _, out in _order_rows(scoped, clause['order'],
+                                                   self.ctx)]
+        outputs = (out for _, out in projected)
+        if skip or limit is not None:
+            outputs = islice(outputs, skip or 0,
+                             None if limit is None else (skip or 0) + limit)
+        if clause['where'] is not None:
+            where = clause['where']
+            outputs = (out for out in outputs
+                       if _truthy(evaluate(where, out, self.ctx)))
+        return outputs, fields
+
+    def _aggregate(self, items, aggregates, rows):
+        keys = [(expr, alias) for expr, alias in items
+                if not aggregate_calls(expr)]
+        groups = {}
+        for row in rows:
+            self.ctx.check()
+            key_values = [evaluate(expr, row, self.ctx) for expr, _ in keys]
+            key = tuple(_hashable(value) for value in key_values)
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = (row, key_values, {
+                    call_id: _Aggregator(call)
+                    for call_id, call in aggregates.items()
+                })
+            for aggregator in group[2].values():
+                aggregator.add(row, self.ctx)
+        if not groups and not keys:
+            groups[()] = ({}, [], {
+                call_id: _Aggregator(call)
+                for call_id, call in aggregates.items()
+            })
+        results = []
+        for row, key_values, aggregators in groups.values():
+            self.ctx.aggregates = {
+                call_id: aggregator.result()
+                for call_id, aggregator in aggregators.items()
+            }
+            out = {}
+            key_iter = iter(key_values)
+            for expr, alias in items:
+                if aggregate_calls(expr):
+                    out[alias] = evaluate(expr, row, self.ctx)
+                else:
+                    out[alias] = next(key_iter)
+            results.append((row, out))
+        self.ctx.aggregates = None
+        return results
+
+    @staticmethod
+    def _distinct(projected):
+        seen = set()
+        for row, out in projected:
+            key = _hashable(list(out.values()))
+            if key not in seen:
+                seen.add(key)
+                yield row, out
+
+    # Writes
+
+    def _create_path(self, path, row):
+        result = dict(row)
+        node_ids = []
+        for pattern in path.nodes:
+            value = result.get(pattern.var)
+            if isinstance(value, NodeRef):
+                if pattern.labels or pattern.props:
+                    raise CypherError(
+                        'Can\'t create node `{}` with labels or properties '
+                        'here. The variable is already declared in this '
+                        'context'.format(pattern.var))
+                node_ids.append(value.id)
+                continue
+            if pattern.var in result and value is None:
+                raise CypherError('Failed to create relationship, node '
+                                  '`{}` is missing'.format(pattern.var))
+            props = evaluate(pattern.props, result,
+                             self.ctx) if pattern.props else {}
+            node_id = self.store.create_node(pattern.labels, props or {})
+            result[pattern.var] = NodeRef(node_id)
+            node_ids.append(node_id)
+        rel_ids = []
+        for i, pattern in enumerate(path.rels):
+            if len(pattern.types) != 1 or pattern.variable:
+                raise CypherError('A relationship to create needs exactly '
+                                  'one type and no length')
+            if pattern.direction == 'in':
+                start, end = node_ids[i + 1], node_ids[i]
+            else:
+                start, end = node_ids[i], node_ids[i + 1]
+            props = evaluate(pattern.props, result,
+                             self.ctx) if pattern.props else {}
+            rel_id = self.store.create_rel(pattern.types[0], start, end, props
+                                           or {})
+            result[pattern.var] = RelRef(rel_id)
+            rel_ids.append(rel_id)
+        if path.var:
+            result[path.var] = PathValue(node_ids, rel_ids)
+        return result
+
+    def create(self, clause, rows):
+        for row in rows:
+            for path in clause['patterns']:
+                row = self._create_path(path, row)
+            yield row
+
+    def merge(self, clause, rows):
+        path = clause['pattern']
+        results = []
+        for row in rows:
+            for pattern in path.nodes:
+                if pattern.var in row and row[pattern.var] is None:
+                    raise CypherError(
+                        'Failed to create relationship, node `{}` is '
+                        'missing'.format(pattern.var))
+            matches = [
+                bound for bound, _ in Matcher(self.ctx, [path], None).
+                match_path(path, row, set())
+            ]
+            if matches:
+                for bound in matches:
+                    self._set(clause['on_match'], bound)
+                    results.append(bound)
+            else:
+                bound = self._create_path(path, row)
+                self._set(clause['on_create'], bound)
+                results.append(bound)
+        return results
+
+    def _set(self, items, row):
+        for item in items:
+            kind = item[0]
+            if kind == 'prop':
+                target = evaluate(item[1], row, self.ctx)
+                if target is None:
+                    continue
+                value = evaluate(item[3], row, self.ctx)
+                props = dict(self.ctx.entity_props(target))
+                if value is None:
+                    props.pop(item[2], None)
+                else:
+                    props[item[2]] = _check_property(value)
+                self._write_props(target, props)
+                continue
+            target = row.get(item[1])
+            if item[1] not in row:
+                raise CypherError('Variable `{}` not defined'.format(item[1]))
+            if target is None:
+                continue
+            if kind == 'labels':
+                if not isinstance(target, NodeRef):
+                    raise CypherError('Labels can only be set on nodes')
+                labels = self.store.nodes[target.id].labels
+                self.store.set_node(target.id, list(labels) + item[2])
+                continue
+            value = evaluate(item[2], row, self.ctx)
+            if isinstance(value, (NodeRef, RelRef)):
+                value = dict(self.ctx.entity_props(value))
+            if value is None:
+                value = {}
+            if not isinstance(value, dict):
+                raise CypherError('Expected a map to set properties')
+            if kind == 'merge':
+                props = dict(self.ctx.entity_props(target))
+                for key, item_value in value.items():
+                    if item_value is None:
+                        props.pop(key, None)
+                    else:
+                        props[key] = _check_property(item_value)
+            else:
+                props = {
+                    key: _check_property(item_value)
+                    for key, item_value in value.items()
+                    if item_value is not None
+                }
+            self._write_props(target, props)
+
+    def _write_props(self, target, props):
+        if isinstance(target, NodeRef):
+            self.store.set_node(target.id, props=props)
+        elif isinstance(target, RelRef):
+            self.store.set_rel(target.id, props)
+        else:
+            raise CypherError('Properties can only be set on nodes and '
+                              'relationships')
+
+    def set(self, clause, rows):
+        for row in rows:
+            self._set(clause['items'], row)
+        return rows
+
+    def remove(self, clause, rows):
+        for row in rows:
+            for item in clause['items']:
+                if item[0] == 'labels':
+                    target = row.get(item[1])
+                    if target is None:
+                        continue
+                    labels = [
+                        label for label in self.store.nodes[target.id].labels
+                        if label not in item[2]
+                    ]
+                    self.store.set_node(target.id, labels)
+                else:
+                    target = evaluate(item[1], row, self.ctx)
+                    if target is None:
+                        continue
+                    props = dict(self.ctx.entity_props(target))
+                    props.pop(item[2], None)
+                    self._write_props(target, props)
+        return rows
+
+    def foreach(self, clause, rows):
+        for row in rows:
+            values = evaluate(clause['expr'], row, self.ctx)
+            if values is None:
+                continue
+            if not isinstance(values, list):
+                raise CypherError('FOREACH expects a list')
+            for value in values:
+                scope = dict(row)
+                scope[clause['var']] = value
+                scoped = [scope]
+                for inner in clause['clauses']:
+                    scoped = list(getattr(self, inner['kind'])(inner, scoped))
+        return rows
+
+    def delete(self, clause, rows):
+        for row in rows:
+            for expr in clause['exprs']:
+                self._delete(evaluate(expr, row, self.ctx), clause['detach'])
+        return rows
+
+    def _delete(self, value, detach):
+        if value is None:
+            return
+        if isinstance(value, NodeRef):
+            self.store.delete_node(value.id, detach)
+        elif isinstance(value, RelRef):
+            self.store.delete_rel(value.id)
+        elif isinstance(value, PathValue):
+            for rel_id in value.rels:
+                self.store.delete_rel(rel_id)
+            for node_id in value.nodes:
+                self.store.delete_node(node_id, detach)
+        elif isinstance(value, list):
+            for item in value:
+                self._delete(item, detach)
+        else:
+            raise CypherError('Only nodes, relationships and paths can be '
+                              'deleted')
+
+    def explain(self, query):
+        operators = []
+        for part in query.get('parts', []):
+            for clause in part:
+                if clause['kind'] == 'match':
+                    matcher = Matcher(self.ctx, clause['patterns'],
+                                      clause['where'])
+                elif clause['kind'] == 'merge':
+                    matcher = Matcher(self.ctx, [clause['pattern']], None)
+                else:
+                    continue
+                operators.extend(matcher.describe({}))
+        return {
+            'operatorType': 'ProduceResults',
+            'args': {},
+            'children': operators,
+        }
+
+
+def _check_property(value):
+    if isinstance(value, (NodeRef, RelRef, PathValue, dict)):
+        raise CypherError('Property values can only be of primitive types '
+                          'or arrays thereof')
+    if isinstance(value, list):
+        for item in value:
+            _check_property(item)
+            if isinstance(item, list):
+                raise CypherError('Collections containing collections can '
+                                  'not be stored in properties')
+    return value
+
+
+_QUERY_CACHE = {}
+
+
+def parse(text):
+    """
+    Parse `text`, reusing the parse of an identical earlier query.
+    """
+    query = _QUERY_CACHE.get(text)
+    if query is None:
+        query = Parser(text).parse()
+        if len(_QUERY_CACHE) > 512:
+            _QUERY_CACHE.clear()
+        _QUERY_CACHE[text] = query
+    return query
+
+
+def execute(store, text, params=None, deadline=None, cancel=None):
+    """
+    Run the query `text` on `store`. Returns the column names, the rows and
+    the plan of an EXPLAIN (None otherwise).
+
+    The query raises `QueryCancelled` once the `time.monotonic()` value
+    `deadline` passed or the `threading.Event` `cancel` is set.
+    """
+    query = parse(text)
+    executor = Executor(store, params or {}, deadline, cancel)
+    executor.ctx.stop_if_due()
+    if query['explain']:
+        return [], [], executor.explain(query)
+    fields, rows = executor.run(query)
+    return fields, rows, None
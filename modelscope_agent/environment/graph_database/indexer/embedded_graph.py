@@ -0,0 +1,689 @@
+import os
+import pickle
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import fasteners
+from py2neo import Node, Path, Relationship
+from py2neo.cypher import Cursor
+
+try:
+    from .embedded_cypher import (CypherError, NodeRef, PathValue, RelRef,
+                                  execute)
+except ImportError:
+    # Imported as a flat module by the indexer scripts.
+    from embedded_cypher import (CypherError, NodeRef, PathValue, RelRef,
+                                 execute)
+
+EMBEDDED_SCHEME = 'embedded://'
+
+# Node properties with a value -> nodes index, the ones every CodexGraph
+# lookup goes through (see INDEXED_PROPERTIES of the Neo4j handler).
+INDEXED_PROPERTIES = ('full_name', 'name', 'file_path')
+
+# The journal is folded into a new snapshot once it is larger than this and
+# than the snapshot itself.
+CHECKPOINT_BYTES = 4 * 1024 * 1024
+
+
+def is_embedded_uri(uri):
+    return isinstance(uri, str) and uri.startswith(EMBEDDED_SCHEME)
+
+
+def embedded_path(uri):
+    """
+    File of an `embedded://` URI: `embedded:///abs/graph.db` or
+    `embedded://relative/graph.db`.
+    """
+    return os.path.abspath(uri[len(EMBEDDED_SCHEME):])
+
+
+class NodeData:
+    __slots__ = ('labels', 'props')
+
+    def __init__(self, labels, props):
+        self.labels = labels
+        self.props = props
+
+
+class RelData:
+    __slots__ = ('type', 'start', 'end', 'props')
+
+    def __init__(self, rel_type, start, end, props):
+        self.type = rel_type
+        self.start = start
+        self.end = end
+        self.props = props
+
+
+class GraphStore:
+    """
+    In-memory property graph: nodes and relationships by id, adjacency lists
+    per node and relationship type in both directions, a label index and a
+    value index on `INDEXED_PROPERTIES`.
+
+    Mutations made between `begin` and `commit`/`rollback` are logged, the
+    first state of every touched entity for `rollback` and the final states
+    (`changes`) for the journal.
+    """
+
+    def __init__(self):
+        self.nodes = {}
+        self.rels = {}
+        self.next_id = 0
+        self.out_adj = {}  # node -> {type: {rel ids}}
+        self.in_adj = {}
+        self.label_index = {}  # label -> {node ids}
+        self.prop_index = {key: {} for key in INDEXED_PROPERTIES}
+        self._undo = None
+
+    # Indexes
+
+    def _index_node(self, node_id, data, add):
+        for label in data.labels:
+            ids = self.label_index.setdefault(label, set())
+            if add:
+                ids.add(node_id)
+            else:
+                ids.discard(node_id)
+                if not ids:
+                    del self.label_index[label]
+        for key, values in self.prop_index.items():
+            value = data.props.get(key)
+            if value is None or not _is_hashable(value):
+                continue
+            ids = values.setdefault(value, set())
+            if add:
+                ids.add(node_id)
+            else:
+                ids.discard(node_id)
+                if not ids:
+                    del values[value]
+
+    def nodes_with_property(self, key, value):
+        """
+        Ids of the nodes whose indexed property `key` equals `value`, None
+        when `key` is not indexed.
+        """
+        values = self.prop_index.get(key)
+        if values is None:
+            return None
+        if value is None or not _is_hashable(value):
+            return set()
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        return values.get(value, set())
+
+    def nodes_with_label(self, label):
+        return self.label_index.get(label, set())
+
+    # Transactions
+
+    def begin(self):
+        self._undo = {}
+
+    def _touch(self, kind, entity_id):
+        if self._undo is None or (kind, entity_id) in self._undo:
+            return
+        entities = self.nodes if kind == 'node' else self.rels
+        data = entities.get(entity_id)
+        if data is not None:
+            if kind == 'node':
+                data = NodeData(data.labels, dict(data.props))
+            else:
+                data = RelData(data.type, data.start, data.end,
+                               dict(data.props))
+        self._undo[(kind, entity_id)] = data
+
+    def changes(self):
+        """
+        Final state (None when deleted) of every entity touched since `begin`.
+        """
+        changes = []
+        for kind, entity_id in self._undo or ():
+            entities = self.nodes if kind == 'node' else self.rels
+            data = entities.get(entity_id)
+            if data is None:
+                changes.append((kind, entity_id, None))
+            elif kind == 'node':
+                changes.append((kind, entity_id,
+                                (data.labels, dict(data.props))))
+            else:
+                changes.append(
+                    (kind, entity_id,
+                     (data.type, data.start, data.end, dict(data.props))))
+        return changes
+
+    def commit(self):
+        changes = self.changes()
+        self._undo = None
+        return changes
+
+    def rollback(self):
+        undo, self._undo = self._undo or {}, None
+        self._restore([(kind, entity_id, data)
+                       for (kind, entity_id), data in undo.items()])
+
+    def apply(self, changes):
+        """
+        Replay the changes of a committed transaction (from the journal).
+        """
+        self._restore([(kind, entity_id, _state_data(kind, state))
+                       for kind, entity_id, state in changes])
+        for kind, entity_id, state in changes:
+            self.next_id = max(self.next_id, entity_id + 1)
+
+    def _restore(self, entities):
+        """
+        Put nodes and relationships into the given states, None removing
+        them. Relationships are removed before and recreated after the
+        nodes they connect.
+        """
+        for kind, entity_id, data in entities:
+            if kind == 'rel' and entity_id in self.rels:
+                self._remove_rel(entity_id)
+        for kind, entity_id, data in entities:
+            if kind != 'node':
+                continue
+            if data is None:
+                if entity_id in self.nodes:
+                    self._remove_node(entity_id)
+            elif entity_id in self.nodes:
+                self._replace_node(entity_id, data.labels, data.props)
+            else:
+                self._put_node(entity_id, data.labels, data.props)
+        for kind, entity_id, data in entities:
+            if kind == 'rel' and data is not None:
+                self._put_rel(entity_id, data.type, data.start, data.end,
+                              data.props)
+
+    # Raw mutations, no logging
+
+    def _put_node(self, node_id, labels, props):
+        data = NodeData(tuple(labels), dict(props))
+        self.nodes[node_id] = data
+        self._index_node(node_id, data, True)
+
+    def _replace_node(self, node_id, labels, props):
+        data = self.nodes[node_id]
+        self._index_node(node_id, data, False)
+        data.labels = tuple(labels)
+        data.props = dict(props)
+        self._index_node(node_id, data, True)
+
+    def _remove_node(self, node_id):
+        data = self.nodes.pop(node_id)
+        self._index_node(node_id, data, False)
+        self.out_adj.pop(node_id, None)
+        self.in_adj.pop(node_id, None)
+
+    def _put_rel(self, rel_id, rel_type, start, end, props):
+        self.rels[rel_id] = RelData(rel_type, start, end, dict(props))
+        self.out_adj.setdefault(start, {}).setdefault(rel_type,
+                                                      set()).add(rel_id)
+        self.in_adj.setdefault(end, {}).setdefault(rel_type, set()).add(rel_id)
+
+    def _remove_rel(self, rel_id):
+        data = self.rels.pop(rel_id)
+        for adjacency, node_id in ((self.out_adj, data.start),
+                                   (self.in_adj, data.end)):
+            by_type = adjacency.get(node_id)
+            if by_type is None:
+                continue
+            ids = by_type.get(data.type)
+            if ids is not None:
+                ids.discard(rel_id)
+                if not ids:
+                    del by_type[data.type]
+
+    # Logged mutations
+
+    def _new_id(self):
+        entity_id = self.next_id
+        self.next_id += 1
+        return entity_id
+
+    def create_node(self, labels, props):
+        node_id = self._new_id()
+        self._touch('node', node_id)
+        self._put_node(node_id, _unique(labels), _clean(props))
+        return node_id
+
+    def set_node(self, node_id, labels=None, props=None):
+        """
+        Replace the labels and/or the properties of a node.
+        """
+        self._touch('node', node_id)
+        data = self.nodes[node_id]
+        self._replace_node(
+            node_id,
+            _unique(labels) if labels is not None else data.labels,
+            _clean(props) if props is not None else data.props)
+
+    def delete_node(self, node_id, detach=False):
+        if node_id not in self.nodes:
+            return
+        rel_ids = self.node_rel_ids(node_id)
+        if rel_ids and not detach:
+            raise CypherError(
+                'Cannot delete node<{}>, because it still has relationships. '
+                'To delete this node, you must first delete its '
+                'relationships.'.format(node_id))
+        for rel_id in rel_ids:
+            self.delete_rel(rel_id)
+        self._touch('node', node_id)
+        self._remove_node(node_id)
+
+    def node_rel_ids(self, node_id):
+        rel_ids = set()
+        for adjacency in (self.out_adj, self.in_adj):
+            for ids in adjacency.get(node_id, {}).values():
+                rel_ids.update(ids)
+        return rel_ids
+
+    def create_rel(self, rel_type, start, end, props):
+        rel_id = self._new_id()
+        self._touch('rel', rel_id)
+        self._put_rel(rel_id, rel_type, start, end, _clean(props))
+        return rel_id
+
+    def set_rel(self, rel_id, props):
+        self._touch('rel', rel_id)
+        self.rels[rel_id].props = _clean(props)
+
+    def delete_rel(self, rel_id):
+        if rel_id not in self.rels:
+            return
+        self._touch('rel', rel_id)
+        self._remove_rel(rel_id)
+
+    # Persistence
+
+    def dump(self):
+        return {
+            'next_id':
+            self.next_id,
+            'nodes': [(node_id, data.labels, data.props)
+                      for node_id, data in self.nodes.items()],
+            'rels': [(rel_id, data.type, data.start, data.end, data.props)
+                     for rel_id, data in self.rels.items()],
+        }
+
+    @classmethod
+    def load(cls, state):
+        store = cls()
+        store.next_id = state['next_id']
+        for node_id, labels, props in state['nodes']:
+            store._put_node(node_id, labels, props)
+        for rel in state['rels']:
+            store._put_rel(*rel)
+        return store
+
+
+def _state_data(kind, state):
+    if state is None:
+        return None
+    if kind == 'node':
+        return NodeData(*state)
+    return RelData(*state)
+
+
+def _is_hashable(value):
+    return isinstance(value, (str, int, float, bool))
+
+
+def _unique(labels):
+    return list(dict.fromkeys(labels))
+
+
+def _clean(props):
+    return {key: value for key, value in props.items() if value is not None}
+
+
+class GraphFile:
+    """
+    Persistence of a `GraphStore`: a pickled snapshot plus an append-only
+    journal of committed transactions, shared by every process that opens
+    the same file.
+
+    Transactions take an inter-process lock and first replay the journal
+    entries other processes appended since their last look. Once the
+    journal outgrows the snapshot it is folded into a new snapshot with a
+    new generation, which makes the other processes reload the snapshot.
+    """
+
+    def __init__(self, path, checkpoint_bytes=CHECKPOINT_BYTES):
+        self.path = path
+        self.journal_path = path + '-journal'
+        self.checkpoint_bytes = checkpoint_bytes
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.process_lock = fasteners.InterProcessLock(path + '.lock')
+        self.generation = None
+        self.offset = 0
+        self.snapshot_size = 0
+        self.store = GraphStore()
+
+    def _read_snapshot(self):
+        with open(self.path, 'rb') as f:
+            state = pickle.load(f)
+            self.snapshot_size = f.tell()
+        self.store = GraphStore.load(state['graph'])
+        self.generation = state['generation']
+        self.offset = 0
+
+    def _write_atomic(self, path, payload):
+        tmp_path = '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+        os.replace(tmp_path, path)
+        return size
+
+    def _reset_journal(self):
+        self.offset = self._write_atomic(self.journal_path,
+                                         {'generation': self.generation})
+
+    def sync(self):
+        """
+        Bring the store up to date with the files. Called with the process
+        lock held.
+        """
+        try:
+            f = open(self.journal_path, 'rb+')
+        except FileNotFoundError:
+            if os.path.exists(self.path):
+                self._read_snapshot()
+                self._reset_journal()
+            else:
+                self.store = GraphStore()
+                self.checkpoint()
+            return
+        with f:
+            header = pickle.load(f)
+            if header['generation'] != self.generation or not self.offset:
+                self._read_snapshot()
+                if header['generation'] != self.generation:
+                    # Left by a checkpoint that stopped after writing the
+                    # snapshot, which already holds these entries.
+                    self._reset_journal()
+                    return
+                self.offset = f.tell()
+            self._replay(f)
+
+    def _replay(self, f):
+        size = os.fstat(f.fileno()).st_size
+        f.seek(self.offset)
+        while self.offset < size:
+            try:
+                changes = pickle.load(f)
+            except Exception:
+                # A writer died half way through an entry, drop it.
+                f.truncate(self.offset)
+                break
+            self.store.apply(changes)
+            self.offset = f.tell()
+
+    def append(self, changes):
+        if not changes:
+            return
+        with open(self.journal_path, 'ab') as f:
+            pickle.dump(changes, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+            self.offset = f.tell()
+        if self.offset > max(self.checkpoint_bytes, self.snapshot_size):
+            self.checkpoint()
+
+    def checkpoint(self):
+        """
+        Write the store as a new snapshot and start an empty journal.
+        """
+        self.generation = uuid.uuid4().hex
+        self.snapshot_size = self._write_atomic(self.path, {
+            'generation': self.generation,
+            'graph': self.store.dump(),
+        })
+        self._reset_journal()
+
+
+class EmbeddedResult:
+    """
+    `py2neo.client.Result` over materialized records, so that `py2neo.Cursor`
+    (`data`, `evaluate`, iteration, `plan`...) works on embedded queries.
+    """
+
+    def __init__(self, fields, records, summary=None):
+        self._fields = fields
+        self._records = records
+        self._index = 0
+        self._summary = summary or {}
+
+    @property
+    def offline(self):
+        return self._index >= len(self._records)
+
+    def fields(self):
+        return self._fields
+
+    def summary(self):
+        return self._summary
+
+    def take(self):
+        if self._index >= len(self._records):
+            return None
+        values = self._records[self._index]
+        self._index += 1
+        return values
+
+    def peek(self, limit):
+        return self._records[self._index:self._index + limit]
+
+    def has_more_records(self):
+        return False
+
+
+class EmbeddedTransaction:
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.closed = False
+
+    def run(self, cypher, parameters=None, **kwparameters):
+        if self.closed:
+            raise TypeError('Cannot run query in closed transaction')
+        return self.graph._execute(cypher,
+                                   dict(parameters or {}, **kwparameters))
+
+    def commit(self):
+        self.graph.commit(self)
+
+    def rollback(self):
+        self.graph.rollback(self)
+
+
+class EmbeddedGraph:
+    """
+    Serverless stand-in for `py2neo.Graph`, opened with an `embedded://path`
+    URI. Runs the Cypher subset of `embedded_cypher` on a `GraphStore`
+    persisted by `GraphFile`, with the `run`/`begin`/`commit`/`rollback`
+    API the handlers use. Results are `py2neo.Cursor`s of py2neo `Node`,
+    `Relationship` and `Path` values, like the ones of a Neo4j server.
+
+    Transactions are serialized: a transaction holds the graph's thread lock
+    and the file's process lock from `begin` to `commit`/`rollback`. So that
+    a runaway query cannot hold them indefinitely, the queries run by a
+    thread inside `deadline()` stop once it expires, and `kill_queries`
+    cancels running queries from any thread.
+    """
+
+    name = 'embedded'
+
+    def __init__(self, path, checkpoint_bytes=CHECKPOINT_BYTES):
+        self.path = path
+        self.file = GraphFile(path, checkpoint_bytes=checkpoint_bytes)
+        self._lock = threading.RLock()
+        self._tx = None
+        # id of the cancel event -> (query text, cancel event) of the
+        # running queries, see `kill_queries`.
+        self._running = {}
+        self._running_lock = threading.Lock()
+        self._local = threading.local()
+
+    def __repr__(self):
+        return 'EmbeddedGraph({!r})'.format(self.path)
+
+    @property
+    def store(self):
+        return self.file.store
+
+    def begin(self, readonly=False):
+        self._lock.acquire()
+        if self._tx is not None:
+            self._lock.release()
+            raise CypherError('A transaction is already open in this thread')
+        try:
+            self.file.process_lock.acquire()
+            try:
+                self.file.sync()
+                self.store.begin()
+            except Exception:
+                self.file.process_lock.release()
+                raise
+        except Exception:
+            self._lock.release()
+            raise
+        self._tx = EmbeddedTransaction(self)
+        return self._tx
+
+    def _finish(self, tx, commit):
+        if tx is not self._tx or tx.closed:
+            raise ValueError('Transaction is not open')
+        tx.closed = True
+        self._tx = None
+        try:
+            if commit:
+                self.file.append(self.store.commit())
+            else:
+                self.store.rollback()
+        finally:
+            self.file.process_lock.release()
+            self._lock.release()
+
+    def commit(self, tx):
+        self._finish(tx, True)
+
+    def rollback(self, tx):
+        self._finish(tx, False)
+
+    def run(self, cypher, parameters=None, **kwparameters):
+        """
+        Run `cypher` in its own transaction and return a `Cursor`.
+        """
+        tx = self.begin()
+        try:
+            cursor = tx.run(cypher, parameters, **kwparameters)
+        except Exception:
+            self.rollback(tx)
+            raise
+        self.commit(tx)
+        return cursor
+
+    @contextmanager
+    def deadline(self, seconds):
+        """
+        Queries this thread runs inside the block raise `QueryCancelled`
+        once `seconds` have passed, releasing the locks they hold.
+        """
+        previous = getattr(self._local, 'deadline', None)
+        self._local.deadline = time.monotonic() + seconds
+        try:
+            yield
+        finally:
+            self._local.deadline = previous
+
+    def kill_queries(self, text):
+        """
+        Cancel the running queries whose text contains `text`, they raise
+        `QueryCancelled` at their next check. Returns how many were
+        cancelled.
+        """
+        killed = 0
+        with self._running_lock:
+            for cypher, cancel in self._running.values():
+                if text in cypher and not cancel.is_set():
+                    cancel.set()
+                    killed += 1
+        return killed
+
+    def _execute(self, cypher, parameters):
+        cancel = threading.Event()
+        with self._running_lock:
+            self._running[id(cancel)] = (cypher, cancel)
+        try:
+            fields, rows, plan = execute(
+                self.store,
+                cypher,
+                parameters,
+                deadline=getattr(self._local, 'deadline', None),
+                cancel=cancel)
+        finally:
+            with self._running_lock:
+                del self._running[id(cancel)]
+        records = [[self._hydrate(value) for value in row] for row in rows]
+        summary = {'plan': plan} if plan is not None else {}
+        return Cursor(EmbeddedResult(fields, records, summary))
+
+    def _hydrate(self, value, nodes=None):
+        """
+        py2neo value of a query result value.
+        """
+        if nodes is None:
+            nodes = {}
+        if isinstance(value, NodeRef):
+            node = nodes.get(value.id)
+            if node is None:
+                data = self.store.nodes.get(value.id)
+                if data is None:
+                    node = Node()
+                else:
+                    node = Node(*data.labels, **data.props)
+                node.identity = value.id
+                nodes[value.id] = node
+            return node
+        if isinstance(value, RelRef):
+            data = self.store.rels.get(value.id)
+            if data is None:
+                return None
+            rel = Relationship(
+                self._hydrate(NodeRef(data.start), nodes), data.type,
+                self._hydrate(NodeRef(data.end), nodes), **data.props)
+            rel.identity = value.id
+            return rel
+        if isinstance(value, PathValue):
+            entities = [self._hydrate(NodeRef(value.nodes[0]), nodes)]
+            for rel_id, node_id in zip(value.rels, value.nodes[1:]):
+                entities.append(self._hydrate(RelRef(rel_id), nodes))
+                entities.append(self._hydrate(NodeRef(node_id), nodes))
+            return Path(*entities)
+        if isinstance(value, list):
+            return [self._hydrate(item, nodes) for item in value]
+        if isinstance(value, dict):
+            return {
+                key: self._hydrate(item, nodes)
+                for key, item in value.items()
+            }
+        return value
+
+    def checkpoint(self):
+        with self._lock, self.file.process_lock:
+            self.file.sync()
+            self.file.checkpoint()
+
+    def node_count(self):
+        with self._lock, self.file.process_lock:
+            self.file.sync()
+            return len(self.store.nodes)
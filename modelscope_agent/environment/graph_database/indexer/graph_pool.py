@@ -0,0 +1,230 @@
+import threading
+import time
+
+from py2neo import Graph, NodeMatcher, RelationshipMatcher
+
+try:
+    from .embedded_graph import EmbeddedGraph, embedded_path, is_embedded_uri
+except ImportError:
+    # Imported as a flat module by the indexer scripts.
+    from embedded_graph import EmbeddedGraph, embedded_path, is_embedded_uri
+
+# Defaults of the pools created by the registry, see `configure`.
+POOL_MAX_SIZE = 16
+# Seconds a Bolt connection is reused before it is replaced.
+POOL_MAX_AGE = 3600
+# A pool idle for longer than this is checked with `RETURN 1` before it is
+# handed out again, and reconnected when the check fails.
+LIVENESS_CHECK_INTERVAL = 30.0
+
+
+class GraphPool:
+    """
+    One shared graph connection: a py2neo `Graph` whose connector pools at
+    most `max_size` Bolt connections (or an `EmbeddedGraph`), with the
+    node/relationship matchers bound to it and usage counters.
+    """
+
+    def __init__(self, key, connect, max_size):
+        self.key = key
+        self.max_size = max_size
+        self._connect = connect
+        # _lock guards the counters, _check_lock one liveness check (whose
+        # query updates the counters) at a time.
+        self._lock = threading.Lock()
+        self._check_lock = threading.Lock()
+        self.acquires = 0
+        self.reconnects = 0
+        self.liveness_failures = 0
+        self.wait_count = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self._open()
+
+    def _open(self):
+        self.graph = self._connect()
+        self.node_matcher = NodeMatcher(self.graph)
+        self.rel_matcher = RelationshipMatcher(self.graph)
+        self.last_checked = time.monotonic()
+        connector = self.connector
+        if connector is not None:
+            self._time_acquisitions(connector)
+
+    @property
+    def connector(self):
+        service = getattr(self.graph, 'service', None)
+        return getattr(service, 'connector', None)
+
+    def _time_acquisitions(self, connector):
+        # Every query and transaction takes its Bolt connection through
+        # Connector._acquire, which blocks while the pool is exhausted.
+        acquire = connector._acquire
+
+        def timed_acquire(*args, **kwargs):
+            start_time = time.monotonic()
+            try:
+                return acquire(*args, **kwargs)
+            finally:
+                self._record_wait(time.monotonic() - start_time)
+
+        connector._acquire = timed_acquire
+
+    def _record_wait(self, seconds):
+        with self._lock:
+            self.wait_count += 1
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+    def in_use(self):
+        connector = self.connector
+        if connector is None:
+            return 0
+        return sum(connector.in_use.values())
+
+    def is_alive(self):
+        if isinstance(self.graph, EmbeddedGraph):
+            return True
+        try:
+            self.graph.run('RETURN 1').evaluate()
+            return True
+        except Exception:
+            return False
+
+    def check(self, interval):
+        """
+        Reconnect when the pool was not checked for `interval` seconds and
+        its server does not answer any more.
+        """
+        with self._check_lock:
+            if time.monotonic() - self.last_checked < interval:
+                return
+            if self.is_alive():
+                self.last_checked = time.monotonic()
+                return
+            self.close()
+            self._open()
+            with self._lock:
+                self.liveness_failures += 1
+                self.reconnects += 1
+
+    def close(self):
+        connector = self.connector
+        if connector is not None:
+            try:
+                connector.close()
+            except Exception as e:
+                print(f'Error closing the connections of {self.key[0]}: {e}')
+
+    def metrics(self):
+        in_use = self.in_use()
+        with self._lock:
+            return {
+                'uri': self.key[0],
+                'user': self.key[1],
+                'database': self.key[3],
+                'acquires': self.acquires,
+                'in_use': in_use,
+                'max_size': self.max_size,
+                'utilization': in_use / self.max_size
+                if self.max_size else 0.0,
+                'acquire_waits': self.wait_count,
+                'acquire_wait_seconds': self.wait_seconds,
+                'max_acquire_wait_seconds': self.max_wait_seconds,
+                'reconnects': self.reconnects,
+                'liveness_failures': self.liveness_failures,
+            }
+
+
+class GraphPoolRegistry:
+    """
+    Process-wide registry of `GraphPool`s keyed by URI, user, password and
+    database, so every `GraphDatabaseHandler` of the process (whatever its
+    task) reuses the same connection pool instead of opening its own.
+
+    Args:
+        max_size: Maximum number of Bolt connections of each pool.
+        max_age: Seconds a Bolt connection is reused.
+        liveness_check_interval: Seconds after which a pool is checked
+            before it is handed out again.
+    """
+
+    def __init__(self,
+                 max_size=POOL_MAX_SIZE,
+                 max_age=POOL_MAX_AGE,
+                 liveness_check_interval=LIVENESS_CHECK_INTERVAL):
+        self.max_size = max_size
+        self.max_age = max_age
+        self.liveness_check_interval = liveness_check_interval
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def configure(self, **settings):
+        """
+        Change the settings used for the pools created from now on.
+        """
+        for name, value in settings.items():
+            if not hasattr(self, name) or name.startswith('_'):
+                raise TypeError(f'Unknown pool setting {name!r}')
+            setattr(self, name, value)
+
+    def _connect(self, uri, user, password, database_name):
+        if is_embedded_uri(uri):
+            return EmbeddedGraph(embedded_path(uri))
+        return Graph(
+            uri,
+            auth=(user, password),
+            name=database_name,
+            max_size=self.max_size,
+            max_age=self.max_age)
+
+    def acquire(self, uri, user, password, database_name='neo4j'):
+        """
+        The pool of a database, connecting on first use. Raises when the
+        database cannot be reached.
+        """
+        key = (uri, user, password, database_name)
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = GraphPool(
+                    key, lambda: self._connect(uri, user, password,
+                                               database_name), self.max_size)
+                self._pools[key] = pool
+                created = True
+            else:
+                created = False
+        if not created:
+            pool.check(self.liveness_check_interval)
+        with pool._lock:
+            pool.acquires += 1
+        return pool
+
+    def close(self):
+        """
+        Close every pool, the next `acquire` connects again.
+        """
+        with self._lock:
+            pools = list(self._pools.values())
+            self._pools.clear()
+        for pool in pools:
+            pool.close()
+
+    def metrics(self):
+        """
+        Utilization and acquire-wait counters of every pool.
+        """
+        with self._lock:
+            pools = list(self._pools.values())
+        return [pool.metrics() for pool in pools]
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_graph_pool_registry():
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = GraphPoolRegistry()
+        return _registry
@@ -6,25 +6,36 @@ import json
 import time
 from typing import Optional, Dict, Any
 
+try:
+    from .description_cache import DescriptionCache, description_key
+except ImportError:
+    # 作为索引子进程脚本运行时使用平铺导入
+    from description_cache import DescriptionCache, description_key
+
+# 提示词版本，修改 _build_prompt 后需要递增，使旧的缓存描述失效
+PROMPT_VERSION = 1
+
 
 class MethodDescriptionGenerator:
     """使用大模型为方法生成描述"""
     
-    def __init__(self, llm_config: Optional[Dict[str, Any]] = None):
+    def __init__(self, llm_config: Optional[Dict[str, Any]] = None,
+                 cache: Optional[DescriptionCache] = None,
+                 cache_path: Optional[str] = None):
         """
         初始化描述生成器
         
         Args:
             llm_config: 大模型配置，包含API密钥、模型名称等
+            cache: 描述缓存，默认使用 cache_path 处的共享SQLite缓存
+            cache_path: 缓存文件路径，默认 ~/.codexgraph/method_descriptions.sqlite3
         """
         self.llm_config = llm_config or self._get_default_config()
-        self.cache = {}  # 缓存已生成的描述，避免重复调用
+        # 按代码内容寻址的持久化缓存，多个进程共享，避免重复调用
+        self.cache = cache if cache is not None else DescriptionCache(cache_path)
         
         # 设置编码环境
         self._setup_encoding()
-        
-        # 加载现有缓存
-        self.load_cache()
     
     def _setup_encoding(self):
         """设置编码环境，解决Windows下的编码问题"""
@@ -76,7 +87,7 @@ class MethodDescriptionGenerator:
             'temperature': 0.3
         }
     
-    def generate_method_description(self, method_code: str, method_name: str, class_name: str = None, file_path: str = None, relations: dict = None) -> str:
+    def generate_method_description(self, method_code: str, method_name: str, class_name: str = None, file_path: str = None, relations: dict = None, raise_on_error: bool = False, skip_cache_lookup: bool = False) -> str:
         """
         为方法生成描述
         
@@ -85,19 +96,20 @@ class MethodDescriptionGenerator:
             method_name: 方法名称
             class_name: 所属类名（可选）
             file_path: 文件路径（可选）
+            raise_on_error: 为True时生成失败直接抛出异常，而不是返回错误描述
+            skip_cache_lookup: 调用方已查过缓存且未命中时为True，避免重复查询（和重复计入未命中）
             
         Returns:
             方法的描述文本
         """
         try:
-            # 生成缓存键，使用更安全的方式
-            import hashlib
-            code_hash = hashlib.md5(method_code.encode('utf-8')).hexdigest()[:8]
-            cache_key = f"{method_name}_{code_hash}"
+            cache_key = self._cache_key(method_code, method_name)
             
             # 检查缓存
-            if cache_key in self.cache:
-                return self.cache[cache_key]
+            if not skip_cache_lookup:
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    return cached
             
             try:
                 # 构建提示词
@@ -107,23 +119,90 @@ class MethodDescriptionGenerator:
                 description = self._call_llm(prompt)
                 
                 # 缓存结果
-                self.cache[cache_key] = description
+                self.cache.put(cache_key, description)
                 
                 return description
                 
             except Exception as e:
                 print(f"生成方法描述失败: {e}")
-                # 返回包含错误信息的描述
-                error_description = f"方法 {method_name} 描述生成失败: {str(e)}"
-                # 也缓存错误描述，避免重复尝试
-                self.cache[cache_key] = error_description
-                return error_description
+                if raise_on_error:
+                    raise
+                # 返回包含错误信息的描述，失败结果不写入缓存，下次构建会重试
+                return f"方法 {method_name} 描述生成失败: {str(e)}"
                 
         except Exception as e:
+            if raise_on_error:
+                raise
             # 最外层的异常处理，确保总是返回一个描述
             print(f"方法描述生成器发生严重错误: {e}")
             return f"方法 {method_name} 描述生成器错误: {str(e)}"
     
+    def _cache_key(self, method_code: str, method_name: str) -> str:
+        """生成缓存键：规范化代码 + 模型 + 提示词版本 的sha256（方法名已包含在代码中）"""
+        return description_key(method_code, self.llm_config.get('model_name', ''), PROMPT_VERSION)
+
+    def get_cached_description(self, method_code: str, method_name: str) -> Optional[str]:
+        """查询缓存中的描述，未命中时返回None"""
+        return self.cache.get(self._cache_key(method_code, method_name))
+
+    def generate_batch_descriptions(self, methods: list, raise_on_error: bool = False, skip_cache_lookup: bool = False) -> list:
+        """
+        在一次大模型调用中为多个方法生成描述
+        
+        Args:
+            methods: 方法列表，每个元素包含method_code, method_name, class_name, file_path, relations
+            raise_on_error: 为True时单独重试仍失败的方法对应位置为None
+            skip_cache_lookup: 调用方已查过缓存且全部未命中时为True
+            
+        Returns:
+            与methods顺序一致的描述列表
+        """
+        descriptions = [None] * len(methods)
+        if not skip_cache_lookup:
+            for i, method in enumerate(methods):
+                descriptions[i] = self.get_cached_description(
+                    method['method_code'], method['method_name'])
+        pending = [i for i, description in enumerate(descriptions) if description is None]
+        if not pending:
+            return descriptions
+
+        sections = []
+        for number, i in enumerate(pending, 1):
+            method = methods[i]
+            sections.append(f"### {number}\n" + self._build_prompt(
+                method['method_code'], method['method_name'],
+                method.get('class_name'), method.get('file_path'),
+                method.get('relations')).rsplit('请用一句话', 1)[0])
+        prompt = ("请分别分析以下Python方法及其结构关系，为每个方法用一句简洁的中文描述它的作用、功能及关键关系。\n\n"
+                  + "\n\n".join(sections)
+                  + "\n\n只输出一个JSON对象，键为方法编号，值为描述，例如 {\"1\": \"...\", \"2\": \"...\"}")
+
+        parsed = {}
+        try:
+            response = self._call_llm(prompt)
+            start, end = response.find('{'), response.rfind('}')
+            parsed = json.loads(response[start:end + 1]) if start != -1 else {}
+        except Exception as e:
+            print(f"批量生成描述失败: {e}")
+
+        for number, i in enumerate(pending, 1):
+            method = methods[i]
+            description = parsed.get(str(number)) if isinstance(parsed, dict) else None
+            if isinstance(description, str) and description.strip():
+                descriptions[i] = description.strip()
+                self.cache.put(self._cache_key(method['method_code'], method['method_name']), descriptions[i])
+            else:
+                # 解析失败的方法单独生成
+                try:
+                    descriptions[i] = self.generate_method_description(
+                        method['method_code'], method['method_name'],
+                        method.get('class_name'), method.get('file_path'),
+                        method.get('relations'), raise_on_error=raise_on_error,
+                        skip_cache_lookup=True)
+                except Exception:
+                    descriptions[i] = None
+        return descriptions
+
     def _build_prompt(self, method_code: str, method_name: str, 
                      class_name: str = None, file_path: str = None, relations: dict = None) -> str:
         """构建大模型提示词"""
@@ -202,10 +281,8 @@ class MethodDescriptionGenerator:
             return self._generate_mock_description(prompt)
         except Exception as e:
             print(f"调用大模型API失败: {e}")
-            import traceback
-            traceback.print_exc()
-            # 返回包含错误信息的描述
-            return f"LLM调用失败: {str(e)}"
+            # 抛出异常由调用方处理，避免把错误信息当作描述缓存
+            raise
     
     def _generate_mock_description(self, prompt: str) -> str:
         """生成模拟描述（用于测试）"""
@@ -330,36 +407,37 @@ class MethodDescriptionGenerator:
         return descriptions
     
     def save_cache(self, cache_file: str = "method_descriptions_cache.json"):
-        """保存缓存到文件"""
+        """把缓存导出为JSON文件（缓存本身已实时持久化，无需调用）"""
         try:
             with open(cache_file, 'w', encoding='utf-8') as f:
-                json.dump(self.cache, f, ensure_ascii=False, indent=2)
+                json.dump(dict(self.cache.items()), f, ensure_ascii=False, indent=2)
             print(f"缓存已保存到: {cache_file}")
         except Exception as e:
             print(f"保存缓存失败: {e}")
     
     def load_cache(self, cache_file: str = "method_descriptions_cache.json"):
-        """从文件加载缓存"""
+        """从 save_cache 导出的JSON文件导入缓存，旧格式（方法名_md5前8位）的键无法还原，会被跳过"""
         try:
             if os.path.exists(cache_file):
                 with open(cache_file, 'r', encoding='utf-8') as f:
-                    self.cache = json.load(f)
-                print(f"已加载缓存: {len(self.cache)} 条记录")
+                    entries = json.load(f)
+                imported = 0
+                for key, description in entries.items():
+                    if len(key) == 64:
+                        self.cache.put(key, description)
+                        imported += 1
+                print(f"已加载缓存: {imported} 条记录")
         except Exception as e:
             print(f"加载缓存失败: {e}")
-            self.cache = {}  # 初始化空缓存
     
     def clear_cache(self):
         """清空缓存"""
         self.cache.clear()
         print("缓存已清空")
     
-    def get_cache_stats(self) -> Dict[str, int]:
-        """获取缓存统计信息"""
-        return {
-            'total_cached': len(self.cache),
-            'cache_size_bytes': len(str(self.cache).encode('utf-8'))
-        }
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息（包括命中率）"""
+        return self.cache.stats()
 
 
 # 全局描述生成器实例
@@ -1,35 +1,18 @@
 import concurrent.futures
 import subprocess
+import time
 
-import fasteners
-from py2neo import Graph, Node, NodeMatcher, Relationship, RelationshipMatcher
+from embedded_graph import is_embedded_uri
+from graph_pool import get_graph_pool_registry
+from task_lock import FileLock, NoOpLock, task_lockfile
 
+# Attempts of a flush transaction failing with a transient error.
+FLUSH_RETRIES = 3
 
-class NoOpLock:
-
-    def __enter__(self):
-        pass
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        pass
-
-
-class FileLock:
-    # 读写锁
-    def __init__(self, lockfile):
-        self.lockfile = lockfile
-        self.lock = fasteners.InterProcessLock(self.lockfile)
-        self.lock_acquired = False
-
-    def __enter__(self):
-        self.lock_acquired = self.lock.acquire(blocking=True)
-        if not self.lock_acquired:
-            raise RuntimeError('Unable to acquire the lock')
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.lock_acquired:
-            self.lock.release()
-            self.lock_acquired = False
+# Labels a node can carry besides task labels.
+NODE_LABELS = [
+    'MODULE', 'CLASS', 'FUNCTION', 'METHOD', 'GLOBAL_VARIABLE', 'FIELD', 'none'
+]
 
 
 class GraphDatabaseHandler:
@@ -43,26 +26,59 @@ class GraphDatabaseHandler:
         task_id='',
         use_lock=False,
         lockfile='neo4j.lock',
+        bulk_write=False,
+        batch_size=1000,
+        max_buffered_rows=10000,
     ):
-        self.graph = self._connect_to_graph(uri, user, password, database_name)
-        self.node_matcher = NodeMatcher(self.graph)
-        self.rel_matcher = RelationshipMatcher(self.graph)
+        # `embedded://path` opens a serverless graph file instead of Neo4j.
+        self.embedded = is_embedded_uri(uri)
+        # The connection and matchers are shared with every other handler of
+        # this process for the same database.
+        self.pool = self._connect_to_graph(uri, user, password, database_name)
         self.none_label = 'none'
         self.task_id = task_id
-        self.lock = FileLock(lockfile) if use_lock else NoOpLock()
+        # Reads never lock. With use_lock the writes of a task are
+        # serialized on a lock file of that task.
+        self.use_lock = use_lock
+        self.lockfile = lockfile
+        self.lock = self.task_lock()
+        # bulk_write routes add_node/add_edge/update_node into buffers that
+        # are written by `flush` with UNWIND statements. Without it every
+        # call is written at once by the same MERGE statements.
+        self.bulk_write = bulk_write
+        self.batch_size = batch_size
+        self.max_buffered_rows = max_buffered_rows
+        self._node_buffer = {}
+        self._update_buffer = {}
+        self._edge_buffer = {}
+        self._edge_update_buffer = {}
 
     def _connect_to_graph(self, uri, user, password, database_name):
+        registry = get_graph_pool_registry()
         try:
-            return Graph(uri, auth=(user, password), name=database_name)
+            return registry.acquire(uri, user, password, database_name)
         except Exception:
             self._start_neo4j()
             try:
-                return Graph(uri, auth=(user, password), name=database_name)
+                return registry.acquire(uri, user, password, database_name)
             except Exception as e:
                 raise ConnectionError(
                     'Failed to connect to Neo4j at {} after attempting to start the service.'
                     .format(uri)) from e
 
+    @property
+    def graph(self):
+        # The pool replaces its graph when it reconnects.
+        return self.pool.graph
+
+    @property
+    def node_matcher(self):
+        return self.pool.node_matcher
+
+    @property
+    def rel_matcher(self):
+        return self.pool.rel_matcher
+
     def _start_neo4j(self):
         # 使用系统命令启动Neo4j
         # 这里假设Neo4j的启动脚本或命令是 "neo4j start"
@@ -72,97 +88,69 @@ class GraphDatabaseHandler:
         except subprocess.CalledProcessError as e:
             raise RuntimeError('Failed to start Neo4j service.') from e
 
-    def _match_node(self, full_name):
-        if self.task_id:
-            existing_node = self.node_matcher.match(
-                self.task_id, full_name=full_name).first()
-        else:
-            existing_node = self.node_matcher.match(
-                full_name=full_name).first()
-        return existing_node
-
-    def _create_node(self, label=None, full_name='', parms={}):
-        if label is None or label == '':
-            label = self.none_label
-        if self.task_id:
-            node = Node(self.task_id, label, full_name=full_name, **parms)
-        else:
-            node = Node(label, full_name=full_name, **parms)
-        self.graph.create(node)
-        return node
-
-    def _update_node_label(self, full_name, label):
-        existing_node = self._match_node(full_name)
-        if existing_node:
-            query = ('MATCH (n:{0}:`{1}` {{full_name: $full_name}}) '
-                     'REMOVE n:{0} '
-                     'SET n:{2}').format(self.none_label, self.task_id, label)
-            self.graph.run(query, full_name=full_name)
-            return True
-        return False
-
-    def _add_node_label(self, full_name, new_label):
-        existing_node = self._match_node(full_name)
-        if existing_node:
-            query = ('MATCH (n:`{0}` {{full_name: $full_name}}) '
-                     'SET n:{1}').format(self.task_id, new_label)
-            self.graph.run(query, full_name=full_name)
-            return True
-        return False
-
-    def clear_task_data(self, task_id, batch_size=500):
-        """
-        Remove a specific label from nodes in batches. If a node only has this one label,
-        delete the node.
+    def task_lock(self, task_id=None):
+        if not self.use_lock:
+            return NoOpLock()
+        return FileLock(task_lockfile(self.lockfile, task_id or self.task_id))
+
+    def count_task_nodes(self, task_id=None):
+        label = task_id or self.task_id
+        return self.graph.run('MATCH (n:`{0}`) RETURN count(n)'.format(
+            label)).evaluate() or 0
+
+    def clear_task_data(self,
+                        task_id,
+                        batch_size=10000,
+                        update_progress_bar=None):
         """
-        remove_label_query_template = """
-        MATCH (n:`{label}`)
-        WHERE size(labels(n)) > 1
-        WITH n LIMIT {limit}
-        REMOVE n:`{label}`
-        RETURN count(n) AS removed_count
+        Remove a task from the graph in batches of one transaction: nodes of
+        this task only are deleted with their edges, nodes shared with other
+        tasks just lose the task label. Returns the number of processed nodes.
         """
-
-        delete_node_query_template = """
+        clear_task_query_template = """
         MATCH (n:`{label}`)
-        WHERE size(labels(n)) = 1
-        WITH n LIMIT {limit}
-        DETACH DELETE n
-        RETURN count(n) AS deleted_count
+        WITH n LIMIT $limit
+        WITH collect(n) AS nodes
+        FOREACH (n IN [x IN nodes WHERE any(l IN labels(x)
+                       WHERE l <> $label AND NOT l IN $node_labels)] |
+            REMOVE n:`{label}`)
+        FOREACH (n IN [x IN nodes WHERE none(l IN labels(x)
+                       WHERE l <> $label AND NOT l IN $node_labels)] |
+            DETACH DELETE n)
+        RETURN size(nodes) AS processed
         """
 
-        with self.lock:
+        total = self.count_task_nodes(task_id) if update_progress_bar else 0
+        query = clear_task_query_template.format(label=task_id)
+        processed = 0
+        with self.task_lock(task_id):
             while True:
-                remove_label_query = remove_label_query_template.format(
-                    label=task_id, limit=batch_size)
-                remove_label_result = self.graph.run(remove_label_query).data()
-                removed_count = remove_label_result[0]['removed_count']
-
-                delete_node_query = delete_node_query_template.format(
-                    label=task_id, limit=batch_size)
-                delete_node_result = self.graph.run(delete_node_query).data()
-                deleted_count = delete_node_result[0]['deleted_count']
-
-                if removed_count == 0 and deleted_count == 0:
+                count = self.graph.run(
+                    query,
+                    limit=batch_size,
+                    label=task_id,
+                    node_labels=NODE_LABELS).evaluate() or 0
+                processed += count
+                if update_progress_bar and total:
+                    update_progress_bar(min(processed / total, 1.0))
+                if count < batch_size:
                     break
+        return processed
 
     def clear_database(self):
-        with self.lock:
-            self.graph.run('MATCH (n) DETACH DELETE n')
+        self.graph.run('MATCH (n) DETACH DELETE n')
 
     def execute_query(self, query, **params):
         try:
-            with self.lock:
-                result = self.graph.run(query, **params)
-                return [record for record in result]
+            result = self.graph.run(query, **params)
+            return [record for record in result]
         except Exception:
             return ''
 
     def execute_query_with_exception(self, query, **params):
         try:
-            with self.lock:
-                result = self.graph.run(query, **params)
-                return [record for record in result], True
+            result = self.graph.run(query, **params)
+            return [record for record in result], True
         except Exception as e:
             return str(e), False
 
@@ -185,26 +173,14 @@ class GraphDatabaseHandler:
         return cypher_response, flag
 
     def update_node(self, full_name, parms={}):
-        with self.lock:
-            existing_node = self._match_node(full_name)
-            if existing_node:
-                existing_node.update(parms)
-                self.graph.push(existing_node)
+        self.queue_node_update(full_name, parms)
+        if not self.bulk_write:
+            self.flush()
 
     def add_node(self, label, full_name, parms={}):
-        with self.lock:
-            existing_node = self._match_node(full_name)
-            if existing_node:
-                if self.none_label in list(existing_node.labels):
-                    self._update_node_label(full_name, label)
-                elif label not in list(existing_node.labels):
-                    self._add_node_label(full_name, label)
-                existing_node.update(parms)
-                self.graph.push(existing_node)
-            else:
-                existing_node = self._create_node(
-                    label, full_name, parms=parms)
-            return existing_node
+        self.queue_node(label, full_name, parms)
+        if not self.bulk_write:
+            self.flush()
 
     def add_edge(
         self,
@@ -215,52 +191,210 @@ class GraphDatabaseHandler:
         end_name='',
         params={},
     ):
-        with self.lock:
-            start_node = self._match_node(full_name=start_name)
-            end_node = self._match_node(full_name=end_name)
-
-            if not start_node:
-                start_node = self._create_node(
-                    start_label, full_name=start_name, parms=params)
-            if not end_node:
-                end_node = self._create_node(
-                    end_label, full_name=end_name, parms=params)
-
-            if start_node and end_node:
-                rel = self.rel_matcher.match((start_node, end_node),
-                                             relationship_type).first()
-                if rel:
-                    rel.update(params)
-                    self.graph.push(rel)
-                    return rel
-                else:
-                    rel = Relationship(start_node, relationship_type, end_node,
-                                       **params)
-                    self.graph.create(rel)
-                    return rel
-            return None
+        self.queue_edge(start_label, start_name, relationship_type, end_label,
+                        end_name, params)
+        if not self.bulk_write:
+            self.flush()
 
     def update_edge(self,
                     start_name='',
                     relationship_type='',
                     end_name='',
                     params={}):
-        with self.lock:
-            start_node = self._match_node(full_name=start_name)
-            end_node = self._match_node(full_name=end_name)
-            if start_node and end_node:
-                rel = self.rel_matcher.match((start_node, end_node),
-                                             relationship_type).first()
-                if rel:
-                    rel.update(params)
-                    self.graph.push(rel)
-                    return rel
-                else:
-                    rel = Relationship(start_node, relationship_type, end_node,
-                                       **params)
-                    self.graph.create(rel)
-                    return rel
-            return None
+        self.queue_edge_update(start_name, relationship_type, end_name,
+                               params)
+        if not self.bulk_write:
+            self.flush()
+
+    def _task_label(self):
+        return ':`{0}`'.format(self.task_id) if self.task_id else ''
+
+    def queue_node(self, label, full_name, parms={}):
+        """
+        Buffer an `add_node`. Repeated calls for the same full_name are merged
+        and written by the next `flush`.
+        """
+        row = self._node_buffer.get(full_name)
+        if row is None:
+            row = self._node_buffer[full_name] = {'labels': [], 'parms': {}}
+        if label and label != self.none_label and label not in row['labels']:
+            row['labels'].append(label)
+        row['parms'].update(parms)
+        self._flush_if_full()
+
+    def queue_node_update(self, full_name, parms={}):
+        """
+        Buffer an `update_node`, which only touches nodes that already exist.
+        """
+        if full_name in self._node_buffer:
+            self._node_buffer[full_name]['parms'].update(parms)
+        else:
+            self._update_buffer.setdefault(full_name, {}).update(parms)
+            self._flush_if_full()
+
+    def queue_edge(
+        self,
+        start_label=None,
+        start_name='',
+        relationship_type='',
+        end_label=None,
+        end_name='',
+        params={},
+    ):
+        """
+        Buffer an `add_edge`. Missing endpoints are created with the edge
+        params, exactly like the unbuffered call does.
+        """
+        key = (start_name, relationship_type, end_name)
+        row = self._edge_buffer.get(key)
+        if row is None:
+            self._edge_buffer[key] = {
+                'start_label': start_label or self.none_label,
+                'end_label': end_label or self.none_label,
+                'params': dict(params),
+            }
+        else:
+            row['params'].update(params)
+        self._flush_if_full()
+
+    def queue_edge_update(self,
+                          start_name='',
+                          relationship_type='',
+                          end_name='',
+                          params={}):
+        """
+        Buffer an `update_edge`, which only connects nodes that already exist.
+        """
+        key = (start_name, relationship_type, end_name)
+        self._edge_update_buffer.setdefault(key, {}).update(params)
+        self._flush_if_full()
+
+    def _flush_if_full(self):
+        pending = len(self._node_buffer) + len(self._update_buffer) + len(
+            self._edge_buffer) + len(self._edge_update_buffer)
+        if pending >= self.max_buffered_rows:
+            self.flush()
+
+    def _bulk_statements(self):
+        task_label = self._task_label()
+        node_groups = {}
+        for full_name, row in self._node_buffer.items():
+            node_groups.setdefault(tuple(row['labels']), []).append({
+                'full_name':
+                full_name,
+                'parms':
+                row['parms'],
+            })
+        statements = []
+        for labels, rows in node_groups.items():
+            if labels:
+                query = ('UNWIND $rows AS row '
+                         'MERGE (n{0} {{full_name: row.full_name}}) '
+                         'SET n += row.parms, n{1} '
+                         'REMOVE n:`{2}`').format(
+                             task_label,
+                             ''.join(':`{0}`'.format(label)
+                                     for label in labels), self.none_label)
+            else:
+                query = ('UNWIND $rows AS row '
+                         'MERGE (n{0} {{full_name: row.full_name}}) '
+                         'ON CREATE SET n:`{1}` '
+                         'SET n += row.parms').format(task_label,
+                                                      self.none_label)
+            statements.append((query, rows))
+
+        if self._update_buffer:
+            query = ('UNWIND $rows AS row '
+                     'MATCH (n{0} {{full_name: row.full_name}}) '
+                     'SET n += row.parms').format(task_label)
+            statements.append((query, [{
+                'full_name': full_name,
+                'parms': parms
+            } for full_name, parms in self._update_buffer.items()]))
+
+        edge_groups = {}
+        for (start_name, relationship_type,
+             end_name), row in self._edge_buffer.items():
+            group = (relationship_type, row['start_label'], row['end_label'])
+            edge_groups.setdefault(group, []).append({
+                'start_name': start_name,
+                'end_name': end_name,
+                'params': row['params'],
+            })
+        for (relationship_type, start_label,
+             end_label), rows in edge_groups.items():
+            query = ('UNWIND $rows AS row '
+                     'MERGE (s{0} {{full_name: row.start_name}}) '
+                     'ON CREATE SET s:`{1}`, s += row.params '
+                     'MERGE (e{0} {{full_name: row.end_name}}) '
+                     'ON CREATE SET e:`{2}`, e += row.params '
+                     'MERGE (s)-[r:`{3}`]->(e) '
+                     'SET r += row.params').format(task_label, start_label,
+                                                   end_label,
+                                                   relationship_type)
+            statements.append((query, rows))
+
+        edge_update_groups = {}
+        for (start_name, relationship_type,
+             end_name), params in self._edge_update_buffer.items():
+            edge_update_groups.setdefault(relationship_type, []).append({
+                'start_name': start_name,
+                'end_name': end_name,
+                'params': params,
+            })
+        for relationship_type, rows in edge_update_groups.items():
+            query = ('UNWIND $rows AS row '
+                     'MATCH (s{0} {{full_name: row.start_name}}) '
+                     'MATCH (e{0} {{full_name: row.end_name}}) '
+                     'MERGE (s)-[r:`{1}`]->(e) '
+                     'SET r += row.params').format(task_label,
+                                                   relationship_type)
+            statements.append((query, rows))
+        return statements
+
+    def flush(self):
+        """
+        Write all buffered nodes, node updates, edges and edge updates (in that
+        order) as
+        `UNWIND $rows` statements of at most `batch_size` rows, all inside one
+        explicit transaction, run again on transient errors. Returns the
+        number of rows written.
+        If the write still fails, the rows stay buffered for the next flush.
+        """
+        statements = self._bulk_statements()
+        if not statements:
+            return 0
+
+        for attempt in range(FLUSH_RETRIES):
+            try:
+                with self.lock:
+                    written = self._write_statements(statements)
+                break
+            except Exception as e:
+                retry = getattr(e, 'should_retry', None)
+                if attempt == FLUSH_RETRIES - 1 or not (retry and retry()):
+                    raise
+                time.sleep(0.1 * 2**attempt)
+
+        self._node_buffer = {}
+        self._update_buffer = {}
+        self._edge_buffer = {}
+        self._edge_update_buffer = {}
+        return written
+
+    def _write_statements(self, statements):
+        written = 0
+        tx = self.graph.begin()
+        try:
+            for query, rows in statements:
+                for i in range(0, len(rows), self.batch_size):
+                    tx.run(query, rows=rows[i:i + self.batch_size])
+                written += len(rows)
+            self.graph.commit(tx)
+        except Exception:
+            self.graph.rollback(tx)
+            raise
+        return written
 
     def update_file_path(self, root_path):
         with self.lock:
@@ -335,3 +469,6 @@ class GraphDatabaseHandlerNone:
         params={},
     ):
         pass
+
+    def flush(self):
+        return 0
@@ -122,6 +122,7 @@ def run():
         database_name=db_name,
         task_id=task_id,
         use_lock=True,
+        bulk_write=True,
     )
     if is_clear:
         graph_db.clear_task_data(task_id)
@@ -132,6 +133,7 @@ def run():
         sourceFilePath=file_path,
         root_path=root_path,
         shallow=is_shallow)
+    graph_db.flush()
     print('Success build graph')
 
 
@@ -79,18 +79,7 @@ def getEnvironment(environmentPath=None):
         'Unable to find an executable Python environment.')
 
 
-def indexSourceFile(
-    sourceFilePath,
-    environmentDirectoryPath,
-    workingDirectory,
-    astVisitorClient,
-    isVerbose,
-    rootPath,
-):
-
-    if isVerbose:
-        print('INFO: Indexing source file "' + sourceFilePath + '".')
-
+def readSourceFile(sourceFilePath):
     sourceCode = ''
     try:
         with codecs.open(sourceFilePath, 'r', encoding='utf-8') as input:
@@ -101,30 +90,92 @@ def indexSourceFile(
         )
         with codecs.open(sourceFilePath, 'r') as input:
             sourceCode = input.read()
+    return sourceCode
+
+
+class IndexingSession:
+    """
+    jedi state shared by every file indexed in one run.
+
+    Probing the Python environment starts a subprocess, so the environment,
+    project, sorted sys path and InferenceState are created once here and
+    reused for all files. Files are parsed through the inference state's
+    grammar with parso's in-memory diff cache, keyed by their real path, so
+    a module already parsed in this run (e.g. while inferring an import) is
+    reused and a changed file only has its changed part re-parsed. Parsed
+    modules are not pickled to parso's disk cache: that writes a file per
+    indexed module and fails on deeply nested code.
+    """
+
+    def __init__(self, environmentDirectoryPath, workingDirectory,
+                 isVerbose=False):
+        self.workingDirectory = workingDirectory
+        self.isVerbose = isVerbose
+        self.environment = getEnvironment(environmentDirectoryPath)
+
+        if isVerbose:
+            print('INFO: Using Python environment at "'
+                  + self.environment.path + '" for indexing.')
+
+        self.project = jedi.api.project.Project(
+            workingDirectory, environment_path=self.environment.path)
+        self.evaluator = InferenceState(
+            self.project,
+            environment=self.environment,
+            script_path=workingDirectory)
+
+        baseSysPath = self.environment.get_sys_path()
+        baseSysPath.sort(reverse=True)
+        self.sysPath = baseSysPath
+
+    def parse(self, sourceFilePath, sourceCode):
+        return self.evaluator.parse(
+            code=sourceCode,
+            path=os.path.abspath(sourceFilePath),
+            cache=False,
+            diff_cache=True)
+
+    def indexFile(self, sourceFilePath, astVisitorClient, rootPath=None):
+        """
+        Index one file, returns its source code.
+        """
+        if self.isVerbose:
+            print('INFO: Indexing source file "' + sourceFilePath + '".')
+
+        sourceCode = readSourceFile(sourceFilePath)
+
+        module_node = self.parse(sourceFilePath, sourceCode)
+        astVisitorClient.this_source_code_lines = sourceCode.split('\n')
+        if self.isVerbose:
+            astVisitor = VerboseAstVisitor(
+                astVisitorClient,
+                self.evaluator,
+                sourceFilePath,
+                sysPath=self.sysPath,
+                rootPath=rootPath)
+        else:
+            astVisitor = AstVisitor(
+                astVisitorClient,
+                self.evaluator,
+                sourceFilePath,
+                sysPath=self.sysPath,
+                rootPath=rootPath)
 
-    environment = getEnvironment(environmentDirectoryPath)
-
-    if isVerbose:
-        print('INFO: Using Python environment at "' + environment.path
-              + '" for indexing.')
-
-    project = jedi.api.project.Project(
-        workingDirectory, environment_path=environment.path)
-
-    evaluator = InferenceState(
-        project, environment=environment, script_path=workingDirectory)
+        astVisitor.traverseNode(module_node)
+        return sourceCode
 
-    module_node = evaluator.parse(
-        code=sourceCode, path=workingDirectory, cache=False, diff_cache=False)
-    astVisitorClient.this_source_code_lines = sourceCode.split('\n')
-    if isVerbose:
-        astVisitor = VerboseAstVisitor(astVisitorClient, evaluator,
-                                       sourceFilePath)
-    else:
-        astVisitor = AstVisitor(
-            astVisitorClient, evaluator, sourceFilePath, rootPath=rootPath)
 
-    astVisitor.traverseNode(module_node)
+def indexSourceFile(
+    sourceFilePath,
+    environmentDirectoryPath,
+    workingDirectory,
+    astVisitorClient,
+    isVerbose,
+    rootPath,
+):
+    session = IndexingSession(environmentDirectoryPath, workingDirectory,
+                              isVerbose)
+    session.indexFile(sourceFilePath, astVisitorClient, rootPath)
 
 
 class ContextType(Enum):
@@ -153,6 +204,67 @@ class ReferenceKindInfo:
         self.node = node
 
 
+class TreeIndex:
+    """
+    Memoized ancestor lookups of one tree. The closest classdef/funcdef and
+    the closest node with a direct name child are looked up for almost every
+    name leaf; here each inner node is resolved at most once, walking up only
+    until an already resolved ancestor is met.
+
+    Entries are keyed by `id(node)`: parso hashes operators and keywords by
+    their value, so using the nodes as keys would make every '(' collide.
+    """
+
+    scopeTypes = ('classdef', 'funcdef')
+
+    def __init__(self, root):
+        self.root = root
+        self.scope = {}
+        self.named = {}
+
+    def _resolve(self, node, cache, isMatch):
+        # Closest node at or above `node` satisfying `isMatch`.
+        path = []
+        current = node
+        while current is not None:
+            currentId = id(current)
+            if currentId in cache:
+                result = cache[currentId]
+                break
+            path.append(currentId)
+            if isMatch(current):
+                result = current
+                break
+            current = current.parent
+        else:
+            result = None
+        for nodeId in path:
+            cache[nodeId] = result
+        return result
+
+    def getParentScope(self, node):
+        """
+        Same result as `getParentWithTypeInList(node, ['classdef', 'funcdef'])`.
+        """
+        if node is None or node.parent is None:
+            return None
+        return self._resolve(node.parent, self.scope,
+                             lambda n: n.type in self.scopeTypes)
+
+    def getNamedParentNode(self, node):
+        """
+        Same result as the module level `getNamedParentNode`.
+        """
+        if node is None or node.parent is None:
+            return None
+        parentNode = node.parent
+        if node.type == 'name':
+            parentNode = parentNode.parent
+        return self._resolve(
+            parentNode, self.named,
+            lambda n: getFirstDirectChildWithType(n, 'name') is not None)
+
+
 class AstVisitor:
 
     def __init__(
@@ -193,6 +305,9 @@ class AstVisitor:
 
         self.contextStack = []
         self.referenceKindStack = []
+        self.treeIndex = None
+        self.moduleNameHierarchyCache = {}
+        self.scopeNameHierarchyCache = {}
 
         fileId = self.client.recordFile(self.sourceFilePath)
         if fileId == 0:
@@ -218,89 +333,92 @@ class AstVisitor:
                 ))
 
     def traverseNode(self, node):
+        """
+        Walk the tree below `node` with an explicit stack. Stack entries are
+        either nodes still to expand or `(function, *args)` tuples that run
+        once everything pushed above them is done, which reproduces the
+        begin/children/end order of a recursive walk without its depth
+        limit.
+        """
         if node is None:
             return
-
-        if node.type == 'classdef':
-            self.traverseClassdef(node)
-        elif node.type == 'funcdef':
-            self.traverseFuncdef(node)
-        elif node.type == 'param':
-            self.traverseParam(node)
-        elif node.type == 'argument':
-            self.traverseArgument(node)
-        elif node.type == 'import_from':
-            self.traverseImportFrom(node)
-        elif node.type == 'dotted_as_name':
-            self.traverseDottedAsNameOrImportAsName(node)
-        elif node.type == 'import_as_name':
-            self.traverseDottedAsNameOrImportAsName(node)
+        if self.treeIndex is None or self.treeIndex.root is not node:
+            self.treeIndex = TreeIndex(node)
+
+        stack = [node]
+        while stack:
+            item = stack.pop()
+            if item.__class__ is tuple:
+                item[0](*item[1:])
+            elif item is not None:
+                self.expandNode(item, stack)
+
+    def expandNode(self, node, stack):
+        nodeType = node.type
+        if nodeType == 'classdef':
+            self.traverseClassdef(node, stack)
+        elif nodeType == 'funcdef':
+            self.traverseFuncdef(node, stack)
+        elif nodeType == 'param':
+            self.traverseParam(node, stack)
+        elif nodeType == 'argument':
+            self.traverseArgument(node, stack)
+        elif nodeType == 'import_from':
+            self.traverseImportFrom(node, stack)
+        elif nodeType == 'dotted_as_name' or nodeType == 'import_as_name':
+            self.traverseDottedAsNameOrImportAsName(node, stack)
         else:
-            if node.type == 'name':
+            endVisit = None
+            if nodeType == 'name':
                 self.beginVisitName(node)
-            elif node.type == 'string':
+                endVisit = self.endVisitName
+            elif nodeType == 'string':
                 self.beginVisitString(node)
-            elif node.type == 'error_leaf':
+                endVisit = self.endVisitString
+            elif nodeType == 'error_leaf':
                 self.beginVisitErrorLeaf(node)
-            elif node.type == 'import_name':
+                endVisit = self.endVisitErrorLeaf
+            elif nodeType == 'import_name':
                 self.beginVisitImportName(node)
+                endVisit = self.endVisitImportName
 
-            if hasattr(node, 'children'):
-                for c in node.children:
-                    self.traverseNode(c)
-
-            if node.type == 'name':
-                self.endVisitName(node)
-            elif node.type == 'string':
-                self.endVisitString(node)
-            elif node.type == 'error_leaf':
-                self.endVisitErrorLeaf(node)
-            elif node.type == 'import_name':
-                self.endVisitImportName(node)
+            children = getattr(node, 'children', None)
+            if not children:
+                if endVisit is not None:
+                    endVisit(node)
+                return
+            if endVisit is not None:
+                stack.append((endVisit, node))
+            stack.extend(reversed(children))
 
     # ----------------
 
-    def traverseClassdef(self, node):
-        if node is None:
-            return
-
+    def traverseClassdef(self, node, stack):
         self.beginVisitClassdef(node)
 
+        stack.append((self.endVisitClassdef, node))
+        stack.append(node.get_suite())
         superArglist = node.get_super_arglist()
         if superArglist is not None:
             self.beginVisitClassdefSuperArglist(superArglist)
-            self.traverseNode(superArglist)
-            self.endVisitClassdefSuperArglist(superArglist)
-        self.traverseNode(node.get_suite())
-
-        self.endVisitClassdef(node)
-
-    def traverseFuncdef(self, node):
-        if node is None:
-            return
+            stack.append((self.endVisitClassdefSuperArglist, superArglist))
+            stack.append(superArglist)
 
+    def traverseFuncdef(self, node, stack):
         self.beginVisitFuncdef(node)
 
-        for n in node.get_params():
-            self.traverseNode(n)
-        self.traverseNode(node.get_suite())
-
-        self.endVisitFuncdef(node)
-
-    def traverseParam(self, node):
-        if node is None:
-            return
+        stack.append((self.endVisitFuncdef, node))
+        stack.append(node.get_suite())
+        stack.extend(reversed(node.get_params()))
 
+    def traverseParam(self, node, stack):
         self.beginVisitParam(node)
 
-        self.traverseNode(node.default)
-
-        self.endVisitParam(node)
-
-    def traverseArgument(self, node):
-        if node is None:
-            return
+        stack.append((self.endVisitParam, node))
+        if node.default is not None:
+            stack.append(node.default)
 
+    def traverseArgument(self, node, stack):
         childTraverseStartIndex = 0
 
         for i in range(len(node.children)):
@@ -309,43 +427,46 @@ class AstVisitor:
                 childTraverseStartIndex = i + 1
                 break
 
-        for i in range(childTraverseStartIndex, len(node.children)):
-            self.traverseNode(node.children[i])
-
-    def traverseImportFrom(self, node):
-        if node is None:
-            return
+        stack.extend(reversed(node.children[childTraverseStartIndex:]))
 
+    def traverseImportFrom(self, node, stack):
+        items = []
         referenceKindAdded = False
 
         for c in node.children:
-            self.traverseNode(c)
+            items.append(c)
             if c.type == 'keyword' and c.value == 'import' and not referenceKindAdded:
-                self.referenceKindStack.append(
-                    ReferenceKindInfo(srctrl.REFERENCE_IMPORT, node))
+                items.append((self.referenceKindStack.append,
+                              ReferenceKindInfo(srctrl.REFERENCE_IMPORT,
+                                                node)))
                 referenceKindAdded = True
 
         if referenceKindAdded:
-            self.referenceKindStack.pop()
+            items.append((self.referenceKindStack.pop, ))
+        stack.extend(reversed(items))
 
-    def traverseDottedAsNameOrImportAsName(self, node):
-        if node is None:
-            return
-
-        referenceKindRemoved = False
-        previousReferenceKind = None
+    def traverseDottedAsNameOrImportAsName(self, node, stack):
+        # Whether the reference kind is removed depends on the stack when the
+        # 'as' keyword is reached, so decide it then.
+        state = {'removed': False, 'previous': None}
+        items = []
 
         for c in node.children:
-            self.traverseNode(c)
-            if (c.type == 'keyword' and c.value == 'as'
-                    and not referenceKindRemoved
-                    and len(self.referenceKindStack) > 0):
-                previousReferenceKind = self.referenceKindStack[-1]
-                self.referenceKindStack.pop()
-                referenceKindRemoved = True
+            items.append(c)
+            if c.type == 'keyword' and c.value == 'as':
+                items.append((self._removeReferenceKind, state))
 
-        if referenceKindRemoved:
-            self.referenceKindStack.append(previousReferenceKind)
+        items.append((self._restoreReferenceKind, state))
+        stack.extend(reversed(items))
+
+    def _removeReferenceKind(self, state):
+        if not state['removed'] and len(self.referenceKindStack) > 0:
+            state['previous'] = self.referenceKindStack.pop()
+            state['removed'] = True
+
+    def _restoreReferenceKind(self, state):
+        if state['removed']:
+            self.referenceKindStack.append(state['previous'])
 
     # ----------------
 
@@ -490,11 +611,11 @@ class AstVisitor:
             if referenceKind == srctrl.REFERENCE_CALL:
 
                 pass
-            namedDefinitionParentNode = getParentWithTypeInList(
-                node, ['classdef', 'funcdef'])
+            namedDefinitionParentNode = self.treeIndex.getParentScope(node)
             if namedDefinitionParentNode is not None:
                 if namedDefinitionParentNode.type in ['classdef']:
-                    if getNamedParentNode(node) == namedDefinitionParentNode:
+                    if self.treeIndex.getNamedParentNode(
+                            node) == namedDefinitionParentNode:
 
                         symbolNameHierarchy = self.getNameHierarchyOfNode(node)
                         if symbolNameHierarchy is not None:
@@ -513,7 +634,8 @@ class AstVisitor:
                             and node.parent.type == 'trailer'
                             and node.get_previous_sibling() is not None
                             and node.get_previous_sibling().value == '.'):
-                        potentialSelfParamNode = getNamedParentNode(node)
+                        potentialSelfParamNode = self.treeIndex.getNamedParentNode(
+                            node)
                         if (potentialSelfParamNode is not None
                                 and getFirstDirectChildWithType(
                                     potentialSelfParamNode, 'name').value
@@ -634,6 +756,15 @@ class AstVisitor:
         return str(self.contextStack[-1].name) + '<' + nameNode.value + '>'
 
     def getNameHierarchyFromModuleFilePath(self, filePath):
+        # Callers extend the returned hierarchy, so hand out copies.
+        if filePath not in self.moduleNameHierarchyCache:
+            self.moduleNameHierarchyCache[
+                filePath] = self.computeNameHierarchyFromModuleFilePath(
+                    filePath)
+        nameHierarchy = self.moduleNameHierarchyCache[filePath]
+        return nameHierarchy.copy() if nameHierarchy is not None else None
+
+    def computeNameHierarchyFromModuleFilePath(self, filePath):
         if filePath is None:
             return None
 
@@ -687,11 +818,10 @@ class AstVisitor:
         if nameNode is None:
             return None
 
-        parentNode = getParentWithTypeInList(nameNode.parent,
-                                             ['classdef', 'funcdef'])
+        parentNode = self.treeIndex.getParentScope(nameNode.parent)
 
         if self.contextStack[-1].contextType == ContextType.METHOD:
-            potentialSelfNode = getNamedParentNode(node)
+            potentialSelfNode = self.treeIndex.getNamedParentNode(node)
             if potentialSelfNode is not None:
                 potentialSelfNameNode = getFirstDirectChildWithType(
                     potentialSelfNode, 'name')
@@ -703,7 +833,7 @@ class AstVisitor:
         nameElement = NameElement(nameNode.value)
 
         if parentNode is not None:
-            parentNodeNameHierarchy = self.getNameHierarchyOfNode(parentNode)
+            parentNodeNameHierarchy = self.getNameHierarchyOfScope(parentNode)
             if parentNodeNameHierarchy is None:
                 return None
             parentNodeNameHierarchy.nameElements.append(nameElement)
@@ -716,25 +846,39 @@ class AstVisitor:
         nameHierarchy.nameElements.append(nameElement)
         return nameHierarchy
 
-        return None
+    def getNameHierarchyOfScope(self, scopeNode):
+        # The hierarchy of an enclosing class or function only depends on the
+        # scope node and, inside a method, on the self parameter and the
+        # class of that method, so it is computed once per combination.
+        context = self.contextStack[-1]
+        if context.contextType == ContextType.METHOD:
+            key = (id(scopeNode), context.selfParamName,
+                   id(self.contextStack[-2].node))
+        else:
+            key = (id(scopeNode), None, None)
+        if key not in self.scopeNameHierarchyCache:
+            self.scopeNameHierarchyCache[key] = self.getNameHierarchyOfNode(
+                scopeNode)
+        nameHierarchy = self.scopeNameHierarchyCache[key]
+        return nameHierarchy.copy() if nameHierarchy is not None else None
+
 
 
 class VerboseAstVisitor(AstVisitor):
 
     def __init__(self,
                  client,
+                 evaluator,
                  sourceFilePath,
                  sourceFileContent=None,
-                 sysPath=None):
-        AstVisitor.__init__(self, client, sourceFilePath, sourceFileContent,
-                            sysPath)
+                 sysPath=None,
+                 rootPath=None):
+        AstVisitor.__init__(self, client, evaluator, sourceFilePath,
+                            sourceFileContent, sysPath, rootPath)
         self.indentationLevel = 0
         self.indentationToken = '| '
 
-    def traverseNode(self, node):
-        if node is None:
-            return
-
+    def expandNode(self, node, stack):
         currentString = ''
         for i in range(0, self.indentationLevel):
             currentString += self.indentationToken
@@ -749,7 +893,10 @@ class VerboseAstVisitor(AstVisitor):
         print('AST: ' + currentString)
 
         self.indentationLevel += 1
-        AstVisitor.traverseNode(self, node)
+        stack.append((self.dedent, ))
+        AstVisitor.expandNode(self, node, stack)
+
+    def dedent(self):
         self.indentationLevel -= 1
 
 
@@ -790,25 +937,18 @@ def getNamedParentNode(node):
 
 
 def getParentWithType(node, type):
-    if node is None:
-        return None
-    parentNode = node.parent
-    if parentNode is None:
-        return None
-    if parentNode.type == type:
-        return parentNode
-    return getParentWithType(parentNode, type)
+    return getParentWithTypeInList(node, [type])
 
 
 def getParentWithTypeInList(node, typeList):
     if node is None:
         return None
     parentNode = node.parent
-    if parentNode is None:
-        return None
-    if parentNode.type in typeList:
-        return parentNode
-    return getParentWithTypeInList(parentNode, typeList)
+    while parentNode is not None:
+        if parentNode.type in typeList:
+            return parentNode
+        parentNode = parentNode.parent
+    return None
 
 
 def getFirstDirectChildWithType(node, type):
@@ -0,0 +1,124 @@
+import os
+import threading
+from collections import OrderedDict
+
+
+def dedent_lines(lines):
+    """
+    Remove the indentation of the first line from every line, like the code
+    snippets stored in and expanded from the graph.
+    """
+    if not lines:
+        return lines
+    indent = len(lines[0]) - len(lines[0].lstrip())
+    return [line[indent:] if len(line) > indent else '' for line in lines]
+
+
+class SourceCache:
+    """
+    Least recently used cache of source files split into lines, shared by
+    the indexer and the expansion of `<CODE>{"S":..,"E":..,"F":..}</CODE>`
+    markers in query results.
+
+    A line range is a slice of the cached line list, so expanding many
+    markers of the same file reads and splits it once. Every access compares
+    the file's mtime and size with the cached ones, so an edited file is
+    read again.
+
+    Args:
+        max_files: Maximum number of cached files.
+        max_bytes: Maximum total size of the cached files.
+    """
+
+    def __init__(self, max_files=256, max_bytes=64 * 1024 * 1024):
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self._files = OrderedDict()  # path -> (mtime_ns, size, lines)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_lines(self, file_path):
+        """
+        Lines of `file_path` (split on '\\n' like the indexer does), None when
+        it cannot be read as utf-8.
+        """
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        with self._lock:
+            entry = self._files.get(file_path)
+            if entry is not None and entry[:2] == (stat.st_mtime_ns,
+                                                   stat.st_size):
+                self._files.move_to_end(file_path)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+
+        try:
+            with open(file_path, 'rb') as f:
+                lines = f.read().decode('utf-8').split('\n')
+        except (OSError, UnicodeDecodeError):
+            return None
+
+        with self._lock:
+            self._discard(file_path)
+            self._files[file_path] = (stat.st_mtime_ns, stat.st_size, lines)
+            self._bytes += stat.st_size
+            while self._files and (len(self._files) > self.max_files
+                                   or self._bytes > self.max_bytes):
+                self._discard(next(iter(self._files)))
+        return lines
+
+    def _discard(self, file_path):
+        entry = self._files.pop(file_path, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def get_range(self, file_path, start_line, end_line):
+        """
+        Lines `start_line` to `end_line` (1-based, inclusive), None when the
+        file cannot be read.
+        """
+        lines = self.get_lines(file_path)
+        if lines is None:
+            return None
+        return lines[max(start_line, 1) - 1:end_line]
+
+    def extract(self, file_path, start_line, end_line, is_indent=True):
+        """
+        Source text of a line range, dedented by the first line's indentation
+        when `is_indent` is set. Returns '' when the file cannot be read.
+        """
+        lines = self.get_range(file_path, start_line, end_line)
+        if not lines:
+            return ''
+        if is_indent:
+            lines = dedent_lines(lines)
+        return '\n'.join(lines)
+
+    def invalidate(self, file_path=None):
+        with self._lock:
+            if file_path is None:
+                self._files.clear()
+                self._bytes = 0
+            else:
+                self._discard(file_path)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'cached_files': len(self._files),
+                'cached_bytes': self._bytes,
+            }
+
+
+_source_cache = SourceCache()
+
+
+def get_source_cache():
+    return _source_cache
@@ -0,0 +1,82 @@
+import os
+import re
+import threading
+
+import fasteners
+
+
+class NoOpLock:
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+class _SharedFileLock:
+    """
+    The state of one lock file in this process: a reentrant thread lock and
+    the inter-process lock, taken by the outermost acquire of the owning
+    thread only. An fcntl lock belongs to the process, so the threads need
+    their own exclusion and nested acquires must not release it early.
+    """
+
+    def __init__(self, lockfile):
+        self.thread_lock = threading.RLock()
+        self.process_lock = fasteners.InterProcessLock(lockfile)
+        self.depth = 0
+
+    def acquire(self):
+        self.thread_lock.acquire()
+        if self.depth == 0:
+            try:
+                acquired = self.process_lock.acquire(blocking=True)
+            except Exception:
+                self.thread_lock.release()
+                raise
+            if not acquired:
+                self.thread_lock.release()
+                raise RuntimeError('Unable to acquire the lock')
+        self.depth += 1
+
+    def release(self):
+        self.depth -= 1
+        if self.depth == 0:
+            self.process_lock.release()
+        self.thread_lock.release()
+
+
+_shared_locks = {}
+_shared_locks_lock = threading.Lock()
+
+
+class FileLock:
+    """
+    Exclusive lock on `lockfile` between the threads of this process and
+    other processes. Reentrant within a thread.
+    """
+
+    def __init__(self, lockfile):
+        self.lockfile = os.path.abspath(lockfile)
+        with _shared_locks_lock:
+            self._lock = _shared_locks.get(self.lockfile)
+            if self._lock is None:
+                self._lock = _shared_locks[self.lockfile] = _SharedFileLock(
+                    self.lockfile)
+
+    def __enter__(self):
+        self._lock.acquire()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._lock.release()
+
+
+def task_lockfile(lockfile, task_id):
+    """
+    Lock file of the writes of one task, `neo4j.lock` -> `neo4j.<task>.lock`.
+    """
+    if not task_id:
+        return lockfile
+    root, ext = os.path.splitext(lockfile)
+    return '{}.{}{}'.format(root, re.sub(r'[^\w.-]', '_', task_id), ext)
@@ -0,0 +1,178 @@
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+from modelscope_agent.environment.graph_database.ast_search.parsed_store import \
+    summarize_source
+
+INDEXER_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'indexer')
+
+# Per-process state of an indexing worker, filled by `_init_worker`.
+_worker_state = {}
+
+
+def _init_worker(root_path, task_id, env_path_dict, batch_size):
+    """
+    Pool initializer: import the indexer modules once and keep one jedi
+    IndexingSession, one AstVisitorClient and one graph connection alive for
+    every file this worker processes.
+    """
+    # The indexer modules use flat imports, exactly like run_index_single.py.
+    if INDEXER_DIR not in sys.path:
+        sys.path.insert(0, INDEXER_DIR)
+    try:
+        import my_client
+        import shallow_indexer
+        from my_graph_db import GraphDatabaseHandler
+
+        working_directory = env_path_dict.get('working_directory') \
+            or INDEXER_DIR
+        graph_db = GraphDatabaseHandler(
+            uri=env_path_dict['url'],
+            user=env_path_dict['user'],
+            password=env_path_dict['password'],
+            database_name=env_path_dict['db_name'],
+            task_id=task_id,
+            use_lock=True,
+            lockfile=os.path.join(working_directory, 'neo4j.lock'),
+            bulk_write=True,
+            batch_size=batch_size,
+        )
+        client = my_client.AstVisitorClient(graph_db, task_root_path=root_path)
+        session = shallow_indexer.IndexingSession(
+            env_path_dict.get('env_path') or None, working_directory, False)
+        _worker_state.update(
+            graph_db=graph_db,
+            client=client,
+            session=session,
+            root_path=root_path,
+        )
+    except Exception:
+        # An exception escaping the initializer makes the pool respawn the
+        # worker forever, so remember it and fail every task instead.
+        _worker_state['init_error'] = traceback.format_exc()
+
+
+def _index_file(file_path):
+    """
+    Index one file. Returns the path, the traceback of a failure (or None)
+    and the file's import/class summary for the `ParsedFileStore`, computed
+    here from the source the indexer already read.
+    """
+    if 'init_error' in _worker_state:
+        return file_path, _worker_state['init_error'], None
+    client = _worker_state['client']
+    try:
+        client.reset_file_state()
+        try:
+            source = _worker_state['session'].indexFile(
+                file_path, client, _worker_state['root_path'])
+        finally:
+            # Like the unbuffered writes, keep what a failing file recorded.
+            _worker_state['graph_db'].flush()
+        summary = summarize_source(file_path, source,
+                                   _worker_state['root_path'])
+        return file_path, None, summary
+    except Exception:
+        return file_path, traceback.format_exc(), None
+
+
+class ParallelIndexer:
+    """
+    Shallow-index many files with a pool of long-lived worker processes.
+
+    Each worker is started once and then pulls files from the pool's shared
+    task queue, which avoids starting a fresh interpreter (and re-probing the
+    jedi environment, re-opening the Neo4j connection) for every file.
+
+    Args:
+        root_path: Root directory of the repository being indexed.
+        task_id: Task label the nodes are written under.
+        env_path_dict: Same settings dict `build_graph_database` receives
+            (env_path, working_directory, url, user, password, db_name).
+        max_workers: Number of worker processes, defaults to the CPU count.
+        batch_size: Rows per UNWIND statement when a worker flushes the
+            nodes and edges buffered for one file.
+        mp_context: multiprocessing start method. `spawn` is the default so
+            that workers never inherit open Bolt sockets or UI threads.
+    """
+
+    def __init__(self,
+                 root_path,
+                 task_id,
+                 env_path_dict,
+                 max_workers=None,
+                 batch_size=1000,
+                 mp_context='spawn'):
+        self.root_path = root_path
+        self.task_id = task_id
+        self.env_path_dict = env_path_dict
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.mp_context = mp_context
+        self._pool = None
+
+    def _create_pool(self, processes):
+        context = multiprocessing.get_context(self.mp_context)
+        return context.Pool(
+            processes=processes,
+            initializer=_init_worker,
+            initargs=(self.root_path, self.task_id, self.env_path_dict,
+                      self.batch_size))
+
+    def open(self):
+        """
+        Start the workers now and keep them across `run` calls, until
+        `close`. Without it every `run` starts and stops its own pool.
+        """
+        if self._pool is None:
+            self._pool = self._create_pool(self.max_workers)
+        return self
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def run(self, file_list, update_progress_bar=None, store=None):
+        """
+        Index `file_list` and return a dict mapping failed files to their
+        traceback. `update_progress_bar(progress, throughput=files_per_s)` is
+        called after every finished file. The summaries of the indexed files
+        are put into `store` (a `ParsedFileStore`) when given.
+        """
+        total_files = len(file_list)
+        failed = {}
+        if not total_files:
+            return failed
+
+        start_time = time.time()
+        pool = self._pool or self._create_pool(
+            min(self.max_workers, total_files))
+        try:
+            results = pool.imap_unordered(_index_file, file_list)
+            for i, (file_path, error, summary) in enumerate(results):
+                if error:
+                    failed[file_path] = error
+                    print('{} generated an exception: {}'.format(
+                        file_path, error))
+                elif store is not None:
+                    store.put(file_path, summary)
+                if update_progress_bar:
+                    elapsed = max(time.time() - start_time, 1e-6)
+                    update_progress_bar((i + 1) / total_files,
+                                        throughput=(i + 1) / elapsed)
+        finally:
+            if pool is not self._pool:
+                pool.terminate()
+        return failed
@@ -0,0 +1,130 @@
+import random
+from contextlib import closing, nullcontext
+
+
+class QueryBudget:
+    """
+    Limits on how much of a query result is rendered and returned.
+
+    Rows are rendered until `max_rows` rows or `max_bytes` bytes (utf-8 size
+    of the rendered rows) are reached. The rest of the stream is then only
+    counted, up to `max_scan_rows` rows in total, while `sample_rows` of
+    these skipped rows are kept by reservoir sampling and shown truncated to
+    `sample_chars` characters.
+
+    Args:
+        max_rows: Maximum number of rendered rows.
+        max_bytes: Maximum total size of the rendered rows.
+        max_scan_rows: Rows read from the stream before it is abandoned,
+            None to count the whole result.
+        sample_rows: Number of sampled rows of the skipped tail.
+        sample_chars: Length the sampled rows are truncated to.
+    """
+
+    def __init__(self,
+                 max_rows=100,
+                 max_bytes=32 * 1024,
+                 max_scan_rows=10000,
+                 sample_rows=3,
+                 sample_chars=200):
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_scan_rows = max_scan_rows
+        self.sample_rows = sample_rows
+        self.sample_chars = sample_chars
+
+
+class BudgetedResult:
+    """
+    Rendered head of a query result and a summary of the rows left out.
+
+    Attributes:
+        rows: Rendered rows within the budget.
+        size: utf-8 size of `rows`.
+        skipped: Number of rows read but not rendered.
+        complete: False when the stream was abandoned at `max_scan_rows`, so
+            that `skipped` is a lower bound.
+        samples: Truncated renderings of sampled skipped rows.
+    """
+
+    def __init__(self):
+        self.rows = []
+        self.size = 0
+        self.skipped = 0
+        self.complete = True
+        self.samples = []
+
+    @property
+    def truncated(self):
+        return bool(self.skipped) or not self.complete
+
+    def __len__(self):
+        return len(self.rows)
+
+    def format(self, separator='\n\n'):
+        text = separator.join(self.rows)
+        if not self.truncated:
+            return text
+        count = str(self.skipped) if self.complete else 'at least {}'.format(
+            self.skipped)
+        tail = ['... {} more rows not shown (result budget reached).'.format(
+            count)]
+        if self.samples:
+            tail.append('Sampled rows of the remainder:')
+            tail.extend(self.samples)
+        return separator.join([text, '\n'.join(tail)] if text else tail)
+
+
+def _truncate(text, max_chars):
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars] + '...(truncated)'
+
+
+def consume_records(records, budget=None, render=str):
+    """
+    Read `records` (any iterable, typically `GraphDatabaseHandler.
+    stream_query`) within `budget` and return a `BudgetedResult`. Only the
+    rows inside the budget and the sampled ones are passed to `render`. The
+    iterable is closed as soon as reading stops, which for a streamed query
+    discards the rest of the result on the server.
+    """
+    budget = budget or QueryBudget()
+    result = BudgetedResult()
+    sampler = random.Random(0)
+    sampled = []
+    read = 0
+    iterator = iter(records)
+    with closing(iterator) if hasattr(iterator, 'close') else nullcontext():
+        for record in iterator:
+            read += 1
+            if not result.skipped and len(result.rows) < budget.max_rows:
+                row = render(record)
+                size = len(row.encode('utf-8'))
+                if result.size + size <= budget.max_bytes:
+                    result.rows.append(row)
+                    result.size += size
+                    continue
+                if not result.rows:
+                    # Always return something of the first row.
+                    row = row.encode('utf-8')[:budget.max_bytes].decode(
+                        'utf-8', 'ignore')
+                    result.rows.append(row + '...(truncated)')
+                    result.size += len(row.encode('utf-8'))
+                    continue
+            result.skipped += 1
+            if len(sampled) < budget.sample_rows:
+                sampled.append(record)
+            else:
+                i = sampler.randrange(result.skipped)
+                if i < budget.sample_rows:
+                    sampled[i] = record
+            if budget.max_scan_rows is not None \
+                    and read >= budget.max_scan_rows:
+                result.complete = next(iterator, None) is None
+                break
+    result.samples = [
+        _truncate(render(record), budget.sample_chars) for record in sampled
+    ]
+    return result
+
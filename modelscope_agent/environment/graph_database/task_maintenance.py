@@ -0,0 +1,227 @@
+import os
+import shutil
+import threading
+import time
+
+from modelscope_agent.environment.graph_database.incremental import \
+    TaskManifest
+
+# Node recording one snapshot of a task, see `TaskSnapshots`.
+SNAPSHOT_LABEL = 'CODEXGRAPH_SNAPSHOT'
+
+RELABEL_QUERY_TEMPLATE = """
+MATCH (n:`{source}`)
+WHERE NOT n:`{target}`
+WITH n LIMIT $limit
+SET n:`{target}`
+RETURN count(n) AS relabeled
+"""
+
+
+def snapshot_label(task_id, name):
+    return '{}@{}'.format(task_id, name)
+
+
+class TaskDeletionJob:
+    """
+    A task being cleared by a background thread. `progress()` is the done
+    fraction, `wait()` blocks until the task is gone and re-raises the error
+    that stopped the deletion, if any.
+    """
+
+    def __init__(self, graph_db, task_id, batch_size):
+        self.graph_db = graph_db
+        self.task_id = task_id
+        self.batch_size = batch_size
+        self.total = graph_db.count_task_nodes(task_id)
+        self.fraction = 0.0
+        self.processed = 0
+        self.error = None
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        self._done = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run,
+            name='codexgraph-clear-{}'.format(task_id),
+            daemon=True)
+
+    def _update(self, fraction):
+        self.fraction = fraction
+
+    def _run(self):
+        try:
+            self.processed = self.graph_db.clear_task_data(
+                self.task_id,
+                batch_size=self.batch_size,
+                update_progress_bar=self._update)
+            self.fraction = 1.0
+        except Exception as e:
+            self.error = e
+        finally:
+            self.finished_at = time.monotonic()
+            self._done.set()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def progress(self):
+        return self.fraction
+
+    def wait(self, timeout=None):
+        if not self._done.wait(timeout):
+            return False
+        if self.error is not None:
+            raise self.error
+        return True
+
+
+class TaskDeleter:
+    """
+    Clear tasks from the graph in transactions of `batch_size` nodes, either
+    at once (`delete`) or on a background thread (`start`).
+
+    Args:
+        graph_db: The `GraphDatabaseHandler` of the graph.
+        batch_size: Nodes processed per transaction.
+        update_progress_bar: Optional callback of `delete` receiving the done
+            fraction after every batch.
+    """
+
+    def __init__(self, graph_db, batch_size=10000, update_progress_bar=None):
+        self.graph_db = graph_db
+        self.batch_size = batch_size
+        self.update_progress_bar = update_progress_bar
+
+    def delete(self, task_id):
+        """
+        Clear the task, returns the number of processed nodes.
+        """
+        return self.graph_db.clear_task_data(
+            task_id,
+            batch_size=self.batch_size,
+            update_progress_bar=self.update_progress_bar)
+
+    def start(self, task_id):
+        """
+        Clear the task on a background thread, returns its `TaskDeletionJob`.
+        """
+        return TaskDeletionJob(self.graph_db, task_id,
+                               self.batch_size).start()
+
+    def collect_garbage(self):
+        """
+        Delete the nodes no task refers to any more.
+        """
+        return self.graph_db.collect_garbage(batch_size=self.batch_size)
+
+
+class TaskSnapshots:
+    """
+    Copy-on-write snapshots of a task graph, so switching back to a branch
+    does not rebuild it. A snapshot adds the label `<task>@<name>` to every
+    node of the task and copies its manifest; the nodes stay shared until the
+    task rewrites them. Incremental updates and clears only strip the task
+    label from a shared node before writing a new one, so the snapshot keeps
+    the old version. Restoring clears the task and labels the snapshot's
+    nodes with the task again.
+
+    Edges added later between two nodes still shared with the snapshot are
+    visible from the snapshot as well.
+
+    Args:
+        graph_db: The `GraphDatabaseHandler` of the graph.
+        manifest_dir: Directory of the task manifests, see `TaskManifest`.
+        batch_size: Nodes relabeled or cleared per transaction.
+    """
+
+    def __init__(self, graph_db, manifest_dir=None, batch_size=10000):
+        self.graph_db = graph_db
+        self.manifest_dir = manifest_dir
+        self.batch_size = batch_size
+
+    def _manifest_path(self, label):
+        return TaskManifest(label, '', manifest_dir=self.manifest_dir).path
+
+    def _copy_manifest(self, source, target):
+        source_path = self._manifest_path(source)
+        target_path = self._manifest_path(target)
+        if os.path.exists(source_path):
+            shutil.copyfile(source_path, target_path)
+        elif os.path.exists(target_path):
+            os.remove(target_path)
+
+    def _relabel(self, source, target):
+        query = RELABEL_QUERY_TEMPLATE.format(source=source, target=target)
+        relabeled = 0
+        while True:
+            count = self.graph_db.graph.run(
+                query, limit=self.batch_size).evaluate() or 0
+            relabeled += count
+            if count < self.batch_size:
+                return relabeled
+
+    def snapshot(self, task_id, name):
+        """
+        Snapshot the current graph of the task, replacing an older snapshot
+        of the same name. Returns the number of nodes in the snapshot.
+        """
+        label = snapshot_label(task_id, name)
+        with self.graph_db.task_lock(task_id):
+            self.graph_db.clear_task_data(label, batch_size=self.batch_size)
+            count = self._relabel(task_id, label)
+            self._copy_manifest(task_id, label)
+            self.graph_db.graph.run(
+                'MERGE (s:{0} {{task_id: $task_id, name: $name}}) '
+                'SET s.label = $label, s.node_count = $count, '
+                's.created_at = $created_at'.format(SNAPSHOT_LABEL),
+                task_id=task_id,
+                name=name,
+                label=label,
+                count=count,
+                created_at=time.time())
+        return count
+
+    def restore(self, task_id, name):
+        """
+        Make the snapshot the current graph of the task. Returns the number
+        of nodes restored.
+        """
+        label = snapshot_label(task_id, name)
+        if name not in self.list(task_id):
+            raise KeyError('No snapshot {!r} of task {!r}'.format(
+                name, task_id))
+        with self.graph_db.task_lock(task_id):
+            self.graph_db.clear_task_data(task_id, batch_size=self.batch_size)
+            count = self._relabel(label, task_id)
+            self._copy_manifest(label, task_id)
+            self.graph_db.bump_graph_version(task_id)
+        return count
+
+    def delete_snapshot(self, task_id, name):
+        label = snapshot_label(task_id, name)
+        with self.graph_db.task_lock(task_id):
+            self.graph_db.clear_task_data(label, batch_size=self.batch_size)
+            self.graph_db.graph.run(
+                'MATCH (s:{0} {{task_id: $task_id, name: $name}}) '
+                'DELETE s'.format(SNAPSHOT_LABEL),
+                task_id=task_id,
+                name=name)
+        manifest_path = self._manifest_path(label)
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+
+    def list(self, task_id):
+        """
+        Names of the snapshots of the task, oldest first.
+        """
+        records = self.graph_db.graph.run(
+            'MATCH (s:{0} {{task_id: $task_id}}) '
+            'RETURN s.name AS name ORDER BY s.created_at'.format(
+                SNAPSHOT_LABEL),
+            task_id=task_id).data()
+        return [record['name'] for record in records]
@@ -0,0 +1,379 @@
+import argparse
+import os
+import threading
+import time
+
+from modelscope_agent.environment.graph_database import GraphDatabaseHandler
+from modelscope_agent.environment.graph_database.build import (
+    build_graph_database, get_py_files)
+from modelscope_agent.environment.graph_database.description_pipeline import \
+    DescriptionPipeline
+from modelscope_agent.environment.graph_database.incremental import \
+    IncrementalIndexer
+from modelscope_agent.environment.graph_database.parallel_indexer import \
+    ParallelIndexer
+
+
+class PollingBackend:
+    """
+    Detect changed `.py` files by comparing (mtime, size) snapshots of the
+    repository every `interval` seconds.
+    """
+
+    def __init__(self, repo_path, notify, interval=1.0):
+        self.repo_path = repo_path
+        self.notify = notify
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _snapshot(self):
+        snapshot = {}
+        for file_path in get_py_files(self.repo_path):
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            snapshot[file_path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def _loop(self):
+        previous = self._snapshot()
+        while not self._stop_event.wait(self.interval):
+            current = self._snapshot()
+            for file_path in set(previous) | set(current):
+                if previous.get(file_path) != current.get(file_path):
+                    self.notify(file_path)
+            previous = current
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._loop, name='codexgraph-poll', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+
+
+class WatchdogBackend:
+    """
+    Filesystem notifications through the optional `watchdog` package.
+    """
+
+    def __init__(self, repo_path, notify):
+        from watchdog.events import FileSystemEventHandler
+        from watchdog.observers import Observer
+
+        class _Handler(FileSystemEventHandler):
+
+            def on_any_event(self, event):
+                if event.is_directory:
+                    return
+                for path in (event.src_path,
+                             getattr(event, 'dest_path', '')):
+                    if path:
+                        notify(path)
+
+        self.observer = Observer()
+        self.observer.schedule(_Handler(), repo_path, recursive=True)
+
+    def start(self):
+        self.observer.start()
+
+    def stop(self):
+        self.observer.stop()
+        self.observer.join()
+
+
+class GraphWatcher:
+    """
+    Keep the code graph of a task in sync with the repository on disk.
+
+    File events are collected from a watchdog or polling backend, a burst of
+    writes is debounced until the repository was quiet for `debounce`
+    seconds (at most `max_delay` seconds after the first pending event), and
+    the batch is applied in the background with `IncrementalIndexer` using a
+    pool of indexing workers that stays alive while the watcher runs.
+
+    `metrics()` reports how far behind the graph is: the number of pending
+    files (queue depth) and the age of the oldest change not yet applied
+    (lag).
+
+    With `generate_descriptions=True` the FUNCTION/METHOD nodes of the
+    changed and added files are described by a `DescriptionPipeline`
+    after every batch, as `build_graph_database` does after a build.
+
+    Args:
+        graph_db: Handler of the task graph.
+        repo_path: Root of the watched repository.
+        task_id: Task label.
+        env_path_dict: Indexer settings, see `build_graph_database`.
+        max_workers: Number of indexing worker processes.
+        debounce: Seconds without new events before a batch is applied.
+        max_delay: Upper bound for delaying a pending change.
+        backend: 'watchdog', 'polling' or 'auto' (watchdog when installed).
+        poll_interval: Scan interval of the polling backend.
+        manifest_dir: Directory of the incremental-indexing manifests.
+        generate_descriptions: Describe new and changed methods.
+        description_options: Keyword arguments of the DescriptionPipeline.
+    """
+
+    def __init__(self,
+                 graph_db: GraphDatabaseHandler,
+                 repo_path: str,
+                 task_id: str,
+                 env_path_dict=None,
+                 max_workers=None,
+                 debounce=1.0,
+                 max_delay=10.0,
+                 backend='auto',
+                 poll_interval=1.0,
+                 manifest_dir=None,
+                 generate_descriptions=True,
+                 description_options=None):
+        self.graph_db = graph_db
+        self.repo_path = repo_path
+        self.task_id = task_id
+        self.env_path_dict = env_path_dict
+        self.max_workers = max_workers
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.backend_name = backend
+        self.poll_interval = poll_interval
+        self.manifest_dir = manifest_dir
+        self.generate_descriptions = generate_descriptions
+        self.description_options = description_options
+
+        self.indexer = ParallelIndexer(
+            repo_path, task_id, env_path_dict, max_workers=max_workers)
+        self.updater = IncrementalIndexer(
+            graph_db,
+            repo_path,
+            task_id,
+            lambda files, callback=None: self.indexer.run(files, callback),
+            manifest_dir=manifest_dir)
+
+        self._cond = threading.Condition()
+        self._pending = {}  # file path -> time of its first pending event
+        self._last_event = 0.0
+        self._in_flight_since = None
+        self._in_flight = 0
+        self._stopping = False
+        self._thread = None
+        self._backend = None
+
+        self.updates_applied = 0
+        self.files_applied = 0
+        self.errors = 0
+        self.last_error = ''
+        self.last_update_seconds = 0.0
+        self.last_update_time = None
+
+    def _create_backend(self):
+        if self.backend_name in ('auto', 'watchdog'):
+            try:
+                return WatchdogBackend(self.repo_path, self.notify)
+            except ImportError:
+                if self.backend_name == 'watchdog':
+                    raise
+        return PollingBackend(
+            self.repo_path, self.notify, interval=self.poll_interval)
+
+    def notify(self, file_path):
+        """
+        Record that `file_path` changed. Non-Python files are ignored.
+        """
+        if not file_path.endswith('.py'):
+            return
+        now = time.time()
+        with self._cond:
+            self._pending.setdefault(file_path, now)
+            self._last_event = now
+            self._cond.notify_all()
+
+    def _take_batch(self):
+        with self._cond:
+            while not self._stopping:
+                if self._pending:
+                    now = time.time()
+                    quiet = now - self._last_event
+                    oldest = min(self._pending.values())
+                    if quiet >= self.debounce or now - oldest >= self.max_delay:
+                        batch = self._pending
+                        self._pending = {}
+                        self._in_flight_since = oldest
+                        self._in_flight = len(batch)
+                        return list(batch)
+                    self._cond.wait(self.debounce - quiet)
+                else:
+                    self._cond.wait()
+            return []
+
+    def _apply(self, batch):
+        start_time = time.time()
+        try:
+            summary = self.updater.run(
+                get_py_files(self.repo_path), candidates=sorted(batch))
+            if self.generate_descriptions:
+                self._describe(summary['changed'] + summary['added'])
+            self.updates_applied += 1
+            self.files_applied += len(batch)
+        except Exception as e:
+            self.errors += 1
+            self.last_error = str(e)
+            print(f'Failed to apply changes of {len(batch)} files: {e}')
+        finally:
+            self.last_update_seconds = time.time() - start_time
+            self.last_update_time = time.time()
+            with self._cond:
+                self._in_flight_since = None
+                self._in_flight = 0
+
+    def _describe(self, files):
+        full_names = self.updater.manifest_nodes(files)
+        if full_names:
+            DescriptionPipeline(self.graph_db, self.task_id,
+                                **(self.description_options
+                                   or {})).run(full_names=full_names)
+
+    def _loop(self):
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                return
+            self._apply(batch)
+
+    def metrics(self):
+        """
+        Queue depth, lag and counters of the watcher.
+        """
+        with self._cond:
+            started = list(self._pending.values())
+            if self._in_flight_since is not None:
+                started.append(self._in_flight_since)
+            lag = time.time() - min(started) if started else 0.0
+            return {
+                'queue_depth': len(self._pending),
+                'in_flight': self._in_flight,
+                'lag_seconds': lag,
+                'updates_applied': self.updates_applied,
+                'files_applied': self.files_applied,
+                'errors': self.errors,
+                'last_error': self.last_error,
+                'last_update_seconds': self.last_update_seconds,
+                'last_update_time': self.last_update_time,
+            }
+
+    def start(self):
+        """
+        Build the graph if it has no usable manifest yet, then start watching.
+        """
+        # Watch before the initial build so no write made meanwhile is lost.
+        self._backend = self._create_backend()
+        self._backend.start()
+        if not self.updater.can_update():
+            build_graph_database(
+                self.graph_db,
+                self.repo_path,
+                self.task_id,
+                max_workers=self.max_workers,
+                env_path_dict=self.env_path_dict,
+                incremental=True,
+                manifest_dir=self.manifest_dir,
+                generate_descriptions=self.generate_descriptions,
+                description_options=self.description_options)
+            self.updater.manifest.load()
+        self.indexer.open()
+        self._stopping = False
+        self._thread = threading.Thread(
+            target=self._loop, name='codexgraph-watch', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._backend:
+            self._backend.stop()
+            self._backend = None
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.indexer.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+def run():
+    parser = argparse.ArgumentParser(
+        description='Keep the CodexGraph code graph of a repository live.')
+    parser.add_argument('--repo_path', type=str, required=True)
+    parser.add_argument('--task_id', type=str, required=True)
+    parser.add_argument('--url', type=str, default='bolt://localhost:7687')
+    parser.add_argument('--user', type=str, default='neo4j')
+    parser.add_argument('--password', type=str, default='')
+    parser.add_argument('--db_name', type=str, default='neo4j')
+    parser.add_argument('--env', type=str, default='')
+    parser.add_argument('--max_workers', type=int, default=None)
+    parser.add_argument('--debounce', type=float, default=1.0)
+    parser.add_argument(
+        '--backend',
+        type=str,
+        default='auto',
+        choices=['auto', 'watchdog', 'polling'])
+    parser.add_argument(
+        '--metrics_interval',
+        type=float,
+        default=10.0,
+        help='seconds between metrics lines, 0 to disable')
+    args = parser.parse_args()
+
+    graph_db = GraphDatabaseHandler(
+        uri=args.url,
+        user=args.user,
+        password=args.password,
+        database_name=args.db_name,
+        task_id=args.task_id,
+        use_lock=True,
+    )
+    env_path_dict = {
+        'env_path':
+        args.env,
+        'working_directory':
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'indexer'),
+        'url':
+        args.url,
+        'user':
+        args.user,
+        'password':
+        args.password,
+        'db_name':
+        args.db_name,
+    }
+    watcher = GraphWatcher(
+        graph_db,
+        args.repo_path,
+        args.task_id,
+        env_path_dict=env_path_dict,
+        max_workers=args.max_workers,
+        debounce=args.debounce,
+        backend=args.backend)
+    with watcher:
+        try:
+            while True:
+                time.sleep(args.metrics_interval or 3600)
+                if args.metrics_interval:
+                    print(watcher.metrics())
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    run()
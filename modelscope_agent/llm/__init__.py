@@ -1,31 +1,71 @@
+import os
 import re
+from typing import Optional, Union
 
 from .base import LLM_REGISTRY, BaseChatModel
 from .dashscope import DashScopeLLM, QwenChatAtDS
 from .modelscope import ModelScopeChatGLM, ModelScopeLLM
 from .ollama import OllamaLLM
 from .openai import OpenAi
+from .utils.client_pool import get_llm_client_pool
+from .utils.response_cache import (ResponseCache, enable_response_cache,
+                                   get_response_cache)
 from .vllm import VllmLLM
 from .zhipu import ZhipuLLM
 
 
-def get_chat_model(model: str, model_server: str, **kwargs) -> BaseChatModel:
+def get_chat_model(model: str,
+                   model_server: str,
+                   response_cache: Union[bool, str, ResponseCache] = None,
+                   **kwargs) -> BaseChatModel:
     """
     model: the model name: such as qwen-max, gpt-4 ...
     model_server: the source of model, such as dashscope, openai, modelscope ...
+    response_cache: serve repeated calls from a response cache: True for
+        the default on-disk cache, a path, or a ResponseCache
     **kwargs: more parameters, such as api_key, api_base
     """
     model_type = re.split(r'[-/_]', model)[0]  # parser qwen / gpt / ...
     registered_model_id = f'{model_server}_{model_type}'
     if registered_model_id in LLM_REGISTRY:  # specific model from specific source
-        return LLM_REGISTRY[registered_model_id](model, model_server, **kwargs)
+        llm = LLM_REGISTRY[registered_model_id](model, model_server, **kwargs)
     elif model_server in LLM_REGISTRY:  # specific source
-        return LLM_REGISTRY[model_server](model, model_server, **kwargs)
+        llm = LLM_REGISTRY[model_server](model, model_server, **kwargs)
     else:
         raise NotImplementedError
+    if response_cache:
+        if response_cache is True:
+            response_cache = get_response_cache()
+        elif isinstance(response_cache, str):
+            response_cache = get_response_cache(response_cache)
+        enable_response_cache(llm, response_cache)
+    return llm
+
+
+def get_llm_client(model_server: str,
+                   api_key: Optional[str] = None,
+                   base_url: Optional[str] = None,
+                   asynchronous: bool = False):
+    """
+    The shared SDK client of an OpenAI-compatible endpoint, created on first
+    use and reused by every agent and request of the process.
+
+    model_server: the source of model, such as openai, vllm-server ...
+    api_key: defaults to OPENAI_API_KEY
+    base_url: defaults to OPENAI_API_BASE or the OpenAI API
+    asynchronous: return an AsyncOpenAI client bound to the running loop
+    """
+    api_key = (api_key or os.getenv('OPENAI_API_KEY', 'EMPTY')).strip()
+    base_url = (base_url or os.getenv('OPENAI_API_BASE',
+                                      'https://api.openai.com/v1')).strip()
+    pool = get_llm_client_pool()
+    if asynchronous:
+        return pool.async_openai(api_key, base_url, model_server=model_server)
+    return pool.openai(api_key, base_url, model_server=model_server)
 
 
 __all__ = [
     'LLM_REGISTRY', 'BaseChatModel', 'OpenAi', 'DashScopeLLM', 'QwenChatAtDS',
-    'ModelScopeLLM', 'ModelScopeChatGLM', 'ZhipuLLM', 'OllamaLLM', 'VllmLLM'
+    'ModelScopeLLM', 'ModelScopeChatGLM', 'ZhipuLLM', 'OllamaLLM', 'VllmLLM',
+    'get_llm_client', 'get_llm_client_pool', 'ResponseCache'
 ]
@@ -1,9 +1,16 @@
 from abc import ABC, abstractmethod
 from functools import wraps
-from typing import Dict, Iterator, List, Optional, Union
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Union
 
 from modelscope_agent.callbacks import BaseCallback
+from modelscope_agent.llm.utils.capabilities import (CAPABILITY_FAILURE_TTL,
+                                                     FUNCTION_CALLING,
+                                                     RAW_PROMPT,
+                                                     get_capability_registry)
 from modelscope_agent.llm.utils.llm_templates import get_model_stop_words
+from modelscope_agent.utils.async_utils import (gather_with_concurrency,
+                                                iterate_in_thread,
+                                                run_in_thread)
 from modelscope_agent.utils.retry import retry
 from modelscope_agent.utils.tokenization_utils import count_tokens
 from modelscope_agent.utils.utils import print_traceback
@@ -55,6 +62,45 @@ def enable_no_stream_callback(model, rsp, callbacks):
     return rsp
 
 
+def enable_llm_async_callback(func):
+
+    @wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        callbacks = kwargs.pop('callbacks', None)
+        if callbacks:
+            callbacks.on_llm_start(*args, **kwargs)
+        response = await func(self, *args, **kwargs)
+        if callbacks:
+            callbacks.on_llm_end(self.model, response, stream=False)
+        return response
+
+    return wrapper
+
+
+def enable_llm_async_stream_callback(func):
+
+    @wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        callbacks = kwargs.pop('callbacks', None)
+        if callbacks:
+            callbacks.on_llm_start(*args, **kwargs)
+        async for chunk in func(self, *args, **kwargs):
+            if callbacks:
+                callbacks.on_llm_new_token(self.model, chunk)
+            yield chunk
+        if callbacks:
+            callbacks.on_llm_end(self.model, '', stream=True)
+
+    return wrapper
+
+
+def llm_retry_key(llm, *args, **kwargs):
+    """
+    Circuit breaker of a chat call: one per model endpoint.
+    """
+    return llm.capability_key()
+
+
 class FnCallNotImplError(NotImplementedError):
     pass
 
@@ -78,8 +124,10 @@ class BaseChatModel(ABC):
                  model_server: str,
                  support_fn_call: bool = None):
         self._support_fn_call: Optional[bool] = support_fn_call
+        self._support_raw_prompt: Optional[bool] = None
         self.model = model
         self.model_server = model_server
+        self.api_base = None
         self.max_length = 6000
 
         self.last_call_usage_info = {}
@@ -92,7 +140,7 @@ class BaseChatModel(ABC):
     #   yield response
     # ```
 
-    @retry(max_retries=3, delay_seconds=0.5)
+    @retry(max_retries=3, delay_seconds=0.5, breaker_key=llm_retry_key)
     @enable_llm_callback
     def chat(self,
              prompt: Optional[str] = None,
@@ -124,7 +172,7 @@ class BaseChatModel(ABC):
         else:
             return self._chat_no_stream(messages, stop=stop, **kwargs)
 
-    @retry(max_retries=3, delay_seconds=0.5)
+    @retry(max_retries=3, delay_seconds=0.5, breaker_key=llm_retry_key)
     @enable_llm_callback
     def chat_with_functions(self,
                             messages: List[Dict],
@@ -183,6 +231,129 @@ class BaseChatModel(ABC):
         """
         raise TextCompleteNotImplError
 
+    # Async interfaces. Backends with an async client implement
+    # _achat_stream and _achat_no_stream and enable them in
+    # _use_native_async; the others run the sync interface on the event
+    # loop's executor so the loop is never blocked.
+
+    def _use_native_async(self) -> bool:
+        return False
+
+    @staticmethod
+    def _prompt_messages(prompt: Optional[str],
+                         messages: Optional[List[Dict]]) -> List[Dict]:
+        if not messages and prompt and isinstance(prompt, str):
+            messages = [{'role': 'user', 'content': prompt}]
+        assert messages, 'messages list must not be empty'
+        return messages
+
+    @enable_llm_async_callback
+    async def achat(self,
+                    prompt: Optional[str] = None,
+                    messages: Optional[List[Dict]] = None,
+                    stop: Optional[List[str]] = None,
+                    **kwargs) -> str:
+        """
+        Async chat interface, the non-streaming output of `chat`.
+        """
+        if not self._use_native_async():
+            return await run_in_thread(
+                self.chat,
+                prompt=prompt,
+                messages=messages,
+                stop=stop,
+                stream=False,
+                **kwargs)
+        messages = self._prompt_messages(prompt, messages)
+        return await self._achat_no_stream(messages, stop=stop, **kwargs)
+
+    @enable_llm_async_stream_callback
+    async def achat_stream(self,
+                           prompt: Optional[str] = None,
+                           messages: Optional[List[Dict]] = None,
+                           stop: Optional[List[str]] = None,
+                           **kwargs) -> AsyncIterator[str]:
+        """
+        Async chat interface, the streaming output of `chat`.
+        """
+        if not self._use_native_async():
+            response = await run_in_thread(
+                self.chat,
+                prompt=prompt,
+                messages=messages,
+                stop=stop,
+                stream=True,
+                **kwargs)
+            if isinstance(response, str):
+                yield response
+            else:
+                async for chunk in iterate_in_thread(response):
+                    yield chunk
+            return
+        messages = self._prompt_messages(prompt, messages)
+        async for chunk in self._achat_stream(messages, stop=stop, **kwargs):
+            yield chunk
+
+    async def achat_with_functions(self,
+                                   messages: List[Dict],
+                                   functions: Optional[List[Dict]] = None,
+                                   **kwargs):
+        """
+        Async function call interface, see `chat_with_functions`. A streaming
+        response is returned as an async iterator.
+        """
+        response = await run_in_thread(
+            self.chat_with_functions,
+            messages=messages,
+            functions=functions,
+            **kwargs)
+        if isinstance(response, Iterator):
+            return iterate_in_thread(response)
+        return response
+
+    async def abatch_chat(self,
+                          requests: List[Union[str, List[Dict]]],
+                          max_concurrency: int = 8,
+                          return_exceptions: bool = False,
+                          **kwargs) -> List:
+        """
+        Send prompts (str) or message lists concurrently through `achat`,
+        at most `max_concurrency` at a time.
+
+        Returns:
+            The responses in the order of `requests`; with return_exceptions
+            a failed request gives its exception instead of raising it.
+        """
+
+        def request_coroutine(request):
+            if isinstance(request, str):
+                return self.achat(prompt=request, **kwargs)
+            return self.achat(messages=request, **kwargs)
+
+        return await gather_with_concurrency(
+            [request_coroutine(request) for request in requests],
+            max_concurrency,
+            return_exceptions=return_exceptions)
+
+    async def _achat_stream(self,
+                            messages: List[Dict],
+                            stop: Optional[List[str]] = None,
+                            **kwargs) -> AsyncIterator[str]:
+        """
+        Native async streaming output interface.
+        """
+        raise NotImplementedError
+        yield
+
+    async def _achat_no_stream(self,
+                               messages: List[Dict],
+                               stop: Optional[List[str]] = None,
+                               **kwargs) -> str:
+        """
+        Native async non-streaming output interface.
+        """
+        raise NotImplementedError
+
     @abstractmethod
     def _chat_stream(self,
                      messages: List[Dict],
@@ -214,64 +385,84 @@ class BaseChatModel(ABC):
         """
         raise NotImplementedError
 
+    def capability_key(self) -> tuple:
+        """
+        The endpoint whose capabilities this instance shares with the others
+        in the capability registry.
+        """
+        return (self.model_server, self.model, self.api_base)
+
     def support_function_calling(self) -> bool:
         """
         Check if LLM supports function calls
         """
         if self._support_fn_call is None:
-            functions = [{
-                'name': 'get_current_weather',
-                'description': 'Get the current weather in a given location.',
-                'parameters': {
-                    'type': 'object',
-                    'properties': {
-                        'location': {
-                            'type':
-                            'string',
-                            'description':
-                            'The city and state, e.g. San Francisco, CA',
-                        },
-                        'unit': {
-                            'type': 'string',
-                            'enum': ['celsius', 'fahrenheit'],
-                        },
+            self._support_fn_call = get_capability_registry().resolve(
+                self.capability_key(), FUNCTION_CALLING,
+                self._probe_function_calling)
+        return self._support_fn_call
+
+    def _probe_function_calling(self):
+        functions = [{
+            'name': 'get_current_weather',
+            'description': 'Get the current weather in a given location.',
+            'parameters': {
+                'type': 'object',
+                'properties': {
+                    'location': {
+                        'type': 'string',
+                        'description':
+                        'The city and state, e.g. San Francisco, CA',
+                    },
+                    'unit': {
+                        'type': 'string',
+                        'enum': ['celsius', 'fahrenheit'],
                     },
-                    'required': ['location'],
                 },
-            }]
-            messages = [{
-                'role': 'user',
-                'content': 'What is the weather like in Boston?'
-            }]
-            self._support_fn_call = False
-            try:
-                response = self.chat_with_functions(
-                    messages=messages, functions=functions)
-                if response.get('function_call', None):
-                    # logger.info('Support of function calling is detected.')
-                    self._support_fn_call = True
-                if response.get('tool_calls', None):
-                    # logger.info('Support of function calling is detected.')
-                    self._support_fn_call = True
-            except FnCallNotImplError:
-                pass
-            except AttributeError:
-                pass
-            except Exception:  # TODO: more specific
-                print_traceback()
-        return self._support_fn_call
+                'required': ['location'],
+            },
+        }]
+        messages = [{
+            'role': 'user',
+            'content': 'What is the weather like in Boston?'
+        }]
+        try:
+            response = self.chat_with_functions(
+                messages=messages, functions=functions)
+            if response.get('function_call', None) or response.get(
+                    'tool_calls', None):
+                # logger.info('Support of function calling is detected.')
+                return True, None
+        except FnCallNotImplError:
+            pass
+        except AttributeError:
+            pass
+        except Exception:  # TODO: more specific
+            print_traceback()
+            return False, CAPABILITY_FAILURE_TTL
+        return False, None
 
     def support_raw_prompt(self) -> bool:
         """
         Check if LLM supports text completion.
         """
+        if self._support_raw_prompt is None:
+            self._support_raw_prompt = get_capability_registry().resolve(
+                self.capability_key(), RAW_PROMPT, self._probe_raw_prompt)
+        return self._support_raw_prompt
+
+    def _probe_raw_prompt(self):
+        # Without an own chat_with_raw_prompt the answer needs no request.
+        if (type(self).chat_with_raw_prompt is
+                BaseChatModel.chat_with_raw_prompt):
+            return False, None
         try:
             self.chat_with_raw_prompt(prompt='')
-            return True
+            return True, None
         except TextCompleteNotImplError:
-            return False
+            return False, None
         except Exception:
-            return False
+            return False, CAPABILITY_FAILURE_TTL
 
     def check_max_length(self, messages: Union[List[Dict], str]) -> bool:
         if isinstance(messages, str):
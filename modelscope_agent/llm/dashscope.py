@@ -1,26 +1,38 @@
 import os
 import re
 from http import HTTPStatus
-from typing import Dict, Iterator, List, Optional, Union
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Union
 
 import dashscope
 from modelscope_agent.utils.logger import agent_logger as logger
+from modelscope_agent.utils.retry import retry
 from modelscope_agent.utils.tokenization_utils import count_tokens
 
-from .base import BaseChatModel, register_llm
+from .base import BaseChatModel, llm_retry_key, register_llm
 
 
-def stream_output(response, **kwargs):
+class StreamOutput:
+    """
+    Turns the generation frames of a dashscope stream (each holding the full
+    text so far) into text increments. The last `delay_len` characters are
+    held back until the next frame, so a partial im_start/im_end marker is
+    never output.
+    """
+
     im_start = '<|im_start|>'
     im_end = '<|im_end|>'
-    last_len = 0
     delay_len = 5
-    in_delay = False
-    text = ''
-    for trunk in response:
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.last_len = 0
+        self.in_delay = False
+        self.text = ''
+
+    def feed(self, trunk) -> Optional[str]:
         if trunk.status_code == HTTPStatus.OK:
             # logging at the first frame for request_id, and the last frame for the whole output
-            if not text:
+            if not self.text:
                 logger.info(
                     f'call dashscope generation api success, '
                     f'request_id: { trunk.request_id}, output: { trunk.output}'
@@ -29,37 +41,59 @@ def stream_output(response, **kwargs):
                 text = trunk.output.choices[0].message.content
             except Exception:
                 text = trunk.output.text
-            text = text.split(im_end)[0].split(im_start)[0]
-            if (len(text) - last_len) <= delay_len:
-                in_delay = True
-                continue
-            else:
-                in_delay = False
-                real_text = text[:-delay_len]
-                now_rsp = real_text[last_len:]
-                yield now_rsp
-                last_len = len(real_text)
-        else:
-            logger.query_error(
-                uuid=kwargs.get('uuid_str', ''),
-                details={
-                    'dashscope.request_id': trunk.request_id,
-                    'dashscope.status_code': trunk.status_code,
-                    'dashscope.code': trunk.code,
-                    'dashscope.message': trunk.message
-                },
-                message='call dashscope generation api error')
-
-            err = '\nError code: %s. Error message: %s with request id %s' % (
-                trunk.code, trunk.message, trunk.request_id)
-            if trunk.code == 'DataInspectionFailed':
-                err += '\n错误码: 数据检查失败。错误信息: 输入数据可能包含不适当的内容。由于该不适当内容会一直存在历史对话中，后续的对话大概率仍会触发此错误。建议刷新重置页面。'
-            text = ''
-            yield f'{err}'
-    # with open('debug.json', 'w', encoding='utf-8') as writer:
-    #     writer.write(json.dumps(trunk, ensure_ascii=False))
-    if text and (in_delay or (last_len != len(text))):
-        yield text[last_len:]
+            self.text = text.split(self.im_end)[0].split(self.im_start)[0]
+            if (len(self.text) - self.last_len) <= self.delay_len:
+                self.in_delay = True
+                return None
+            self.in_delay = False
+            real_text = self.text[:-self.delay_len]
+            now_rsp = real_text[self.last_len:]
+            self.last_len = len(real_text)
+            return now_rsp
+        logger.query_error(
+            uuid=self.kwargs.get('uuid_str', ''),
+            details={
+                'dashscope.request_id': trunk.request_id,
+                'dashscope.status_code': trunk.status_code,
+                'dashscope.code': trunk.code,
+                'dashscope.message': trunk.message
+            },
+            message='call dashscope generation api error')
+
+        err = '\nError code: %s. Error message: %s with request id %s' % (
+            trunk.code, trunk.message, trunk.request_id)
+        if trunk.code == 'DataInspectionFailed':
+            err += '\n错误码: 数据检查失败。错误信息: 输入数据可能包含不适当的内容。由于该不适当内容会一直存在历史对话中，后续的对话大概率仍会触发此错误。建议刷新重置页面。'
+        self.text = ''
+        return f'{err}'
+
+    def finish(self) -> Optional[str]:
+        if self.text and (self.in_delay or
+                          (self.last_len != len(self.text))):
+            return self.text[self.last_len:]
+        return None
+
+
+def stream_output(response, **kwargs):
+    output = StreamOutput(**kwargs)
+    for trunk in response:
+        text = output.feed(trunk)
+        if text is not None:
+            yield text
+    text = output.finish()
+    if text is not None:
+        yield text
+
+
+async def astream_output(response, **kwargs):
+    output = StreamOutput(**kwargs)
+    async for trunk in response:
+        text = output.feed(trunk)
+        if text is not None:
+            yield text
+    text = output.finish()
+    if text is not None:
+        yield text
 
 
 @register_llm('dashscope')
@@ -81,6 +115,16 @@ class DashScopeLLM(BaseChatModel):
                      messages: List[Dict],
                      stop: Optional[List[str]] = None,
                      **kwargs) -> Iterator[str]:
+        generation_input = self._stream_generation_input(
+            messages, stop, **kwargs)
+        response = dashscope.Generation.call(**generation_input)
+        response = self.stat_last_call_token_info_stream(response)
+        return stream_output(response, **kwargs)
+
+    def _stream_generation_input(self,
+                                 messages: List[Dict],
+                                 stop: Optional[List[str]] = None,
+                                 **kwargs) -> Dict:
         stop = self._update_stop_word(stop)
         generation_input = {
             'model': self.model,
@@ -99,10 +143,7 @@ class DashScopeLLM(BaseChatModel):
             generation_input['temperature'] = kwargs.get('temperature')
         if kwargs.get('seed', None):
             generation_input['seed'] = kwargs.get('seed')
-
-        response = dashscope.Generation.call(**generation_input)
-        response = self.stat_last_call_token_info_stream(response)
-        return stream_output(response, **kwargs)
+        return generation_input
 
     def _chat_no_stream(self,
                         messages: List[Dict],
@@ -119,6 +160,9 @@ class DashScopeLLM(BaseChatModel):
             stop=[word for word in stop],
             top_p=top_p,
         )
+        return self._no_stream_output(response)
+
+    def _no_stream_output(self, response) -> str:
         if response.status_code == HTTPStatus.OK:
             self.stat_last_call_token_info_no_stream(response)
             return response.output.choices[0].message.content
@@ -129,6 +173,55 @@ class DashScopeLLM(BaseChatModel):
             )
             return err
 
+    def _use_native_async(self) -> bool:
+        # AioGeneration is missing from old dashscope releases.
+        return getattr(dashscope, 'AioGeneration', None) is not None
+
+    @retry(max_retries=3, delay_seconds=0.5, breaker_key=llm_retry_key)
+    async def _achat_stream(self,
+                            messages: List[Dict],
+                            stop: Optional[List[str]] = None,
+                            **kwargs) -> AsyncIterator[str]:
+        generation_input = self._stream_generation_input(
+            messages, stop, **kwargs)
+        response = await dashscope.AioGeneration.call(**generation_input)
+        async for text in astream_output(
+                self._astat_last_call_token_info_stream(response), **kwargs):
+            yield text
+
+    @retry(max_retries=3, delay_seconds=0.5, breaker_key=llm_retry_key)
+    async def _achat_no_stream(self,
+                               messages: List[Dict],
+                               stop: Optional[List[str]] = None,
+                               **kwargs) -> str:
+        stop = self._update_stop_word(stop)
+        top_p = kwargs.get('top_p', 0.8)
+
+        response = await dashscope.AioGeneration.call(
+            self.model,
+            messages=messages,  # noqa
+            result_format='message',
+            stream=False,
+            stop=[word for word in stop],
+            top_p=top_p,
+        )
+        return self._no_stream_output(response)
+
+    async def _astat_last_call_token_info_stream(self, response):
+        async for chunk in response:
+            usage = getattr(chunk, 'usage', None)
+            if usage:
+                self.last_call_usage_info = {
+                    'prompt_tokens':
+                    usage.input_tokens,
+                    'completion_tokens':
+                    usage.output_tokens,
+                    'total_tokens':
+                    usage.get('total_tokens')
+                    or usage.input_tokens + usage.output_tokens
+                }
+            yield chunk
+
     def stat_last_call_token_info_no_stream(self, response):
         try:
             if response.usage is not None:
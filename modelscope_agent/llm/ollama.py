@@ -3,7 +3,8 @@ from typing import Dict, Iterator, List, Optional, Union
 from modelscope_agent.utils.logger import agent_logger as logger
 from modelscope_agent.utils.retry import retry
 
-from .base import BaseChatModel, register_llm
+from .base import BaseChatModel, llm_retry_key, register_llm
+from .utils.client_pool import get_llm_client_pool
 
 
 @register_llm('ollama')
@@ -18,7 +19,9 @@ class OllamaLLM(BaseChatModel):
             ) from e
         super().__init__(model, model_server)
         host = kwargs.get('host', 'http://localhost:11434')
-        self.client = ollama.Client(host=host)
+        self.api_base = host
+        self.client = get_llm_client_pool().get(
+            model_server, host, None, lambda: ollama.Client(host=host))
         self.model = model
         try:
             logger.debug(f'Pulling model {self.model}')
@@ -68,6 +71,7 @@ class OllamaLLM(BaseChatModel):
             if hasattr(chunk['message']['content'], 'text'):
                 yield chunk['message']['content'].text
 
+    @retry(max_retries=3, delay_seconds=0.5, breaker_key=llm_retry_key)
     def chat_with_raw_prompt(self,
                              prompt: str,
                              stream: bool = True,
@@ -85,7 +89,6 @@ class OllamaLLM(BaseChatModel):
         else:
             return response['message']['content']
 
-    @retry(max_retries=3, delay_seconds=0.5)
     def chat(self,
              prompt: Optional[str] = None,
              messages: Optional[List[Dict]] = None,
@@ -1,10 +1,11 @@
 import os
-from typing import Dict, Iterator, List, Optional, Union
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Union
 
-from modelscope_agent.llm.base import BaseChatModel, register_llm
+from modelscope_agent.llm.base import (BaseChatModel, llm_retry_key,
+                                       register_llm)
+from modelscope_agent.llm.utils.client_pool import get_llm_client_pool
 from modelscope_agent.utils.logger import agent_logger as logger
 from modelscope_agent.utils.retry import retry
-from openai import OpenAI
 
 
 @register_llm('openai')
@@ -25,7 +26,11 @@ class OpenAi(BaseChatModel):
                              os.getenv('OPENAI_API_KEY',
                                        default='EMPTY')).strip()
         logger.info(f'client url {api_base}, client key: {api_key}')
-        self.client = OpenAI(api_key=api_key, base_url=api_base)
+        self.api_base = api_base
+        self.api_key = api_key
+        # Shared with every other instance for the same endpoint.
+        self.client = get_llm_client_pool().openai(
+            api_key=api_key, base_url=api_base, model_server=model_server)
         self.is_function_call = is_function_call
         self.is_chat = is_chat
         self.support_stream = support_stream
@@ -79,6 +84,85 @@ class OpenAi(BaseChatModel):
         # TODO: error handling
         return response.choices[0].message.content
 
+    @property
+    def async_client(self):
+        """
+        The AsyncOpenAI client of this endpoint for the running event loop.
+        """
+        return get_llm_client_pool().async_openai(
+            api_key=self.api_key,
+            base_url=self.api_base,
+            model_server=self.model_server)
+
+    def _use_native_async(self) -> bool:
+        # Completion models (or unknown ones) and a forced stream mode take
+        # the paths of `chat`.
+        return self.is_chat is True and self.support_stream is None
+
+    @retry(max_retries=3, delay_seconds=0.5, breaker_key=llm_retry_key)
+    async def _achat_stream(self,
+                            messages: List[Dict],
+                            stop: Optional[List[str]] = None,
+                            **kwargs) -> AsyncIterator[str]:
+        kwargs.pop('uuid_str', None)
+        kwargs.pop('append_files', None)
+        stop = self._update_stop_word(stop)
+        logger.info(
+            f'call openai api, model: {self.model}, messages: {str(messages)}, '
+            f'stop: {str(stop)}, stream: True, args: {str(kwargs)}')
+        response = await self.async_client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            stop=stop,
+            stream=True,
+            stream_options={'include_usage': True},
+            **kwargs)
+        async for chunk in response:
+            if getattr(chunk, 'usage', None) is not None:
+                self.last_call_usage_info = chunk.usage.dict()
+            if len(chunk.choices) > 0 and hasattr(
+                    chunk.choices[0].delta,
+                    'content') and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    @retry(max_retries=3, delay_seconds=0.5, breaker_key=llm_retry_key)
+    async def _achat_no_stream(self,
+                               messages: List[Dict],
+                               stop: Optional[List[str]] = None,
+                               **kwargs) -> str:
+        kwargs.pop('uuid_str', None)
+        kwargs.pop('append_files', None)
+        stop = self._update_stop_word(stop)
+        logger.info(
+            f'call openai api, model: {self.model}, messages: {str(messages)}, '
+            f'stop: {str(stop)}, stream: False, args: {str(kwargs)}')
+        response = await self.async_client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            stop=stop,
+            stream=False,
+            **kwargs)
+        self.stat_last_call_token_info_no_stream(response)
+        logger.info(
+            f'call openai api success, output: {response.choices[0].message.content}'
+        )
+        return response.choices[0].message.content
+
+    async def achat_with_functions(self,
+                                   messages: List[Dict],
+                                   functions: Optional[List[Dict]] = None,
+                                   **kwargs):
+        if functions:
+            kwargs.update(
+                tools=[{
+                    'type': 'function',
+                    'function': item
+                } for item in functions],
+                tool_choice='auto')
+        response = await self.async_client.chat.completions.create(
+            model=self.model, messages=messages, **kwargs)
+        return response.choices[0].message
+
     def support_function_calling(self):
         if self.is_function_call is None:
             return super().support_function_calling()
@@ -92,7 +176,6 @@ class OpenAi(BaseChatModel):
             # if not chat, then prompt
             return not self.is_chat
 
-    @retry(max_retries=3, delay_seconds=0.5)
     def chat(self,
              prompt: Optional[str] = None,
              messages: Optional[List[Dict]] = None,
@@ -119,6 +202,7 @@ class OpenAi(BaseChatModel):
             if hasattr(chunk.choices[0], 'text'):
                 yield chunk.choices[0].text
 
+    @retry(max_retries=3, delay_seconds=0.5, breaker_key=llm_retry_key)
     def chat_with_raw_prompt(self,
                              prompt: str,
                              stream: bool = True,
@@ -182,3 +266,20 @@ class Vllm(OpenAi):
                     f'call openai api success, output: {chunk.choices[0].delta.content}'
                 )
                 yield chunk.choices[0].delta.content
+
+    @retry(max_retries=3, delay_seconds=0.5, breaker_key=llm_retry_key)
+    async def _achat_stream(self,
+                            messages: List[Dict],
+                            stop: Optional[List[str]] = None,
+                            **kwargs) -> AsyncIterator[str]:
+        stop = self._update_stop_word(stop)
+        logger.info(
+            f'call openai api, model: {self.model}, messages: {str(messages)}, '
+            f'stop: {str(stop)}, stream: True, args: {str(kwargs)}')
+        response = await self.async_client.chat.completions.create(
+            model=self.model, messages=messages, stop=stop, stream=True)
+        async for chunk in response:
+            if len(chunk.choices) > 0 and hasattr(
+                    chunk.choices[0].delta,
+                    'content') and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
@@ -0,0 +1,173 @@
+import json
+import os
+import re
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from modelscope_agent.utils.logger import agent_logger as logger
+
+FUNCTION_CALLING = 'function_calling'
+RAW_PROMPT = 'raw_prompt'
+
+# Seconds a probed capability is trusted before it is probed again.
+CAPABILITY_TTL = float(os.getenv('LLM_CAPABILITY_TTL', 24 * 3600))
+# Seconds a probe that failed with an unexpected error (network, quota, ...)
+# is trusted, so a transient failure is retried soon.
+CAPABILITY_FAILURE_TTL = 60.0
+# Optional JSON file sharing the probed capabilities between processes.
+CAPABILITY_CACHE_FILE = os.getenv('LLM_CAPABILITY_CACHE_FILE')
+
+# Capabilities known without a probe: (model_server pattern, model pattern,
+# capabilities). The first match wins, see `register_capabilities`.
+STATIC_CAPABILITIES = []
+
+
+def register_capabilities(model_server: str, model: str, **capabilities):
+    """
+    Declare capabilities of the models matching the `model_server` and
+    `model` regular expressions, e.g.
+    `register_capabilities('openai', r'gpt-4', function_calling=True)`.
+    Later declarations take precedence.
+    """
+    STATIC_CAPABILITIES.insert(
+        0, (re.compile(model_server), re.compile(model), capabilities))
+
+
+def static_capability(model_server: str, model: str,
+                      capability: str) -> Optional[bool]:
+    for server_pattern, model_pattern, capabilities in STATIC_CAPABILITIES:
+        if capability in capabilities and server_pattern.fullmatch(
+                model_server or '') and model_pattern.match(model or ''):
+            return capabilities[capability]
+    return None
+
+
+class CapabilityRegistry:
+    """
+    Process-wide cache of what each LLM endpoint supports, keyed by
+    (model_server, model, api_base), so a capability is probed once per
+    endpoint instead of once per `BaseChatModel` instance.
+
+    Args:
+        ttl: Seconds a probed capability is trusted.
+        path: Optional JSON file the entries are loaded from and saved to.
+    """
+
+    def __init__(self,
+                 ttl: float = CAPABILITY_TTL,
+                 path: Optional[str] = None):
+        self.ttl = ttl
+        self.path = path
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._probe_locks = {}
+        self._loaded = False
+        self.probes = 0
+        self.hits = 0
+
+    @staticmethod
+    def _entry_key(key: Tuple, capability: str) -> str:
+        return '|'.join([str(part or '') for part in key] + [capability])
+
+    def _load(self):
+        self._loaded = True
+        if not self.path:
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._entries.update(json.load(f))
+        except (OSError, ValueError):
+            pass
+
+    def _save(self):
+        if not self.path:
+            return
+        try:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f'Failed to save LLM capabilities: {e}')
+
+    def lookup(self, key: Tuple, capability: str) -> Optional[bool]:
+        """
+        The cached capability, None when unknown or expired.
+        """
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            entry = self._entries.get(self._entry_key(key, capability))
+        if entry is None or entry['expires_at'] < time.time():
+            return None
+        return entry['value']
+
+    def record(self,
+               key: Tuple,
+               capability: str,
+               value: bool,
+               ttl: Optional[float] = None):
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            self._entries[self._entry_key(key, capability)] = {
+                'value': value,
+                'expires_at': time.time() + (self.ttl if ttl is None else ttl)
+            }
+            self._save()
+
+    def resolve(self, key: Tuple, capability: str,
+                probe: Callable[[], Tuple[bool, float]]) -> bool:
+        """
+        The capability of the endpoint `key`: from the cache, the static
+        declarations, or else `probe()`, which returns the value and the
+        seconds to trust it. Concurrent callers of one endpoint share the
+        probe.
+        """
+        value = self.lookup(key, capability)
+        if value is None:
+            value = static_capability(key[0], key[1], capability)
+        if value is not None:
+            self.hits += 1
+            return value
+        entry_key = self._entry_key(key, capability)
+        with self._lock:
+            probe_lock = self._probe_locks.setdefault(entry_key,
+                                                      threading.Lock())
+        with probe_lock:
+            value = self.lookup(key, capability)
+            if value is not None:
+                self.hits += 1
+                return value
+            self.probes += 1
+            value, ttl = probe()
+            self.record(key, capability, value, ttl)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._save()
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'probes': self.probes,
+                'hits': self.hits,
+            }
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_capability_registry() -> CapabilityRegistry:
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = CapabilityRegistry(path=CAPABILITY_CACHE_FILE)
+        return _registry
@@ -0,0 +1,205 @@
+import asyncio
+import hashlib
+import os
+import threading
+import weakref
+from typing import Callable, Dict, List, Optional
+
+import httpx
+from openai import (AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient,
+                    OpenAI)
+
+# Defaults of the shared HTTP pools, see `LLMClientPool.configure`.
+MAX_CONNECTIONS = int(os.getenv('LLM_MAX_CONNECTIONS', 100))
+MAX_KEEPALIVE_CONNECTIONS = int(
+    os.getenv('LLM_MAX_KEEPALIVE_CONNECTIONS', 20))
+# Seconds an idle connection is kept open for the next request.
+KEEPALIVE_EXPIRY = float(os.getenv('LLM_KEEPALIVE_EXPIRY', 60.0))
+# Seconds a request may take; generations can be long.
+REQUEST_TIMEOUT = float(os.getenv('LLM_REQUEST_TIMEOUT', 600.0))
+CONNECT_TIMEOUT = 5.0
+
+
+def _key_hash(api_key: Optional[str]) -> str:
+    return hashlib.sha256((api_key or '').encode('utf-8')).hexdigest()[:12]
+
+
+def _pool_stats(http_client) -> Dict:
+    pool = getattr(getattr(http_client, '_transport', None), '_pool', None)
+    if pool is None:
+        return {}
+    connections = list(getattr(pool, 'connections', []))
+    requests = list(getattr(pool, '_requests', []))
+    idle = sum(1 for connection in connections if connection.is_idle())
+    return {
+        'connections': len(connections),
+        'idle_connections': idle,
+        'active_connections': len(connections) - idle,
+        'requests': len(requests),
+        'queued_requests': sum(1 for request in requests
+                               if request.is_queued()),
+    }
+
+
+class LLMClientPool:
+    """
+    Process-wide cache of LLM SDK clients keyed by (model_server, base_url,
+    api_key), so every agent and request of the process reuses one client.
+    The OpenAI-compatible clients share one keep-alive HTTP connection pool
+    (one per event loop for the async clients, whose connections belong to
+    the loop that opened them).
+
+    Args:
+        max_connections: Maximum open connections of a shared pool.
+        max_keepalive_connections: Idle connections kept open.
+        keepalive_expiry: Seconds an idle connection is kept open.
+        timeout: Seconds a request may take.
+    """
+
+    def __init__(self,
+                 max_connections: int = MAX_CONNECTIONS,
+                 max_keepalive_connections: int = MAX_KEEPALIVE_CONNECTIONS,
+                 keepalive_expiry: float = KEEPALIVE_EXPIRY,
+                 timeout: float = REQUEST_TIMEOUT):
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._http_client = None
+        # event loop -> (async HTTP client, {key: client})
+        self._async_clients = weakref.WeakKeyDictionary()
+        self.created = 0
+        self.reused = 0
+
+    def configure(self, **settings):
+        """
+        Change the settings used for the HTTP pools created from now on.
+        """
+        for name, value in settings.items():
+            if not hasattr(self, name) or name.startswith('_'):
+                raise TypeError(f'Unknown client pool setting {name!r}')
+            setattr(self, name, value)
+
+    def _limits(self):
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry)
+
+    def _timeout(self):
+        return httpx.Timeout(self.timeout, connect=CONNECT_TIMEOUT)
+
+    @property
+    def http_client(self) -> httpx.Client:
+        """
+        The HTTP pool shared by the synchronous OpenAI-compatible clients.
+        """
+        with self._lock:
+            if self._http_client is None:
+                self._http_client = DefaultHttpxClient(
+                    limits=self._limits(), timeout=self._timeout())
+            return self._http_client
+
+    def _async_state(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            state = self._async_clients.get(loop)
+            if state is None:
+                state = (DefaultAsyncHttpxClient(
+                    limits=self._limits(), timeout=self._timeout()), {})
+                self._async_clients[loop] = state
+            return state
+
+    def _get(self, clients, key, create: Callable):
+        with self._lock:
+            client = clients.get(key)
+            if client is not None:
+                self.reused += 1
+                return client
+        client = create()
+        with self._lock:
+            # Another thread may have created it meanwhile, keep the first.
+            existing = clients.get(key)
+            if existing is not None:
+                self.reused += 1
+                return existing
+            clients[key] = client
+            self.created += 1
+        return client
+
+    def get(self, model_server: str, base_url: Optional[str],
+            api_key: Optional[str], create: Callable):
+        """
+        The cached client of an endpoint, created by `create()` on first use.
+        """
+        return self._get(self._clients, (model_server, base_url, api_key),
+                         create)
+
+    def openai(self, api_key: str, base_url: str, model_server='openai'):
+        http_client = self.http_client
+        return self.get(
+            model_server, base_url, api_key, lambda: OpenAI(
+                api_key=api_key, base_url=base_url, http_client=http_client))
+
+    def async_openai(self,
+                     api_key: str,
+                     base_url: str,
+                     model_server='openai'):
+        """
+        The AsyncOpenAI client of an endpoint for the running event loop.
+        """
+        http_client, clients = self._async_state()
+        return self._get(
+            clients, (model_server, base_url, api_key), lambda: AsyncOpenAI(
+                api_key=api_key, base_url=base_url, http_client=http_client))
+
+    def stats(self) -> Dict:
+        """
+        Cache counters, the cached endpoints (without keys) and the
+        connections of the shared HTTP pools.
+        """
+        with self._lock:
+            endpoints: List[Dict] = [{
+                'model_server': model_server,
+                'base_url': base_url,
+                'api_key': _key_hash(api_key),
+            } for model_server, base_url, api_key in self._clients]
+            http_client = self._http_client
+            async_pools = [state[0] for state in self._async_clients.values()]
+            stats = {
+                'clients': len(self._clients),
+                'created': self.created,
+                'reused': self.reused,
+                'endpoints': endpoints,
+                'max_connections': self.max_connections,
+                'max_keepalive_connections': self.max_keepalive_connections,
+            }
+        stats['http_pool'] = _pool_stats(http_client) if http_client else {}
+        stats['async_http_pools'] = [_pool_stats(c) for c in async_pools]
+        return stats
+
+    def close(self):
+        """
+        Drop the cached clients and close the synchronous HTTP pool; the
+        next request creates new ones.
+        """
+        with self._lock:
+            http_client, self._http_client = self._http_client, None
+            self._clients.clear()
+            self._async_clients = weakref.WeakKeyDictionary()
+        if http_client is not None:
+            http_client.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_llm_client_pool() -> LLMClientPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = LLMClientPool()
+        return _pool
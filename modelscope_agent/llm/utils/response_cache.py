@@ -0,0 +1,400 @@
+import hashlib
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from functools import wraps
+from typing import Callable, Dict, Iterator, List, Optional
+
+from modelscope_agent.llm.base import (enable_no_stream_callback,
+                                       enable_stream_callback)
+from modelscope_agent.utils.logger import agent_logger as logger
+
+DEFAULT_CACHE_PATH = os.getenv(
+    'LLM_RESPONSE_CACHE_PATH',
+    os.path.join(
+        os.path.expanduser('~'), '.cache', 'modelscope_agent',
+        'llm_responses.sqlite'))
+# Seconds an entry is served.
+DEFAULT_TTL = 7 * 24 * 3600
+# Entries kept; the least recently used are evicted beyond it.
+DEFAULT_MAX_ENTRIES = 10000
+# Characters per chunk when a non-streamed response is replayed as a stream.
+REPLAY_CHUNK_SIZE = 16
+
+# Call arguments that do not change the response.
+IGNORED_KWARGS = {'uuid_str', 'append_files', 'callbacks', 'stream'}
+MESSAGE_KEYS = ('role', 'content', 'name', 'function_call', 'tool_calls',
+                'tool_call_id')
+# Error texts some backends return as a response or yield mid-stream after
+# partial text (e.g. DashScope's StreamOutput); never cached.
+ERROR_RESPONSE = re.compile(r'^\s*Error code:', re.M)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    scope TEXT NOT NULL,
+    response TEXT NOT NULL,
+    streamed INTEGER NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    embedding BLOB,
+    expires_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at);
+CREATE INDEX IF NOT EXISTS responses_scope ON responses (scope);
+"""
+
+
+def normalize_messages(messages: Optional[List[Dict]]) -> List[Dict]:
+    """
+    The parts of the messages that decide the response, with the content
+    whitespace normalized.
+    """
+    normalized = []
+    for message in messages or []:
+        item = {key: message[key] for key in MESSAGE_KEYS if key in message}
+        if isinstance(item.get('content'), str):
+            item['content'] = '\n'.join(
+                line.rstrip()
+                for line in item['content'].strip().splitlines())
+        normalized.append(item)
+    return normalized
+
+
+def _digest(data) -> str:
+    text = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _cosine(a, b) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class ResponseCache:
+    """
+    On-disk cache of LLM responses in SQLite, keyed by the model endpoint,
+    the normalized messages, the functions and the sampling parameters.
+    Entries expire after `ttl` seconds and the least recently used beyond
+    `max_entries` are evicted. With `embed` (a text -> vector function) a
+    miss is served by a cached response to a prompt at least
+    `similarity_threshold` similar, under the same model and parameters.
+
+    Args:
+        path: The SQLite file, ':memory:' for a cache of this process only.
+        ttl: Seconds an entry is served.
+        max_entries: Entries kept.
+        embed: Optional embedding function of the semantic mode.
+        similarity_threshold: Cosine similarity of a semantic hit.
+    """
+
+    def __init__(self,
+                 path: str = DEFAULT_CACHE_PATH,
+                 ttl: float = DEFAULT_TTL,
+                 max_entries: int = DEFAULT_MAX_ENTRIES,
+                 embed: Optional[Callable[[str], List[float]]] = None,
+                 similarity_threshold: float = 0.95):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.embed = embed
+        self.similarity_threshold = similarity_threshold
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._last_embedding = (None, None)
+        self._conn = sqlite3.connect(
+            path, timeout=30, check_same_thread=False)
+        if path != ':memory:':
+            self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.saved_prompt_tokens = 0
+        self.saved_completion_tokens = 0
+
+    def make_key(self,
+                 endpoint,
+                 call: str,
+                 messages=None,
+                 prompt=None,
+                 **params):
+        """
+        The exact key of a call and its scope, the key without the
+        conversation, which groups the candidates of a semantic hit.
+        """
+        params = {
+            name: value
+            for name, value in params.items()
+            if name not in IGNORED_KWARGS and value is not None
+        }
+        scope = _digest({
+            'endpoint': list(endpoint),
+            'call': call,
+            'params': params
+        })
+        key = _digest({
+            'scope': scope,
+            'prompt': prompt,
+            'messages': normalize_messages(messages)
+        })
+        return key, scope
+
+    @staticmethod
+    def _embedding_text(messages, prompt=None) -> str:
+        parts = [prompt or '']
+        parts += [
+            str(message.get('content', ''))
+            for message in normalize_messages(messages)
+        ]
+        return '\n'.join(part for part in parts if part)
+
+    def _embedding(self, messages, prompt):
+        if self.embed is None:
+            return None
+        text = self._embedding_text(messages, prompt)
+        # A miss embeds the prompt for the lookup and again for the store.
+        last_text, last_embedding = self._last_embedding
+        if text == last_text:
+            return last_embedding
+        try:
+            embedding = list(self.embed(text))
+        except Exception as e:
+            logger.warning(f'Failed to embed the prompt for the cache: {e}')
+            return None
+        self._last_embedding = (text, embedding)
+        return embedding
+
+    def _hit(self, key, row):
+        response, streamed, prompt_tokens, completion_tokens = row
+        self._conn.execute(
+            'UPDATE responses SET accessed_at = ? WHERE key = ?',
+            (time.time(), key))
+        self._conn.commit()
+        self.saved_prompt_tokens += prompt_tokens
+        self.saved_completion_tokens += completion_tokens
+        return json.loads(response), bool(streamed)
+
+    def lookup(self, key, scope, messages=None, prompt=None):
+        """
+        The cached (response, streamed) of a call, None on a miss.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT response, streamed, prompt_tokens, completion_tokens '
+                'FROM responses WHERE key = ? AND expires_at > ?',
+                (key, now)).fetchone()
+            if row is not None:
+                self.hits += 1
+                return self._hit(key, row)
+        embedding = self._embedding(messages, prompt)
+        if embedding is not None:
+            with self._lock:
+                candidates = self._conn.execute(
+                    'SELECT key, embedding FROM responses WHERE scope = ? '
+                    'AND embedding IS NOT NULL AND expires_at > ?',
+                    (scope, now)).fetchall()
+                best_key, best = None, self.similarity_threshold
+                for candidate_key, blob in candidates:
+                    similarity = _cosine(embedding, array('f', blob))
+                    if similarity >= best:
+                        best_key, best = candidate_key, similarity
+                if best_key is not None:
+                    row = self._conn.execute(
+                        'SELECT response, streamed, prompt_tokens, '
+                        'completion_tokens FROM responses WHERE key = ?',
+                        (best_key, )).fetchone()
+                    self.semantic_hits += 1
+                    return self._hit(best_key, row)
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def store(self,
+              key,
+              scope,
+              response,
+              streamed=False,
+              usage=None,
+              messages=None,
+              prompt=None):
+        """
+        Cache a response (a str, a JSON-serializable object, or the list of
+        chunks of a stream). Error responses are not cached.
+        """
+        chunks = response if streamed else [response]
+        text = ''.join(chunk for chunk in chunks if isinstance(chunk, str))
+        if not response or ERROR_RESPONSE.search(text):
+            return False
+        try:
+            serialized = json.dumps(response, ensure_ascii=False)
+        except (TypeError, ValueError):
+            return False
+        usage = usage or {}
+        embedding = self._embedding(messages, prompt)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses VALUES '
+                '(?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, scope, serialized, int(streamed),
+                 usage.get('prompt_tokens') or 0,
+                 usage.get('completion_tokens') or 0,
+                 array('f', embedding).tobytes() if embedding else None,
+                 now + self.ttl, now))
+            self._evict(now)
+            self._conn.commit()
+            self.stores += 1
+        return True
+
+    def _evict(self, now):
+        expired = self._conn.execute(
+            'DELETE FROM responses WHERE expires_at <= ?', (now, )).rowcount
+        count = self._conn.execute(
+            'SELECT count(*) FROM responses').fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                'DELETE FROM responses WHERE key IN (SELECT key FROM '
+                'responses ORDER BY accessed_at LIMIT ?)', (overflow, ))
+        self.evictions += expired + max(overflow, 0)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM responses')
+            self._conn.commit()
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            entries = self._conn.execute(
+                'SELECT count(*) FROM responses').fetchone()[0]
+            lookups = self.hits + self.semantic_hits + self.misses
+            return {
+                'entries': entries,
+                'hits': self.hits,
+                'semantic_hits': self.semantic_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.semantic_hits) / lookups
+                if lookups else 0.0,
+                'stores': self.stores,
+                'evictions': self.evictions,
+                'saved_prompt_tokens': self.saved_prompt_tokens,
+                'saved_completion_tokens': self.saved_completion_tokens,
+            }
+
+
+def _replay_stream(response, streamed) -> Iterator:
+    if streamed:
+        yield from response
+    elif isinstance(response, str):
+        for i in range(0, len(response), REPLAY_CHUNK_SIZE):
+            yield response[i:i + REPLAY_CHUNK_SIZE]
+    else:
+        yield response
+
+
+def _replay(response, streamed, stream):
+    if stream:
+        return _replay_stream(response, streamed)
+    if streamed and all(isinstance(chunk, str) for chunk in response):
+        return ''.join(response)
+    return response
+
+
+def _record_stream(llm, cache, key, scope, stream, messages, prompt):
+    chunks = []
+    for chunk in stream:
+        chunks.append(chunk)
+        yield chunk
+    cache.store(
+        key,
+        scope,
+        chunks,
+        streamed=True,
+        usage=llm.get_usage(),
+        messages=messages,
+        prompt=prompt)
+
+
+def _cached(llm, cache, call, func, default_stream):
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if args:
+            # Positional use of the cached methods is not cacheable.
+            return func(*args, **kwargs)
+        stream = kwargs.get('stream', default_stream)
+        # A function call answers with a message or a stream of chunks
+        # depending on `stream`; a chat's text is the same either way.
+        call_name = call if call == 'chat' or not stream else call + ':stream'
+        key, scope = cache.make_key(llm.capability_key(), call_name,
+                                    **kwargs)
+        messages, prompt = kwargs.get('messages'), kwargs.get('prompt')
+        cached = cache.lookup(key, scope, messages=messages, prompt=prompt)
+        if cached is None:
+            response = func(*args, **kwargs)
+            if isinstance(response, Iterator):
+                return _record_stream(llm, cache, key, scope, response,
+                                      messages, prompt)
+            cache.store(
+                key,
+                scope,
+                response,
+                usage=llm.get_usage(),
+                messages=messages,
+                prompt=prompt)
+            return response
+        llm.last_call_usage_info = {
+            'prompt_tokens': 0,
+            'completion_tokens': 0,
+            'total_tokens': 0
+        }
+        response = _replay(*cached, stream)
+        callbacks = kwargs.pop('callbacks', None)
+        if callbacks:
+            callbacks.on_llm_start(**kwargs)
+            if stream:
+                return enable_stream_callback(llm.model, response, callbacks)
+            return enable_no_stream_callback(llm.model, response, callbacks)
+        return response
+
+    return wrapper
+
+
+def enable_response_cache(llm, cache: ResponseCache):
+    """
+    Serve `llm.chat` and `llm.chat_with_functions` from `cache`. Call them
+    with keyword arguments, as the agents do; responses that are not JSON
+    serializable (e.g. SDK message objects) pass through uncached.
+    """
+    llm.response_cache = cache
+    llm.chat = _cached(llm, cache, 'chat', llm.chat, False)
+    llm.chat_with_functions = _cached(llm, cache, 'chat_with_functions',
+                                      llm.chat_with_functions, True)
+    return llm
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_response_cache(path: str = DEFAULT_CACHE_PATH) -> ResponseCache:
+    """
+    The cache of this process stored at `path`.
+    """
+    with _caches_lock:
+        cache = _caches.get(path)
+        if cache is None:
+            cache = _caches[path] = ResponseCache(path)
+        return cache
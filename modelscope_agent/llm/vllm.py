@@ -1,7 +1,6 @@
 from typing import Dict, Iterator, List, Optional, Union
 
 from modelscope_agent.utils.logger import agent_logger as logger
-from modelscope_agent.utils.retry import retry
 
 from .base import BaseChatModel, register_llm
 
@@ -61,7 +60,6 @@ class VllmLLM(BaseChatModel):
         # TODO: support stop word
         return outputs[0].outputs[0].text
 
-    @retry(max_retries=3, delay_seconds=0.5)
     def chat(self,
              prompt: Optional[str] = None,
              messages: Optional[List[Dict]] = None,
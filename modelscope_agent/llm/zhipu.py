@@ -4,6 +4,7 @@ from typing import Dict, Iterator, List, Optional
 from modelscope_agent.utils.logger import agent_logger as logger
 
 from .base import BaseChatModel, register_llm
+from .utils.client_pool import get_llm_client_pool
 
 
 def stream_output(response, **kwargs):
@@ -46,7 +47,8 @@ class ZhipuLLM(BaseChatModel):
         super().__init__(model, model_server, support_fn_call=support_fn_call)
         api_key = kwargs.get('api_key', os.getenv('ZHIPU_API_KEY', '')).strip()
         assert api_key, 'ZHIPU_API_KEY is required.'
-        self.client = ZhipuAI(api_key=api_key)
+        self.client = get_llm_client_pool().get(
+            model_server, None, api_key, lambda: ZhipuAI(api_key=api_key))
 
     def _chat_stream(self,
                      messages: List[Dict],
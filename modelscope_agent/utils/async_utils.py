@@ -0,0 +1,49 @@
+import asyncio
+import contextvars
+import functools
+from typing import AsyncIterator, Awaitable, Iterable, List, TypeVar
+
+T = TypeVar('T')
+
+_DONE = object()
+
+
+async def run_in_thread(func, *args, **kwargs):
+    """
+    Run a blocking call on the loop's default executor, keeping the context
+    variables of the caller.
+    """
+    loop = asyncio.get_running_loop()
+    call = functools.partial(contextvars.copy_context().run, func, *args,
+                             **kwargs)
+    return await loop.run_in_executor(None, call)
+
+
+async def iterate_in_thread(iterable: Iterable[T]) -> AsyncIterator[T]:
+    """
+    Iterate a blocking iterator (e.g. a streaming SDK response), fetching
+    every item on the executor so the loop is never blocked.
+    """
+    iterator = iter(iterable)
+    while True:
+        item = await run_in_thread(next, iterator, _DONE)
+        if item is _DONE:
+            return
+        yield item
+
+
+async def gather_with_concurrency(aws: Iterable[Awaitable[T]],
+                                  limit: int,
+                                  return_exceptions: bool = False) -> List[T]:
+    """
+    `asyncio.gather` running at most `limit` of the awaitables at a time.
+    Results are in the order of `aws`.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(aw):
+        async with semaphore:
+            return await aw
+
+    return await asyncio.gather(*[run(aw) for aw in aws],
+                                return_exceptions=return_exceptions)
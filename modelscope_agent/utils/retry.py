@@ -1,42 +1,476 @@
+import asyncio
+import inspect
+import random
+import threading
 import time
+from email.utils import parsedate_to_datetime
 from functools import wraps
 from traceback import format_exc
+from typing import Callable, Optional
 
 from modelscope_agent.utils.logger import agent_logger as logger
 
+# HTTP statuses worth another attempt; other 4xx are the caller's fault.
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429}
+# Exceptions of a bug rather than of the remote side.
+NON_RETRYABLE_ERRORS = (AssertionError, TypeError, AttributeError, KeyError,
+                        NotImplementedError)
+# Upper bound of one backoff sleep, in seconds.
+MAX_DELAY_SECONDS = 30.0
+# A Retry-After longer than this gives up instead of sleeping.
+MAX_RETRY_AFTER_SECONDS = 60.0
 
-def retry(max_retries=3, delay_seconds=1, return_str=False):
+
+class CircuitOpenError(Exception):
+    """
+    Raised without calling the function while its circuit is open.
+    """
+
+
+class RetryError(Exception):
+    """
+    All attempts failed; the last error is the `__cause__`.
+    """
+
+
+def error_status_code(error: BaseException) -> Optional[int]:
+    """
+    The HTTP status of an SDK error (openai, httpx, requests, dashscope).
+    """
+    for value in (getattr(error, 'status_code', None),
+                  getattr(getattr(error, 'response', None), 'status_code',
+                          None), getattr(error, 'status', None)):
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def is_retryable(error: BaseException) -> bool:
+    """
+    Whether another attempt may succeed: rate limits, timeouts, 5xx and
+    connection errors are retried, other 4xx and programming errors are not.
+    Neither are the failures of an inner `retry` (RetryError, an open
+    circuit): its attempts were made already.
+    """
+    if isinstance(error, (RetryError, CircuitOpenError)):
+        return False
+    should_retry = getattr(error, 'should_retry', None)
+    if callable(should_retry):
+        return bool(should_retry())
+    status = error_status_code(error)
+    if status is not None:
+        return status >= 500 or status in RETRYABLE_STATUS_CODES
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    if isinstance(error, NON_RETRYABLE_ERRORS):
+        return False
+    # SDK errors without a status such as APIConnectionError or
+    # APITimeoutError, and anything unknown, keep the old retry-all
+    # behaviour.
+    return True
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """
+    The delay the server asked for with `Retry-After(-ms)`, if any.
+    """
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    try:
+        value = headers.get('retry-after-ms')
+        if value is not None:
+            return max(float(value) / 1000, 0.0)
+        value = headers.get('retry-after')
+        if value is None:
+            return None
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            return max(
+                parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryBudget:
+    """
+    Process-wide limit on retries, so a failing provider sees a bounded
+    amount of extra load instead of every caller retrying in lock-step. Every
+    call deposits `ratio` of a retry, and `min_per_second` retries are
+    granted per second regardless; a retry withdraws one.
+
+    Args:
+        ratio: Retries allowed per call.
+        min_per_second: Retries always allowed per second.
+        capacity: Most retries that can be saved up.
+    """
+
+    def __init__(self,
+                 ratio: float = 0.2,
+                 min_per_second: float = 1.0,
+                 capacity: float = 20.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.capacity = capacity
+        self._balance = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._balance = min(
+            self.capacity,
+            self._balance + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def deposit(self):
+        with self._lock:
+            self._refill()
+            self._balance = min(self.capacity, self._balance + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            self._refill()
+            if self._balance >= 1:
+                self._balance -= 1
+                return True
+            self.rejected += 1
+            return False
+
+
+class CircuitBreaker:
+    """
+    Fails fast after `failure_threshold` consecutive retryable failures, for
+    `reset_timeout` seconds; then one trial call decides whether it closes
+    again. A trial that ends without an outcome (cancelled, or a stream
+    closed before its first item) hands its slot back with `release`.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        # Token of the running half-open trial, None when there is none.
+        self._trial = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return 'open'
+        return 'half_open'
+
+    def allow(self) -> bool:
+        allowed, _ = self.acquire()
+        return allowed
+
+    def acquire(self):
+        """
+        Returns (allowed, trial): `trial` is a token when the call is the
+        half-open trial, to be given to `release` whatever its outcome.
+        """
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True, None
+            if state == 'half_open' and self._trial is None:
+                self._trial = object()
+                return True, self._trial
+            return False, None
+
+    def release(self, trial):
+        """
+        Free the trial slot of `trial` if no outcome was recorded for it.
+        """
+        with self._lock:
+            if trial is not None and self._trial is trial:
+                self._trial = None
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial = None
+            if self.opened_at is not None or (self.failures
+                                              >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+
+
+_budget = RetryBudget()
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_retry_budget() -> RetryBudget:
+    return _budget
+
+
+def get_circuit_breaker(key) -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = _breakers[key] = CircuitBreaker()
+        return breaker
+
+
+class RetryPolicy:
+    """
+    When and how long to wait before the next attempt: exponential backoff
+    with full jitter (a random delay up to `delay_seconds * 2**attempt`),
+    at least the server's Retry-After, within the retry budget.
+    """
+
+    def __init__(self,
+                 max_retries: int = 3,
+                 delay_seconds: float = 1,
+                 max_delay: float = MAX_DELAY_SECONDS,
+                 max_retry_after: float = MAX_RETRY_AFTER_SECONDS,
+                 retryable: Callable[[BaseException], bool] = is_retryable,
+                 budget: Optional[RetryBudget] = None):
+        self.max_retries = max_retries
+        self.delay_seconds = delay_seconds
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.retryable = retryable
+        self.budget = budget
+
+    def backoff(self, attempt: int, error: BaseException) -> Optional[float]:
+        """
+        Seconds to sleep before attempt `attempt + 1`, None to give up.
+        """
+        if attempt + 1 >= self.max_retries or not self.retryable(error):
+            return None
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None and retry_after > self.max_retry_after:
+            return None
+        if self.budget is not None and not self.budget.withdraw():
+            logger.warning('Retry budget exhausted, not retrying')
+            return None
+        delay = random.uniform(
+            0, min(self.max_delay, self.delay_seconds * 2**attempt))
+        return max(delay, retry_after or 0.0)
+
+
+def retry(max_retries=3,
+          delay_seconds=1,
+          return_str=False,
+          max_delay=MAX_DELAY_SECONDS,
+          retryable=is_retryable,
+          breaker_key=None,
+          use_budget=True):
     """
     Retry decorator with exponential backoff.
     Args:
-        max_retries: max retry times
-        delay_seconds: delay seconds between retries
+        max_retries: max attempts
+        delay_seconds: base delay of the backoff, doubled on every attempt
         return_str: want to return in str format, set it to True
+        max_delay: upper bound of one delay
+        retryable: decides whether an error is worth another attempt
+        breaker_key: function of the call arguments naming its circuit
+            breaker, by default one breaker per decorated function
+        use_budget: count the retries against the process retry budget
+
+    Works on functions, coroutine functions and (async) generator
+    functions. A returned generator is retried only until it yields its
+    first item; an error after that is raised to the consumer.
 
     Returns:func
 
     """
 
     def decorator(func):
+        policy = RetryPolicy(
+            max_retries=max_retries,
+            delay_seconds=delay_seconds,
+            max_delay=max_delay,
+            retryable=retryable,
+            budget=get_retry_budget() if use_budget else None)
+        name = func.__name__
+
+        def breaker_of(args, kwargs):
+            key = breaker_key(*args, **kwargs) if breaker_key else None
+            return get_circuit_breaker((func.__qualname__, key))
+
+        def give_up(error):
+            if return_str:
+                return f'Max retries reached. Attempt to run {name} failed after {max_retries} times'
+            if isinstance(error, CircuitOpenError) or not policy.retryable(
+                    error):
+                raise error
+            raise RetryError(
+                'Max retries reached. Failed to get result') from error
+
+        def failed(breaker, attempt, error):
+            """
+            Record a failed attempt, returns the delay before the next one
+            or None.
+            """
+            logger.warning(
+                f'Attempt to run {name} {attempt + 1} failed: {format_exc()}')
+            if isinstance(error, (RetryError, CircuitOpenError)):
+                # Already recorded by the breaker of the inner retry.
+                pass
+            elif policy.retryable(error):
+                breaker.record_failure()
+            else:
+                # The endpoint answered, the request itself is wrong.
+                breaker.record_success()
+            return policy.backoff(attempt, error)
+
+        def check(breaker):
+            """
+            Admit a call, returns its trial token (see `CircuitBreaker`).
+            """
+            allowed, trial = breaker.acquire()
+            if not allowed:
+                raise CircuitOpenError(
+                    f'Circuit of {name} is open after repeated failures')
+            return trial
+
+        def retry_stream(stream, call, breaker, attempt):
+            while True:
+                started = False
+                trial = None
+                try:
+                    # The slot is taken once the stream is iterated, so an
+                    # unconsumed stream never holds the half-open trial.
+                    trial = check(breaker)
+                    if stream is None:
+                        stream = call()
+                    for item in stream:
+                        if not started:
+                            started = True
+                            breaker.record_success()
+                        yield item
+                    if not started:
+                        breaker.record_success()
+                    return
+                except CircuitOpenError as e:
+                    yield give_up(e)
+                    return
+                except Exception as e:
+                    if started:
+                        raise
+                    delay = failed(breaker, attempt, e)
+                    if delay is None:
+                        yield give_up(e)
+                        return
+                finally:
+                    breaker.release(trial)
+                time.sleep(delay)
+                attempt += 1
+                stream = None
+
+        async def aretry_stream(call, breaker):
+            attempt = 0
+            while True:
+                started = False
+                trial = None
+                try:
+                    trial = check(breaker)
+                    async for item in call():
+                        if not started:
+                            started = True
+                            breaker.record_success()
+                        yield item
+                    if not started:
+                        breaker.record_success()
+                    return
+                except CircuitOpenError as e:
+                    yield give_up(e)
+                    return
+                except Exception as e:
+                    if started:
+                        raise
+                    delay = failed(breaker, attempt, e)
+                    if delay is None:
+                        yield give_up(e)
+                        return
+                finally:
+                    breaker.release(trial)
+                await asyncio.sleep(delay)
+                attempt += 1
+
+        if inspect.isasyncgenfunction(func):
+
+            @wraps(func)
+            async def async_gen_wrapper(*args, **kwargs):
+                breaker = breaker_of(args, kwargs)
+                if policy.budget is not None:
+                    policy.budget.deposit()
+                async for item in aretry_stream(lambda: func(*args, **kwargs),
+                                                breaker):
+                    yield item
+
+            return async_gen_wrapper
+
+        if inspect.iscoroutinefunction(func):
+
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                breaker = breaker_of(args, kwargs)
+                if policy.budget is not None:
+                    policy.budget.deposit()
+                attempt = 0
+                while True:
+                    trial = None
+                    try:
+                        trial = check(breaker)
+                        result = await func(*args, **kwargs)
+                        breaker.record_success()
+                        return result
+                    except CircuitOpenError as e:
+                        return give_up(e)
+                    except Exception as e:
+                        delay = failed(breaker, attempt, e)
+                        if delay is None:
+                            return give_up(e)
+                    finally:
+                        # e.g. the trial was cancelled.
+                        breaker.release(trial)
+                    await asyncio.sleep(delay)
+                    attempt += 1
+
+            return async_wrapper
 
         @wraps(func)
         def wrapper(*args, **kwargs):
-            attempts = 0
-            while attempts < max_retries:
+            breaker = breaker_of(args, kwargs)
+            if policy.budget is not None:
+                policy.budget.deposit()
+            attempt = 0
+            while True:
+                trial = None
                 try:
-                    return func(*args, **kwargs)
-                except AssertionError as e:
-                    raise AssertionError(e)
-                except Exception:
-                    logger.warning(
-                        f'Attempt to run {func.__name__} {attempts + 1} failed: {format_exc()}'
-                    )
-                    attempts += 1
-                    time.sleep(delay_seconds)
-            if return_str:
-                return f'Max retries reached. Attempt to run {func.__name__} failed after {max_retries} times'
-            else:
-                raise Exception('Max retries reached. Failed to get result')
+                    trial = check(breaker)
+                    result = func(*args, **kwargs)
+                    if inspect.isgenerator(result):
+                        # retry_stream admits the stream when it is iterated.
+                        return retry_stream(result,
+                                            lambda: func(*args, **kwargs),
+                                            breaker, attempt)
+                    breaker.record_success()
+                    return result
+                except CircuitOpenError as e:
+                    return give_up(e)
+                except Exception as e:
+                    delay = failed(breaker, attempt, e)
+                    if delay is None:
+                        return give_up(e)
+                finally:
+                    breaker.release(trial)
+                time.sleep(delay)
+                attempt += 1
 
         return wrapper
 
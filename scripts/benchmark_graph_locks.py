@@ -0,0 +1,159 @@
+"""
+Benchmark GraphDatabaseHandler write throughput and read latency with 1-32
+concurrent worker processes.
+
+Every worker writes its own task (or, with --shared_task, one common task)
+in bulk batches and issues a point read after every batch. --mode global
+serializes every read and write of every worker on one lock file, the way
+all handlers used to share `neo4j.lock`; --mode task is the current model
+(lock-free reads, one write lock per task).
+
+    python scripts/benchmark_graph_locks.py --uri bolt://localhost:7687 \
+        --user neo4j --password <password> --mode task
+    python scripts/benchmark_graph_locks.py --mode global
+
+The default URI is an embedded graph in a temporary directory, which writes
+through one file lock of its own and so only shows the read side.
+"""
+import argparse
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+
+def run_worker(args, worker, lock_dir, run_id, barrier, results):
+    from modelscope_agent.environment.graph_database import \
+        GraphDatabaseHandler
+    from modelscope_agent.environment.graph_database.indexer.task_lock import (
+        FileLock, NoOpLock)
+
+    task_id = 'bench_{}_{}'.format(run_id,
+                                   'shared' if args.shared_task else worker)
+    lockfile = os.path.join(lock_dir, 'neo4j.lock')
+    graph_db = GraphDatabaseHandler(
+        uri=args.uri,
+        user=args.user,
+        password=args.password,
+        database_name=args.db_name,
+        task_id=task_id,
+        use_lock=True,
+        lockfile=lockfile,
+        bulk_write=True,
+        batch_size=args.batch_size)
+    global_lock = FileLock(lockfile) if args.mode == 'global' else NoOpLock()
+    read_query = ('MATCH (n:`{0}`) WHERE n.full_name = $full_name '
+                  'RETURN n.name').format(task_id)
+
+    barrier.wait()
+    start_time = time.perf_counter()
+    write_seconds = 0.0
+    read_latencies = []
+    written = 0
+    for batch_start in range(0, args.nodes, args.batch_size):
+        names = [
+            'w{}.m{}'.format(worker, i) for i in range(
+                batch_start, min(batch_start + args.batch_size, args.nodes))
+        ]
+        for full_name in names:
+            graph_db.add_node('FUNCTION', full_name, {'name': full_name})
+            graph_db.add_edge('MODULE', 'w{}'.format(worker), 'CONTAINS',
+                              'FUNCTION', full_name)
+        write_start = time.perf_counter()
+        with global_lock:
+            written += graph_db.flush()
+        write_seconds += time.perf_counter() - write_start
+
+        read_start = time.perf_counter()
+        with global_lock:
+            graph_db.execute_query(read_query, full_name=names[0])
+        read_latencies.append(time.perf_counter() - read_start)
+    results.put({
+        'written': written,
+        'elapsed': time.perf_counter() - start_time,
+        'write_seconds': write_seconds,
+        'read_latencies': read_latencies,
+    })
+
+
+def run(args, workers, lock_dir):
+    run_id = uuid.uuid4().hex[:8]
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    processes = [
+        context.Process(
+            target=run_worker,
+            args=(args, worker, lock_dir, run_id, barrier, results))
+        for worker in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    outcomes = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    from modelscope_agent.environment.graph_database import \
+        GraphDatabaseHandler
+    graph_db = GraphDatabaseHandler(
+        uri=args.uri,
+        user=args.user,
+        password=args.password,
+        database_name=args.db_name)
+    for worker in range(1 if args.shared_task else workers):
+        graph_db.clear_task_data('bench_{}_{}'.format(
+            run_id, 'shared' if args.shared_task else worker))
+
+    elapsed = max(outcome['elapsed'] for outcome in outcomes)
+    latencies = sorted(latency for outcome in outcomes
+                       for latency in outcome['read_latencies'])
+    return {
+        'rows_per_second':
+        sum(outcome['written'] for outcome in outcomes) / elapsed,
+        'read_p50_ms':
+        statistics.median(latencies) * 1000,
+        'read_p95_ms':
+        latencies[int(len(latencies) * 0.95) - 1] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--uri', default=None)
+    parser.add_argument('--user', default='neo4j')
+    parser.add_argument('--password', default='')
+    parser.add_argument('--db_name', default='neo4j')
+    parser.add_argument('--workers', default='1,2,4,8,16,32')
+    parser.add_argument(
+        '--nodes', type=int, default=500, help='nodes written per worker')
+    parser.add_argument('--batch_size', type=int, default=50)
+    parser.add_argument(
+        '--mode', choices=['task', 'global'], default='task')
+    parser.add_argument('--shared_task', action='store_true')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as lock_dir:
+        if args.uri is None:
+            args.uri = 'embedded://' + os.path.join(lock_dir, 'graph.db')
+        print('mode={} shared_task={} uri={}'.format(args.mode,
+                                                     args.shared_task,
+                                                     args.uri))
+        print('{:>8} {:>12} {:>13} {:>13}'.format('workers', 'rows/s',
+                                                  'read p50 ms',
+                                                  'read p95 ms'))
+        for workers in (int(n) for n in args.workers.split(',')):
+            result = run(args, workers, lock_dir)
+            print('{:>8} {:>12.0f} {:>13.2f} {:>13.2f}'.format(
+                workers, result['rows_per_second'], result['read_p50_ms'],
+                result['read_p95_ms']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+import threading
+import time
+
+from modelscope_agent.agents.codexgraph_agent import CypherAgent
+from modelscope_agent.environment.graph_database.query_budget import \
+    consume_records
+
+
+class FakeLLM:
+
+    def __init__(self, answers):
+        self.answers = list(answers)
+
+    def chat(self, messages, **kwargs):
+        return self.answers.pop(0)
+
+    def get_usage(self):
+        return {}
+
+
+class SlowGraphDB:
+
+    def __init__(self):
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def graph_version(self, task_id=None):
+        return None
+
+    def execute_query_with_timeout(self, cypher, budget=None, render=str):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        # Later queries finish first.
+        time.sleep(0.3 - 0.1 * int(cypher.split('RETURN ')[1]))
+        with self.lock:
+            self.running -= 1
+        if 'broken' in cypher:
+            return 'Invalid input', False
+        return consume_records([cypher.split('RETURN ')[1]], budget,
+                               render), True
+
+
+def cypher_answer(*queries):
+    return '\n'.join('```cypher\n{}\n```'.format(query) for query in queries)
+
+
+def test_queries_run_concurrently_in_order():
+    graph_db = SlowGraphDB()
+    agent = CypherAgent(llm=object(), graph_db=graph_db, task_id='t')
+    responses = agent.execute_cyphers(
+        ['MATCH (n) RETURN {}'.format(i) for i in range(3)])
+    assert responses == [('0', True), ('1', True), ('2', True)]
+    assert graph_db.max_running == 3
+
+
+def test_failed_batch_is_retried():
+    llm = FakeLLM([
+        cypher_answer('MATCH (broken) RETURN 0', 'MATCH (n) RETURN 1'),
+        cypher_answer('MATCH (n) RETURN 2'),
+    ])
+    agent = CypherAgent(llm=llm, graph_db=SlowGraphDB(), task_id='t')
+    response = agent._run('find things')
+    assert response == ('### Extracted Cypher query 0:\nMATCH (n) RETURN 2\n'
+                        '### Response for Cypher query 0:\n2\n\n')
+    assert llm.answers == []
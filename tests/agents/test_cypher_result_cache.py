@@ -0,0 +1,63 @@
+from modelscope_agent.agents.codexgraph_agent import CypherAgent
+from modelscope_agent.agents.codexgraph_agent.utils.result_cache import (
+    CypherResultCache, normalize_cypher)
+from modelscope_agent.environment.graph_database.query_budget import \
+    consume_records
+
+
+class FakeGraphDB:
+
+    def __init__(self):
+        self.version = 'v1'
+        self.queries = []
+
+    def graph_version(self, task_id=None):
+        return self.version
+
+    def execute_query_with_timeout(self, cypher, budget=None, render=str):
+        self.queries.append(cypher)
+        if 'broken' in cypher:
+            return 'Invalid input', False
+        return consume_records(['row'], budget, render), True
+
+
+def test_normalize_cypher_keeps_literals():
+    assert normalize_cypher('MATCH (n)\n  WHERE n.name = "a  b"\nRETURN n;') \
+        == 'MATCH (n) WHERE n.name = "a  b" RETURN n'
+
+
+def test_cache_expires_and_evicts(mocker):
+    clock = mocker.patch(
+        'modelscope_agent.agents.codexgraph_agent.utils.result_cache.'
+        'time.monotonic',
+        return_value=0.0)
+    cache = CypherResultCache(max_entries=2, ttl=10)
+    keys = [CypherResultCache.make_key('t', 'v', str(i)) for i in range(3)]
+    for key in keys:
+        cache.put(key, 'result')
+    assert cache.get(keys[0]) is None
+    assert cache.get(keys[2]) == 'result'
+    clock.return_value = 11.0
+    assert cache.get(keys[2]) is None
+    assert cache.stats()['hits'] == 1
+
+
+def test_agent_reuses_results_until_the_graph_changes():
+    graph_db = FakeGraphDB()
+    agent = CypherAgent(llm=object(), graph_db=graph_db, task_id='t')
+    assert agent.execute_cypher('MATCH (n) RETURN n') == ('row', True)
+    assert agent.execute_cypher('MATCH (n)  RETURN n;') == ('row', True)
+    assert len(graph_db.queries) == 1
+
+    graph_db.version = 'v2'
+    agent.execute_cypher('MATCH (n) RETURN n')
+    assert len(graph_db.queries) == 2
+
+    agent.execute_cypher('broken')
+    agent.execute_cypher('broken')
+    assert len(graph_db.queries) == 4
+    assert agent.get_cache_stats() == {
+        'hits': 1,
+        'misses': 4,
+        'hit_rate': 0.2,
+    }
@@ -0,0 +1,91 @@
+import os
+
+from modelscope_agent.environment.graph_database.ast_search import AstManager
+
+
+class FakeGraphDB:
+
+    def __init__(self, contains, members):
+        self.contains = contains
+        self.members = members
+        self.queries = []
+        self.edges = []
+        self.edge_updates = []
+        self.flushed = 0
+
+    def execute_query(self, query, **params):
+        self.queries.append(query)
+        if '[:CONTAINS]' in query:
+            return [{
+                'module': module,
+                'full_name': full_name,
+                'name': full_name.split('.')[-1],
+                'labels': ['t1', label],
+            } for module, full_name, label in self.contains]
+        return [{
+            'class': class_name,
+            'full_name': full_name,
+            'name': full_name.split('.')[-1] if full_name else None,
+            'relationship_type': 'HAS_METHOD' if full_name else None,
+        } for class_name, full_name in self.members]
+
+    def queue_edge(self, start_label=None, start_name='',
+                   relationship_type='', end_label=None, end_name='',
+                   params={}):
+        self.edges.append(
+            (start_name, relationship_type, end_name,
+             params['association_type']))
+
+    def queue_edge_update(self, start_name='', relationship_type='',
+                          end_name='', params={}):
+        self.edge_updates.append((start_name, relationship_type, end_name))
+
+    def flush(self):
+        self.flushed += 1
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def test_resolves_imports_and_inheritance_in_memory(tmpdir):
+    repo = str(tmpdir.mkdir('repo'))
+    write(os.path.join(repo, 'pkg', '__init__.py'),
+          'from pkg.impl import Thing\n')
+    write(
+        os.path.join(repo, 'pkg', 'impl.py'), 'class Thing:\n'
+        '    def run(self):\n        pass\n\n'
+        '    def stop(self):\n        pass\n')
+    write(
+        os.path.join(repo, 'app.py'), 'from pkg import Thing\n\n\n'
+        'class Sub(Thing):\n    def run(self):\n        pass\n')
+    write(os.path.join(repo, 'star.py'), 'from pkg.impl import *\n')
+
+    graph_db = FakeGraphDB(
+        contains=[('pkg.impl', 'pkg.impl.Thing', 'CLASS'),
+                  ('app', 'app.Sub', 'CLASS')],
+        members=[('pkg.impl.Thing', 'pkg.impl.Thing.run'),
+                 ('pkg.impl.Thing', 'pkg.impl.Thing.stop'),
+                 ('app.Sub', 'app.Sub.run')])
+    AstManager(repo, 't1', graph_db).run(py_files=[
+        os.path.join(repo, 'app.py'),
+        os.path.join(repo, 'pkg', '__init__.py'),
+        os.path.join(repo, 'pkg', 'impl.py'),
+        os.path.join(repo, 'star.py'),
+    ])
+
+    # two bulk reads, no per-import lookups
+    assert len(graph_db.queries) == 2
+    assert sorted(graph_db.edges) == [
+        ('app', 'CONTAINS', 'pkg.impl.Thing', 'CLASS'),
+        ('pkg', 'CONTAINS', 'pkg.impl.Thing', 'CLASS'),
+        ('star', 'CONTAINS', 'pkg.impl.Thing', 'CLASS'),
+    ]
+    # run is overridden, only stop is inherited
+    assert graph_db.edge_updates == [
+        ('app.Sub', 'INHERITS', 'pkg.impl.Thing'),
+        ('app.Sub', 'HAS_METHOD', 'pkg.impl.Thing.stop'),
+    ]
+    assert graph_db.flushed == 1
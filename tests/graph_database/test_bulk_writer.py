@@ -0,0 +1,132 @@
+import pytest
+from modelscope_agent.environment.graph_database import GraphDatabaseHandler
+
+
+class FakeTransaction:
+
+    def __init__(self):
+        self.statements = []
+
+    def run(self, query, **params):
+        self.statements.append((query, params))
+
+
+class FakeGraph:
+
+    def __init__(self):
+        self.transactions = []
+        self.committed = []
+        self.fail_commits = 0
+
+    def begin(self):
+        tx = FakeTransaction()
+        self.transactions.append(tx)
+        return tx
+
+    def commit(self, tx):
+        if self.fail_commits:
+            self.fail_commits -= 1
+            raise ConnectionError('connection lost')
+        self.committed.append(tx)
+
+    def rollback(self, tx):
+        pass
+
+
+@pytest.fixture
+def graph_db(mocker):
+    mocker.patch.object(
+        GraphDatabaseHandler, '_connect_to_graph', return_value=FakeGraph())
+    return GraphDatabaseHandler(
+        uri='bolt://localhost:7687',
+        user='neo4j',
+        password='',
+        task_id='task',
+        bulk_write=True,
+        batch_size=2)
+
+
+def test_bulk_writes_are_buffered_until_flush(graph_db):
+    graph_db.add_node('MODULE', 'm', parms={'name': 'm'})
+    graph_db.add_node('CLASS', 'm.A', parms={'name': 'A'})
+    graph_db.add_node('CLASS', 'm.A', parms={'code': 'class A: ...'})
+    graph_db.add_edge('MODULE', 'm', 'CONTAINS', 'CLASS', 'm.A',
+                      {'association_type': 'CLASS'})
+    assert graph_db.graph.transactions == []
+
+    assert graph_db.flush() == 3
+    assert len(graph_db.graph.committed) == 1
+    statements = graph_db.graph.committed[0].statements
+    assert len(statements) == 3
+
+    class_query, class_params = statements[1]
+    assert 'MERGE (n:`task` {full_name: row.full_name})' in class_query
+    assert 'n:`CLASS`' in class_query
+    assert class_params['rows'] == [{
+        'full_name': 'm.A',
+        'parms': {
+            'name': 'A',
+            'code': 'class A: ...'
+        }
+    }]
+
+    edge_query, edge_params = statements[2]
+    assert 'MERGE (s)-[r:`CONTAINS`]->(e)' in edge_query
+    assert edge_params['rows'][0]['start_name'] == 'm'
+
+    assert graph_db.flush() == 0
+
+
+def test_flush_splits_rows_into_batches(graph_db):
+    for i in range(5):
+        graph_db.add_edge('METHOD', f'a{i}', 'CALL', 'FUNCTION', f'b{i}')
+    graph_db.flush()
+    statements = graph_db.graph.committed[0].statements
+    assert [len(params['rows']) for _, params in statements] == [2, 2, 1]
+
+
+def test_update_node_merges_into_buffered_node(graph_db):
+    graph_db.add_node('FUNCTION', 'm.f', parms={'name': 'f'})
+    graph_db.update_node('m.f', parms={'description': 'does f'})
+    graph_db.update_node('m.g', parms={'description': 'does g'})
+    graph_db.flush()
+    statements = graph_db.graph.committed[0].statements
+    assert statements[0][1]['rows'][0]['parms'] == {
+        'name': 'f',
+        'description': 'does f'
+    }
+    assert statements[1][0].startswith('UNWIND $rows AS row MATCH')
+    assert statements[1][1]['rows'] == [{
+        'full_name': 'm.g',
+        'parms': {
+            'description': 'does g'
+        }
+    }]
+
+
+def test_edge_updates_only_match_existing_nodes(graph_db):
+    graph_db.queue_edge_update('m.B', 'INHERITS', 'm.A')
+    graph_db.queue_edge_update('m.C', 'INHERITS', 'm.A')
+    graph_db.queue_edge_update('m.B', 'HAS_METHOD', 'm.A.f')
+
+    assert graph_db.flush() == 3
+    statements = graph_db.graph.committed[0].statements
+    assert len(statements) == 2
+    query, params = statements[0]
+    assert 'MATCH (s:`task` {full_name: row.start_name})' in query
+    assert 'MERGE (s)-[r:`INHERITS`]->(e)' in query
+    assert 'CREATE' not in query
+    assert [row['start_name'] for row in params['rows']] == ['m.B', 'm.C']
+
+
+def test_failed_flush_keeps_the_rows(graph_db):
+    graph_db.add_node('FUNCTION', 'm.f', parms={'name': 'f'})
+    graph_db.add_edge('MODULE', 'm', 'CONTAINS', 'FUNCTION', 'm.f')
+    graph_db.graph.fail_commits = 1
+
+    with pytest.raises(ConnectionError):
+        graph_db.flush()
+    assert graph_db.graph.committed == []
+
+    assert graph_db.flush() == 2
+    assert graph_db.flush() == 0
@@ -0,0 +1,50 @@
+import os
+
+from modelscope_agent.environment.graph_database.indexer.description_cache import (
+    DescriptionCache, description_key)
+
+
+def test_key_ignores_indentation_and_whitespace():
+    code = 'def f():\n    return 1\n'
+    indented = '    def f():  \r\n        return 1'
+    assert description_key(code) == description_key(indented)
+    assert description_key(code) != description_key('def f():\n    return 2')
+    assert description_key(code, 'model-a') != description_key(
+        code, 'model-b')
+    assert description_key(code, 'm', 1) != description_key(code, 'm', 2)
+
+
+def test_put_get_and_hit_rate():
+    cache = DescriptionCache(':memory:')
+    key = description_key('def f(): pass')
+    assert cache.get(key) is None
+    cache.put(key, 'does nothing')
+    assert cache.get(key) == 'does nothing'
+    assert key in cache
+    stats = cache.stats()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+    assert stats['hit_rate'] == 0.5
+    assert stats['total_cached'] == 1
+
+
+def test_evicts_least_recently_used():
+    cache = DescriptionCache(':memory:', max_entries=2, evict_every=1)
+    cache.put('a', 'A')
+    cache.put('b', 'B')
+    cache.get('a')
+    cache.put('c', 'C')
+    assert len(cache) == 2
+    assert 'b' not in cache
+    assert cache.get('a') == 'A'
+    assert cache.get('c') == 'C'
+
+
+def test_entries_are_shared_between_instances(tmpdir):
+    path = os.path.join(str(tmpdir), 'descriptions.sqlite3')
+    writer = DescriptionCache(path)
+    writer.put('key', 'description')
+    writer.close()
+    reader = DescriptionCache(path)
+    assert reader.get('key') == 'description'
+    reader.close()
@@ -0,0 +1,145 @@
+import time
+
+from modelscope_agent.environment.graph_database.description_pipeline import (
+    DescriptionPipeline, TokenRateLimiter)
+from modelscope_agent.environment.graph_database.indexer.description_cache import \
+    DescriptionCache
+from modelscope_agent.environment.graph_database.indexer.method_description_generator import \
+    MethodDescriptionGenerator
+
+
+class FakeGraphDB:
+
+    def __init__(self, records):
+        self.records = records
+        self.updates = {}
+        self.flushes = 0
+
+    def execute_query_with_exception(self, query, **params):
+        if 'RETURN n.full_name' in query:
+            return self.records, True
+        return [{
+            'source': 'm.f0',
+            'relationship_type': 'CALL',
+            'target': 'm.f1'
+        }], True
+
+    def queue_node_update(self, full_name, parms={}):
+        self.updates[full_name] = parms
+
+    def flush(self):
+        self.flushes += 1
+
+
+class FakeGenerator:
+
+    def __init__(self):
+        self.llm_config = {'max_tokens': 10}
+        self.single_calls = []
+        self.batch_calls = []
+
+    def get_cached_description(self, method_code, method_name):
+        return 'cached' if method_name == 'cached' else None
+
+    def generate_method_description(self,
+                                    method_code,
+                                    method_name,
+                                    class_name,
+                                    file_path,
+                                    relations,
+                                    raise_on_error=False,
+                                    skip_cache_lookup=False):
+        assert skip_cache_lookup
+        self.single_calls.append((method_name, relations))
+        return 'describes ' + method_name
+
+    def generate_batch_descriptions(self,
+                                    methods,
+                                    raise_on_error=False,
+                                    skip_cache_lookup=False):
+        assert skip_cache_lookup
+        self.batch_calls.append([m['method_name'] for m in methods])
+        return ['describes ' + m['method_name'] for m in methods]
+
+
+def make_records(tmpdir, count):
+    source = tmpdir.join('mod.py')
+    source.write('\n'.join(f'def f{i}():\n    return {i}'
+                           for i in range(count)))
+    records = []
+    for i in range(count):
+        marker = '<CODE>{"S":%d,"E":%d,"F":"%s"}</CODE>' % (2 * i + 1,
+                                                           2 * i + 2, source)
+        records.append({
+            'full_name': f'm.f{i}',
+            'name': f'f{i}',
+            'class_name': None,
+            'file_path': 'mod.py',
+            'code': marker
+        })
+    return records
+
+
+def test_resolve_code_markers(tmpdir):
+    records = make_records(tmpdir, 2)
+    pipeline = DescriptionPipeline(
+        FakeGraphDB([]), 't1', generator=FakeGenerator())
+    assert pipeline.resolve_code(
+        records[1]['code']) == 'def f1():\n    return 1'
+
+
+def test_run_packs_methods_and_writes_in_batches(tmpdir):
+    records = make_records(tmpdir, 5)
+    records.append(dict(records[0], full_name='m.cached', name='cached'))
+    graph_db = FakeGraphDB(records)
+    generator = FakeGenerator()
+    pipeline = DescriptionPipeline(
+        graph_db,
+        't1',
+        generator=generator,
+        concurrency=2,
+        methods_per_prompt=2,
+        write_batch_size=2)
+    stats = pipeline.run()
+
+    assert stats['methods'] == 6
+    assert stats['cached'] == 1
+    assert stats['generated'] == 5
+    assert stats['llm_requests'] == 3
+    assert sorted(sum(generator.batch_calls, [])) == ['f0', 'f1', 'f2', 'f3']
+    assert generator.single_calls == [('f4', None)]
+    assert graph_db.updates['m.cached'] == {'description': 'cached'}
+    assert graph_db.updates['m.f3'] == {'description': 'describes f3'}
+    assert graph_db.flushes >= 2
+
+
+def test_single_method_prompts_get_relations(tmpdir):
+    graph_db = FakeGraphDB(make_records(tmpdir, 2))
+    generator = FakeGenerator()
+    DescriptionPipeline(graph_db, 't1', generator=generator).run()
+    relations = dict(generator.single_calls)
+    assert relations['f0']['outgoing_calls'] == ['m.f1']
+    assert relations['f1']['incoming_calls'] == ['m.f0']
+
+
+def test_token_rate_limiter_blocks_when_budget_is_spent():
+    limiter = TokenRateLimiter(tokens_per_minute=600)
+    limiter.acquire(600)
+    start = time.monotonic()
+    limiter.acquire(5)
+    assert time.monotonic() - start >= 0.4
+
+
+def test_uncached_methods_count_one_miss(tmpdir, mocker):
+    cache = DescriptionCache(':memory:')
+    generator = MethodDescriptionGenerator(
+        llm_config={'model_name': 'm'}, cache=cache)
+    mocker.patch.object(
+        generator, '_call_llm', return_value='{"1": "a", "2": "b"}')
+    graph_db = FakeGraphDB(make_records(tmpdir, 4))
+    DescriptionPipeline(
+        graph_db, 't1', generator=generator, methods_per_prompt=2).run()
+
+    stats = cache.stats()
+    assert stats['misses'] == 4
+    assert stats['hits'] == 0
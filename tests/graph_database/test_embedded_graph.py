@@ -0,0 +1,198 @@
+import os
+import threading
+import time
+
+import pytest
+from modelscope_agent.environment.graph_database import GraphDatabaseHandler
+from modelscope_agent.environment.graph_database.indexer.embedded_cypher import (
+    CypherError, QueryCancelled)
+from modelscope_agent.environment.graph_database.indexer.embedded_graph import \
+    EmbeddedGraph
+
+
+@pytest.fixture
+def graph_path(tmpdir):
+    return os.path.join(str(tmpdir), 'graph.db')
+
+
+def make_handler(graph_path, **kwargs):
+    return GraphDatabaseHandler(
+        uri='embedded://' + graph_path,
+        user='',
+        password='',
+        task_id='task',
+        **kwargs)
+
+
+def build_sample(graph_db):
+    graph_db.add_node('MODULE', 'm', parms={'name': 'm', 'file_path': 'm.py'})
+    graph_db.add_node('CLASS', 'm.A', parms={'name': 'A', 'file_path': 'm.py'})
+    graph_db.add_node('CLASS', 'm.B', parms={'name': 'B', 'file_path': 'm.py'})
+    graph_db.add_node(
+        'METHOD', 'm.A.run', parms={
+            'name': 'run',
+            'file_path': 'm.py'
+        })
+    graph_db.add_edge('MODULE', 'm', 'CONTAINS', 'CLASS', 'm.A',
+                      {'association_type': 'CLASS'})
+    graph_db.add_edge('MODULE', 'm', 'CONTAINS', 'CLASS', 'm.B',
+                      {'association_type': 'CLASS'})
+    graph_db.add_edge('CLASS', 'm.A', 'HAS_METHOD', 'METHOD', 'm.A.run')
+    graph_db.add_edge('CLASS', 'm.B', 'INHERITS', 'CLASS', 'm.A')
+    graph_db.flush()
+
+
+def test_bulk_writes_and_prompt_queries(graph_path):
+    graph_db = make_handler(graph_path, bulk_write=True)
+    build_sample(graph_db)
+
+    records = graph_db.execute_query(
+        'MATCH (c:CLASS:`task`)-[:HAS_METHOD]->(m:METHOD) '
+        'WHERE c.name = $name RETURN m.name AS method', name='A')
+    assert [record['method'] for record in records] == ['run']
+
+    records = graph_db.execute_query(
+        'MATCH (sub:CLASS)-[:INHERITS]->(base:CLASS {name: "A"}) '
+        'RETURN sub.full_name AS sub, base')
+    assert records[0]['sub'] == 'm.B'
+    base = records[0]['base']
+    assert set(base.labels) == {'CLASS', 'task'}
+    assert base['full_name'] == 'm.A'
+
+    records = graph_db.execute_query(
+        'MATCH (m:MODULE)-[r:CONTAINS]->(c) '
+        'RETURN m.name AS module, count(c) AS classes, '
+        'collect(c.name) AS names ORDER BY module')
+    assert records[0]['classes'] == 2
+    assert sorted(records[0]['names']) == ['A', 'B']
+
+    records = graph_db.execute_query(
+        'MATCH (n:`task`) WHERE n.name =~ "(?i)a|run" AND NOT n:MODULE '
+        'RETURN n.full_name AS name ORDER BY name DESC LIMIT 5')
+    assert [record['name'] for record in records] == ['m.A.run', 'm.A']
+
+    response, ok = graph_db.execute_query_with_exception(
+        'MATCH (n) RETURN n.name AS name ORDER BY')
+    assert not ok and 'Invalid input' in response
+
+
+def test_write_through_without_bulk_write(graph_path):
+    graph_db = make_handler(graph_path)
+
+    graph_db.add_node('CLASS', 'm.A', parms={'name': 'A'})
+    graph_db.add_node('METHOD', 'm.A.f', parms={'name': 'f'})
+    graph_db.add_edge('CLASS', 'm.A', 'HAS_METHOD', 'METHOD', 'm.A.f')
+    graph_db.update_node('m.A.f', {'code': 'def f(): ...'})
+
+    records = graph_db.execute_query(
+        'MATCH (:CLASS)-[:HAS_METHOD]->(m) RETURN m.code AS code')
+    assert [record['code'] for record in records] == ['def f(): ...']
+
+
+def test_clear_task_data(graph_path):
+    graph_db = make_handler(graph_path, bulk_write=True)
+    build_sample(graph_db)
+    graph_db.execute_query('CREATE (:`task` {full_name: "only_task"})')
+    graph_db.execute_query(
+        'MATCH (n:`task` {full_name: "m.A"}) SET n:`other_task`')
+
+    assert graph_db.clear_task_data('task', batch_size=2) == 5
+
+    assert graph_db.execute_query(
+        'MATCH (n:`task`) RETURN count(n) AS n')[0]['n'] == 0
+    # Only the node shared with another task is left.
+    records = graph_db.execute_query(
+        'MATCH (n) RETURN n.full_name AS name, labels(n) AS labels')
+    assert [(r['name'], sorted(r['labels'])) for r in records] == [
+        ('m.A', ['CLASS', 'other_task'])
+    ]
+
+
+def test_changes_persist_across_instances(graph_path):
+    graph_db = make_handler(graph_path, bulk_write=True)
+    build_sample(graph_db)
+    version = graph_db.bump_graph_version()
+
+    other = make_handler(graph_path)
+    assert other.graph_version('task') == version
+    assert other.execute_query(
+        'MATCH (n:`task`) RETURN count(n) AS n')[0]['n'] == 4
+
+    # The first handler sees the second one's writes on its next query.
+    other.execute_query('MATCH (n {full_name: "m.B"}) DETACH DELETE n')
+    assert graph_db.execute_query(
+        'MATCH (n:`task`) RETURN count(n) AS n')[0]['n'] == 3
+
+    graph_db.graph.checkpoint()
+    reopened = EmbeddedGraph(graph_path)
+    assert reopened.run('MATCH (n:CLASS) RETURN n.name').evaluate() == 'A'
+
+
+def test_failed_transaction_rolls_back(graph_path):
+    graph = EmbeddedGraph(graph_path)
+    graph.run('CREATE (:CLASS {full_name: "m.A"})')
+
+    tx = graph.begin()
+    tx.run('MATCH (n) SET n.name = "changed"')
+    tx.run('CREATE (:CLASS {full_name: "m.B"})')
+    with pytest.raises(CypherError):
+        tx.run('MATCH (n) RETURN unknown_variable')
+    graph.rollback(tx)
+
+    assert graph.run('MATCH (n) RETURN n.full_name, n.name').data() == [{
+        'n.full_name': 'm.A',
+        'n.name': None
+    }]
+    assert EmbeddedGraph(graph_path).node_count() == 1
+
+
+def test_explain_reports_index_seeks(graph_path):
+    graph_db = make_handler(graph_path, bulk_write=True)
+    build_sample(graph_db)
+
+    report = graph_db.index_usage_report()
+    assert report['match_node']['uses_index']
+    assert report['bulk_merge_node']['uses_index']
+
+    report = graph_db.index_usage_report(
+        {'scan': 'MATCH (n) WHERE n.code CONTAINS "x" RETURN n'})
+    assert report['scan']['operators'] == ['ProduceResults', 'AllNodesScan']
+
+
+def test_timed_out_query_releases_the_graph(graph_path):
+    graph_db = make_handler(graph_path, bulk_write=True)
+    for i in range(200):
+        graph_db.add_node('CLASS', f'm.C{i}', parms={'name': f'C{i}'})
+    graph_db.flush()
+
+    response, flag = graph_db.execute_query_with_timeout(
+        'MATCH (a:`task`), (b:`task`), (c:`task`) RETURN count(*)',
+        timeout=0.5)
+    assert response == 'cypher too complex, out of memory'
+    start = time.monotonic()
+    records = graph_db.execute_query(
+        'MATCH (n:CLASS {full_name: "m.C1"}) RETURN n.name AS name')
+    assert records[0]['name'] == 'C1'
+    assert time.monotonic() - start < 2
+    assert graph_db.query_metrics()['cancelled'] == 1
+
+
+def test_kill_cancels_a_running_query(graph_path):
+    graph = EmbeddedGraph(graph_path)
+    graph.run('UNWIND range(1, 300) AS i CREATE (:N {i: i})')
+    errors = []
+
+    def run():
+        try:
+            graph.run('/* slow */ MATCH (a:N), (b:N), (c:N) RETURN count(*)')
+        except CypherError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    while not graph.kill_queries('/* slow */'):
+        time.sleep(0.01)
+    thread.join(5)
+    assert not thread.is_alive()
+    assert isinstance(errors[0], QueryCancelled)
+    assert graph.node_count() == 300
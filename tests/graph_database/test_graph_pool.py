@@ -0,0 +1,118 @@
+import pytest
+from modelscope_agent.environment.graph_database import GraphDatabaseHandler
+from modelscope_agent.environment.graph_database.indexer import graph_pool
+from modelscope_agent.environment.graph_database.indexer.graph_pool import \
+    GraphPoolRegistry
+
+
+class FakeConnector:
+
+    def __init__(self):
+        self.in_use = {'server': 0}
+        self.closed = False
+
+    def _acquire(self, graph_name=None, readonly=False):
+        self.in_use['server'] += 1
+        return 'connection'
+
+    def close(self):
+        self.closed = True
+
+
+class FakeService:
+
+    def __init__(self):
+        self.connector = FakeConnector()
+
+
+class FakeGraph:
+
+    def __init__(self, uri, database_name):
+        self.uri = uri
+        self.database_name = database_name
+        self.service = FakeService()
+        self.alive = True
+
+    def run(self, query, **params):
+        self.service.connector._acquire()
+        if not self.alive:
+            raise ConnectionError('server is gone')
+        return self
+
+    def evaluate(self):
+        return 1
+
+
+@pytest.fixture
+def registry(mocker):
+    registry = GraphPoolRegistry(max_size=4, liveness_check_interval=0)
+    mocker.patch.object(
+        registry,
+        '_connect',
+        side_effect=lambda uri, user, password, database_name: FakeGraph(
+            uri, database_name))
+    mocker.patch.object(
+        graph_pool, 'get_graph_pool_registry', return_value=registry)
+    mocker.patch(
+        'modelscope_agent.environment.graph_database.graph_database.'
+        'get_graph_pool_registry',
+        return_value=registry)
+    return registry
+
+
+def make_handler(task_id, database_name='neo4j'):
+    return GraphDatabaseHandler(
+        uri='bolt://localhost:7687',
+        user='neo4j',
+        password='secret',
+        database_name=database_name,
+        task_id=task_id)
+
+
+def test_handlers_share_one_pool_per_database(registry):
+    first = make_handler('task_a')
+    second = make_handler('task_b')
+    other_database = make_handler('task_a', database_name='other')
+
+    assert first.graph is second.graph
+    assert first.node_matcher is second.node_matcher
+    assert other_database.graph is not first.graph
+
+    metrics = {m['database']: m for m in registry.metrics()}
+    assert metrics['neo4j']['acquires'] == 2
+    assert metrics['other']['acquires'] == 1
+    assert 'secret' not in str(metrics)
+
+
+def test_metrics_count_connection_acquisitions(registry):
+    graph_db = make_handler('task')
+    graph_db.graph.service.connector._acquire()
+    graph_db.graph.service.connector._acquire()
+
+    metrics = graph_db.pool_metrics()
+    assert metrics['acquire_waits'] == 2
+    assert metrics['in_use'] == 2
+    assert metrics['utilization'] == 0.5
+    assert metrics['max_acquire_wait_seconds'] >= 0.0
+
+
+def test_dead_pool_is_reconnected_on_acquire(registry):
+    graph_db = make_handler('task')
+    old_graph = graph_db.graph
+    old_graph.alive = False
+
+    make_handler('other_task')
+
+    assert old_graph.service.connector.closed
+    # Handlers created before the reconnect follow the pool's new graph.
+    assert graph_db.graph is not old_graph
+    metrics = graph_db.pool_metrics()
+    assert metrics['reconnects'] == 1
+    assert metrics['liveness_failures'] == 1
+
+
+def test_configure_rejects_unknown_settings(registry):
+    registry.configure(max_size=8)
+    assert registry.max_size == 8
+    with pytest.raises(TypeError):
+        registry.configure(size=8)
@@ -0,0 +1,128 @@
+import os
+
+from modelscope_agent.environment.graph_database import GraphDatabaseHandler
+from modelscope_agent.environment.graph_database.incremental import (
+    IncrementalIndexer, TaskManifest, imported_modules)
+
+
+class FakeGraphDB:
+
+    def __init__(self):
+        self.queries = []
+        self.versions = 0
+
+    def execute_query_with_exception(self, query, **params):
+        self.queries.append((query, params))
+        return [], True
+
+    def execute_query(self, query, **params):
+        return []
+
+    def update_edge(self, *args, **kwargs):
+        return None
+
+    def queue_edge(self, *args, **kwargs):
+        pass
+
+    def queue_edge_update(self, *args, **kwargs):
+        pass
+
+    def flush(self):
+        return 0
+
+    def bump_graph_version(self, task_id=None):
+        self.versions += 1
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def make_repo(tmpdir):
+    repo = str(tmpdir.mkdir('repo'))
+    write(os.path.join(repo, 'pkg', '__init__.py'), '')
+    write(os.path.join(repo, 'pkg', 'base.py'), 'class Base:\n    pass\n')
+    write(
+        os.path.join(repo, 'pkg', 'child.py'),
+        'from pkg.base import Base\n\n\nclass Child(Base):\n    pass\n')
+    write(os.path.join(repo, 'other.py'), 'import os\n')
+    return repo
+
+
+def test_imported_modules(tmpdir):
+    repo = make_repo(tmpdir)
+    assert imported_modules(repo, os.path.join(
+        repo, 'pkg', 'child.py')) == ['pkg.base', 'pkg.base.Base']
+
+
+def test_manifest_round_trip(tmpdir):
+    repo = make_repo(tmpdir)
+    manifest = TaskManifest('t1', repo, manifest_dir=str(tmpdir))
+    manifest.files = {'other.py': {'hash': 'x'}}
+    manifest.save()
+
+    loaded = TaskManifest('t1', repo, manifest_dir=str(tmpdir))
+    assert loaded.load()
+    assert loaded.files == {'other.py': {'hash': 'x'}}
+    assert not TaskManifest(
+        't1', str(tmpdir), manifest_dir=str(tmpdir)).load()
+
+
+def test_only_changed_files_are_reindexed(tmpdir):
+    repo = make_repo(tmpdir)
+    indexed = []
+    graph_db = FakeGraphDB()
+    updater = IncrementalIndexer(
+        graph_db,
+        repo,
+        't1',
+        lambda files, progress=None: indexed.extend(files),
+        manifest_dir=str(tmpdir))
+    file_list = sorted(
+        os.path.join(root, name) for root, _, names in os.walk(repo)
+        for name in names)
+    updater.record_full_build(file_list)
+
+    summary = updater.run(file_list)
+    assert summary['changed'] == summary['added'] == summary['deleted'] == []
+    assert indexed == []
+    assert graph_db.versions == 0
+
+    base = os.path.join(repo, 'pkg', 'base.py')
+    write(base, 'class Base:\n    x = 1\n')
+    os.remove(os.path.join(repo, 'other.py'))
+    file_list.remove(os.path.join(repo, 'other.py'))
+
+    summary = updater.run(file_list)
+    assert summary['changed'] == [base]
+    assert summary['deleted'] == [os.path.join(repo, 'other.py')]
+    assert indexed == [base]
+    assert graph_db.versions == 1
+    assert updater.dependents([base]) == [os.path.join(repo, 'pkg', 'child.py')]
+    assert 'other.py' not in updater.manifest.files
+
+
+def test_restored_edges_count_only_merged_edges(tmpdir):
+    graph_db = GraphDatabaseHandler(
+        uri='embedded://' + os.path.join(str(tmpdir), 'graph.db'),
+        user='',
+        password='',
+        task_id='t1')
+    graph_db.add_node('CLASS', 'm.A', parms={'name': 'A'})
+    graph_db.add_node('CLASS', 'm.B', parms={'name': 'B'})
+    updater = IncrementalIndexer(
+        graph_db,
+        str(tmpdir),
+        't1',
+        lambda files, progress=None: None,
+        manifest_dir=str(tmpdir))
+
+    edges = [{
+        'source': 'm.B',
+        'relationship_type': 'INHERITS',
+        'params': {},
+        'target': target
+    } for target in ('m.A', 'm.gone')]
+    assert updater._restore_edges(edges) == 1
@@ -0,0 +1,80 @@
+import os
+
+from modelscope_agent.environment.graph_database.ast_search import \
+    ParsedFileStore
+from modelscope_agent.environment.graph_database.ast_search.parsed_store import \
+    summarize_source
+
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def make_repo(tmpdir):
+    repo = str(tmpdir.mkdir('repo'))
+    write(os.path.join(repo, 'pkg', '__init__.py'), 'from pkg.base import *\n')
+    write(os.path.join(repo, 'pkg', 'base.py'), 'class Base:\n    pass\n')
+    write(
+        os.path.join(repo, 'pkg', 'child.py'),
+        'import os\nfrom pkg.base import Base\n\n\n'
+        'class Child(Base, os.PathLike):\n    pass\n')
+    return repo
+
+
+def test_summarize_source(tmpdir):
+    repo = make_repo(tmpdir)
+    child = os.path.join(repo, 'pkg', 'child.py')
+    with open(child) as f:
+        summary = summarize_source(child, f.read(), repo)
+    assert summary == {
+        'module': 'pkg.child',
+        'imports': [('pkg.base', ['Base'])],
+        'modules': ['os'],
+        'classes': [('Child', ['Base'])],
+    }
+
+    init = os.path.join(repo, 'pkg', '__init__.py')
+    assert summarize_source(init, 'from pkg.base import *\n', repo) == {
+        'module': 'pkg',
+        'imports': [('pkg.base', ['*'])],
+        'modules': [],
+        'classes': [],
+    }
+    assert summarize_source(child, 'def broken(:\n', repo) is None
+
+
+def test_files_are_parsed_once(tmpdir):
+    repo = make_repo(tmpdir)
+    base = os.path.join(repo, 'pkg', 'base.py')
+    child = os.path.join(repo, 'pkg', 'child.py')
+    with ParsedFileStore(repo) as store:
+        store.put(child, {'module': 'pkg.child'})
+        assert store.get(child) == {'module': 'pkg.child'}
+        assert store.parsed == 0
+
+        assert store.get(base)['module'] == 'pkg.base'
+        assert store.get(base)['module'] == 'pkg.base'
+        assert store.parsed == 1
+        assert store.get(os.path.join(repo, 'missing.py')) is None
+
+
+def test_summaries_spill_beyond_the_memory_budget(tmpdir):
+    repo = make_repo(tmpdir)
+    store = ParsedFileStore(repo, max_bytes=1)
+    paths = [os.path.join(repo, 'f{}.py'.format(i)) for i in range(5)]
+    for i, path in enumerate(paths):
+        store.put(path, {'module': 'f{}'.format(i), 'classes': [('A', ['B'])]})
+
+    assert len(store) == 5
+    assert len(store._memory) == 1
+    for i, path in enumerate(paths):
+        assert path in store
+        assert store.get(path)['module'] == 'f{}'.format(i)
+    assert store.parsed == 0
+
+    store.put(paths[0], {'module': 'changed'})
+    assert store.get(paths[0]) == {'module': 'changed'}
+    store.close()
+    assert len(store) == 0
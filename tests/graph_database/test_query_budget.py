@@ -0,0 +1,143 @@
+from modelscope_agent.environment.graph_database import GraphDatabaseHandler
+from modelscope_agent.environment.graph_database.query_budget import (
+    QueryBudget, consume_records)
+
+
+class FakeResult:
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.buffer = []
+        self.more = True
+
+    def fields(self):
+        return ['n']
+
+    def take(self):
+        return self.buffer.pop(0) if self.buffer else None
+
+    def has_more_records(self):
+        return self.more
+
+
+class FakeConnector:
+    profile = None
+
+    def __init__(self, rows):
+        self.result = FakeResult(rows)
+        self.pulls = []
+        self.discarded = False
+
+    def auto_run(self, query, params, graph_name=None):
+        return self.result
+
+    def pull(self, result, n=-1):
+        self.pulls.append(n)
+        count = len(result.rows) if n == -1 else n
+        result.buffer.extend([row] for row in result.rows[:count])
+        result.rows = result.rows[count:]
+        result.more = bool(result.rows)
+
+    def discard(self, result):
+        self.discarded = True
+        result.rows = []
+        result.more = False
+
+
+class FakeService:
+
+    def __init__(self, connector):
+        self.connector = connector
+
+
+class FakeGraph:
+    name = 'neo4j'
+
+    def __init__(self, rows):
+        self.service = FakeService(FakeConnector(rows))
+
+
+def make_handler(mocker, rows):
+    mocker.patch.object(
+        GraphDatabaseHandler,
+        '_connect_to_graph',
+        return_value=FakeGraph(rows))
+    mocker.patch(
+        'modelscope_agent.environment.graph_database.graph_database.'
+        'Connection.default_hydrant',
+        return_value=None)
+    return GraphDatabaseHandler(
+        uri='bolt://localhost:7687', user='neo4j', password='', task_id='t1')
+
+
+def test_rows_within_budget_are_complete():
+    result = consume_records(['a', 'b'], QueryBudget(max_rows=5))
+    assert result.rows == ['a', 'b']
+    assert not result.truncated
+    assert result.format() == 'a\n\nb'
+
+
+def test_row_and_byte_budgets_summarize_the_tail():
+    rendered = []
+
+    def render(record):
+        rendered.append(record)
+        return 'row {}'.format(record)
+
+    budget = QueryBudget(max_rows=3, sample_rows=2)
+    result = consume_records(range(100), budget, render)
+    assert result.rows == ['row 0', 'row 1', 'row 2']
+    assert result.skipped == 97
+    assert result.complete
+    assert len(result.samples) == 2
+    # Only the kept rows and the samples are rendered.
+    assert len(rendered) == 3 + 2
+    assert '97 more rows not shown' in result.format()
+
+    result = consume_records(['x' * 10] * 5, QueryBudget(max_bytes=25))
+    assert len(result.rows) == 2
+    assert result.skipped == 3
+
+    result = consume_records(['x' * 100], QueryBudget(max_bytes=10))
+    assert result.rows == ['x' * 10 + '...(truncated)']
+
+
+def test_scan_limit_abandons_the_stream():
+    closed = []
+
+    def records():
+        try:
+            for i in range(1000):
+                yield i
+        finally:
+            closed.append(True)
+
+    result = consume_records(records(),
+                             QueryBudget(max_rows=1, max_scan_rows=10))
+    assert closed == [True]
+    assert result.skipped == 9
+    assert not result.complete
+    assert 'at least 9 more rows' in result.format()
+
+
+def test_stream_query_pulls_in_batches(mocker):
+    graph_db = make_handler(mocker, list(range(7)))
+    connector = graph_db.graph.service.connector
+    records = list(graph_db.stream_query('MATCH (n) RETURN n', fetch_size=3))
+    assert [record['n'] for record in records] == list(range(7))
+    assert connector.pulls == [3, 3, 3]
+    assert not connector.discarded
+
+
+def test_budgeted_query_discards_the_rest(mocker):
+    graph_db = make_handler(mocker, list(range(100)))
+    connector = graph_db.graph.service.connector
+    result, flag = graph_db.execute_query_budgeted(
+        'MATCH (n) RETURN n',
+        QueryBudget(max_rows=2, max_scan_rows=5),
+        fetch_size=4)
+    assert flag
+    assert len(result.rows) == 2
+    assert not result.complete
+    assert connector.pulls == [4, 4]
+    assert connector.discarded
@@ -0,0 +1,66 @@
+import threading
+
+from modelscope_agent.environment.graph_database import GraphDatabaseHandler
+from modelscope_agent.environment.graph_database.graph_database import \
+    KILL_QUERY_TEMPLATE
+
+
+class FakeCursor(list):
+
+    def evaluate(self):
+        return self[0] if self else None
+
+
+class FakeGraph:
+
+    def __init__(self):
+        self.killed = threading.Event()
+        self.queries = []
+
+    def run(self, query, **params):
+        if query == KILL_QUERY_TEMPLATE:
+            killed = any(params['tag'] in q for q in self.queries)
+            self.killed.set()
+            return FakeCursor([int(killed)])
+        self.queries.append(query)
+        if 'slow' in query:
+            self.killed.wait(5)
+            raise RuntimeError('The transaction has been terminated.')
+        if 'broken' in query:
+            raise RuntimeError('Invalid input')
+        return FakeCursor([{'n': 1}])
+
+
+def make_handler(mocker):
+    mocker.patch.object(
+        GraphDatabaseHandler, '_connect_to_graph', return_value=FakeGraph())
+    return GraphDatabaseHandler(
+        uri='bolt://localhost:7687', user='neo4j', password='', task_id='t1')
+
+
+def test_completed_and_failed_queries_are_counted(mocker):
+    graph_db = make_handler(mocker)
+    response, flag = graph_db.execute_query_with_timeout('MATCH (n) RETURN n')
+    assert flag and response == [{'n': 1}]
+    assert graph_db.graph.queries[0].startswith('/* codexgraph-query-')
+
+    response, flag = graph_db.execute_query_with_timeout('broken')
+    assert not flag and response == 'Invalid input'
+
+    metrics = graph_db.query_metrics()
+    assert metrics['completed'] == 1
+    assert metrics['failed'] == 1
+    assert metrics['timed_out'] == 0
+
+
+def test_timed_out_query_is_killed_on_the_server(mocker):
+    graph_db = make_handler(mocker)
+    response, flag = graph_db.execute_query_with_timeout(
+        'MATCH (slow) RETURN slow', timeout=0.2)
+    assert flag and response == 'cypher too complex, out of memory'
+    assert graph_db.graph.killed.is_set()
+
+    metrics = graph_db.query_metrics()
+    assert metrics['timed_out'] == 1
+    assert metrics['cancelled'] == 1
+    assert metrics['completed'] == 0
@@ -0,0 +1,71 @@
+from modelscope_agent.environment.graph_database import GraphDatabaseHandler
+
+
+class FakeCursor:
+
+    def __init__(self, plan=None):
+        self._plan = plan
+
+    def plan(self):
+        return self._plan
+
+
+class FakeGraph:
+
+    def __init__(self, failing=(), plan=None):
+        self.failing = failing
+        self.queries = []
+        self._plan = plan
+
+    def run(self, query, **params):
+        self.queries.append(query)
+        if any(word in query for word in self.failing):
+            raise RuntimeError('unsupported: ' + query)
+        return FakeCursor(self._plan)
+
+
+def make_handler(mocker, graph):
+    mocker.patch.object(
+        GraphDatabaseHandler, '_connect_to_graph', return_value=graph)
+    return GraphDatabaseHandler(
+        uri='bolt://localhost:7687', user='neo4j', password='', task_id='t1')
+
+
+def test_create_indexes_uses_constraint_for_full_name(mocker):
+    graph_db = make_handler(mocker, FakeGraph())
+    report = graph_db.create_indexes()
+    assert set(report.values()) == {'ok'}
+    assert len(graph_db.graph.queries) == 3
+    assert 'CONSTRAINT `codexgraph_t1_full_name_unique`' in \
+        graph_db.graph.queries[0]
+    assert 'INDEX `codexgraph_t1_name` IF NOT EXISTS' in \
+        graph_db.graph.queries[1]
+
+
+def test_create_indexes_falls_back_to_plain_index(mocker):
+    graph_db = make_handler(mocker, FakeGraph(failing=('CONSTRAINT', )))
+    report = graph_db.create_indexes('t2')
+    assert 'INDEX `codexgraph_t2_full_name` IF NOT EXISTS' in \
+        graph_db.graph.queries[2]
+    assert list(report.values()).count('ok') == 3
+
+
+def test_index_usage_report_reads_plan(mocker):
+    plan = {
+        'operatorType': 'ProduceResults@neo4j',
+        'args': {},
+        'children': [{
+            'operatorType': 'NodeUniqueIndexSeek@neo4j',
+            'args': {
+                'Details': 'UNIQUE n:t1(full_name) WHERE full_name = $x'
+            },
+            'children': []
+        }]
+    }
+    graph_db = make_handler(mocker, FakeGraph(plan=plan))
+    report = graph_db.index_usage_report()
+    assert report['match_node']['uses_index']
+    assert report['match_node']['operators'] == [
+        'ProduceResults', 'NodeUniqueIndexSeek'
+    ]
+    assert graph_db.graph.queries[0].startswith('EXPLAIN MATCH (n:`t1`)')
@@ -0,0 +1,130 @@
+import os
+
+import pytest
+from modelscope_agent.environment.graph_database import indexer
+
+FIXTURE = '''import os
+
+
+class Base:
+
+    def __init__(self, value):
+        self.value = value
+
+    def run(self):
+        return os.path.join(self.value, 'x')
+
+
+class Child(Base):
+
+    def run(self):
+        return helper(super().run())
+
+
+def helper(path):
+    return path.upper()
+
+
+LIMIT = 3
+'''
+
+
+class RecordingClient:
+    """Keeps the symbols and references the visitor reports by name."""
+
+    def __init__(self):
+        self.names = {}
+        self.kinds = {}
+        self.references = set()
+        self.unsolved = set()
+
+    def recordFile(self, filePath):
+        self.names[1] = filePath
+        return 1
+
+    def recordSymbol(self, nameHierarchy, **kwargs):
+        name = nameHierarchy.getDisplayString()
+        for symbol_id, known in self.names.items():
+            if known == name:
+                return symbol_id
+        symbol_id = len(self.names) + 1
+        self.names[symbol_id] = name
+        return symbol_id
+
+    def recordSymbolKind(self, symbolId, symbolKind):
+        self.kinds[self.names[symbolId]] = symbolKind
+
+    def recordReference(self, contextSymbolId, referencedSymbolId,
+                        referenceKind):
+        self.references.add((self.names[contextSymbolId],
+                             self.names[referencedSymbolId], referenceKind))
+        return 0
+
+    def recordReferenceToUnsolvedSymhol(self, contextSymbolId, referenceKind,
+                                        sourceRange):
+        line = self.this_source_code_lines[sourceRange.startLine - 1]
+        text = line[sourceRange.startColumn - 1:sourceRange.endColumn]
+        self.unsolved.add((self.names[contextSymbolId], text, referenceKind))
+
+    def __getattr__(self, name):
+        if name.startswith('record'):
+            return lambda *args, **kwargs: 0
+        raise AttributeError(name)
+
+
+@pytest.fixture
+def session(monkeypatch, tmpdir):
+    # The indexer modules import each other as top-level modules.
+    monkeypatch.syspath_prepend(os.path.dirname(indexer.__file__))
+    import shallow_indexer
+    return shallow_indexer.IndexingSession(None, str(tmpdir))
+
+
+def write_module(tmpdir, text):
+    package = tmpdir.mkdir('pkg')
+    package.join('__init__.py').write('')
+    path = package.join('mod.py')
+    path.write(text)
+    return str(path)
+
+
+def test_deeply_nested_file_is_indexed(session, tmpdir):
+    depth = 1200
+    path = write_module(tmpdir,
+                        'x = ' + 'f(1, ' * depth + '1' + ')' * depth + '\n')
+
+    source = session.indexFile(path, RecordingClient(), str(tmpdir))
+    assert source.startswith('x = f(1, ')
+
+
+def test_fixture_symbols_and_references(session, tmpdir):
+    import sourcetraildb as srctrl
+    path = write_module(tmpdir, FIXTURE)
+    client = RecordingClient()
+    session.indexFile(path, client, str(tmpdir))
+
+    assert client.kinds == {
+        'pkg.mod': srctrl.SYMBOL_MODULE,
+        'pkg.mod.Base': srctrl.SYMBOL_CLASS,
+        'pkg.mod.Base.__init__': srctrl.SYMBOL_METHOD,
+        'pkg.mod.Base.run': srctrl.SYMBOL_METHOD,
+        'pkg.mod.Base.value': srctrl.SYMBOL_FIELD,
+        'pkg.mod.Child': srctrl.SYMBOL_CLASS,
+        'pkg.mod.Child.run': srctrl.SYMBOL_METHOD,
+        'pkg.mod.helper': srctrl.SYMBOL_FUNCTION,
+        'pkg.mod.LIMIT': srctrl.SYMBOL_GLOBAL_VARIABLE,
+    }
+    assert client.references == {
+        ('pkg.mod.Base.__init__', 'pkg.mod.Base.value',
+         srctrl.REFERENCE_USAGE),
+    }
+    assert client.unsolved == {
+        ('pkg.mod', 'os', srctrl.REFERENCE_IMPORT),
+        ('pkg.mod.Base.run', 'join', srctrl.REFERENCE_CALL),
+        ('pkg.mod.Base.run', 'value', srctrl.REFERENCE_USAGE),
+        ('pkg.mod.Child', 'Base', srctrl.REFERENCE_INHERITANCE),
+        ('pkg.mod.Child.run', 'helper', srctrl.REFERENCE_CALL),
+        ('pkg.mod.Child.run', 'run', srctrl.REFERENCE_CALL),
+        ('pkg.mod.Child.run', 'super', srctrl.REFERENCE_CALL),
+        ('pkg.mod.helper', 'upper', srctrl.REFERENCE_CALL),
+    }
@@ -0,0 +1,47 @@
+import os
+
+from modelscope_agent.environment.graph_database.indexer.source_cache import \
+    SourceCache
+
+
+def write(path, text):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+def test_extract_dedents_line_range(tmpdir):
+    path = os.path.join(str(tmpdir), 'a.py')
+    write(path, 'class A:\n    def f(self):\n        return 1\n')
+    cache = SourceCache()
+    assert cache.extract(path, 2, 3) == 'def f(self):\n    return 1'
+    assert cache.extract(path, 0, 1, is_indent=False) == 'class A:'
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+
+def test_changed_file_is_read_again(tmpdir):
+    path = os.path.join(str(tmpdir), 'a.py')
+    write(path, 'x = 1\n')
+    cache = SourceCache()
+    assert cache.extract(path, 1, 1) == 'x = 1'
+    write(path, 'x = 100\n')
+    assert cache.extract(path, 1, 1) == 'x = 100'
+
+
+def test_least_recently_used_file_is_dropped(tmpdir):
+    paths = [os.path.join(str(tmpdir), f'{i}.py') for i in range(3)]
+    for i, path in enumerate(paths):
+        write(path, f'x = {i}\n')
+    cache = SourceCache(max_files=2)
+    cache.get_lines(paths[0])
+    cache.get_lines(paths[1])
+    cache.get_lines(paths[0])
+    cache.get_lines(paths[2])
+    assert cache.stats()['cached_files'] == 2
+    cache.get_lines(paths[1])
+    assert cache.stats()['misses'] == 4
+
+
+def test_missing_file_gives_empty_code(tmpdir):
+    cache = SourceCache()
+    assert cache.extract(os.path.join(str(tmpdir), 'missing.py'), 1, 2) == ''
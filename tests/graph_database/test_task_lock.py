@@ -0,0 +1,130 @@
+import os
+import threading
+
+import pytest
+from modelscope_agent.environment.graph_database import GraphDatabaseHandler
+from modelscope_agent.environment.graph_database.indexer.task_lock import (
+    FileLock, task_lockfile)
+from py2neo.errors import TransientError
+
+
+class FakeTransaction:
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.statements = []
+
+    def run(self, query, **params):
+        if self.graph.failures:
+            self.graph.failures -= 1
+            raise TransientError('deadlock detected',
+                                 'Neo.TransientError.Transaction.DeadlockDetected')
+        self.statements.append((query, params))
+
+
+class FakeGraph:
+
+    def __init__(self):
+        self.committed = []
+        self.failures = 0
+        self.queries = []
+
+    def begin(self):
+        return FakeTransaction(self)
+
+    def commit(self, tx):
+        self.committed.append(tx)
+
+    def rollback(self, tx):
+        pass
+
+    def run(self, query, **params):
+        self.queries.append(query)
+        return []
+
+
+@pytest.fixture
+def make_handler(mocker, tmpdir):
+    mocker.patch.object(
+        GraphDatabaseHandler,
+        '_connect_to_graph',
+        side_effect=lambda *args: FakeGraph())
+
+    def make(task_id='task', **kwargs):
+        return GraphDatabaseHandler(
+            uri='bolt://localhost:7687',
+            user='neo4j',
+            password='',
+            task_id=task_id,
+            use_lock=True,
+            lockfile=os.path.join(str(tmpdir), 'neo4j.lock'),
+            **kwargs)
+
+    return make
+
+
+def test_task_lockfile():
+    assert task_lockfile('/tmp/neo4j.lock', 'repo 1') == '/tmp/neo4j.repo_1.lock'
+    assert task_lockfile('/tmp/neo4j.lock', '') == '/tmp/neo4j.lock'
+
+
+def test_file_lock_is_reentrant_and_excludes_threads(tmpdir):
+    lockfile = os.path.join(str(tmpdir), 'a.lock')
+    acquired = threading.Event()
+
+    def other_thread():
+        with FileLock(lockfile):
+            acquired.set()
+
+    with FileLock(lockfile):
+        with FileLock(lockfile):
+            pass
+        thread = threading.Thread(target=other_thread)
+        thread.start()
+        assert not acquired.wait(0.2)
+    assert acquired.wait(5)
+    thread.join()
+
+
+def test_reads_and_other_tasks_do_not_wait_for_a_task_write(make_handler):
+    graph_db = make_handler('task_a')
+    other_task = make_handler('task_b')
+    done = threading.Event()
+
+    def work():
+        graph_db.execute_query('MATCH (n) RETURN n')
+        other_task.add_node('CLASS', 'm.A')
+        done.set()
+
+    with graph_db.task_lock():
+        thread = threading.Thread(target=work)
+        thread.start()
+        assert done.wait(5)
+    thread.join()
+    assert len(other_task.graph.committed) == 1
+
+
+def test_unbuffered_writes_merge_at_once(make_handler):
+    graph_db = make_handler()
+    graph_db.add_node('CLASS', 'm.A', parms={'name': 'A'})
+    graph_db.add_edge('CLASS', 'm.A', 'HAS_METHOD', 'METHOD', 'm.A.f')
+
+    statements = [tx.statements[0] for tx in graph_db.graph.committed]
+    assert len(statements) == 2
+    assert statements[0][0].startswith('UNWIND $rows AS row MERGE (n:`task`')
+    assert 'MERGE (s)-[r:`HAS_METHOD`]->(e)' in statements[1][0]
+
+
+def test_flush_retries_transient_errors(make_handler, mocker):
+    mocker.patch('time.sleep')
+    graph_db = make_handler(bulk_write=True)
+    graph_db.graph.failures = 2
+    graph_db.add_node('CLASS', 'm.A')
+
+    assert graph_db.flush() == 1
+    assert len(graph_db.graph.committed) == 1
+
+    graph_db.graph.failures = 3
+    graph_db.add_node('CLASS', 'm.B')
+    with pytest.raises(TransientError):
+        graph_db.flush()
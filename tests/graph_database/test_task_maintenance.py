@@ -0,0 +1,91 @@
+import json
+import os
+
+import pytest
+from modelscope_agent.environment.graph_database import GraphDatabaseHandler
+from modelscope_agent.environment.graph_database.task_maintenance import (
+    TaskDeleter, TaskSnapshots)
+
+
+@pytest.fixture
+def graph_db(tmpdir):
+    return GraphDatabaseHandler(
+        uri='embedded://' + os.path.join(str(tmpdir), 'graph.db'),
+        user='',
+        password='',
+        task_id='task',
+        bulk_write=True)
+
+
+def build(graph_db, names):
+    graph_db.add_node('MODULE', 'm', parms={'name': 'm'})
+    for name in names:
+        graph_db.add_node('FUNCTION', 'm.' + name, parms={'name': name})
+        graph_db.add_edge('MODULE', 'm', 'CONTAINS', 'FUNCTION', 'm.' + name)
+    graph_db.flush()
+
+
+def names(graph_db, label='task'):
+    records = graph_db.execute_query(
+        'MATCH (n:`{0}`) RETURN n.full_name AS name '
+        'ORDER BY name'.format(label))
+    return [record['name'] for record in records]
+
+
+def test_background_deletion_reports_progress(graph_db):
+    build(graph_db, ['f{}'.format(i) for i in range(9)])
+    graph_db.execute_query(
+        'MATCH (n:`task` {full_name: "m.f0"}) SET n:`other`')
+
+    job = TaskDeleter(graph_db, batch_size=3).start('task')
+    assert job.wait(30)
+
+    assert job.done and job.progress() == 1.0
+    assert job.total == 10 and job.processed == 10
+    assert names(graph_db) == []
+    assert names(graph_db, 'other') == ['m.f0']
+
+
+def test_collect_garbage_deletes_nodes_without_task(graph_db):
+    build(graph_db, ['f'])
+    graph_db.execute_query('CREATE (:FUNCTION {full_name: "orphan"})')
+    graph_db.bump_graph_version()
+
+    assert TaskDeleter(graph_db).collect_garbage() == 1
+    assert graph_db.execute_query(
+        'MATCH (n:FUNCTION) RETURN n.full_name AS name')[0]['name'] == 'm.f'
+    assert graph_db.graph_version() is not None
+
+
+def test_snapshot_and_restore(graph_db, tmpdir):
+    manifest_dir = str(tmpdir.mkdir('manifests'))
+    with open(os.path.join(manifest_dir, 'task.json'), 'w') as f:
+        json.dump({'branch': 'main'}, f)
+    build(graph_db, ['f', 'g'])
+    snapshots = TaskSnapshots(graph_db, manifest_dir, batch_size=2)
+
+    assert snapshots.snapshot('task', 'main') == 3
+    assert snapshots.list('task') == ['main']
+
+    # Switch branch: g is replaced the way the incremental indexer does it,
+    # the node shared with the snapshot only loses the task label.
+    graph_db.execute_query(
+        'MATCH (n:`task` {full_name: "m.g"}) REMOVE n:`task`')
+    build(graph_db, ['h'])
+    with open(os.path.join(manifest_dir, 'task.json'), 'w') as f:
+        json.dump({'branch': 'dev'}, f)
+    version = graph_db.graph_version()
+
+    assert snapshots.restore('task', 'main') == 3
+    assert names(graph_db) == ['m', 'm.f', 'm.g']
+    assert graph_db.graph_version() != version
+    with open(os.path.join(manifest_dir, 'task.json')) as f:
+        assert json.load(f) == {'branch': 'main'}
+
+    snapshots.delete_snapshot('task', 'main')
+    assert snapshots.list('task') == []
+    assert names(graph_db) == ['m', 'm.f', 'm.g']
+    assert graph_db.execute_query(
+        'MATCH (n) WHERE n.full_name = "m.h" RETURN n') == []
+    with pytest.raises(KeyError):
+        snapshots.restore('task', 'main')
@@ -0,0 +1,93 @@
+import os
+import time
+
+from modelscope_agent.environment.graph_database.watcher import GraphWatcher
+
+
+class FakeUpdater:
+
+    def __init__(self):
+        self.batches = []
+
+    def can_update(self):
+        return True
+
+    def run(self, file_list, update_progress_bar=None, candidates=None):
+        self.batches.append(candidates)
+        return {'changed': candidates, 'added': [], 'deleted': []}
+
+    def manifest_nodes(self, file_paths):
+        return [
+            os.path.basename(path)[:-3] + '.run' for path in file_paths
+        ]
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def make_watcher(mocker, repo, **kwargs):
+    kwargs.setdefault('generate_descriptions', False)
+    watcher = GraphWatcher(None, repo, 't1', **kwargs)
+    watcher.updater = FakeUpdater()
+    mocker.patch.object(watcher.indexer, 'open')
+    mocker.patch.object(watcher.indexer, 'close')
+    return watcher
+
+
+def test_bursts_are_debounced_into_one_batch(mocker, tmpdir):
+    repo = str(tmpdir)
+    watcher = make_watcher(
+        mocker, repo, debounce=0.2, backend='polling', poll_interval=60)
+    with watcher:
+        for name in ('a.py', 'b.py', 'a.py', 'notes.txt'):
+            watcher.notify(os.path.join(repo, name))
+        metrics = watcher.metrics()
+        assert metrics['queue_depth'] == 2
+        assert metrics['lag_seconds'] >= 0
+        assert wait_for(lambda: watcher.metrics()['updates_applied'] == 1)
+    assert watcher.updater.batches == [[
+        os.path.join(repo, 'a.py'),
+        os.path.join(repo, 'b.py')
+    ]]
+    assert watcher.metrics()['lag_seconds'] == 0.0
+
+
+def test_polling_backend_reports_changed_files(mocker, tmpdir):
+    repo = str(tmpdir)
+    path = os.path.join(repo, 'mod.py')
+    with open(path, 'w') as f:
+        f.write('x = 1\n')
+    watcher = make_watcher(
+        mocker, repo, debounce=0.05, backend='polling', poll_interval=0.05)
+    with watcher:
+        time.sleep(0.1)
+        with open(path, 'w') as f:
+            f.write('x = 22\n')
+        assert wait_for(lambda: watcher.updater.batches)
+    assert watcher.updater.batches[0] == [path]
+
+
+def test_changed_methods_are_described(mocker, tmpdir):
+    repo = str(tmpdir)
+    pipeline = mocker.patch(
+        'modelscope_agent.environment.graph_database.watcher.'
+        'DescriptionPipeline')
+    watcher = make_watcher(
+        mocker,
+        repo,
+        debounce=0.05,
+        backend='polling',
+        poll_interval=60,
+        generate_descriptions=True,
+        description_options={'concurrency': 2})
+    with watcher:
+        watcher.notify(os.path.join(repo, 'mod.py'))
+        assert wait_for(lambda: watcher.metrics()['updates_applied'] == 1)
+    pipeline.assert_called_once_with(None, 't1', concurrency=2)
+    pipeline.return_value.run.assert_called_once_with(full_names=['mod.run'])
@@ -0,0 +1,165 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import dashscope
+from modelscope_agent.callbacks import BaseCallback
+from modelscope_agent.llm import OpenAi, QwenChatAtDS
+from modelscope_agent.llm.base import BaseChatModel
+from modelscope_agent.llm.dashscope import stream_output
+
+
+class SyncLLM(BaseChatModel):
+
+    def __init__(self):
+        super().__init__('sync', 'test')
+        self.threads = set()
+
+    def support_raw_prompt(self):
+        return False
+
+    def _chat_stream(self, messages, stop=None, **kwargs):
+        for chunk in ['hello', ' there']:
+            self.threads.add(threading.get_ident())
+            yield chunk
+
+    def _chat_no_stream(self, messages, stop=None, **kwargs):
+        self.threads.add(threading.get_ident())
+        return 'hello there'
+
+
+class RecordingCallback(BaseCallback):
+
+    def __init__(self):
+        self.events = []
+
+    def on_llm_start(self, *args, **kwargs):
+        self.events.append('start')
+
+    def on_llm_new_token(self, model, chunk, **kwargs):
+        self.events.append(chunk)
+
+    def on_llm_end(self, model, response, **kwargs):
+        self.events.append(('end', response))
+
+
+async def collect(stream):
+    return [chunk async for chunk in stream]
+
+
+def test_sync_backend_runs_off_the_event_loop():
+    llm = SyncLLM()
+    callback = RecordingCallback()
+
+    async def run():
+        loop_thread = threading.get_ident()
+        messages = [{'role': 'user', 'content': 'hi'}]
+        response = await llm.achat(messages=messages)
+        chunks = await collect(
+            llm.achat_stream(messages=messages, callbacks=callback))
+        return loop_thread, response, chunks
+
+    loop_thread, response, chunks = asyncio.run(run())
+    assert response == 'hello there'
+    assert chunks == ['hello', ' there']
+    assert loop_thread not in llm.threads
+    assert callback.events == ['start', 'hello', ' there', ('end', '')]
+
+
+class FakeCompletions:
+
+    def __init__(self):
+        self.running = 0
+        self.max_running = 0
+        self.requests = []
+
+    async def create(self, **kwargs):
+        self.requests.append(kwargs)
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        content = kwargs['messages'][-1]['content'].upper()
+        if kwargs['stream']:
+            return self.stream(content)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(
+                content=content))],
+            usage=SimpleNamespace(dict=lambda: {'total_tokens': 3}))
+
+    async def stream(self, content):
+        for text in (content[:1], content[1:], None):
+            delta = SimpleNamespace(content=text)
+            yield SimpleNamespace(
+                choices=[SimpleNamespace(delta=delta)], usage=None)
+
+
+def make_openai(mocker):
+    llm = OpenAi(
+        'gpt-4',
+        'openai',
+        api_key='sk-test',
+        api_base='http://localhost:8000/v1',
+        is_chat=True)
+    completions = FakeCompletions()
+    mocker.patch.object(
+        OpenAi,
+        'async_client',
+        new=SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+    return llm, completions
+
+
+def test_openai_native_async(mocker):
+    llm, completions = make_openai(mocker)
+
+    response = asyncio.run(llm.achat(prompt='abc', uuid_str='u'))
+    chunks = asyncio.run(collect(llm.achat_stream(prompt='abc')))
+
+    assert response == 'ABC'
+    assert chunks == ['A', 'BC']
+    assert 'uuid_str' not in completions.requests[0]
+    assert completions.requests[1]['stream_options'] == {
+        'include_usage': True
+    }
+    assert llm.get_usage() == {'total_tokens': 3}
+
+
+def test_batch_chat_limits_concurrency(mocker):
+    llm, completions = make_openai(mocker)
+    requests = ['p{}'.format(i) for i in range(10)]
+    requests.append([{'role': 'user', 'content': 'messages'}])
+
+    responses = asyncio.run(llm.abatch_chat(requests, max_concurrency=3))
+
+    assert responses[:2] == ['P0', 'P1']
+    assert responses[-1] == 'MESSAGES'
+    assert completions.max_running == 3
+
+
+def test_dashscope_native_stream_matches_sync(mocker):
+    texts = ['Hello', 'Hello, wor', 'Hello, world!<|im_end|>']
+    frames = [
+        SimpleNamespace(
+            status_code=200,
+            request_id='r',
+            output=SimpleNamespace(choices=[
+                SimpleNamespace(message=SimpleNamespace(content=text))
+            ]),
+            usage=None) for text in texts
+    ]
+
+    async def call(**kwargs):
+        assert kwargs['stream'] and kwargs['model'] == 'qwen-max'
+
+        async def stream():
+            for frame in frames:
+                yield frame
+
+        return stream()
+
+    mocker.patch.object(dashscope.AioGeneration, 'call', side_effect=call)
+    llm = QwenChatAtDS('qwen-max', 'dashscope', api_key='test')
+
+    chunks = asyncio.run(collect(llm.achat_stream(prompt='hi')))
+    assert chunks == list(stream_output(frames))
+    assert ''.join(chunks) == 'Hello, world!'
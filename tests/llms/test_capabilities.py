@@ -0,0 +1,93 @@
+import os
+
+import pytest
+from modelscope_agent.llm import QwenChatAtDS
+from modelscope_agent.llm.base import BaseChatModel
+from modelscope_agent.llm.utils import capabilities
+from modelscope_agent.llm.utils.capabilities import (STATIC_CAPABILITIES,
+                                                     CapabilityRegistry,
+                                                     register_capabilities)
+
+
+class ProbedLLM(BaseChatModel):
+
+    def __init__(self, model='probed', **kwargs):
+        super().__init__(model, 'test', **kwargs)
+        self.calls = 0
+
+    def _chat_stream(self, messages, stop=None, **kwargs):
+        yield ''
+
+    def _chat_no_stream(self, messages, stop=None, **kwargs):
+        return ''
+
+    def chat_with_functions(self, messages, functions=None, **kwargs):
+        self.calls += 1
+        return {'tool_calls': [{'function': {'name': 'get_current_weather'}}]}
+
+    def chat_with_raw_prompt(self, prompt, stop=None, **kwargs):
+        self.calls += 1
+        raise ConnectionError('server is gone')
+
+
+@pytest.fixture
+def registry(mocker):
+    registry = CapabilityRegistry()
+    mocker.patch(
+        'modelscope_agent.llm.base.get_capability_registry',
+        return_value=registry)
+    return registry
+
+
+def test_probe_once_per_endpoint(registry):
+    first = ProbedLLM()
+    assert first.support_function_calling()
+    second = ProbedLLM()
+    assert second.support_function_calling()
+    assert first.calls == 1 and second.calls == 0
+
+    other_model = ProbedLLM(model='other')
+    assert other_model.support_function_calling()
+    assert other_model.calls == 1
+    assert registry.metrics()['probes'] == 2
+
+
+def test_failed_probe_expires_soon(registry, mocker):
+    llm = ProbedLLM()
+    assert not llm.support_raw_prompt()
+    assert not ProbedLLM().support_raw_prompt()
+    assert llm.calls == 1
+
+    mocker.patch('time.time', return_value=10**12)
+    fresh = ProbedLLM()
+    assert not fresh.support_raw_prompt()
+    assert fresh.calls == 1
+
+
+def test_raw_prompt_without_implementation_needs_no_request(registry):
+
+    class ChatOnlyLLM(ProbedLLM):
+        chat_with_raw_prompt = BaseChatModel.chat_with_raw_prompt
+
+    assert not ChatOnlyLLM().support_raw_prompt()
+    assert QwenChatAtDS('qwen-max', 'dashscope',
+                        api_key='test').support_raw_prompt()
+
+
+def test_static_capabilities_skip_the_probe(registry, mocker):
+    mocker.patch.object(capabilities, 'STATIC_CAPABILITIES',
+                        list(STATIC_CAPABILITIES))
+    register_capabilities('test', r'prob', function_calling=False)
+    llm = ProbedLLM()
+    assert not llm.support_function_calling()
+    assert llm.calls == 0
+
+
+def test_capabilities_persist_to_disk(tmpdir):
+    path = os.path.join(str(tmpdir), 'capabilities.json')
+    key = ('openai', 'gpt-4', 'https://api.openai.com/v1')
+    CapabilityRegistry(path=path).record(key, 'function_calling', True)
+
+    registry = CapabilityRegistry(path=path)
+    assert registry.lookup(key, 'function_calling') is True
+    assert registry.lookup(key, 'raw_prompt') is None
@@ -0,0 +1,67 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from modelscope_agent.llm import OpenAi, get_llm_client
+from modelscope_agent.llm.utils.client_pool import LLMClientPool
+
+
+@pytest.fixture
+def pool(mocker):
+    pool = LLMClientPool(max_connections=8, max_keepalive_connections=4)
+    for target in ('modelscope_agent.llm.get_llm_client_pool',
+                   'modelscope_agent.llm.openai.get_llm_client_pool'):
+        mocker.patch(target, return_value=pool)
+    yield pool
+    pool.close()
+
+
+def make_llm(api_key='sk-test', api_base='http://localhost:8000/v1'):
+    return OpenAi(
+        'gpt-4', 'openai', api_key=api_key, api_base=api_base, is_chat=True)
+
+
+def test_instances_share_the_client_of_an_endpoint(pool):
+    first = make_llm()
+    second = make_llm()
+    other_key = make_llm(api_key='sk-other')
+
+    assert first.client is second.client
+    assert other_key.client is not first.client
+    # All endpoints go through one HTTP connection pool.
+    assert first.client._client is other_key.client._client
+    assert get_llm_client(
+        'openai', 'sk-test', 'http://localhost:8000/v1') is first.client
+
+    stats = pool.stats()
+    assert stats['clients'] == 2
+    assert stats['created'] == 2 and stats['reused'] == 2
+    assert stats['http_pool']['connections'] == 0
+    assert 'sk-test' not in str(stats)
+
+
+def test_concurrent_callers_get_one_client(pool):
+    with ThreadPoolExecutor(8) as executor:
+        clients = list(
+            executor.map(lambda _: make_llm().client, range(32)))
+    assert all(client is clients[0] for client in clients)
+    assert pool.stats()['clients'] == 1
+
+
+def test_async_clients_are_bound_to_their_loop(pool):
+
+    async def get_clients():
+        return (get_llm_client('openai', 'sk-test', asynchronous=True),
+                get_llm_client('openai', 'sk-test', asynchronous=True))
+
+    first, second = asyncio.run(get_clients())
+    assert first is second
+    other_loop, _ = asyncio.run(get_clients())
+    assert other_loop is not first
+
+
+def test_configure_rejects_unknown_settings(pool):
+    pool.configure(max_connections=16)
+    assert pool.max_connections == 16
+    with pytest.raises(TypeError):
+        pool.configure(connections=16)
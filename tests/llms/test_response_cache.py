@@ -0,0 +1,175 @@
+import pytest
+from modelscope_agent.callbacks import BaseCallback
+from modelscope_agent.llm.base import BaseChatModel
+from modelscope_agent.llm.utils.response_cache import (ResponseCache,
+                                                       enable_response_cache)
+
+
+class FakeLLM(BaseChatModel):
+
+    def __init__(self, response='hello there'):
+        super().__init__('fake', 'test')
+        self.response = response
+        self.calls = 0
+
+    def support_raw_prompt(self):
+        return False
+
+    def _chat_stream(self, messages, stop=None, **kwargs):
+        self.calls += 1
+        self.last_call_usage_info = {
+            'prompt_tokens': 5,
+            'completion_tokens': 2,
+            'total_tokens': 7
+        }
+        yield from ['hello', ' there']
+
+    def _chat_no_stream(self, messages, stop=None, **kwargs):
+        self.calls += 1
+        self.last_call_usage_info = {
+            'prompt_tokens': 5,
+            'completion_tokens': 2,
+            'total_tokens': 7
+        }
+        return self.response
+
+
+class RecordingCallback(BaseCallback):
+
+    def __init__(self):
+        self.events = []
+
+    def on_llm_start(self, *args, **kwargs):
+        self.events.append('start')
+
+    def on_llm_new_token(self, model, chunk, **kwargs):
+        self.events.append(chunk)
+
+    def on_llm_end(self, model, response, **kwargs):
+        self.events.append(('end', response))
+
+
+def messages(content='hi'):
+    return [{'role': 'user', 'content': content}]
+
+
+@pytest.fixture
+def cache():
+    return ResponseCache(':memory:')
+
+
+def test_exact_hit_saves_the_call(cache):
+    llm = enable_response_cache(FakeLLM(), cache)
+
+    assert llm.chat(messages=messages(), stream=False) == 'hello there'
+    # Trailing whitespace and sampling-irrelevant arguments share the entry.
+    assert llm.chat(
+        messages=messages('hi  \n'), stream=False,
+        uuid_str='u') == 'hello there'
+    assert llm.calls == 1
+    assert llm.get_usage()['total_tokens'] == 0
+
+    llm.chat(messages=messages(), stream=False, temperature=0.1)
+    assert llm.calls == 2
+
+    metrics = cache.metrics()
+    assert metrics['hits'] == 1 and metrics['misses'] == 2
+    assert metrics['saved_prompt_tokens'] == 5
+    assert metrics['saved_completion_tokens'] == 2
+
+
+def test_streams_are_recorded_and_replayed(cache):
+    llm = enable_response_cache(FakeLLM(), cache)
+
+    assert list(llm.chat(messages=messages(),
+                         stream=True)) == ['hello', ' there']
+    assert list(llm.chat(messages=messages(),
+                         stream=True)) == ['hello', ' there']
+    assert llm.chat(messages=messages(), stream=False) == 'hello there'
+    assert llm.calls == 1
+
+
+def test_non_stream_response_replays_as_chunks(cache):
+    text = 'x' * 40
+    llm = enable_response_cache(FakeLLM(text), cache)
+
+    llm.chat(messages=messages(), stream=False)
+    chunks = list(llm.chat(messages=messages(), stream=True))
+    assert ''.join(chunks) == text and len(chunks) > 1
+    assert llm.calls == 1
+
+
+def test_errors_are_not_cached(cache):
+    llm = enable_response_cache(
+        FakeLLM('Error code: 429 - rate limited'), cache)
+
+    llm.chat(messages=messages(), stream=False)
+    llm.chat(messages=messages(), stream=False)
+    assert llm.calls == 2
+    assert cache.metrics()['entries'] == 0
+
+    # A stream failing after partial text, as DashScope's reports it.
+    key, scope = cache.make_key(('test', 'fake', None), 'chat', messages())
+    assert not cache.store(
+        key,
+        scope, ['Hello, ', '\nError code: DataInspectionFailed'],
+        streamed=True)
+    assert cache.lookup(key, scope) is None
+
+
+def test_expiry_and_lru_eviction(mocker):
+    now = [1000.0]
+    mocker.patch('time.time', side_effect=lambda: now[0])
+    cache = ResponseCache(':memory:', ttl=60, max_entries=2)
+    for name in ('a', 'b'):
+        key, scope = cache.make_key(('test', 'fake', None), 'chat',
+                                    messages(name))
+        cache.store(key, scope, name)
+        now[0] += 1
+    key_a, scope = cache.make_key(('test', 'fake', None), 'chat',
+                                  messages('a'))
+    assert cache.lookup(key_a, scope) == ('a', False)
+
+    now[0] += 1
+    key_c, _ = cache.make_key(('test', 'fake', None), 'chat', messages('c'))
+    cache.store(key_c, scope, 'c')
+    key_b, _ = cache.make_key(('test', 'fake', None), 'chat', messages('b'))
+    # b was the least recently used.
+    assert cache.lookup(key_b, scope) is None
+    assert cache.lookup(key_a, scope) == ('a', False)
+
+    now[0] += 120
+    assert cache.lookup(key_a, scope) is None
+    assert cache.metrics()['evictions'] == 1
+
+
+def test_semantic_hit_within_the_same_parameters():
+
+    def embed(text):
+        return [1.0, 0.0] if 'weather' in text else [0.0, 1.0]
+
+    cache = ResponseCache(':memory:', embed=embed)
+    llm = enable_response_cache(FakeLLM('sunny'), cache)
+
+    llm.chat(messages=messages('what is the weather'), stream=False)
+    assert llm.chat(
+        messages=messages('tell me the weather'), stream=False) == 'sunny'
+    llm.chat(messages=messages('tell me a joke'), stream=False)
+    llm.chat(
+        messages=messages('how is the weather'),
+        stream=False,
+        temperature=0.9)
+
+    assert llm.calls == 3
+    assert cache.metrics()['semantic_hits'] == 1
+
+
+def test_callbacks_run_on_a_hit(cache):
+    llm = enable_response_cache(FakeLLM(), cache)
+    list(llm.chat(messages=messages(), stream=True))
+
+    callback = RecordingCallback()
+    chunks = list(
+        llm.chat(messages=messages(), stream=True, callbacks=callback))
+    assert chunks == ['hello', ' there']
+    assert callback.events == ['start', 'hello', ' there', ('end', '')]
@@ -0,0 +1,227 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from modelscope_agent.utils.retry import (CircuitBreaker, CircuitOpenError,
+                                          RetryBudget, RetryError,
+                                          is_retryable, retry)
+
+
+class StatusError(Exception):
+
+    def __init__(self, status_code, headers=None):
+        super().__init__(f'status {status_code}')
+        self.status_code = status_code
+        self.response = SimpleNamespace(
+            status_code=status_code, headers=headers or {})
+
+
+@pytest.fixture(autouse=True)
+def breakers(mocker):
+    # Every test starts with closed circuits.
+    mocker.patch.dict('modelscope_agent.utils.retry._breakers', clear=True)
+
+
+@pytest.fixture
+def sleeps(mocker):
+    sleeps = []
+    mocker.patch('time.sleep', side_effect=sleeps.append)
+    # Full jitter at its upper bound.
+    mocker.patch('random.uniform', side_effect=lambda low, high: high)
+    return sleeps
+
+
+def failing(errors, result='ok'):
+    calls = []
+
+    def call():
+        calls.append(1)
+        if errors:
+            raise errors.pop(0)
+        return result
+
+    return call, calls
+
+
+def test_exponential_backoff_until_success(sleeps):
+    call, calls = failing([ConnectionError(), StatusError(503)])
+    assert retry(delay_seconds=0.5, use_budget=False)(call)() == 'ok'
+    assert len(calls) == 3
+    assert sleeps == [0.5, 1.0]
+
+
+def test_client_errors_are_not_retried(sleeps):
+    call, calls = failing([StatusError(400)])
+    with pytest.raises(StatusError):
+        retry(use_budget=False)(call)()
+    assert len(calls) == 1 and sleeps == []
+
+    assert not is_retryable(TypeError())
+    assert is_retryable(StatusError(429))
+    assert is_retryable(SimpleNamespace(should_retry=lambda: True))
+
+
+def test_retry_after_is_honored(sleeps):
+    call, _ = failing([StatusError(429, {'retry-after': '7'})])
+    assert retry(delay_seconds=0.5, use_budget=False)(call)() == 'ok'
+    assert sleeps == [7.0]
+
+    call, calls = failing([StatusError(429, {'retry-after': '3600'})])
+    with pytest.raises(RetryError):
+        retry(use_budget=False)(call)()
+    assert len(calls) == 1 and sleeps == [7.0]
+
+
+def test_max_retries_reached(sleeps):
+    call, calls = failing([ConnectionError()] * 3)
+    with pytest.raises(RetryError) as info:
+        retry(max_retries=3, use_budget=False)(call)()
+    assert isinstance(info.value.__cause__, ConnectionError)
+    assert len(calls) == 3
+
+    call, _ = failing([ConnectionError()] * 2)
+    assert retry(
+        max_retries=2, return_str=True,
+        use_budget=False)(call)().startswith('Max retries reached')
+
+
+def test_stream_is_retried_only_before_the_first_item(sleeps):
+    attempts = []
+
+    @retry(use_budget=False)
+    def stream(fail_after):
+        attempts.append(1)
+        for i in range(3):
+            if i == fail_after and len(attempts) == 1:
+                raise ConnectionError()
+            yield i
+
+    assert list(stream(0)) == [0, 1, 2]
+    assert len(attempts) == 2
+
+    attempts.clear()
+    chunks = []
+    with pytest.raises(ConnectionError):
+        for chunk in stream(1):
+            chunks.append(chunk)
+    assert chunks == [0] and len(attempts) == 1
+
+
+def test_retry_budget_limits_retries(sleeps, mocker):
+    budget = RetryBudget(ratio=0.0, min_per_second=0.0, capacity=1)
+    mocker.patch(
+        'modelscope_agent.utils.retry.get_retry_budget', return_value=budget)
+    call, calls = failing([ConnectionError()] * 3)
+    with pytest.raises(RetryError):
+        retry(max_retries=5)(call)()
+    assert len(calls) == 2
+    assert budget.rejected == 1
+
+
+def test_circuit_breaker_fails_fast(mocker):
+    now = [0.0]
+    mocker.patch('time.monotonic', side_effect=lambda: now[0])
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+    mocker.patch(
+        'modelscope_agent.utils.retry.get_circuit_breaker',
+        return_value=breaker)
+    call, calls = failing([ConnectionError()] * 2)
+    guarded = retry(max_retries=1, use_budget=False)(call)
+
+    for _ in range(2):
+        with pytest.raises(RetryError):
+            guarded()
+    with pytest.raises(CircuitOpenError):
+        guarded()
+    assert len(calls) == 2 and breaker.state == 'open'
+
+    now[0] = 11.0
+    assert breaker.state == 'half_open'
+    assert guarded() == 'ok'
+    assert breaker.state == 'closed'
+
+
+def test_coroutines_are_retried(mocker):
+    mocker.patch('random.uniform', return_value=0.0)
+    calls = []
+
+    @retry(use_budget=False)
+    async def chat():
+        calls.append(1)
+        if len(calls) < 2:
+            raise TimeoutError()
+        return 'ok'
+
+    assert asyncio.run(chat()) == 'ok'
+    assert len(calls) == 2
+
+
+def test_nested_retries_do_not_multiply(sleeps):
+    calls = []
+
+    @retry(use_budget=False)
+    def inner():
+        calls.append(1)
+        raise StatusError(429)
+
+    outer = retry(use_budget=False)(inner)
+    with pytest.raises(RetryError):
+        outer()
+    assert len(calls) == 3
+    assert not is_retryable(RetryError())
+    assert not is_retryable(CircuitOpenError())
+
+
+def open_breaker(mocker, now):
+    mocker.patch('time.monotonic', side_effect=lambda: now[0])
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    mocker.patch(
+        'modelscope_agent.utils.retry.get_circuit_breaker',
+        return_value=breaker)
+    breaker.record_failure()
+    now[0] = 11.0
+    assert breaker.state == 'half_open'
+    return breaker
+
+
+def test_cancelled_trial_frees_the_half_open_slot(mocker):
+    breaker = open_breaker(mocker, [0.0])
+    started = []
+
+    @retry(use_budget=False)
+    async def chat():
+        started.append(1)
+        await asyncio.sleep(10)
+        return 'ok'
+
+    async def run():
+        task = asyncio.ensure_future(chat())
+        while not started:
+            await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    assert breaker.allow()
+
+
+def test_unconsumed_stream_does_not_hold_the_trial(mocker):
+    breaker = open_breaker(mocker, [0.0])
+
+    def chunks():
+        yield from ['a', 'b']
+
+    @retry(use_budget=False)
+    def chat():
+        return chunks()
+
+    stream = chat()
+    del stream
+    assert breaker.allow()
+
+    breaker = open_breaker(mocker, [0.0])
+    stream = chat()
+    assert next(stream) == 'a'
+    stream.close()
+    assert breaker.state == 'closed'